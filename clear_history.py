@@ -2,12 +2,12 @@
 """
 清除歷史記錄腳本
 """
-from core.history_manager import HistoryManager
+from core.history_manager import get_history_manager
 
 if __name__ == "__main__":
     print("🧹 清除歷史記錄...")
     
-    manager = HistoryManager()
+    manager = get_history_manager()
     
     print(f"\n清除前：{len(manager.history)} 條記錄")
     print(f"知識點計數: {dict(manager.knowledge_point_counter)}")
@@ -2,6 +2,8 @@
 系統配置文件
 用於設定模型和系統參數
 """
+import os
+
 
 class Config:
     """系統配置類"""
@@ -9,6 +11,10 @@ class Config:
     # ==================== 共享 OpenAI Client ====================
     
     _openai_client = None
+    _async_openai_client = None
+    
+    # API 基礎 URL（None 表示官方 API；指向 scripts/mock_openai_server.py 可離線壓測）
+    OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL")
     
     @classmethod
     def get_openai_client(cls, api_key: str = None):
@@ -24,10 +30,41 @@ class Config:
         if cls._openai_client is None:
             from openai import OpenAI
             print("⚙️ 初始化共享 OpenAI client...")
-            cls._openai_client = OpenAI(api_key=api_key) if api_key else OpenAI()
+            cls._openai_client = OpenAI(**cls._client_kwargs(api_key))
+            if cls.OPENAI_BASE_URL:
+                print(f"🔗 使用自訂 API 位址: {cls.OPENAI_BASE_URL}")
             print("✅ OpenAI client 初始化完成")
         return cls._openai_client
     
+    @classmethod
+    def get_async_openai_client(cls, api_key: str = None):
+        """
+        獲取共享的 AsyncOpenAI client（單例模式，用於流式生成等需要非阻塞的調用）
+        
+        Args:
+            api_key: OpenAI API Key（可選）
+            
+        Returns:
+            AsyncOpenAI client 實例
+        """
+        if cls._async_openai_client is None:
+            from openai import AsyncOpenAI
+            cls._async_openai_client = AsyncOpenAI(**cls._client_kwargs(api_key))
+        return cls._async_openai_client
+    
+    @classmethod
+    def _client_kwargs(cls, api_key: str = None) -> dict:
+        """組合 OpenAI client 建構參數"""
+        kwargs = {}
+        if api_key:
+            kwargs["api_key"] = api_key
+        if cls.OPENAI_BASE_URL:
+            kwargs["base_url"] = cls.OPENAI_BASE_URL
+            # 模擬伺服器不驗證金鑰，未設定時給佔位值避免 client 初始化失敗
+            if not api_key and not os.getenv("OPENAI_API_KEY"):
+                kwargs["api_key"] = "sk-mock"
+        return kwargs
+    
     # ==================== 模型配置 ====================
     
     # Embedding 模型
@@ -72,9 +109,46 @@ class Config:
     # 歷史紀錄保存數量
     HISTORY_SIZE = 10
     
-    # 重複詢問閾值（連續詢問同一知識點超過此次數視為重複）
+    # 歷史日誌背景寫入間隔（秒，<= 0 時每筆查詢立即追加寫入）
+    HISTORY_FLUSH_INTERVAL = 1.0
+    
+    # 歷史日誌累積多少行後壓縮為快照（history.json）
+    HISTORY_COMPACT_THRESHOLD = 1000
+    
+    # 歷史統計是否維護分鐘 / 小時 / 天的時間分桶
+    HISTORY_ROLLUPS_ENABLED = True
+    
+    # 各時間分桶保留的桶數（分鐘：1 天，小時：30 天，天：1 年）
+    HISTORY_ROLLUP_RETENTION = {"minute": 1440, "hour": 720, "day": 366}
+    
+    # 歷史紀錄後端："jsonl"（快照 + 追加日誌，只保留最近 HISTORY_SIZE 筆）或 "sqlite"（長期保存、索引查詢）
+    HISTORY_BACKEND = "jsonl"
+    
+    # 重複詢問閾值（同一知識點在本次與視窗內的詢問中出現達此次數視為重複）
     REPETITION_THRESHOLD = 3
     
+    # 重複性檢測視窗（與前幾次詢問比較）
+    REPETITION_WINDOW = 2
+    
+    # 知識圖譜預先計算的最大鄰域距離（相關知識點最多查到幾跳）
+    KNOWLEDGE_GRAPH_MAX_HOPS = 2
+    
+    # 會話狀態：保留最近幾個知識點
+    SESSION_RECENT_KP_SIZE = 10
+    
+    # 會話狀態：查詢向量快取數量
+    SESSION_EMBEDDING_CACHE_SIZE = 64
+    
+    # 會話儲存後端："memory"（單一 worker）或 "sqlite"（多個 worker 共享）
+    SESSION_BACKEND = "memory"
+    
+    # 會話儲存：最多保留的會話數、閒置淘汰時間（秒）
+    SESSION_MAX_COUNT = 10000
+    SESSION_IDLE_TIMEOUT = 1800.0
+    
+    # 未提供 session id 的請求共用的預設會話
+    DEFAULT_SESSION_ID = "default"
+    
     # RAG 檢索參數
     RAG_TOP_K = 3  # 返回前 K 個最相關文件
     RAG_SIMILARITY_THRESHOLD = 0.7  # 相似度閾值
@@ -84,23 +158,105 @@ class Config:
     LLM_MAX_TOKENS = 500  # 草稿最大 token 數
     LLM_FINAL_MAX_TOKENS = 200  # 最終答案最大 token 數（測試環境：約100字）
     
+    # ==================== 上游容錯 ====================
+    
+    # 單次上游 API 調用逾時（秒）
+    UPSTREAM_TIMEOUT = 10.0
+    
+    # 斷路器：連續失敗幾次後開啟
+    CIRCUIT_BREAKER_FAILURE_THRESHOLD = 3
+    
+    # 斷路器：開啟後多久進入半開探測（秒）
+    CIRCUIT_BREAKER_RECOVERY_TIMEOUT = 30.0
+    
+    # 斷路器：半開探測的期限（秒；超過仍未回報視為遺失並重新開啟，需大於最終生成的串流時間）
+    CIRCUIT_BREAKER_PROBE_TIMEOUT = 60.0
+    
+    # ==================== 追蹤輸出 ====================
+    
+    # 每個查詢都會記錄 span，但只有以下情況才寫出 Chrome trace-event 檔案：
+    # - 請求帶有 X-Trace-Export 標頭（或 process_query(export_trace=True)）
+    # - 依取樣率隨機抽樣（0.0 表示不抽樣）
+    # - 總耗時超過慢請求閾值（秒，0 表示停用）
+    TRACE_SAMPLE_RATE = 0.0
+    TRACE_SLOW_THRESHOLD = 0.0
+    
+    # ==================== 請求剖析 ====================
+    
+    # 隨機剖析的取樣率（0.0 表示只剖析帶 X-Profile 標頭的請求）
+    PROFILE_SAMPLE_RATE = 0.0
+    
+    # 預設剖析模式："sample"（取樣，collapsed stacks）或 "cprofile"（確定性，pstats）
+    PROFILE_DEFAULT_MODE = "sample"
+    
+    # 取樣剖析的取樣間隔（秒）、記憶體中保留的剖析結果數
+    PROFILE_SAMPLE_INTERVAL = 0.005
+    PROFILE_MAX_STORED = 50
+    
+    # 管理端點（/admin/*）與 X-Profile 標頭所需的權杖（X-Admin-Token）；未設定時停用
+    ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
+    
+    # ==================== 指標 ====================
+    
+    # 延遲分位數的時間窗（秒）：/metrics 的分位數反映最近 1~2 個時間窗
+    METRICS_WINDOW = 60.0
+    
+    # /metrics 輸出的分位數
+    METRICS_QUANTILES = (0.5, 0.95, 0.99)
+    
+    # 事件迴圈監控：是否啟用、量測間隔（秒）、阻塞閾值（秒）與保留的堆疊樣本數
+    LOOP_MONITOR_ENABLED = True
+    LOOP_MONITOR_INTERVAL = 0.05
+    LOOP_BLOCK_THRESHOLD = 0.1
+    LOOP_MONITOR_MAX_SAMPLES = 20
+    
+    # 並行度回歸檢查（scripts/analyze_concurrency.py）：
+    # 第一回合分支重疊率中位數的最低要求、出現串行化分支的查詢比例上限
+    CONCURRENCY_MIN_OVERLAP = 0.7
+    CONCURRENCY_MAX_SERIALIZED = 0.1
+    
+    # ==================== 用量與成本 ====================
+    
+    # 各模型單價（美元 / 每百萬 token），未列出的模型只統計 token 不計成本
+    MODEL_PRICING = {
+        "gpt-4o-mini": {"input": 0.15, "output": 0.60},
+        "gpt-4o": {"input": 2.50, "output": 10.00},
+        "text-embedding-3-small": {"input": 0.02, "output": 0.0},
+        "text-embedding-3-large": {"input": 0.13, "output": 0.0}
+    }
+    
+    # 用量統計：最多保留的會話數（超過時淘汰最久未使用的會話）
+    USAGE_MAX_SESSIONS = 10000
+    
     # ==================== 儲存路徑 ====================
     
     # 向量儲存路徑
     VECTOR_STORAGE_PATH = "vectors.pkl"
     
-    # 歷史紀錄儲存路徑
+    # 歷史紀錄快照路徑（追加日誌為同名的 .jsonl 檔）
     HISTORY_STORAGE_PATH = "history.json"
     
+    # 歷史紀錄資料庫路徑（HISTORY_BACKEND = "sqlite" 時使用）
+    HISTORY_DB_PATH = "history.db"
+    
+    # 會話狀態資料庫路徑（SESSION_BACKEND = "sqlite" 時使用）
+    SESSION_DB_PATH = "sessions.db"
+    
     # 結果輸出目錄
     RESULTS_DIR = "results"
     
+    # Chrome trace-event 檔案輸出目錄
+    TRACE_OUTPUT_DIR = "results/traces"
+    
     # 文件目錄
     DOCS_DIR = "data/docs"
     
     # 情境目錄
     SCENARIOS_DIR = "data/scenarios"
     
+    # 知識圖譜（節點與關係）定義檔
+    KNOWLEDGE_RELATIONS_PATH = "data/knowledge_relations.json"
+    
     # ==================== 三維度定義 ====================
     
     DIMENSIONS = {
@@ -118,7 +274,8 @@ class Config:
             "name": "重複性",
             "description": "是否在同一知識點上重複詢問多次",
             "values": ["正常", "重複"],
-            "threshold": REPETITION_THRESHOLD
+            "threshold": REPETITION_THRESHOLD,
+            "window": REPETITION_WINDOW
         }
     }
     
@@ -184,6 +341,9 @@ class Config:
     
     # 是否啟用流式輸出
     ENABLE_STREAMING = True
+    
+    # 流式生成時要求上游在結尾回報 token 用量（不支援 stream_options 的相容後端請關閉，改用本地估算）
+    STREAM_INCLUDE_USAGE = True
 
 
 # 創建全局配置實例
@@ -195,6 +355,11 @@ def get_shared_client(api_key: str = None):
     return Config.get_openai_client(api_key)
 
 
+def get_shared_async_client(api_key: str = None):
+    """獲取共享的 AsyncOpenAI client"""
+    return Config.get_async_openai_client(api_key)
+
+
 def update_config(**kwargs):
     """
     動態更新配置
@@ -221,6 +386,7 @@ def get_config_summary() -> dict:
     """
     return {
         "models": {
+            "base_url": Config.OPENAI_BASE_URL,
             "embedding": Config.EMBEDDING_MODEL,
             "llm": Config.LLM_MODEL,
             "classifier": Config.CLASSIFIER_MODEL
@@ -228,12 +394,13 @@ def get_config_summary() -> dict:
         "parameters": {
             "history_size": Config.HISTORY_SIZE,
             "repetition_threshold": Config.REPETITION_THRESHOLD,
+            "repetition_window": Config.REPETITION_WINDOW,
             "rag_top_k": Config.RAG_TOP_K,
             "temperature": Config.LLM_TEMPERATURE
         },
         "paths": {
             "vectors": Config.VECTOR_STORAGE_PATH,
-            "history": Config.HISTORY_STORAGE_PATH,
+            "history": Config.HISTORY_DB_PATH if Config.HISTORY_BACKEND == "sqlite" else Config.HISTORY_STORAGE_PATH,
             "results": Config.RESULTS_DIR
         }
     }
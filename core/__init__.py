@@ -9,9 +9,11 @@ __version__ = "1.0.0"
 from .vector_store import VectorStore, cosine_similarity
 from .rag_module import RAGRetriever, RAGCache
 from .scenario_classifier import ScenarioClassifier
-from .history_manager import HistoryManager, HistoryRecord
+from .history_manager import HistoryManager, HistoryRecord, get_history_manager
 from .timer_utils import Timer, TimerRecord, TimerReport
+from .tracer import Tracer, Span, get_current_tracer, trace_span
 from .ontology_manager import OntologyManager
+from .knowledge_graph import KnowledgeGraph, get_knowledge_graph
 
 __all__ = [
     'VectorStore',
@@ -20,9 +22,16 @@ __all__ = [
     'RAGCache',
     'ScenarioClassifier',
     'HistoryManager',
+    'get_history_manager',
     'HistoryRecord',
     'Timer',
     'TimerRecord',
     'TimerReport',
+    'Tracer',
+    'Span',
+    'get_current_tracer',
+    'trace_span',
     'OntologyManager',
+    'KnowledgeGraph',
+    'get_knowledge_graph',
 ]
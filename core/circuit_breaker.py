@@ -0,0 +1,171 @@
+"""
+斷路器模組
+包裝每個上游 API 調用點（C 值檢測、知識點檢測、Embedding、最終生成），
+上游故障時快速失敗並改用本地降級結果，避免每個請求都等到逾時
+"""
+import threading
+import time
+from typing import Dict
+
+from config import Config
+
+
+class CircuitOpenError(Exception):
+    """斷路器開啟時拋出，表示本次調用已被跳過（未發出網路請求）"""
+
+    def __init__(self, name: str):
+        super().__init__(f"斷路器 '{name}' 已開啟，跳過上游調用")
+        self.name = name
+
+
+class CircuitBreaker:
+    """
+    斷路器（三態：closed → open → half_open）
+
+    - closed: 正常放行；連續失敗達到閾值 → open
+    - open: 直接拒絕（不發出請求）；經過恢復時間 → half_open
+    - half_open: 只放行一個探測請求；成功 → closed，失敗 → open
+      （探測超過期限仍未回報時視為遺失 → open，避免永遠停在半開狀態）
+
+    呼叫端必須以 record_success / record_failure / release 之一結束每個放行的請求，
+    取消（asyncio.CancelledError）時也要呼叫 release。
+    狀態變更以鎖保護，事件迴圈與 asyncio.to_thread 的工作執行緒可共用同一個斷路器
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failure_threshold: int = None,
+        recovery_timeout: float = None,
+        probe_timeout: float = None
+    ):
+        """
+        初始化斷路器
+
+        Args:
+            name: 上游調用點名稱
+            failure_threshold: 連續失敗幾次後開啟（默認從配置讀取）
+            recovery_timeout: 開啟後多久進入半開探測（秒，默認從配置讀取）
+            probe_timeout: 半開探測的期限（秒，默認從配置讀取）
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold or Config.CIRCUIT_BREAKER_FAILURE_THRESHOLD
+        self.recovery_timeout = recovery_timeout or Config.CIRCUIT_BREAKER_RECOVERY_TIMEOUT
+        self.probe_timeout = probe_timeout or Config.CIRCUIT_BREAKER_PROBE_TIMEOUT
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+        # 統計
+        self.total_failures = 0
+        self.total_rejected = 0
+
+    def allow_request(self) -> bool:
+        """
+        判斷本次是否允許發出上游請求
+
+        Returns:
+            True 表示放行；False 表示應直接使用降級結果
+        """
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+
+            now = time.monotonic()
+            if self.state == self.OPEN:
+                if now - self.opened_at >= self.recovery_timeout:
+                    # 進入半開狀態，放行一個探測請求
+                    self.state = self.HALF_OPEN
+                    self._start_probe(now)
+                    print(f"🔌 斷路器 [{self.name}]：進入半開狀態，發出探測請求")
+                    return True
+                self.total_rejected += 1
+                return False
+
+            # HALF_OPEN：探測進行中時拒絕其他請求；探測逾期未回報則視為遺失，重新開啟
+            if self._probe_in_flight:
+                if now - self._probe_started_at >= self.probe_timeout:
+                    print(f"⚠️  斷路器 [{self.name}]：探測請求逾時未回報，重新開啟斷路器")
+                    self.state = self.OPEN
+                    self.opened_at = now
+                    self._probe_in_flight = False
+                self.total_rejected += 1
+                return False
+            self._start_probe(now)
+            return True
+
+    def _start_probe(self, now: float):
+        """標記探測請求進行中（呼叫端需持有鎖）"""
+        self._probe_in_flight = True
+        self._probe_started_at = now
+
+    def record_success(self):
+        """記錄一次成功調用"""
+        with self._lock:
+            if self.state != self.CLOSED:
+                print(f"✅ 斷路器 [{self.name}]：上游已恢復，關閉斷路器")
+            self.state = self.CLOSED
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def record_failure(self):
+        """記錄一次失敗調用"""
+        with self._lock:
+            self.total_failures += 1
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    print(f"⚠️  斷路器 [{self.name}]：連續失敗 {self.consecutive_failures} 次，開啟斷路器")
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def release(self):
+        """調用被呼叫端取消（非上游故障）：不計成功或失敗，只釋放半開探測名額"""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def get_stats(self) -> Dict:
+        """獲取斷路器狀態"""
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "total_failures": self.total_failures,
+                "total_rejected": self.total_rejected
+            }
+
+
+# 全局斷路器註冊表（每個上游調用點一個）
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """
+    獲取（或建立）指定調用點的斷路器
+
+    Args:
+        name: 上游調用點名稱
+
+    Returns:
+        CircuitBreaker 實例
+    """
+    breaker = _breakers.get(name)
+    if breaker is None:
+        breaker = CircuitBreaker(name)
+        _breakers[name] = breaker
+    return breaker
+
+
+def get_all_breaker_stats() -> Dict[str, Dict]:
+    """獲取所有斷路器狀態"""
+    return {name: breaker.get_stats() for name, breaker in _breakers.items()}
@@ -0,0 +1,153 @@
+"""
+歷史統計聚合模組
+在新增記錄時增量維護統計，讀取時不需要重新掃描歷史記錄：
+- total：查詢總數
+- K / C / R：三維度的值分布
+- knowledge_point：知識點訪問次數
+- session：各會話的查詢次數
+- minute / hour / day：依時間分桶的查詢數（時間戳前綴即桶鍵，超過保留期限的桶會被清除）
+
+JSON Lines 後端將計數保存在記憶體與快照中；SQLite 後端以相同的 (名稱, 鍵) 寫入計數表
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from config import Config
+
+DIMENSION_NAMES = ("K", "C", "R")
+
+# 分桶粒度 → (ISO 8601 時間戳前綴長度, 每桶時間長度)
+ROLLUP_GRANULARITIES = {
+    "minute": (16, timedelta(minutes=1)),
+    "hour": (13, timedelta(hours=1)),
+    "day": (10, timedelta(days=1)),
+}
+
+
+def record_counts(record, rollups: bool = True) -> Iterator[Tuple[str, str]]:
+    """
+    一筆記錄對各計數的貢獻（每個 (名稱, 鍵) 加 1）
+
+    Args:
+        record: HistoryRecord
+        rollups: 是否包含時間分桶
+
+    Yields:
+        (計數名稱, 鍵)
+    """
+    yield "total", ""
+    for dim in DIMENSION_NAMES:
+        value = record.dimensions.get(dim)
+        if value is not None:
+            yield dim, str(value)
+    for kp in record.knowledge_points:
+        yield "knowledge_point", kp
+    yield "session", record.session_id
+    if rollups:
+        for granularity, (length, _) in ROLLUP_GRANULARITIES.items():
+            yield granularity, record.timestamp[:length]
+
+
+def rollup_cutoff(granularity: str, now: datetime = None) -> str:
+    """
+    保留期限的起點桶鍵（鍵小於此值的桶應清除）
+
+    Args:
+        granularity: "minute" / "hour" / "day"
+        now: 目前時間（默認為現在）
+
+    Returns:
+        桶鍵
+    """
+    length, unit = ROLLUP_GRANULARITIES[granularity]
+    retention = Config.HISTORY_ROLLUP_RETENTION[granularity]
+    return ((now or datetime.now()) - unit * (retention - 1)).isoformat()[:length]
+
+
+class HistoryAggregates:
+    """增量維護的歷史統計"""
+
+    def __init__(self, rollups: bool = None):
+        """
+        初始化統計
+
+        Args:
+            rollups: 是否維護時間分桶（默認從配置讀取）
+        """
+        self.rollups = Config.HISTORY_ROLLUPS_ENABLED if rollups is None else rollups
+        self.counters: Dict[str, Counter] = {}
+
+    def counter(self, name: str) -> Counter:
+        """獲取指定名稱的計數（不存在時建立）"""
+        if name not in self.counters:
+            self.counters[name] = Counter()
+        return self.counters[name]
+
+    def add(self, record):
+        """將一筆記錄計入統計"""
+        new_bucket = False
+        for name, key in record_counts(record, self.rollups):
+            counter = self.counter(name)
+            counter[key] += 1
+            new_bucket = new_bucket or (name == "minute" and counter[key] == 1)
+        # 只在出現新的分鐘桶時檢查保留期限
+        if new_bucket:
+            self.prune()
+
+    def prune(self, now: datetime = None):
+        """清除超過保留期限的時間分桶（桶依時間先後加入，只需檢查最舊的幾個）"""
+        for granularity in ROLLUP_GRANULARITIES:
+            buckets = self.counters.get(granularity)
+            if not buckets:
+                continue
+            cutoff = rollup_cutoff(granularity, now)
+            while buckets:
+                oldest = next(iter(buckets))
+                if oldest >= cutoff:
+                    break
+                del buckets[oldest]
+
+    @property
+    def total(self) -> int:
+        """查詢總數"""
+        return self.counters.get("total", Counter()).get("", 0)
+
+    def get_dimension_stats(self) -> Dict[str, Counter]:
+        """三維度值分布（K/C/R）"""
+        return {dim: Counter(self.counters.get(dim, {})) for dim in DIMENSION_NAMES}
+
+    def get_rollup(self, granularity: str, limit: int = None) -> List[Dict]:
+        """
+        時間分桶的查詢數
+
+        Args:
+            granularity: "minute" / "hour" / "day"
+            limit: 只返回最近的幾個桶（默認全部）
+
+        Returns:
+            由舊到新的 [{"bucket", "queries"}]
+        """
+        if granularity not in ROLLUP_GRANULARITIES:
+            raise ValueError(f"未知的分桶粒度: {granularity}（可用: {', '.join(ROLLUP_GRANULARITIES)}）")
+        buckets = sorted(self.counters.get(granularity, {}).items())
+        if limit is not None:
+            buckets = buckets[-limit:] if limit > 0 else []
+        return [{"bucket": bucket, "queries": count} for bucket, count in buckets]
+
+    def clear(self):
+        """清空統計"""
+        self.counters.clear()
+
+    def to_dict(self) -> Dict[str, Dict[str, int]]:
+        """轉換為字典（快照用）"""
+        return {name: dict(counter) for name, counter in self.counters.items() if counter}
+
+    @classmethod
+    def from_dict(cls, data: Optional[Dict[str, Dict[str, int]]], rollups: bool = None) -> "HistoryAggregates":
+        """從字典（快照或計數表）建立；時間分桶依鍵排序，維持由舊到新的順序"""
+        aggregates = cls(rollups)
+        for name, counts in (data or {}).items():
+            items = sorted(counts.items()) if name in ROLLUP_GRANULARITIES else counts.items()
+            aggregates.counters[name] = Counter(dict(items))
+        return aggregates
@@ -1,9 +1,23 @@
 """
 歷史紀錄管理模組
 負責追蹤查詢歷史和知識點訪問記錄
+
+儲存方式：
+- 每筆查詢只追加一行到 JSON Lines 日誌（history.jsonl），由背景執行緒定期批次寫入，
+  單次查詢的持久化成本為 O(1)，不再於請求中重寫整個 history.json
+- 日誌行數達到門檻時壓縮：將目前狀態寫成快照（history.json，先寫暫存檔再原子替換）並清空日誌
+- 每筆記錄帶有遞增序號，快照記錄已包含的最後序號；載入時只重播序號較新的日誌行，
+  壓縮途中中斷也不會重複計數
+- 同一路徑在行程內只有一個寫入者（get_history_manager），web API 與 ResponsesRAGSystem 共用
+- SQLiteHistoryManager（HISTORY_BACKEND = "sqlite"）：寫入 SQLite，依會話、時間與知識點建立索引，
+  長期保存全部記錄，分頁查詢直接在資料庫中進行，單次查詢的成本不隨記錄數增加
+- 統計（K/C/R 分布、知識點、各會話次數、分鐘 / 小時 / 天分桶）在新增時增量維護
+  （見 core/history_aggregates.py），讀取統計不掃描歷史記錄
 """
 import json
 import os
+import sqlite3
+import threading
 from datetime import datetime
 from typing import List, Dict, Optional
 from collections import deque, Counter
@@ -11,6 +25,7 @@ from collections import deque, Counter
 
 from dataclasses import dataclass
 from config import Config
+from core.history_aggregates import ROLLUP_GRANULARITIES, HistoryAggregates, record_counts, rollup_cutoff
 
 @dataclass
 class HistoryRecord:
@@ -18,17 +33,21 @@ class HistoryRecord:
     query: str
     matched_docs: List[str]
     knowledge_points: List[str]
-    dimensions: Dict[str, str]
+    dimensions: Dict[str, int]
     timestamp: str
+    session_id: str = Config.DEFAULT_SESSION_ID
+    id: Optional[int] = None
     
     def to_dict(self) -> dict:
         """轉換為字典"""
         return {
+            "id": self.id,
             "query": self.query,
             "matched_docs": self.matched_docs,
             "knowledge_points": self.knowledge_points,
             "dimensions": self.dimensions,
-            "timestamp": self.timestamp
+            "timestamp": self.timestamp,
+            "session_id": self.session_id
         }
     
     @classmethod
@@ -39,33 +58,49 @@ class HistoryRecord:
             matched_docs=data["matched_docs"],
             knowledge_points=data["knowledge_points"],
             dimensions=data["dimensions"],
-            timestamp=data["timestamp"]
+            timestamp=data["timestamp"],
+            session_id=data.get("session_id", Config.DEFAULT_SESSION_ID),
+            id=data.get("id")
         )
 
 
 class HistoryManager:
     """歷史紀錄管理器"""
     
-    def __init__(self, max_size: int = None, storage_path: str = None):
+    def __init__(self, max_size: int = None, storage_path: str = None, flush_interval: float = None):
         """
         初始化歷史管理器
         
         Args:
             max_size: 最大保存記錄數（默認從配置讀取）
-            storage_path: 儲存路徑（默認從配置讀取）
+            storage_path: 快照儲存路徑（默認從配置讀取；日誌為同名的 .jsonl 檔）
+            flush_interval: 背景寫入日誌的間隔（秒，默認從配置讀取；<= 0 時每筆記錄立即寫入）
         """
         self.max_size = max_size or Config.HISTORY_SIZE
         self.storage_path = storage_path or Config.HISTORY_STORAGE_PATH
+        self.log_path = os.path.splitext(self.storage_path)[0] + ".jsonl"
+        self.flush_interval = Config.HISTORY_FLUSH_INTERVAL if flush_interval is None else flush_interval
         
         # 使用 deque 實現固定大小的歷史記錄
         self.history: deque = deque(maxlen=self.max_size)
         
-        # 知識點訪問計數器
-        self.knowledge_point_counter = Counter()
+        # 增量維護的統計（查詢數、K/C/R 分布、知識點、各會話次數、時間分桶）
+        self.aggregates = HistoryAggregates()
         
         # 連續訪問追蹤（用於檢測重複）
         self.consecutive_access: deque = deque(maxlen=10)
         
+        # 日誌狀態：最後序號（即最後一筆記錄的 id）、尚未寫入的記錄、日誌中的行數
+        self.seq = 0
+        self._pending: List[HistoryRecord] = []
+        self._log_lines = 0
+        
+        # _lock 保護記憶體狀態與待寫入佇列；_io_lock 讓日誌寫入與壓縮互斥
+        self._lock = threading.Lock()
+        self._io_lock = threading.Lock()
+        self._flusher: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+        
         # 載入已存在的歷史
         self.load()
     
@@ -73,17 +108,19 @@ class HistoryManager:
         self,
         query: str,
         matched_docs: List[str],
-        dimensions: Dict[str, str],
-        knowledge_points: List[str] = None
+        dimensions: Dict[str, int],
+        knowledge_points: List[str] = None,
+        session_id: str = None
     ) -> HistoryRecord:
         """
-        添加查詢記錄
+        添加查詢記錄（只更新記憶體並排入日誌佇列，由背景執行緒寫入）
         
         Args:
             query: 查詢內容
             matched_docs: 匹配的文件列表
             dimensions: 三維度判定結果（K/C/R）
             knowledge_points: 知識點名稱列表
+            session_id: 會話 ID（默認為預設會話）
             
         Returns:
             HistoryRecord: 創建的歷史記錄
@@ -98,22 +135,37 @@ class HistoryManager:
             matched_docs=matched_docs,
             knowledge_points=knowledge_points,
             dimensions=dimensions,
-            timestamp=datetime.now().isoformat()
+            timestamp=datetime.now().isoformat(),
+            session_id=session_id or Config.DEFAULT_SESSION_ID
         )
         
+        with self._lock:
+            self.seq += 1
+            record.id = self.seq
+            self._apply(record)
+            self._pending.append(record)
+        
+        if self.flush_interval > 0:
+            self._ensure_flusher()
+        else:
+            self.flush()
+        
+        return record
+    
+    def _apply(self, record: HistoryRecord):
+        """將一筆記錄套用到記憶體狀態（新增與載入日誌共用）"""
         # 添加到歷史
         self.history.append(record)
         
-        for kp in knowledge_points:
-            self.knowledge_point_counter[kp] += 1
+        self.aggregates.add(record)
         
         # 更新連續訪問記錄
-        self.consecutive_access.extend(knowledge_points)
-        
-        # 自動儲存
-        self.save()
-        
-        return record
+        self.consecutive_access.extend(record.knowledge_points)
+    
+    @property
+    def knowledge_point_counter(self) -> Counter:
+        """知識點訪問計數器（全部記錄）"""
+        return self.aggregates.counter("knowledge_point")
     
     def _extract_knowledge_points(self, matched_docs: List[str]) -> List[str]:
         """
@@ -131,38 +183,23 @@ class HistoryManager:
                 knowledge_points.append(Config.KNOWLEDGE_POINTS[doc])
         return knowledge_points
     
-    def check_repetition(self, knowledge_point: str) -> bool:
-        """
-        檢查是否連續重複詢問同一知識點
-        
-        Args:
-            knowledge_point: 知識點名稱
-            
-        Returns:
-            是否處於重複狀態
-        """
-        if len(self.consecutive_access) < Config.REPETITION_THRESHOLD:
-            return False
-        
-        # 檢查最近的 N 次訪問
-        recent = list(self.consecutive_access)[-Config.REPETITION_THRESHOLD:]
-        
-        # 如果最近 N 次都是同一個知識點，則判定為重複
-        return all(kp == knowledge_point for kp in recent)
-    
-    def get_recent_history(self, n: int = None) -> List[HistoryRecord]:
+    def get_recent_history(self, n: int = None, session_id: str = None) -> List[HistoryRecord]:
         """
         獲取最近的 N 條歷史記錄
         
         Args:
             n: 記錄數量（默認全部）
+            session_id: 只返回指定會話的記錄（默認全部會話）
             
         Returns:
             歷史記錄列表
         """
+        records = list(self.history)
+        if session_id is not None:
+            records = [r for r in records if r.session_id == session_id]
         if n is None:
-            return list(self.history)
-        return list(self.history)[-n:]
+            return records
+        return records[-n:]
     
     def get_knowledge_point_stats(self) -> Dict[str, int]:
         """
@@ -175,75 +212,224 @@ class HistoryManager:
     
     def get_dimension_stats(self) -> Dict[str, Counter]:
         """
-        獲取三維度統計 (K/C/R)
+        獲取三維度統計 (K/C/R，全部記錄)
         
         Returns:
             各維度的值分布統計
         """
-        stats = {
-            "K": Counter(),
-            "C": Counter(),
-            "R": Counter()
-        }
+        return self.aggregates.get_dimension_stats()
+    
+    def get_session_stats(self, session_id: str = None) -> Dict[str, int]:
+        """
+        獲取各會話的查詢次數
         
-        for record in self.history:
-            for dim, value in record.dimensions.items():
-                stats[dim][value] += 1
+        Args:
+            session_id: 只返回指定會話（默認全部會話）
+            
+        Returns:
+            會話 ID → 查詢次數
+        """
+        counter = self.aggregates.counter("session")
+        if session_id is not None:
+            return {session_id: counter[session_id]} if session_id in counter else {}
+        return dict(counter)
+    
+    def get_rollup(self, granularity: str, limit: int = None) -> List[Dict]:
+        """
+        獲取時間分桶的查詢數
         
-        return stats
+        Args:
+            granularity: "minute" / "hour" / "day"
+            limit: 只返回最近的幾個桶（默認全部）
+            
+        Returns:
+            由舊到新的 [{"bucket", "queries"}]
+        """
+        return self.aggregates.get_rollup(granularity, limit)
+    
+    def get_total_queries(self) -> int:
+        """獲取查詢總數（全部記錄）"""
+        return self.aggregates.total
+    
+    def query_history(
+        self,
+        limit: int = 10,
+        before_id: int = None,
+        session_id: str = None,
+        knowledge_point: str = None,
+        since: str = None,
+        until: str = None
+    ) -> Dict:
+        """
+        分頁查詢歷史記錄（由新到舊翻頁，以 before_id 作為游標）
+        
+        Args:
+            limit: 每頁記錄數
+            before_id: 只返回 id 小於此值的記錄（上一頁返回的 next_before_id）
+            session_id: 只返回指定會話的記錄
+            knowledge_point: 只返回涉及指定知識點的記錄
+            since: 只返回此時間（ISO 8601，含）之後的記錄
+            until: 只返回此時間（ISO 8601，不含）之前的記錄
+            
+        Returns:
+            {"records": 由舊到新排列的 HistoryRecord 列表, "total": 符合條件的記錄數,
+             "next_before_id": 下一頁的游標（沒有更多記錄時為 None）}
+        """
+        with self._lock:
+            matched = [
+                r for r in self.history
+                if (session_id is None or r.session_id == session_id)
+                and (knowledge_point is None or knowledge_point in r.knowledge_points)
+                and (since is None or r.timestamp >= since)
+                and (until is None or r.timestamp < until)
+            ]
+        page = [r for r in matched if before_id is None or (r.id or 0) < before_id]
+        records = page[-limit:] if limit > 0 else []
+        has_more = len(page) > len(records)
+        return {
+            "records": records,
+            "total": len(matched),
+            "next_before_id": records[0].id if has_more and records else None
+        }
     
     def clear(self):
-        """清空歷史記錄"""
-        self.history.clear()
-        self.knowledge_point_counter.clear()
-        self.consecutive_access.clear()
+        """清空歷史記錄（快照寫為空狀態並清空日誌）"""
+        with self._lock:
+            self.history.clear()
+            self.aggregates.clear()
+            self.consecutive_access.clear()
         self.save()
         print("✅ 歷史記錄已完全清除")
     
+    # ==================== 持久化 ====================
+    
+    def _ensure_flusher(self):
+        """啟動背景寫入執行緒（第一次新增記錄時，或 close 之後再次新增時）"""
+        if self._flusher is not None and self._flusher.is_alive():
+            return
+        self._stopped.clear()
+        self._flusher = threading.Thread(target=self._run_flusher, name="history-flusher", daemon=True)
+        self._flusher.start()
+    
+    def _run_flusher(self):
+        """定期將待寫入的日誌行批次追加到日誌"""
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception as e:
+                print(f"⚠️  寫入歷史日誌失敗: {e}")
+    
+    def flush(self):
+        """寫出待寫入的記錄"""
+        with self._io_lock:
+            with self._lock:
+                records, self._pending = self._pending, []
+            if records:
+                self._write(records)
+    
+    def _write(self, records: List[HistoryRecord]):
+        """追加到日誌，行數達到門檻時壓縮為快照（需持有 _io_lock）"""
+        with open(self.log_path, 'a', encoding='utf-8') as f:
+            f.write("".join(json.dumps(r.to_dict(), ensure_ascii=False) + "\n" for r in records))
+        self._log_lines += len(records)
+        if self._log_lines >= Config.HISTORY_COMPACT_THRESHOLD:
+            self._compact()
+    
     def save(self):
-        """儲存歷史記錄到文件"""
-        data = {
-            "history": [record.to_dict() for record in self.history],
-            "knowledge_point_counter": dict(self.knowledge_point_counter),
-            "consecutive_access": list(self.consecutive_access)
-        }
+        """將目前狀態寫成快照並清空日誌（壓縮）"""
+        with self._io_lock:
+            self._compact()
+    
+    def _compact(self):
+        """寫出快照並清空日誌（需持有 _io_lock；待寫入的記錄已包含在快照中）"""
+        with self._lock:
+            data = {
+                "history": [record.to_dict() for record in self.history],
+                "knowledge_point_counter": dict(self.knowledge_point_counter),
+                "consecutive_access": list(self.consecutive_access),
+                "aggregates": self.aggregates.to_dict(),
+                "last_seq": self.seq
+            }
+            self._pending = []
         
-        with open(self.storage_path, 'w', encoding='utf-8') as f:
+        tmp_path = self.storage_path + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
             json.dump(data, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.storage_path)
+        
+        # 快照已包含日誌中的所有記錄（即使清空前中斷，載入時也會依序號略過）
+        open(self.log_path, 'w', encoding='utf-8').close()
+        self._log_lines = 0
+    
+    def close(self):
+        """停止背景寫入並寫出剩餘記錄"""
+        self._stopped.set()
+        if self._flusher is not None:
+            self._flusher.join()
+            self._flusher = None
+        self.flush()
     
     def load(self) -> bool:
         """
-        從文件載入歷史記錄
+        從快照載入歷史記錄，再重播日誌中較新的記錄
         
         Returns:
             是否成功載入
         """
-        if not os.path.exists(self.storage_path):
-            return False
+        loaded = False
+        if os.path.exists(self.storage_path):
+            try:
+                with open(self.storage_path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                
+                # 載入歷史記錄
+                self.history = deque(
+                    [HistoryRecord.from_dict(record) for record in data.get("history", [])],
+                    maxlen=self.max_size
+                )
+                
+                # 載入統計（舊版快照沒有 aggregates：由保留的記錄重建，知識點沿用累計的計數）
+                if "aggregates" in data:
+                    self.aggregates = HistoryAggregates.from_dict(data["aggregates"])
+                else:
+                    self.aggregates = HistoryAggregates()
+                    for record in self.history:
+                        self.aggregates.add(record)
+                    self.aggregates.counters["knowledge_point"] = Counter(data.get("knowledge_point_counter", {}))
+                
+                # 載入連續訪問記錄
+                self.consecutive_access = deque(
+                    data.get("consecutive_access", []),
+                    maxlen=10
+                )
+                
+                self.seq = data.get("last_seq", 0)
+                loaded = True
+            except Exception as e:
+                print(f"⚠️  載入歷史記錄失敗: {e}")
         
-        try:
-            with open(self.storage_path, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            # 載入歷史記錄
-            self.history = deque(
-                [HistoryRecord.from_dict(record) for record in data.get("history", [])],
-                maxlen=self.max_size
-            )
-            
-            # 載入知識點計數
-            self.knowledge_point_counter = Counter(data.get("knowledge_point_counter", {}))
-            
-            # 載入連續訪問記錄
-            self.consecutive_access = deque(
-                data.get("consecutive_access", []),
-                maxlen=10
-            )
-            
-            return True
-        except Exception as e:
-            print(f"⚠️  載入歷史記錄失敗: {e}")
+        return self._replay_log() or loaded
+    
+    def _replay_log(self) -> bool:
+        """重播日誌中序號大於快照的記錄（略過寫到一半的最後一行）"""
+        if not os.path.exists(self.log_path):
             return False
+        
+        replayed = 0
+        with open(self.log_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                self._log_lines += 1
+                try:
+                    data = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                seq = data.get("id") or 0
+                if seq <= self.seq:
+                    continue
+                self._apply(HistoryRecord.from_dict(data))
+                self.seq = seq
+                replayed += 1
+        return replayed > 0
     
     def get_summary(self) -> dict:
         """
@@ -253,7 +439,7 @@ class HistoryManager:
             摘要字典
         """
         return {
-            "total_queries": len(self.history),
+            "total_queries": self.get_total_queries(),
             "max_size": self.max_size,
             "knowledge_points": self.get_knowledge_point_stats(),
             "dimension_stats": {
@@ -270,7 +456,7 @@ class HistoryManager:
         print("\n" + "="*60)
         print("📊 歷史紀錄摘要")
         print("="*60)
-        print(f"總查詢次數: {summary['total_queries']}/{summary['max_size']}")
+        print(f"總查詢次數: {summary['total_queries']}（記憶體保留最近 {summary['max_size']} 筆）")
         
         print("\n知識點訪問統計:")
         for kp, count in summary['knowledge_points'].items():
@@ -288,3 +474,287 @@ class HistoryManager:
         print(f"  {' → '.join(summary['recent_access'])}")
         
         print("="*60 + "\n")
+
+
+class SQLiteHistoryManager(HistoryManager):
+    """
+    SQLite 後端的歷史紀錄管理器
+    
+    記錄由背景執行緒批次寫入 history 表（每批一個交易），知識點另存於
+    history_knowledge_points 表；依會話、時間與知識點建立索引。
+    統計計數在同一個交易中累加到 history_counters 表（主鍵 (name, key)），
+    讀取統計只查計數表，多個 worker 共用資料庫時也一致。
+    記憶體中仍保留最近 max_size 筆記錄與連續訪問（重複性檢測用），
+    統計與分頁查詢則涵蓋資料庫中的全部記錄
+    """
+    
+    def __init__(self, max_size: int = None, db_path: str = None, flush_interval: float = None):
+        """
+        初始化 SQLite 歷史管理器
+        
+        Args:
+            max_size: 記憶體中保留的最近記錄數（默認從配置讀取）
+            db_path: 資料庫路徑（默認從配置讀取）
+            flush_interval: 背景寫入間隔（秒，默認從配置讀取；<= 0 時每筆記錄立即寫入）
+        """
+        self.db_path = db_path or Config.HISTORY_DB_PATH
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS history ("
+            " id INTEGER PRIMARY KEY AUTOINCREMENT,"
+            " session_id TEXT NOT NULL,"
+            " timestamp TEXT NOT NULL,"
+            " query TEXT NOT NULL,"
+            " matched_docs TEXT NOT NULL,"
+            " knowledge_points TEXT NOT NULL,"
+            " k INTEGER, c INTEGER, r INTEGER)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS history_knowledge_points ("
+            " history_id INTEGER NOT NULL,"
+            " knowledge_point TEXT NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_history_session ON history(session_id, id)")
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_history_timestamp ON history(timestamp)")
+        self.conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_history_kp ON history_knowledge_points(knowledge_point, history_id)"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS history_counters ("
+            " name TEXT NOT NULL,"
+            " key TEXT NOT NULL,"
+            " count INTEGER NOT NULL,"
+            " PRIMARY KEY (name, key)) WITHOUT ROWID"
+        )
+        super().__init__(max_size, storage_path=self.db_path, flush_interval=flush_interval)
+    
+    def _row_to_record(self, row) -> HistoryRecord:
+        id_, session_id, timestamp, query, matched_docs, knowledge_points, k, c, r = row
+        return HistoryRecord(
+            query=query,
+            matched_docs=json.loads(matched_docs),
+            knowledge_points=json.loads(knowledge_points),
+            # 與 JSON Lines 後端一致返回整數（舊資料庫的欄位宣告為 TEXT）
+            dimensions={dim: int(value) for dim, value in (("K", k), ("C", c), ("R", r)) if value is not None},
+            timestamp=timestamp,
+            session_id=session_id,
+            id=id_
+        )
+    
+    def _fetch(self, sql: str, params: tuple = ()) -> list:
+        with self._io_lock:
+            return self.conn.execute(sql, params).fetchall()
+    
+    def _counter_rows(self, name: str, order_by: str = "count DESC", limit: int = -1) -> list:
+        return self._fetch(
+            f"SELECT key, count FROM history_counters WHERE name = ? ORDER BY {order_by} LIMIT ?", (name, limit)
+        )
+    
+    def _rebuild_counters(self):
+        """由 history 表重建計數表（升級前建立的資料庫首次開啟時執行一次）"""
+        aggregates = HistoryAggregates()
+        with self._io_lock:
+            for row in self.conn.execute(
+                "SELECT id, session_id, timestamp, query, matched_docs, knowledge_points, k, c, r"
+                " FROM history ORDER BY id"
+            ):
+                aggregates.add(self._row_to_record(row))
+            self.conn.execute("BEGIN")
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO history_counters (name, key, count) VALUES (?, ?, ?)",
+                [(name, key, count) for name, counter in aggregates.counters.items() for key, count in counter.items()]
+            )
+            self.conn.execute("COMMIT")
+    
+    def load(self) -> bool:
+        """從資料庫載入最近的記錄、知識點計數與連續訪問"""
+        rows = self._fetch(
+            "SELECT id, session_id, timestamp, query, matched_docs, knowledge_points, k, c, r"
+            " FROM history ORDER BY id DESC LIMIT ?", (self.max_size,)
+        )
+        if rows and not self._fetch("SELECT 1 FROM history_counters LIMIT 1"):
+            self._rebuild_counters()
+        records = [self._row_to_record(row) for row in reversed(rows)]
+        self.history = deque(records, maxlen=self.max_size)
+        self.aggregates = HistoryAggregates.from_dict({"knowledge_point": dict(self._counter_rows("knowledge_point"))})
+        self.consecutive_access = deque((kp for r in records for kp in r.knowledge_points), maxlen=10)
+        self.seq = records[-1].id if records else 0
+        return bool(records)
+    
+    def _write(self, records: List[HistoryRecord]):
+        """在一個交易中寫入一批記錄（需持有 _io_lock；id 以資料庫配發的為準）"""
+        self.conn.execute("BEGIN")
+        try:
+            for record in records:
+                dims = record.dimensions
+                cursor = self.conn.execute(
+                    "INSERT INTO history (session_id, timestamp, query, matched_docs, knowledge_points, k, c, r)"
+                    " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (record.session_id, record.timestamp, record.query,
+                     json.dumps(record.matched_docs, ensure_ascii=False),
+                     json.dumps(record.knowledge_points, ensure_ascii=False),
+                     dims.get("K"), dims.get("C"), dims.get("R"))
+                )
+                record.id = cursor.lastrowid
+                self.conn.executemany(
+                    "INSERT INTO history_knowledge_points (history_id, knowledge_point) VALUES (?, ?)",
+                    [(record.id, kp) for kp in record.knowledge_points]
+                )
+            
+            # 累加統計計數，並清除超過保留期限的時間分桶（主鍵範圍刪除）
+            deltas = Counter(
+                (name, key) for record in records for name, key in record_counts(record, self.aggregates.rollups)
+            )
+            self.conn.executemany(
+                "INSERT INTO history_counters (name, key, count) VALUES (?, ?, ?)"
+                " ON CONFLICT(name, key) DO UPDATE SET count = count + excluded.count",
+                [(name, key, count) for (name, key), count in deltas.items()]
+            )
+            if self.aggregates.rollups:
+                self.conn.executemany(
+                    "DELETE FROM history_counters WHERE name = ? AND key < ?",
+                    [(granularity, rollup_cutoff(granularity)) for granularity in ROLLUP_GRANULARITIES]
+                )
+            self.conn.execute("COMMIT")
+        except Exception:
+            self.conn.execute("ROLLBACK")
+            raise
+    
+    def save(self):
+        """寫出待寫入的記錄（資料庫即為持久狀態，不需要快照）"""
+        self.flush()
+    
+    def clear(self):
+        """清空資料庫與記憶體中的歷史記錄"""
+        with self._io_lock:
+            with self._lock:
+                self._pending = []
+                self.history.clear()
+                self.aggregates.clear()
+                self.consecutive_access.clear()
+            self.conn.execute("DELETE FROM history_knowledge_points")
+            self.conn.execute("DELETE FROM history")
+            self.conn.execute("DELETE FROM history_counters")
+        print("✅ 歷史記錄已完全清除")
+    
+    def get_total_queries(self) -> int:
+        """獲取資料庫中的記錄總數（讀取計數表）"""
+        self.flush()
+        rows = self._counter_rows("total")
+        return rows[0][1] if rows else 0
+    
+    def get_recent_history(self, n: int = None, session_id: str = None) -> List[HistoryRecord]:
+        """獲取最近的 N 條歷史記錄（默認為 max_size 條；指定會話時查詢資料庫中的全部記錄）"""
+        return self.query_history(limit=n or self.max_size, session_id=session_id)["records"]
+    
+    def query_history(
+        self,
+        limit: int = 10,
+        before_id: int = None,
+        session_id: str = None,
+        knowledge_point: str = None,
+        since: str = None,
+        until: str = None
+    ) -> Dict:
+        """分頁查詢歷史記錄（參數與返回值同 HistoryManager.query_history，以索引查詢）"""
+        self.flush()
+        conditions, params = [], []
+        if session_id is not None:
+            conditions.append("session_id = ?")
+            params.append(session_id)
+        if knowledge_point is not None:
+            conditions.append("id IN (SELECT history_id FROM history_knowledge_points WHERE knowledge_point = ?)")
+            params.append(knowledge_point)
+        if since is not None:
+            conditions.append("timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("timestamp < ?")
+            params.append(until)
+        where = " WHERE " + " AND ".join(conditions) if conditions else ""
+        total = self._count_matching(where, params, session_id, knowledge_point, since, until)
+        
+        if before_id is not None:
+            where = (where + " AND" if where else " WHERE") + " id < ?"
+            params.append(before_id)
+        rows = self._fetch(
+            "SELECT id, session_id, timestamp, query, matched_docs, knowledge_points, k, c, r"
+            f" FROM history{where} ORDER BY id DESC LIMIT ?", tuple(params) + (max(limit, 0) + 1,)
+        )
+        has_more = len(rows) > limit
+        records = [self._row_to_record(row) for row in reversed(rows[:max(limit, 0)])]
+        return {
+            "records": records,
+            "total": total,
+            "next_before_id": records[0].id if has_more and records else None
+        }
+    
+    def _count_matching(self, where: str, params: list, session_id, knowledge_point, since, until) -> int:
+        """符合條件的記錄數：只有單一會話或知識點條件（或沒有條件）時直接讀取計數表"""
+        if since is None and until is None:
+            if session_id is None and knowledge_point is None:
+                return self.get_total_queries()
+            if knowledge_point is None or session_id is None:
+                name, key = ("session", session_id) if knowledge_point is None else ("knowledge_point", knowledge_point)
+                rows = self._fetch("SELECT count FROM history_counters WHERE name = ? AND key = ?", (name, key))
+                return rows[0][0] if rows else 0
+        return self._fetch(f"SELECT COUNT(*) FROM history{where}", tuple(params))[0][0]
+    
+    def get_knowledge_point_stats(self) -> Dict[str, int]:
+        """獲取全部記錄的知識點訪問統計（讀取計數表）"""
+        self.flush()
+        return dict(self._counter_rows("knowledge_point"))
+    
+    def get_dimension_stats(self) -> Dict[str, Counter]:
+        """獲取全部記錄的三維度統計 (K/C/R，讀取計數表)"""
+        self.flush()
+        return {dim: Counter(dict(self._counter_rows(dim, order_by="key"))) for dim in ("K", "C", "R")}
+    
+    def get_session_stats(self, session_id: str = None) -> Dict[str, int]:
+        """獲取各會話的查詢次數（讀取計數表；指定會話時以主鍵查詢）"""
+        self.flush()
+        if session_id is not None:
+            return dict(self._fetch(
+                "SELECT key, count FROM history_counters WHERE name = 'session' AND key = ?", (session_id,)
+            ))
+        return dict(self._counter_rows("session"))
+    
+    def get_rollup(self, granularity: str, limit: int = None) -> List[Dict]:
+        """獲取時間分桶的查詢數（讀取計數表，由舊到新）"""
+        if granularity not in ROLLUP_GRANULARITIES:
+            raise ValueError(f"未知的分桶粒度: {granularity}（可用: {', '.join(ROLLUP_GRANULARITIES)}）")
+        self.flush()
+        rows = self._counter_rows(granularity, order_by="key DESC", limit=-1 if limit is None else limit)
+        return [{"bucket": bucket, "queries": count} for bucket, count in reversed(rows)]
+
+
+def create_history_manager(storage_path: str = None) -> HistoryManager:
+    """依配置建立歷史管理器（HISTORY_BACKEND: "jsonl" 或 "sqlite"）"""
+    if Config.HISTORY_BACKEND == "sqlite":
+        return SQLiteHistoryManager(db_path=storage_path)
+    return HistoryManager(storage_path=storage_path)
+
+
+# 每個儲存路徑一個共享的歷史管理器（同一行程內的單一寫入者）
+_managers: Dict[str, HistoryManager] = {}
+_managers_lock = threading.Lock()
+
+
+def get_history_manager(storage_path: str = None) -> HistoryManager:
+    """
+    獲取共享的歷史管理器
+
+    Args:
+        storage_path: 快照或資料庫路徑（默認依 HISTORY_BACKEND 從配置讀取）
+
+    Returns:
+        該路徑的 HistoryManager（首次調用時依配置建立）
+    """
+    default_path = Config.HISTORY_DB_PATH if Config.HISTORY_BACKEND == "sqlite" else Config.HISTORY_STORAGE_PATH
+    path = os.path.abspath(storage_path or default_path)
+    with _managers_lock:
+        if path not in _managers:
+            _managers[path] = create_history_manager(path)
+        return _managers[path]
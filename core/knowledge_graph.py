@@ -0,0 +1,278 @@
+"""
+知識圖譜模組
+載入 data/knowledge_relations.json 的節點與關係，在啟動時建立以整數索引的鄰接表，
+並預先計算每個節點的 k 跳鄰域與上層節點的遞移閉包，查詢時不再走訪圖：
+- 相關知識點：依距離串接預先計算的鄰域，成本與結果數量成正比
+- 上層節點：閉包以位元遮罩保存，多個知識點的共同上層為遮罩交集，成本 O(知識點數)
+- 知識點之間的關係：只檢查各知識點的出邊，成本 O(度數)
+
+關係格式：{"source": "ipv4", "target": "ip_address", "type": "is_a"}
+is_a / part_of 表示 target 是 source 的上層節點；其他類型只作為相關性（不分方向）
+"""
+import json
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from config import Config
+
+# 表示上下層（target 為上層）的關係類型
+HIERARCHY_RELATION_TYPES = ("is_a", "part_of")
+
+# 提示詞上下文快取的最大組合數（圖譜載入後不變，同一組知識點只需格式化一次）
+CONTEXT_CACHE_SIZE = 4096
+
+
+class KnowledgeGraph:
+    """知識圖譜（節點以整數索引，鄰域與閉包在載入時預先計算）"""
+
+    def __init__(self, relations_file: str = None, max_hops: int = None):
+        """
+        初始化知識圖譜
+
+        Args:
+            relations_file: 節點與關係定義檔（默認從配置讀取，相對路徑以專案根目錄為準）
+            max_hops: 預先計算的最大鄰域距離（默認從配置讀取）
+        """
+        if relations_file is None:
+            relations_file = Path(__file__).parent.parent / Config.KNOWLEDGE_RELATIONS_PATH
+        self.relations_file = Path(relations_file)
+        self.max_hops = Config.KNOWLEDGE_GRAPH_MAX_HOPS if max_hops is None else max_hops
+
+        self.node_ids: List[str] = []
+        self.node_names: List[str] = []
+        self._index: Dict[str, int] = {}                      # 節點 id 與名稱 → 索引
+        self._out_edges: List[Tuple[Tuple[int, str], ...]] = []  # 索引 → ((目標索引, 關係類型), ...)
+        self._hops: List[Tuple[Tuple[int, ...], ...]] = []       # 索引 → (距離 1 的節點, 距離 2 的節點, ...)
+        self._ancestors: List[int] = []                       # 索引 → 上層節點位元遮罩（遞移閉包）
+        self.relation_count = 0
+        self._context_cache: Dict[Tuple[str, ...], str] = {}
+
+        self._load()
+
+    def _load(self):
+        """載入定義檔並建立索引"""
+        try:
+            with open(self.relations_file, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+        except Exception as e:
+            print(f"⚠️  無法載入知識圖譜 {self.relations_file}: {e}")
+            data = {}
+
+        self.build(data.get("nodes", []), data.get("relations", []))
+
+    def build(self, nodes: List[Dict], relations: List[Dict]):
+        """
+        由節點與關係建立鄰接表、k 跳鄰域與上層閉包
+
+        Args:
+            nodes: [{"id", "name"}]
+            relations: [{"source", "target", "type"}]（端點可使用節點 id 或名稱）
+        """
+        self.node_ids = [node["id"] for node in nodes]
+        self.node_names = [node.get("name", node["id"]) for node in nodes]
+        self._index = {}
+        for i, (node_id, name) in enumerate(zip(self.node_ids, self.node_names)):
+            self._index[node_id] = i
+            self._index.setdefault(name, i)
+
+        n = len(nodes)
+        out_edges = [[] for _ in range(n)]
+        neighbours = [set() for _ in range(n)]
+        parents = [set() for _ in range(n)]
+        self.relation_count = 0
+        for relation in relations:
+            source = self._index.get(relation.get("source"))
+            target = self._index.get(relation.get("target"))
+            if source is None or target is None or source == target:
+                print(f"⚠️  略過無效的知識點關係: {relation}")
+                continue
+            relation_type = relation.get("type", "related_to")
+            out_edges[source].append((target, relation_type))
+            neighbours[source].add(target)
+            neighbours[target].add(source)
+            if relation_type in HIERARCHY_RELATION_TYPES:
+                parents[source].add(target)
+            self.relation_count += 1
+
+        self._out_edges = [tuple(edges) for edges in out_edges]
+        self._hops = [self._bfs_rings(neighbours, i) for i in range(n)]
+        self._ancestors = [self._closure_mask(parents, i) for i in range(n)]
+        self._context_cache = {}
+
+    def _bfs_rings(self, neighbours: List[set], start: int) -> Tuple[Tuple[int, ...], ...]:
+        """從 start 出發依距離分層的鄰域（最多 max_hops 層）"""
+        seen = {start}
+        frontier = [start]
+        rings = []
+        for _ in range(self.max_hops):
+            ring = sorted({j for i in frontier for j in neighbours[i]} - seen)
+            if not ring:
+                break
+            rings.append(tuple(ring))
+            seen.update(ring)
+            frontier = ring
+        return tuple(rings)
+
+    @staticmethod
+    def _closure_mask(parents: List[set], start: int) -> int:
+        """start 的所有上層節點（位元遮罩；上下層關係有環時也會終止）"""
+        mask = 0
+        stack = list(parents[start])
+        while stack:
+            i = stack.pop()
+            if not mask >> i & 1:
+                mask |= 1 << i
+                stack.extend(parents[i])
+        return mask & ~(1 << start)
+
+    def _names(self, mask: int) -> List[str]:
+        """位元遮罩 → 節點名稱（依索引順序）"""
+        names = []
+        while mask:
+            low = mask & -mask
+            names.append(self.node_names[low.bit_length() - 1])
+            mask ^= low
+        return names
+
+    def _indices(self, knowledge_points: List[str]) -> List[int]:
+        """知識點 → 索引（略過未定義的知識點，保留順序並去重）"""
+        indices = []
+        for kp in knowledge_points:
+            i = self._index.get(kp)
+            if i is not None and i not in indices:
+                indices.append(i)
+        return indices
+
+    def has_node(self, knowledge_point: str) -> bool:
+        """知識點（id 或名稱）是否為圖譜節點"""
+        return knowledge_point in self._index
+
+    def get_related(self, knowledge_point: str, hops: int = 1) -> List[str]:
+        """
+        相關知識點（依距離由近到遠）
+
+        Args:
+            knowledge_point: 知識點 id 或名稱
+            hops: 最大距離（超過預先計算的距離時以 max_hops 為準）
+
+        Returns:
+            知識點名稱列表（未定義的知識點返回空列表）
+        """
+        i = self._index.get(knowledge_point)
+        if i is None:
+            return []
+        return [self.node_names[j] for ring in self._hops[i][:hops] for j in ring]
+
+    def get_ancestors(self, knowledge_point: str) -> List[str]:
+        """
+        所有上層知識點（沿 is_a / part_of 遞移）
+
+        Args:
+            knowledge_point: 知識點 id 或名稱
+
+        Returns:
+            知識點名稱列表
+        """
+        i = self._index.get(knowledge_point)
+        return [] if i is None else self._names(self._ancestors[i])
+
+    def get_shared_ancestors(self, knowledge_points: List[str]) -> List[str]:
+        """
+        多個知識點的共同上層知識點（K>1 時使用）
+
+        Args:
+            knowledge_points: 知識點 id 或名稱列表
+
+        Returns:
+            知識點名稱列表（少於兩個已定義的知識點時返回空列表）
+        """
+        indices = self._indices(knowledge_points)
+        if len(indices) < 2:
+            return []
+        mask = self._ancestors[indices[0]]
+        for i in indices[1:]:
+            mask &= self._ancestors[i]
+        return self._names(mask)
+
+    def get_relations_between(self, knowledge_points: List[str]) -> List[Dict[str, str]]:
+        """
+        知識點之間直接定義的關係
+
+        Args:
+            knowledge_points: 知識點 id 或名稱列表
+
+        Returns:
+            [{"source", "target", "type"}]（名稱）
+        """
+        indices = self._indices(knowledge_points)
+        members = set(indices)
+        return [
+            {"source": self.node_names[i], "target": self.node_names[j], "type": relation_type}
+            for i in indices
+            for j, relation_type in self._out_edges[i]
+            if j in members
+        ]
+
+    def get_context_for_prompt(self, knowledge_points: List[str]) -> str:
+        """
+        為提示詞生成結構化的知識點關係（取代整份本體論文本）
+
+        Args:
+            knowledge_points: 匹配的知識點列表
+
+        Returns:
+            關係說明文本（沒有可用的關係時返回「無」）
+        """
+        key = tuple(knowledge_points)
+        context = self._context_cache.get(key)
+        if context is None:
+            if len(self._context_cache) >= CONTEXT_CACHE_SIZE:
+                del self._context_cache[next(iter(self._context_cache))]
+            context = self._context_cache[key] = self._format_context(knowledge_points)
+        return context
+
+    def _format_context(self, knowledge_points: List[str]) -> str:
+        """格式化知識點關係（get_context_for_prompt 的未快取版本）"""
+        lines = [
+            f"- {relation['source']} --{relation['type']}--> {relation['target']}"
+            for relation in self.get_relations_between(knowledge_points)
+        ]
+        shared = self.get_shared_ancestors(knowledge_points)
+        if shared:
+            lines.append(f"共同上層知識點：{', '.join(shared)}")
+        # 直接相鄰、但未被匹配的知識點作為延伸學習建議
+        indices = self._indices(knowledge_points)
+        related = []
+        for i in indices:
+            for ring in self._hops[i][:1]:
+                related.extend(j for j in ring if j not in indices and j not in related)
+        if related:
+            lines.append(f"延伸知識點：{', '.join(self.node_names[j] for j in related)}")
+        return "\n".join(lines) if lines else "無"
+
+    def get_stats(self) -> Dict[str, int]:
+        """圖譜規模"""
+        return {
+            "nodes": len(self.node_ids),
+            "relations": self.relation_count,
+            "max_hops": self.max_hops,
+        }
+
+
+# 全局知識圖譜（載入一次，供各模組共用）
+_knowledge_graph: Optional[KnowledgeGraph] = None
+
+
+def get_knowledge_graph() -> KnowledgeGraph:
+    """
+    獲取共用的知識圖譜（首次呼叫時載入並預先計算）
+
+    Returns:
+        KnowledgeGraph 實例
+    """
+    global _knowledge_graph
+    if _knowledge_graph is None:
+        _knowledge_graph = KnowledgeGraph()
+        stats = _knowledge_graph.get_stats()
+        print(f"✅ 已載入知識圖譜（{stats['nodes']} 個節點、{stats['relations']} 條關係）")
+    return _knowledge_graph
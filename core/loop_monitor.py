@@ -0,0 +1,166 @@
+"""
+事件迴圈延遲監控模組
+持續量測 asyncio 事件迴圈的排程延遲，並在某個回呼阻塞超過閾值時記錄堆疊樣本：
+- 監控協程每隔 interval 秒喚醒一次，實際喚醒時間與預期的差即為排程延遲（lag）
+- 看門狗執行緒檢查監控協程的心跳；心跳停滯超過閾值時，
+  以 sys._current_frames() 取得事件迴圈執行緒當下的堆疊（即正在阻塞的程式碼）
+- 延遲與阻塞次數寫入 /metrics（rag_event_loop_lag_seconds、rag_event_loop_blocked_total），
+  堆疊樣本輸出到日誌並保留最近幾筆（/api/health）
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from config import Config
+from core.metrics import get_metrics
+
+# 專案根目錄：日誌中顯示堆疊裡最內層的專案程式碼（而非第三方套件內部）
+_PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+class LoopMonitor:
+    """事件迴圈延遲與阻塞監控"""
+
+    def __init__(
+        self,
+        interval: float = None,
+        block_threshold: float = None,
+        max_samples: int = None
+    ):
+        """
+        初始化監控器
+
+        Args:
+            interval: 量測間隔（秒，默認從配置讀取）
+            block_threshold: 阻塞閾值（秒，默認從配置讀取）
+            max_samples: 保留的堆疊樣本數（默認從配置讀取）
+        """
+        self.interval = interval or Config.LOOP_MONITOR_INTERVAL
+        self.block_threshold = block_threshold or Config.LOOP_BLOCK_THRESHOLD
+        self.samples: Deque[Dict] = deque(maxlen=max_samples or Config.LOOP_MONITOR_MAX_SAMPLES)
+
+        self.max_lag = 0.0
+        self.blocked_count = 0
+        self.ticks = 0
+
+        self._heartbeat = time.monotonic()
+        self._pending_stack: Optional[List[str]] = None
+        self._loop_thread_id: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._watchdog: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self):
+        """在目前的事件迴圈上啟動監控（需在協程中呼叫）"""
+        if self._task is not None:
+            return
+        self._loop_thread_id = threading.get_ident()
+        self._heartbeat = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+        self._watchdog = threading.Thread(target=self._watch, name="loop-monitor-watchdog", daemon=True)
+        self._watchdog.start()
+        print(f"🩺 事件迴圈監控已啟動（間隔 {self.interval * 1000:.0f}ms，阻塞閾值 {self.block_threshold * 1000:.0f}ms）")
+
+    async def stop(self):
+        """停止監控"""
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            self._watchdog.join(timeout=1.0)
+            self._watchdog = None
+
+    async def _run(self):
+        """監控協程：量測每次喚醒的排程延遲"""
+        metrics = get_metrics()
+        while True:
+            expected = time.monotonic() + self.interval
+            await asyncio.sleep(self.interval)
+            now = time.monotonic()
+            lag = max(0.0, now - expected)
+            self._heartbeat = now
+            self.ticks += 1
+            self.max_lag = max(self.max_lag, lag)
+            metrics.observe("rag_event_loop_lag_seconds", lag)
+
+            if lag >= self.block_threshold:
+                self._record_block(lag)
+
+    def _record_block(self, lag: float):
+        """記錄一次阻塞（附上看門狗在阻塞期間取得的堆疊）"""
+        stack, self._pending_stack = self._pending_stack, None
+        self.blocked_count += 1
+        get_metrics().inc("rag_event_loop_blocked_total")
+        where = _blocking_location(stack or [])
+        self.samples.append({
+            "timestamp": time.time(),
+            "lag": round(lag, 6),
+            "location": where,
+            "stack": stack or []
+        })
+        print(f"🐢 事件迴圈阻塞 {lag * 1000:.0f}ms（閾值 {self.block_threshold * 1000:.0f}ms）: {where}")
+
+    def _watch(self):
+        """看門狗執行緒：心跳停滯超過閾值時取得事件迴圈執行緒的堆疊（每次阻塞只取一次）"""
+        check_interval = self.block_threshold / 2
+        sampled_heartbeat = None
+        while not self._stopped.wait(check_interval):
+            heartbeat = self._heartbeat
+            stalled = time.monotonic() - heartbeat - self.interval
+            if stalled < self.block_threshold or heartbeat == sampled_heartbeat:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self._pending_stack = traceback.format_stack(frame)
+            sampled_heartbeat = heartbeat
+
+    def get_stats(self) -> Dict:
+        """
+        獲取監控統計
+
+        Returns:
+            量測次數、最大延遲、阻塞次數與最近的堆疊樣本
+        """
+        return {
+            "running": self._task is not None,
+            "interval": self.interval,
+            "block_threshold": self.block_threshold,
+            "ticks": self.ticks,
+            "max_lag": round(self.max_lag, 6),
+            "blocked_count": self.blocked_count,
+            "recent_blocks": list(self.samples)
+        }
+
+
+def _blocking_location(stack: List[str]) -> str:
+    """堆疊中最內層的專案程式碼位置（找不到時為最內層的框架）"""
+    if not stack:
+        return "（未取得堆疊）"
+    for entry in reversed(stack):
+        if _PROJECT_ROOT in entry and "site-packages" not in entry:
+            return " ".join(line.strip() for line in entry.strip().splitlines())
+    return stack[-1].strip().splitlines()[0]
+
+
+# 全局監控器
+_monitor: Optional[LoopMonitor] = None
+
+
+def get_loop_monitor() -> LoopMonitor:
+    """獲取全局事件迴圈監控器"""
+    global _monitor
+    if _monitor is None:
+        _monitor = LoopMonitor()
+    return _monitor
@@ -0,0 +1,393 @@
+"""
+指標模組
+彙總每個請求的計時與計數，提供 Prometheus 文字格式輸出（/metrics）：
+- 延遲直方圖：HDR 風格的對數-線性分桶（微秒精度、相對誤差約 3%），
+  以兩個時間窗輪替計算最近的 p50 / p95 / p99
+- 非時間的分布（例如吞吐量）使用同樣的直方圖，但以該數值自己的單位分桶（見 observe_value）
+- 計數器：快取命中、錯誤、降級、token 用量等
+- 量測值：進行中的請求數、斷路器狀態等
+
+記錄操作只做一次字典更新（鎖只保護該次更新，不跨越 await），每次觀測約數微秒
+"""
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from config import Config
+
+
+# 吞吐量直方圖的解析度（tokens/秒；延遲直方圖為 1 微秒）
+TOKENS_PER_SECOND_RESOLUTION = 0.01
+
+# 已知指標的說明文字（Prometheus HELP）
+METRIC_HELP = {
+    "rag_stage_latency_seconds": "各處理階段（span）耗時",
+    "rag_upstream_latency_seconds": "上游 API 調用耗時",
+    "rag_request_latency_seconds": "API 端點處理耗時",
+    "rag_requests_total": "已處理的查詢數",
+    "rag_inflight_requests": "處理中的查詢數",
+    "rag_cache_lookups_total": "快取查詢次數",
+    "rag_fallbacks_total": "改用本地降級結果的次數",
+    "rag_errors_total": "錯誤次數",
+    "rag_tokens_total": "上游 token 用量（source=estimate 為本地估算）",
+    "rag_ttft_seconds": "首個 token 時間（從收到查詢起算）",
+    "rag_upstream_ttft_seconds": "上游調用的首個 token 時間（非流式調用為整個回應時間）",
+    "rag_upstream_tokens_per_second": "上游輸出吞吐量（completion tokens / 秒）",
+    "rag_inter_token_gap_seconds": "流式生成的 token 間隔（每次請求的平均、p95 與最大值）",
+    "rag_circuit_breaker_open": "斷路器是否開啟（1=開啟或半開）",
+    "rag_event_loop_lag_seconds": "事件迴圈排程延遲",
+    "rag_event_loop_blocked_total": "事件迴圈阻塞超過閾值的次數"
+}
+
+LabelKey = Tuple[Tuple[str, str], ...]
+
+
+class LatencyHistogram:
+    """
+    HDR 風格延遲直方圖
+
+    數值以解析度為單位（默認 1 微秒）：小於 64 個單位時每個值一個桶；之後每個 2 的冪次區間切成 32 個等寬桶，
+    因此任何分位數的相對誤差不超過約 3%，而 1µs ~ 1 小時只需要約 1000 個桶（稀疏儲存）
+    """
+
+    SUB_BUCKETS = 64
+    HALF_BUCKETS = 32
+
+    def __init__(self, resolution: float = 1e-6):
+        """
+        初始化
+
+        Args:
+            resolution: 最小桶寬（觀測值的單位；延遲為 1e-6 秒）
+        """
+        self.resolution = resolution
+        self.counts: Dict[int, int] = {}
+        self.count = 0
+        self.sum = 0.0
+
+    @classmethod
+    def _index(cls, units: int) -> int:
+        """數值（解析度單位）→ 桶編號"""
+        if units < cls.SUB_BUCKETS:
+            return units
+        shift = units.bit_length() - 6
+        return cls.SUB_BUCKETS + (shift - 1) * cls.HALF_BUCKETS + ((units >> shift) - cls.HALF_BUCKETS)
+
+    def _value(self, index: int) -> float:
+        """桶編號 → 代表值（桶中點，觀測值的單位）"""
+        if index < self.SUB_BUCKETS:
+            return index * self.resolution
+        offset = index - self.SUB_BUCKETS
+        shift = offset // self.HALF_BUCKETS + 1
+        low = (offset % self.HALF_BUCKETS + self.HALF_BUCKETS) << shift
+        return (low + (1 << shift) / 2) * self.resolution
+
+    def record(self, value: float):
+        """記錄一次觀測值（延遲為秒）"""
+        index = self._index(max(int(value / self.resolution), 0))
+        self.counts[index] = self.counts.get(index, 0) + 1
+        self.count += 1
+        self.sum += value
+
+    def merge(self, other: "LatencyHistogram") -> "LatencyHistogram":
+        """合併兩個直方圖（返回新實例，兩者解析度需相同）"""
+        merged = LatencyHistogram(self.resolution)
+        merged.counts = dict(self.counts)
+        for index, count in other.counts.items():
+            merged.counts[index] = merged.counts.get(index, 0) + count
+        merged.count = self.count + other.count
+        merged.sum = self.sum + other.sum
+        return merged
+
+    def quantiles(self, qs: Iterable[float]) -> Dict[float, float]:
+        """
+        計算分位數
+
+        Args:
+            qs: 分位數列表（0~1）
+
+        Returns:
+            分位數 → 觀測值（延遲為秒）
+        """
+        qs = sorted(qs)
+        result = {q: 0.0 for q in qs}
+        if self.count == 0:
+            return result
+
+        targets = [(q, max(1, int(q * self.count + 0.999999))) for q in qs]
+        seen = 0
+        pending = 0
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            while pending < len(targets) and seen >= targets[pending][1]:
+                result[targets[pending][0]] = self._value(index)
+                pending += 1
+            if pending == len(targets):
+                break
+        return result
+
+
+class RollingHistogram:
+    """以兩個時間窗輪替的直方圖：分位數反映最近 1~2 個時間窗，總數與總和為累計值"""
+
+    def __init__(self, window: float, resolution: float = 1e-6):
+        """
+        初始化
+
+        Args:
+            window: 時間窗長度（秒）
+            resolution: 最小桶寬（見 LatencyHistogram）
+        """
+        self.window = window
+        self.resolution = resolution
+        self.current = LatencyHistogram(resolution)
+        self.previous = LatencyHistogram(resolution)
+        self.rotated_at = time.monotonic()
+        self.count = 0
+        self.sum = 0.0
+
+    def record(self, value: float):
+        """記錄一次觀測值（延遲為秒）"""
+        now = time.monotonic()
+        if now - self.rotated_at >= self.window:
+            self._rotate(now)
+        self.current.record(value)
+        self.count += 1
+        self.sum += value
+
+    def _rotate(self, now: float):
+        """輪替時間窗（閒置超過兩個時間窗時兩者都清空）"""
+        if now - self.rotated_at >= 2 * self.window:
+            self.previous = LatencyHistogram(self.resolution)
+        else:
+            self.previous = self.current
+        self.current = LatencyHistogram(self.resolution)
+        self.rotated_at = now
+
+    def quantiles(self, qs: Iterable[float]) -> Dict[float, float]:
+        """計算最近時間窗的分位數"""
+        now = time.monotonic()
+        if now - self.rotated_at >= self.window:
+            self._rotate(now)
+        return self.current.merge(self.previous).quantiles(qs)
+
+
+class MetricsRegistry:
+    """指標註冊表（全局單例，見 get_metrics）"""
+
+    def __init__(self, window: float = None, quantiles: Iterable[float] = None):
+        """
+        初始化註冊表
+
+        Args:
+            window: 分位數時間窗（秒，默認從配置讀取）
+            quantiles: 輸出的分位數（默認從配置讀取）
+        """
+        self.window = window or Config.METRICS_WINDOW
+        self.quantile_list: List[float] = list(quantiles or Config.METRICS_QUANTILES)
+        self._lock = threading.Lock()
+        self.histograms: Dict[str, Dict[LabelKey, RollingHistogram]] = {}
+        self.counters: Dict[str, Dict[LabelKey, float]] = {}
+        self.gauges: Dict[str, Dict[LabelKey, float]] = {}
+
+    @staticmethod
+    def _key(labels: Dict[str, object]) -> LabelKey:
+        return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def observe(self, name: str, seconds: float, **labels):
+        """
+        記錄一次延遲觀測
+
+        Args:
+            name: 指標名稱
+            seconds: 耗時（秒）
+            **labels: 標籤
+        """
+        self.observe_value(name, seconds, 1e-6, **labels)
+
+    def observe_value(self, name: str, value: float, resolution: float, **labels):
+        """
+        記錄一次非時間的觀測值（例如吞吐量），以該數值自己的單位分桶
+
+        Args:
+            name: 指標名稱（同一指標需使用相同解析度）
+            value: 觀測值
+            resolution: 最小桶寬（與觀測值同單位）
+            **labels: 標籤
+        """
+        key = self._key(labels)
+        with self._lock:
+            series = self.histograms.setdefault(name, {})
+            histogram = series.get(key)
+            if histogram is None:
+                histogram = series[key] = RollingHistogram(self.window, resolution)
+            histogram.record(value)
+
+    def inc(self, name: str, value: float = 1.0, **labels):
+        """計數器累加"""
+        key = self._key(labels)
+        with self._lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        """設定量測值"""
+        key = self._key(labels)
+        with self._lock:
+            self.gauges.setdefault(name, {})[key] = value
+
+    def add_gauge(self, name: str, delta: float, **labels):
+        """量測值增減"""
+        key = self._key(labels)
+        with self._lock:
+            series = self.gauges.setdefault(name, {})
+            series[key] = series.get(key, 0.0) + delta
+
+    def get_gauge(self, name: str, **labels) -> float:
+        """讀取量測值（不存在時為 0）"""
+        key = self._key(labels)
+        with self._lock:
+            return self.gauges.get(name, {}).get(key, 0.0)
+
+    def snapshot(self) -> Dict:
+        """
+        獲取目前所有指標（JSON 友善格式）
+
+        Returns:
+            {"histograms": ..., "counters": ..., "gauges": ...}
+        """
+        result = {"histograms": {}, "counters": {}, "gauges": {}}
+        with self._lock:
+            for name, series in self.histograms.items():
+                result["histograms"][name] = [
+                    {
+                        "labels": dict(key),
+                        "count": histogram.count,
+                        "sum": round(histogram.sum, 6),
+                        "quantiles": {
+                            str(q): round(v, 6) for q, v in histogram.quantiles(self.quantile_list).items()
+                        }
+                    }
+                    for key, histogram in series.items()
+                ]
+            for kind, source in (("counters", self.counters), ("gauges", self.gauges)):
+                for name, series in source.items():
+                    result[kind][name] = [
+                        {"labels": dict(key), "value": value} for key, value in series.items()
+                    ]
+        return result
+
+    def render_prometheus(self) -> str:
+        """
+        輸出 Prometheus 文字格式
+
+        直方圖以 summary 型別輸出（分位數 + _sum + _count，數值為各指標自己的單位）
+
+        Returns:
+            文字內容
+        """
+        snapshot = self.snapshot()
+        lines: List[str] = []
+
+        def fmt_labels(labels: Dict[str, str], extra: Optional[Dict[str, str]] = None) -> str:
+            merged = {**labels, **(extra or {})}
+            if not merged:
+                return ""
+            return "{" + ",".join(f'{k}="{_escape_label(v)}"' for k, v in merged.items()) + "}"
+
+        for name, series in sorted(snapshot["histograms"].items()):
+            lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+            lines.append(f"# TYPE {name} summary")
+            for entry in series:
+                for q, value in entry["quantiles"].items():
+                    lines.append(f"{name}{fmt_labels(entry['labels'], {'quantile': q})} {value}")
+                lines.append(f"{name}_sum{fmt_labels(entry['labels'])} {entry['sum']}")
+                lines.append(f"{name}_count{fmt_labels(entry['labels'])} {entry['count']}")
+
+        for kind, prom_type in (("counters", "counter"), ("gauges", "gauge")):
+            for name, series in sorted(snapshot[kind].items()):
+                lines.append(f"# HELP {name} {METRIC_HELP.get(name, name)}")
+                lines.append(f"# TYPE {name} {prom_type}")
+                for entry in series:
+                    lines.append(f"{name}{fmt_labels(entry['labels'])} {entry['value']}")
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self):
+        """清空所有指標"""
+        with self._lock:
+            self.histograms.clear()
+            self.counters.clear()
+            self.gauges.clear()
+
+
+def _escape_label(value: str) -> str:
+    """跳脫 Prometheus 標籤值中的反斜線、雙引號與換行"""
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def record_trace(tracer, registry: "MetricsRegistry" = None):
+    """
+    將一次查詢的追蹤資料彙總到指標（在請求完成後以 loop.call_soon 排程執行，不佔用請求路徑）
+
+    - 每個已結束的 span → rag_stage_latency_seconds{stage}
+    - 帶 upstream 屬性的 span → rag_upstream_latency_seconds{call, model}
+    - ttft / ttft_generation / tokens_per_second / gap_* 屬性 → 首 token 時間、吞吐量與 token 間隔
+    - prompt_tokens / completion_tokens 屬性 → rag_tokens_total{stage, type, source}
+    - cache_hit / fallback / error 屬性 → 對應計數器
+
+    Args:
+        tracer: core.tracer.Tracer
+        registry: 指標註冊表（默認為全局註冊表）
+    """
+    registry = registry or get_metrics()
+    for span in tracer.spans:
+        if not span.finished:
+            continue
+        attributes = span.attributes
+        registry.observe("rag_stage_latency_seconds", span.duration, stage=span.name)
+        if span.parent_id is None and "ttft" in attributes:
+            registry.observe("rag_ttft_seconds", attributes["ttft"])
+        if attributes.get("upstream"):
+            call = {"call": span.name, "model": attributes.get("model", "")}
+            registry.observe("rag_upstream_latency_seconds", span.duration, **call)
+            ttft = attributes.get("ttft_generation", attributes.get("ttft"))
+            if ttft is not None:
+                registry.observe("rag_upstream_ttft_seconds", ttft, **call)
+            if attributes.get("tokens_per_second"):
+                registry.observe_value(
+                    "rag_upstream_tokens_per_second", attributes["tokens_per_second"],
+                    TOKENS_PER_SECOND_RESOLUTION, **call
+                )
+            for stat in ("gap_mean", "gap_p95", "gap_max"):
+                if stat in attributes:
+                    registry.observe("rag_inter_token_gap_seconds", attributes[stat], stat=stat[4:], **call)
+        source = "estimate" if attributes.get("usage_estimated") else "upstream"
+        for token_type in ("prompt_tokens", "completion_tokens"):
+            if attributes.get(token_type):
+                registry.inc(
+                    "rag_tokens_total", attributes[token_type],
+                    stage=span.name, type=token_type, source=source
+                )
+        if "cache_hit" in attributes:
+            registry.inc(
+                "rag_cache_lookups_total", stage=span.name,
+                result="hit" if attributes["cache_hit"] else "miss"
+            )
+        if attributes.get("fallback"):
+            registry.inc("rag_fallbacks_total", stage=span.name)
+        if "error" in attributes:
+            registry.inc("rag_errors_total", stage=span.name, type=attributes["error"])
+    registry.inc("rag_requests_total")
+
+
+# 全局註冊表
+_registry: Optional[MetricsRegistry] = None
+
+
+def get_metrics() -> MetricsRegistry:
+    """獲取全局指標註冊表"""
+    global _registry
+    if _registry is None:
+        _registry = MetricsRegistry()
+    return _registry
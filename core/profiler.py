@@ -0,0 +1,230 @@
+"""
+請求剖析模組
+針對單一查詢啟用剖析器，結果保留在記憶體中供管理端點查看：
+- "cprofile"：確定性剖析（cProfile），可輸出 pstats 文字報告或二進位檔（snakeviz 等工具開啟）；
+  同一時間只能有一個確定性剖析（cProfile 以執行緒為單位掛載，重複啟用會互相覆蓋）
+- "sample"：取樣剖析，背景執行緒定時取得各執行緒的堆疊（sys._current_frames），
+  輸出 collapsed stacks（flamegraph.pl / speedscope 可直接讀取），同時涵蓋 to_thread 的工作執行緒
+
+注意：剖析範圍是整個事件迴圈執行緒，剖析期間同時進行的其他請求也會出現在結果中
+（結果中的 concurrent_requests 為開始時進行中的請求數）。
+未剖析的請求只多一次條件判斷（與取樣率大於 0 時的一次亂數）
+"""
+import cProfile
+import io
+import marshal
+import pstats
+import random
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from typing import Deque, Dict, List, Optional
+
+from config import Config
+
+PROFILE_MODES = ("cprofile", "sample")
+
+# 取樣時略過的監控用執行緒（其他請求的取樣器、事件迴圈監控看門狗）
+_SKIPPED_THREADS = ("request-profiler", "loop-monitor-watchdog")
+
+
+class ProfilerBusy(Exception):
+    """已有其他確定性剖析進行中"""
+    pass
+
+
+@dataclass
+class ProfileResult:
+    """單次剖析結果"""
+    profile_id: str
+    mode: str
+    query: str
+    started_at: float
+    duration: float = 0.0
+    trace_id: Optional[str] = None
+    concurrent_requests: int = 0
+    samples: Counter = field(default_factory=Counter)
+    stats: Optional[pstats.Stats] = None
+
+    def to_summary(self) -> Dict:
+        """列表用的摘要"""
+        return {
+            "profile_id": self.profile_id,
+            "mode": self.mode,
+            "query": self.query,
+            "trace_id": self.trace_id,
+            "started_at": self.started_at,
+            "duration": round(self.duration, 6),
+            "concurrent_requests": self.concurrent_requests,
+            "sample_count": sum(self.samples.values()) if self.mode == "sample" else None,
+            "formats": ["collapsed"] if self.mode == "sample" else ["text", "pstats"]
+        }
+
+    def collapsed(self) -> str:
+        """collapsed stacks 格式（每行「框架;框架;… 次數」，根在左）"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+    def pstats_text(self, sort: str = "cumulative", limit: int = 50) -> str:
+        """pstats 文字報告"""
+        stream = io.StringIO()
+        self.stats.stream = stream
+        self.stats.sort_stats(sort).print_stats(limit)
+        return stream.getvalue()
+
+    def pstats_bytes(self) -> bytes:
+        """pstats 二進位內容（與 Stats.dump_stats 的檔案相同）"""
+        return marshal.dumps(self.stats.stats)
+
+
+class DeterministicProfiler:
+    """cProfile 確定性剖析（同一時間只允許一個）"""
+
+    _active = threading.Lock()
+
+    def __init__(self, result: ProfileResult):
+        self.result = result
+        self.profile = cProfile.Profile()
+
+    def start(self):
+        if not self._active.acquire(blocking=False):
+            raise ProfilerBusy()
+        self.profile.enable()
+
+    def stop(self) -> ProfileResult:
+        self.profile.disable()
+        self._active.release()
+        self.result.stats = pstats.Stats(self.profile)
+        return self.result
+
+
+class SamplingProfiler:
+    """取樣剖析：背景執行緒每隔 interval 秒記錄所有執行緒的堆疊"""
+
+    def __init__(self, result: ProfileResult, interval: float = None):
+        self.result = result
+        self.interval = interval or Config.PROFILE_SAMPLE_INTERVAL
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="request-profiler", daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self) -> ProfileResult:
+        self._stopped.set()
+        self._thread.join()
+        return self.result
+
+    def _run(self):
+        own_id = threading.get_ident()
+        samples = self.result.samples
+        while not self._stopped.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                name = names.get(thread_id, str(thread_id))
+                if thread_id == own_id or name in _SKIPPED_THREADS:
+                    continue
+                samples[_collapse(name, frame)] += 1
+
+
+def _collapse(thread_name: str, frame) -> str:
+    """將堆疊轉為 collapsed 格式的一行（執行緒;外層;…;內層）"""
+    frames: List[str] = []
+    while frame is not None:
+        code = frame.f_code
+        frames.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+        frame = frame.f_back
+    frames.append(thread_name)
+    return ";".join(reversed(frames))
+
+
+class RequestProfile:
+    """單一請求的剖析（start → stop 之間的執行）"""
+
+    def __init__(self, mode: str, query: str, concurrent_requests: int = 0):
+        """
+        初始化
+
+        Args:
+            mode: "cprofile" 或 "sample"
+            query: 用戶查詢（僅用於顯示）
+            concurrent_requests: 開始時進行中的請求數
+        """
+        self.result = ProfileResult(
+            profile_id=uuid.uuid4().hex[:12],
+            mode=mode,
+            query=query,
+            started_at=time.time(),
+            concurrent_requests=concurrent_requests
+        )
+        if mode == "cprofile":
+            self.profiler = DeterministicProfiler(self.result)
+        else:
+            self.profiler = SamplingProfiler(self.result)
+        self._t_start = 0.0
+
+    def start(self) -> "RequestProfile":
+        """開始剖析（確定性剖析忙碌時拋出 ProfilerBusy）"""
+        self._t_start = time.perf_counter()
+        self.profiler.start()
+        return self
+
+    def stop(self, trace_id: Optional[str] = None) -> ProfileResult:
+        """結束剖析並保存結果"""
+        result = self.profiler.stop()
+        result.duration = time.perf_counter() - self._t_start
+        result.trace_id = trace_id
+        get_profile_store().add(result)
+        return result
+
+
+def choose_profile_mode(requested: Optional[str]) -> Optional[str]:
+    """
+    決定本次請求的剖析模式
+
+    Args:
+        requested: 呼叫端要求的模式（"cprofile"、"sample"；其他真值使用預設模式；None 表示未要求）
+
+    Returns:
+        剖析模式，不剖析時為 None
+    """
+    if requested:
+        return requested if requested in PROFILE_MODES else Config.PROFILE_DEFAULT_MODE
+    if Config.PROFILE_SAMPLE_RATE > 0 and random.random() < Config.PROFILE_SAMPLE_RATE:
+        return Config.PROFILE_DEFAULT_MODE
+    return None
+
+
+class ProfileStore:
+    """最近的剖析結果（記憶體中，數量有上限）"""
+
+    def __init__(self, max_size: int = None):
+        self._profiles: Deque[ProfileResult] = deque(maxlen=max_size or Config.PROFILE_MAX_STORED)
+        self._lock = threading.Lock()
+
+    def add(self, result: ProfileResult):
+        with self._lock:
+            self._profiles.append(result)
+
+    def get(self, profile_id: str) -> Optional[ProfileResult]:
+        with self._lock:
+            return next((p for p in self._profiles if p.profile_id == profile_id), None)
+
+    def list(self) -> List[Dict]:
+        """由新到舊的摘要列表"""
+        with self._lock:
+            return [p.to_summary() for p in reversed(self._profiles)]
+
+
+# 全局剖析結果儲存
+_store: Optional[ProfileStore] = None
+
+
+def get_profile_store() -> ProfileStore:
+    """獲取全局剖析結果儲存"""
+    global _store
+    if _store is None:
+        _store = ProfileStore()
+    return _store
@@ -18,24 +18,33 @@ class RAGRetriever:
         """
         self.vector_store = vector_store
     
-    async def retrieve(self, query: str, top_k: int = 3) -> List[Dict]:
+    async def retrieve(self, query: str, top_k: int = 3, embedding_cache=None) -> List[Dict]:
         """
         檢索最相關的文件
         
         Args:
             query: 查詢文本
             top_k: 返回前 K 個最相關文件
+            embedding_cache: 查詢向量快取（可選，需提供 get/put）
             
         Returns:
             相關文件列表，包含 doc_id, content, score
         """
         import time
         
-        # 生成查詢向量
-        query_embedding = await self.vector_store.create_embedding(query)
-        
-        # 獲取實際的 API 調用時間
-        embedding_time = getattr(self.vector_store, '_last_embedding_time', 0)
+        # 生成查詢向量（命中快取時跳過 Embedding）
+        query_embedding = embedding_cache.get(query) if embedding_cache is not None else None
+        cache_hit = query_embedding is not None
+        if cache_hit:
+            embedding_time = 0.0
+        else:
+            query_embedding = await self.vector_store.create_embedding(query)
+            
+            # 獲取實際的 API 調用時間
+            embedding_time = getattr(self.vector_store, '_last_embedding_time', 0)
+            
+            if embedding_cache is not None:
+                embedding_cache.put(query, query_embedding)
         
         # 計算所有文件的相似度
         t3 = time.perf_counter()
@@ -60,7 +69,8 @@ class RAGRetriever:
         self._last_timing = {
             "embedding_api": embedding_time,
             "similarity_calc": similarity_time,
-            "total": embedding_time + similarity_time
+            "total": embedding_time + similarity_time,
+            "embedding_cache_hit": cache_hit
         }
         
         return similarities[:top_k]
@@ -0,0 +1,313 @@
+"""
+會話狀態模組
+保存單一學生會話的暖狀態：重複性視窗、最近知識點、查詢向量快取
+並提供依 session id 查找的會話儲存：
+- SessionStore: 記憶體 LRU + 閒置淘汰（單一 worker）
+- SQLiteSessionStore: SQLite 後端（多個 worker 共享狀態）
+"""
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional
+
+from config import Config
+from core.tools.repetition_checker import RepetitionChecker
+
+
+class EmbeddingCache:
+    """查詢向量 LRU 快取（同一會話內重複的問題不再重新計算 Embedding）"""
+
+    def __init__(self, max_size: int = None):
+        """
+        初始化快取
+
+        Args:
+            max_size: 最大快取數量（默認從配置讀取）
+        """
+        self.max_size = max_size or Config.SESSION_EMBEDDING_CACHE_SIZE
+        self.cache: OrderedDict = OrderedDict()
+        self.hit_count = 0
+        self.miss_count = 0
+
+    def get(self, query: str) -> Optional[List[float]]:
+        """從快取獲取查詢向量"""
+        embedding = self.cache.get(query)
+        if embedding is None:
+            self.miss_count += 1
+            return None
+        self.cache.move_to_end(query)
+        self.hit_count += 1
+        return embedding
+
+    def put(self, query: str, embedding: List[float]):
+        """將查詢向量放入快取"""
+        self.cache[query] = embedding
+        self.cache.move_to_end(query)
+        if len(self.cache) > self.max_size:
+            self.cache.popitem(last=False)
+
+    def get_stats(self) -> dict:
+        """獲取快取統計"""
+        return {
+            "hits": self.hit_count,
+            "misses": self.miss_count,
+            "cache_size": len(self.cache)
+        }
+
+
+@dataclass
+class SessionState:
+    """單一會話的狀態"""
+    session_id: str
+    repetition_checker: RepetitionChecker = field(default_factory=RepetitionChecker)
+    recent_knowledge_points: deque = field(
+        default_factory=lambda: deque(maxlen=Config.SESSION_RECENT_KP_SIZE)
+    )
+    embedding_cache: EmbeddingCache = field(default_factory=EmbeddingCache)
+    query_count: int = 0
+    created_at: float = field(default_factory=time.time)
+    last_active: float = field(default_factory=time.time)
+
+    def record_turn(self, knowledge_points: List[str]):
+        """記錄一輪問答（R 值已由 repetition_checker 更新）"""
+        self.query_count += 1
+        self.recent_knowledge_points.extend(knowledge_points)
+        self.last_active = time.time()
+
+    def to_dict(self) -> dict:
+        """轉換為字典（查詢向量快取僅存在於記憶體，只輸出統計）"""
+        return {
+            "session_id": self.session_id,
+            "query_count": self.query_count,
+            "recent_knowledge_points": list(self.recent_knowledge_points),
+            "repetition": self.repetition_checker.to_dict(),
+            "embedding_cache": self.embedding_cache.get_stats(),
+            "created_at": self.created_at,
+            "last_active": self.last_active
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """從字典還原"""
+        state = cls(
+            session_id=data["session_id"],
+            repetition_checker=RepetitionChecker.from_dict(data.get("repetition", {})),
+            query_count=data.get("query_count", 0),
+            created_at=data.get("created_at", time.time()),
+            last_active=data.get("last_active", time.time())
+        )
+        state.recent_knowledge_points.extend(data.get("recent_knowledge_points", []))
+        return state
+
+
+class SessionStore:
+    """記憶體會話儲存（LRU + 閒置淘汰，查找與更新皆為 O(1)）"""
+
+    def __init__(self, max_sessions: int = None, idle_timeout: float = None):
+        """
+        初始化會話儲存
+
+        Args:
+            max_sessions: 最多保留的會話數（默認從配置讀取）
+            idle_timeout: 閒置多久後淘汰（秒，默認從配置讀取）
+        """
+        self.max_sessions = max_sessions or Config.SESSION_MAX_COUNT
+        self.idle_timeout = idle_timeout or Config.SESSION_IDLE_TIMEOUT
+        # 依最近使用順序排列（最舊在前）
+        self.sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+        self.evicted_count = 0
+
+    def get(self, session_id: str) -> SessionState:
+        """
+        獲取（或建立）會話狀態
+
+        Args:
+            session_id: 會話 ID
+
+        Returns:
+            SessionState 實例
+        """
+        self._evict_idle()
+        session = self.sessions.get(session_id)
+        if session is None:
+            session = SessionState(session_id=session_id)
+            self.sessions[session_id] = session
+            if len(self.sessions) > self.max_sessions:
+                self.sessions.popitem(last=False)
+                self.evicted_count += 1
+        else:
+            session.last_active = time.time()
+            self.sessions.move_to_end(session_id)
+        return session
+
+    def save(self, session: SessionState):
+        """保存會話狀態（記憶體儲存中狀態已就地更新，只需刷新 LRU 位置）"""
+        if session.session_id in self.sessions:
+            self.sessions.move_to_end(session.session_id)
+        else:
+            self.sessions[session.session_id] = session
+
+    def reset(self, session_id: str) -> SessionState:
+        """重置會話狀態"""
+        self.sessions.pop(session_id, None)
+        return self.get(session_id)
+
+    # 事件迴圈上使用的版本：記憶體儲存沒有 IO，直接執行；SQLite 後端將資料庫操作移到執行緒
+
+    async def get_async(self, session_id: str) -> SessionState:
+        """獲取（或建立）會話狀態（不阻塞事件迴圈）"""
+        return self.get(session_id)
+
+    async def save_async(self, session: SessionState):
+        """保存會話狀態（不阻塞事件迴圈）"""
+        self.save(session)
+
+    async def reset_async(self, session_id: str) -> SessionState:
+        """重置會話狀態（不阻塞事件迴圈）"""
+        return self.reset(session_id)
+
+    def _evict_idle(self):
+        """淘汰閒置會話（只檢查最舊的幾個，攤銷 O(1)）"""
+        deadline = time.time() - self.idle_timeout
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if oldest.last_active >= deadline:
+                break
+            self.sessions.popitem(last=False)
+            self.evicted_count += 1
+
+    def get_stats(self) -> Dict:
+        """獲取儲存統計"""
+        return {
+            "backend": "memory",
+            "active_sessions": len(self.sessions),
+            "evicted": self.evicted_count
+        }
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    SQLite 會話儲存（多個 worker 共享）
+
+    每次 get 以主鍵讀取最新狀態、save 以主鍵寫回，查找與更新皆為 O(1)；
+    查詢向量快取只保留在本地記憶體中。
+    同一 worker 內的並發請求由 ResponsesRAGSystem 依會話序列化；不同 worker 同時更新同一會話時為後寫者勝出
+    """
+
+    def __init__(self, db_path: str = None, max_sessions: int = None, idle_timeout: float = None):
+        """
+        初始化 SQLite 會話儲存
+
+        Args:
+            db_path: 資料庫路徑（默認從配置讀取）
+            max_sessions: 本地快取的會話數（默認從配置讀取）
+            idle_timeout: 閒置多久後淘汰（秒，默認從配置讀取）
+        """
+        super().__init__(max_sessions, idle_timeout)
+        self.db_path = db_path or Config.SESSION_DB_PATH
+        self._lock = threading.Lock()
+        self._ops = 0
+        self.conn = sqlite3.connect(self.db_path, check_same_thread=False, isolation_level=None)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS sessions ("
+            " session_id TEXT PRIMARY KEY,"
+            " state TEXT NOT NULL,"
+            " last_active REAL NOT NULL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS idx_sessions_last_active ON sessions(last_active)")
+
+    def get(self, session_id: str) -> SessionState:
+        """獲取會話狀態（以資料庫中的最新狀態為準，保留本地查詢向量快取）"""
+        local = super().get(session_id)
+        return self._merge(local, self._read_state(session_id))
+
+    def save(self, session: SessionState):
+        """寫回會話狀態"""
+        super().save(session)
+        self._write_state(session.session_id, self._serialize(session), session.last_active)
+
+    def reset(self, session_id: str) -> SessionState:
+        """重置會話狀態"""
+        self._delete_state(session_id)
+        return super().reset(session_id)
+
+    # 非同步版本：資料庫操作在執行緒中進行，本地 LRU 仍只在事件迴圈上更新
+
+    async def get_async(self, session_id: str) -> SessionState:
+        """獲取會話狀態（資料庫讀取不阻塞事件迴圈）"""
+        local = super().get(session_id)
+        return self._merge(local, await asyncio.to_thread(self._read_state, session_id))
+
+    async def save_async(self, session: SessionState):
+        """寫回會話狀態（序列化在事件迴圈上完成，之後的修改不影響本次寫入）"""
+        super().save(session)
+        await asyncio.to_thread(self._write_state, session.session_id, self._serialize(session), session.last_active)
+
+    async def reset_async(self, session_id: str) -> SessionState:
+        """重置會話狀態（資料庫刪除不阻塞事件迴圈）"""
+        await asyncio.to_thread(self._delete_state, session_id)
+        return super().reset(session_id)
+
+    def _merge(self, local: SessionState, state: Optional[str]) -> SessionState:
+        """以資料庫中的狀態取代本地狀態，保留本地查詢向量快取"""
+        if state is None:
+            # 資料庫中沒有記錄（新會話，或已被其他 worker 重置）
+            stored = SessionState(session_id=local.session_id)
+        else:
+            stored = SessionState.from_dict(json.loads(state))
+        stored.embedding_cache = local.embedding_cache
+        stored.last_active = local.last_active
+        self.sessions[local.session_id] = stored
+        return stored
+
+    @staticmethod
+    def _serialize(session: SessionState) -> str:
+        data = session.to_dict()
+        data.pop("embedding_cache", None)
+        return json.dumps(data, ensure_ascii=False)
+
+    def _read_state(self, session_id: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute(
+                "SELECT state FROM sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()
+        return row[0] if row else None
+
+    def _write_state(self, session_id: str, state: str, last_active: float):
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO sessions (session_id, state, last_active) VALUES (?, ?, ?)",
+                (session_id, state, last_active)
+            )
+            self._ops += 1
+            # 定期清理閒置會話（利用 last_active 索引）
+            if self._ops % 1000 == 0:
+                self.conn.execute(
+                    "DELETE FROM sessions WHERE last_active < ?",
+                    (time.time() - self.idle_timeout,)
+                )
+
+    def _delete_state(self, session_id: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+
+    def get_stats(self) -> Dict:
+        """獲取儲存統計"""
+        with self._lock:
+            total = self.conn.execute("SELECT COUNT(*) FROM sessions").fetchone()[0]
+        stats = super().get_stats()
+        stats.update({"backend": "sqlite", "stored_sessions": total, "db_path": self.db_path})
+        return stats
+
+
+def create_session_store() -> SessionStore:
+    """依配置建立會話儲存（SESSION_BACKEND: "memory" 或 "sqlite"）"""
+    if Config.SESSION_BACKEND == "sqlite":
+        return SQLiteSessionStore()
+    return SessionStore()
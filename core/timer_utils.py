@@ -7,12 +7,19 @@
 - Thread E: 知識點檢測 (API)
 
 注：K值和R值為本地計算，幾乎無延遲
+
+Timer 為 core/tracer.py 的相容介面：每個階段即一個 span，thread 參數記錄為 span 屬性；
+TimerReport 是追蹤資料的其中一種匯出格式。
+每個請求的追蹤器透過 core.tracer 的 contextvars 傳遞給各分支任務（見 use_tracer / get_current_tracer），
+並發請求的計時互不干擾
 """
 import time
 from typing import Dict, List, Optional
 from dataclasses import dataclass, field
 from datetime import datetime
 
+from core.tracer import Tracer
+
 
 @dataclass
 class TimerRecord:
@@ -82,19 +89,68 @@ class TimerReport:
             result["thread_e"] = self.thread_e_report.to_dict()
         
         return result
+    
+    # 線程標識 → 報告欄位與顯示名稱
+    THREAD_SLOTS = {
+        'A': ("thread_a_report", "Thread A（RAG 檢索）"),
+        'B': ("thread_b_report", "Thread B（保留）"),
+        'C': ("thread_c_report", "Thread C（C值檢測 - 正確性）"),
+        'D': ("thread_d_report", "Thread D（保留）"),
+        'E': ("thread_e_report", "Thread E（知識點檢測）")
+    }
+    
+    @classmethod
+    def from_tracer(cls, tracer: Tracer) -> "TimerReport":
+        """
+        由追蹤資料產生報告
+        
+        - 主流程：沒有 thread 屬性、深度不超過 1 的已結束 span
+        - 各線程：thread 屬性為 A~E 的已結束 span（同名階段取最後一次）
+        
+        Args:
+            tracer: 追蹤器
+            
+        Returns:
+            TimerReport 實例
+        """
+        report = cls()
+        report.timestamp = datetime.now().isoformat()
+        
+        thread_reports: Dict[str, ThreadTimingReport] = {}
+        for span in tracer.spans:
+            if not span.finished:
+                continue
+            thread = span.attributes.get("thread")
+            if thread is None:
+                if tracer.depth(span) <= 1:
+                    report.records[span.name] = round(span.duration, 3)
+                continue
+            if thread not in cls.THREAD_SLOTS:
+                continue
+            if thread not in thread_reports:
+                thread_reports[thread] = ThreadTimingReport(thread_name=cls.THREAD_SLOTS[thread][1])
+            thread_reports[thread].stages[span.name] = round(span.duration, 3)
+        
+        for thread, thread_report in thread_reports.items():
+            thread_report.total_time = round(sum(thread_report.stages.values()), 3)
+            setattr(report, cls.THREAD_SLOTS[thread][0], thread_report)
+        
+        report.total_time = round(time.perf_counter() - tracer.origin, 3)
+        return report
 
 
 class Timer:
     """計時器管理類 - 支援並行分支獨立計時（Thread A, C, E）"""
     
-    def __init__(self):
-        self.records: Dict[str, TimerRecord] = {}
-        self.thread_a_records: Dict[str, TimerRecord] = {}  # Thread A: RAG 檢索
-        self.thread_b_records: Dict[str, TimerRecord] = {}  # Thread B: 保留（向後兼容）
-        self.thread_c_records: Dict[str, TimerRecord] = {}  # Thread C: C值判定
-        self.thread_d_records: Dict[str, TimerRecord] = {}  # Thread D: 保留（向後兼容）
-        self.thread_e_records: Dict[str, TimerRecord] = {}  # Thread E: 知識點檢測
-        self.start_time = time.perf_counter()
+    def __init__(self, tracer: Optional[Tracer] = None):
+        """
+        初始化計時器
+        
+        Args:
+            tracer: 底層追蹤器（默認建立新的 Tracer）
+        """
+        self.tracer = tracer or Tracer()
+        self.start_time = self.tracer.origin
     
     def start_stage(self, stage_name: str, thread: Optional[str] = None):
         """
@@ -104,30 +160,8 @@ class Timer:
             stage_name: 階段名稱
             thread: 線程標識 ('A', 'B', 'C', 'D', 'E')，None 表示主流程
         """
-        if thread == 'A':
-            if stage_name not in self.thread_a_records:
-                self.thread_a_records[stage_name] = TimerRecord(name=stage_name)
-            self.thread_a_records[stage_name].start()
-        elif thread == 'B':
-            if stage_name not in self.thread_b_records:
-                self.thread_b_records[stage_name] = TimerRecord(name=stage_name)
-            self.thread_b_records[stage_name].start()
-        elif thread == 'C':
-            if stage_name not in self.thread_c_records:
-                self.thread_c_records[stage_name] = TimerRecord(name=stage_name)
-            self.thread_c_records[stage_name].start()
-        elif thread == 'D':
-            if stage_name not in self.thread_d_records:
-                self.thread_d_records[stage_name] = TimerRecord(name=stage_name)
-            self.thread_d_records[stage_name].start()
-        elif thread == 'E':
-            if stage_name not in self.thread_e_records:
-                self.thread_e_records[stage_name] = TimerRecord(name=stage_name)
-            self.thread_e_records[stage_name].start()
-        else:
-            if stage_name not in self.records:
-                self.records[stage_name] = TimerRecord(name=stage_name)
-            self.records[stage_name].start()
+        attributes = {"thread": thread} if thread else {}
+        self.tracer.start_span(stage_name, **attributes)
     
     def stop_stage(self, stage_name: str, thread: Optional[str] = None) -> float:
         """
@@ -140,70 +174,30 @@ class Timer:
         Returns:
             該階段的持續時間
         """
-        if thread == 'A':
-            if stage_name in self.thread_a_records:
-                return self.thread_a_records[stage_name].stop()
-        elif thread == 'B':
-            if stage_name in self.thread_b_records:
-                return self.thread_b_records[stage_name].stop()
-        elif thread == 'C':
-            if stage_name in self.thread_c_records:
-                return self.thread_c_records[stage_name].stop()
-        elif thread == 'D':
-            if stage_name in self.thread_d_records:
-                return self.thread_d_records[stage_name].stop()
-        elif thread == 'E':
-            if stage_name in self.thread_e_records:
-                return self.thread_e_records[stage_name].stop()
-        else:
-            if stage_name in self.records:
-                return self.records[stage_name].stop()
-        return 0.0
+        span = self.tracer.find_span(stage_name, open_only=True, thread=thread)
+        if span is None:
+            return 0.0
+        return span.end()
+    
+    def get_stage_duration(self, stage_name: str, thread: Optional[str] = None) -> float:
+        """
+        獲取某個階段的持續時間
+        
+        Args:
+            stage_name: 階段名稱
+            thread: 線程標識 ('A', 'B', 'C', 'D', 'E')，None 表示主流程
+            
+        Returns:
+            該階段的持續時間（未記錄或未結束時為 0）
+        """
+        span = self.tracer.find_span(stage_name, thread=thread)
+        if span is None or not span.finished:
+            return 0.0
+        return span.duration
     
     def get_report(self) -> TimerReport:
         """生成完整報告"""
-        report = TimerReport()
-        report.timestamp = datetime.now().isoformat()
-        
-        # 主流程記錄
-        for name, record in self.records.items():
-            report.records[name] = round(record.duration, 3)
-        
-        # Thread A 報告（RAG 檢索）
-        if self.thread_a_records:
-            thread_a_report = ThreadTimingReport(thread_name="Thread A（RAG 檢索）")
-            thread_a_total = 0.0
-            for name, record in self.thread_a_records.items():
-                duration = round(record.duration, 3)
-                thread_a_report.stages[name] = duration
-                thread_a_total += duration
-            thread_a_report.total_time = round(thread_a_total, 3)
-            report.thread_a_report = thread_a_report
-        
-        # Thread C 報告（C值判定）
-        if self.thread_c_records:
-            thread_c_report = ThreadTimingReport(thread_name="Thread C（C值檢測 - 正確性）")
-            thread_c_total = 0.0
-            for name, record in self.thread_c_records.items():
-                duration = round(record.duration, 3)
-                thread_c_report.stages[name] = duration
-                thread_c_total += duration
-            thread_c_report.total_time = round(thread_c_total, 3)
-            report.thread_c_report = thread_c_report
-        
-        # Thread E 報告（知識點檢測）
-        if self.thread_e_records:
-            thread_e_report = ThreadTimingReport(thread_name="Thread E（知識點檢測）")
-            thread_e_total = 0.0
-            for name, record in self.thread_e_records.items():
-                duration = round(record.duration, 3)
-                thread_e_report.stages[name] = duration
-                thread_e_total += duration
-            thread_e_report.total_time = round(thread_e_total, 3)
-            report.thread_e_report = thread_e_report
-        
-        report.total_time = round(time.perf_counter() - self.start_time, 3)
-        return report
+        return TimerReport.from_tracer(self.tracer)
     
     def print_report(self):
         """打印報告"""
@@ -262,3 +256,4 @@ class Timer:
         print("\n" + "="*70)
         print(f"  {'🎯 總計時間':35s}: {report.total_time:6.3f}s")
         print("="*70 + "\n")
+
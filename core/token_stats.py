@@ -0,0 +1,151 @@
+"""
+Token 串流統計模組
+記錄流式生成的首個 token 時間（TTFT）、token 間隔、吞吐量與 token 用量：
+- 上游在串流結尾回報 usage（stream_options.include_usage）時使用實際值
+- 否則（上游不支援、降級答案）以本地估算值代替，並標記 usage_estimated
+"""
+import re
+import time
+from typing import Dict, List, Optional
+
+# 中日韓字元大致一字一 token；其餘文字約 4 字元一 token
+_CJK_PATTERN = re.compile(r"[　-〿㐀-䶿一-鿿豈-﫿＀-￯]")
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    本地估算文字的 token 數（不依賴 tokenizer）
+
+    Args:
+        text: 文字內容
+
+    Returns:
+        估算的 token 數
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_PATTERN.findall(text))
+    others = len(text) - cjk
+    return cjk + (others + 3) // 4
+
+
+def _percentile(values: List[float], q: float) -> float:
+    """最近秩法分位數（values 需已排序）"""
+    if not values:
+        return 0.0
+    index = min(len(values) - 1, max(0, int(q * len(values) + 0.999999) - 1))
+    return values[index]
+
+
+class TokenStreamStats:
+    """單次流式生成的 token 統計"""
+
+    def __init__(self):
+        self.start_time = time.perf_counter()
+        self.first_token_time: Optional[float] = None
+        self.last_token_time: Optional[float] = None
+        self.gaps: List[float] = []
+        self.chunks = 0
+        self.text_parts: List[str] = []
+        self.prompt_text = ""
+        self.prompt_tokens: Optional[int] = None
+        self.completion_tokens: Optional[int] = None
+
+    def on_prompt(self, prompt: str):
+        """記錄送出的提示詞（供沒有 usage 時估算 prompt token）"""
+        self.prompt_text = prompt
+
+    def on_token(self, delta: str):
+        """
+        記錄收到的一段內容
+
+        Args:
+            delta: token delta
+        """
+        now = time.perf_counter()
+        if self.first_token_time is None:
+            self.first_token_time = now
+        else:
+            self.gaps.append(now - self.last_token_time)
+        self.last_token_time = now
+        self.chunks += 1
+        self.text_parts.append(delta)
+
+    def on_usage(self, usage):
+        """
+        記錄上游回報的 token 用量
+
+        Args:
+            usage: OpenAI usage 物件（None 時忽略）
+        """
+        if usage is None:
+            return
+        self.prompt_tokens = getattr(usage, "prompt_tokens", None)
+        self.completion_tokens = getattr(usage, "completion_tokens", None)
+
+    @property
+    def usage_estimated(self) -> bool:
+        return self.completion_tokens is None
+
+    def to_attributes(self) -> Dict:
+        """
+        彙總為 span 屬性
+
+        Returns:
+            ttft_generation（從發出請求起算）、tokens_per_second、token 間隔統計與 token 用量
+        """
+        if self.chunks == 0 and self.usage_estimated:
+            # 沒有收到任何上游內容（例如改用降級答案）
+            return {"chunks": 0}
+
+        completion_tokens = self.completion_tokens
+        prompt_tokens = self.prompt_tokens
+        if completion_tokens is None:
+            completion_tokens = estimate_tokens("".join(self.text_parts))
+        if prompt_tokens is None:
+            prompt_tokens = estimate_tokens(self.prompt_text)
+
+        attributes = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "usage_estimated": self.usage_estimated,
+            "chunks": self.chunks
+        }
+        if self.first_token_time is None:
+            return attributes
+
+        # 吞吐量以首個 token 之後的串流時間計算（不含排隊與提示詞處理）
+        stream_time = self.last_token_time - self.first_token_time
+        gaps = sorted(self.gaps)
+        attributes.update(
+            ttft_generation=round(self.first_token_time - self.start_time, 6),
+            stream_time=round(stream_time, 6),
+            tokens_per_second=round(completion_tokens / stream_time, 2) if stream_time > 0 else 0.0,
+            gap_mean=round(sum(gaps) / len(gaps), 6) if gaps else 0.0,
+            gap_p95=round(_percentile(gaps, 0.95), 6),
+            gap_max=round(gaps[-1], 6) if gaps else 0.0
+        )
+        return attributes
+
+
+# API 響應中輸出的 span 屬性
+TOKEN_STAT_KEYS = (
+    "ttft", "ttft_generation", "stream_time", "tokens_per_second",
+    "gap_mean", "gap_p95", "gap_max",
+    "prompt_tokens", "completion_tokens", "usage_estimated"
+)
+
+
+def span_token_stats(span) -> Dict:
+    """
+    從 span 屬性取出 token 統計（span 為 None 時返回空字典）
+
+    Args:
+        span: core.tracer.Span
+
+    Returns:
+        token 統計字典
+    """
+    if span is None:
+        return {}
+    return {key: span.attributes[key] for key in TOKEN_STAT_KEYS if key in span.attributes}
@@ -2,9 +2,12 @@
 C (Correctness) - 正確性檢測工具
 API 呼叫 #2 - 判斷用戶問題的表達是否正確
 """
+import asyncio
 import json
 from openai import OpenAI
-from config import Config, get_shared_client
+from config import Config, get_shared_async_client
+from core.circuit_breaker import CircuitOpenError, get_breaker
+from core.tracer import get_current_tracer, record_usage, start_span
 
 
 class CorrectnessDetector:
@@ -16,11 +19,14 @@ class CorrectnessDetector:
         
         Args:
             api_key: OpenAI API Key
-            timer: 計時器（可選）
+            timer: 計時器（可選；請求範圍內優先使用目前請求的計時器）
         """
-        # 使用共享的 OpenAI client
-        self.client = get_shared_client(api_key)
+        # 使用共享的 AsyncOpenAI client（同步 client 會阻塞事件迴圈，使並行分支串行化）
+        self.client = get_shared_async_client(api_key)
         self.timer = timer
+        
+        # 上游斷路器
+        self.breaker = get_breaker("correctness_detector")
     
     async def detect(self, query: str) -> int:
         """
@@ -31,15 +37,30 @@ class CorrectnessDetector:
             
         Returns:
             int: 0=正確, 1=不正確
+            
+        Raises:
+            CircuitOpenError: 斷路器開啟時立即拋出（不發出請求）
+            Exception: 上游調用失敗時重新拋出（已計入斷路器，由呼叫端改用降級結果）
         """
         import time
         t_start = time.perf_counter()
         
+        if not self.breaker.allow_request():
+            self._last_timing = 0.0
+            print(f"⚡ C值檢測：斷路器開啟，跳過 API 調用")
+            raise CircuitOpenError(self.breaker.name)
+        
         print(f"\n🔍 C值檢測：開始分析查詢...")
         print(f"🤖 使用模型: {Config.CLASSIFIER_MODEL}")
         
-        if self.timer:
-            self.timer.start_stage("C值 API 調用（正確性檢測）", thread='C')
+        # 記錄到目前請求的追蹤器（並發請求各自獨立；未在請求中時使用注入的計時器）
+        span = start_span(
+            "C值 API 調用（正確性檢測）",
+            tracer=get_current_tracer() or (self.timer.tracer if self.timer else None),
+            thread='C',
+            model=Config.CLASSIFIER_MODEL,
+            upstream=True
+        )
         
         # 簡化提示詞，減少處理時間
         prompt = f"""分析這句話：「{query}」
@@ -53,11 +74,11 @@ class CorrectnessDetector:
 
 返回 JSON: {{"correct": 0}} 或 {{"correct": 1}}"""
         
+        t_api_start = time.perf_counter()
+        print(f"📤 C值檢測：發送 API 請求...")
+        # 只有上游調用本身計入斷路器；回應內容的解析問題不代表上游故障
         try:
-            t_api_start = time.perf_counter()
-            print(f"📤 C值檢測：發送 API 請求...")
-            
-            response = self.client.chat.completions.create(
+            response = await self.client.chat.completions.create(
                 model=Config.CLASSIFIER_MODEL,
                 messages=[
                     {"role": "system", "content": "快速判斷正確性。預設正確。"},
@@ -65,40 +86,55 @@ class CorrectnessDetector:
                 ],
                 response_format={"type": "json_object"},
                 temperature=0,
-                max_tokens=20
+                max_tokens=20,
+                timeout=Config.UPSTREAM_TIMEOUT
             )
-            
-            t_api_end = time.perf_counter()
-            api_duration = t_api_end - t_api_start
-            print(f"📥 C值檢測：API 回應耗時 {api_duration:.3f} 秒")
-            
-            result = response.choices[0].message.content.strip()
-            print(f"📝 C值檢測：API 回應內容: {result}")
-            
-            if self.timer:
-                self.timer.stop_stage("C值 API 調用（正確性檢測）", thread='C')
-            
-            t_end = time.perf_counter()
-            self._last_timing = t_end - t_start
-            
-            # 解析 JSON
-            try:
-                data = json.loads(result)
-                c_value = data.get("correct", 0)
-                print(f"✅ C值檢測：結果 = {c_value} ({['正確', '不正確'][c_value]})")
-                print(f"⏱️  C值檢測總耗時: {self._last_timing:.3f} 秒")
-                return c_value
-            except json.JSONDecodeError as json_err:
-                print(f"⚠️  C值檢測 JSON 解析失敗: {json_err}")
-                print(f"   原始回應: {result}")
-                return 0  # 默認為正確
-            
+        except asyncio.CancelledError:
+            # 呼叫端取消（例如客戶端斷線）不代表上游故障：只釋放探測名額
+            self.breaker.release()
+            span.set_attribute("error", "CancelledError")
+            span.end()
+            raise
         except Exception as e:
-            t_end = time.perf_counter()
-            error_duration = t_end - t_start
+            self.breaker.record_failure()
+            self._last_timing = time.perf_counter() - t_start
             print(f"❌ C值檢測 API 調用失敗: {e}")
-            print(f"⏱️  C值檢測失敗耗時: {error_duration:.3f} 秒")
-            if self.timer:
-                self.timer.stop_stage("C值 API 調用（正確性檢測）", thread='C')
-            self._last_timing = error_duration
+            print(f"⏱️  C值檢測失敗耗時: {self._last_timing:.3f} 秒")
+            span.set_attribute("error", type(e).__name__)
+            span.end()
+            raise
+        self.breaker.record_success()
+        
+        api_duration = time.perf_counter() - t_api_start
+        record_usage(span, response, elapsed=api_duration)
+        span.end()
+        print(f"📥 C值檢測：API 回應耗時 {api_duration:.3f} 秒")
+        
+        result = (response.choices[0].message.content or "").strip()
+        print(f"📝 C值檢測：API 回應內容: {result}")
+        self._last_timing = time.perf_counter() - t_start
+        
+        c_value = self._parse_c_value(result)
+        print(f"✅ C值檢測：結果 = {c_value} ({['正確', '不正確'][c_value]})")
+        print(f"⏱️  C值檢測總耗時: {self._last_timing:.3f} 秒")
+        return c_value
+    
+    @staticmethod
+    def _parse_c_value(result: str) -> int:
+        """
+        解析模型回應的 C 值（無法解析時默認為正確，超出範圍時限制在 0/1）
+        
+        Args:
+            result: 模型回應內容（JSON 字串）
+            
+        Returns:
+            int: 0=正確, 1=不正確
+        """
+        try:
+            data = json.loads(result)
+            value = int(data.get("correct", 0)) if isinstance(data, dict) else 0
+        except (json.JSONDecodeError, TypeError, ValueError) as e:
+            print(f"⚠️  C值檢測回應解析失敗: {e}")
+            print(f"   原始回應: {result}")
             return 0  # 默認為正確
+        return min(max(value, 0), 1)
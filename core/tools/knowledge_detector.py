@@ -4,9 +4,12 @@
 """
 from openai import OpenAI
 from typing import List
+import asyncio
 import json
 import os
-from config import get_shared_client
+from config import Config, get_shared_async_client
+from core.circuit_breaker import CircuitOpenError, get_breaker
+from core.tracer import get_current_tracer, record_usage, start_span
 
 
 class KnowledgeDetector:
@@ -18,14 +21,17 @@ class KnowledgeDetector:
         
         Args:
             api_key: OpenAI API Key
-            timer: 計時器（可選）
+            timer: 計時器（可選；請求範圍內優先使用目前請求的計時器）
             ontology_content: 知識本體論內容（包含所有知識點）
         """
-        # 使用共享的 OpenAI client
-        self.client = get_shared_client(api_key)
+        # 使用共享的 AsyncOpenAI client（同步 client 會阻塞事件迴圈，使並行分支串行化）
+        self.client = get_shared_async_client(api_key)
         self.timer = timer
         self.ontology_content = ontology_content
         
+        # 上游斷路器
+        self.breaker = get_breaker("knowledge_detector")
+        
         # 知識點列表（從 JSON 清單載入）
         self.knowledge_points = self._load_points_from_json()
     
@@ -60,10 +66,18 @@ class KnowledgeDetector:
             
         Returns:
             List[str]: 知識點名稱列表，例如 ["機器學習基礎", "深度學習"]
+            
+        Raises:
+            CircuitOpenError: 斷路器開啟時立即拋出（不發出請求）
         """
         import time
         t_start = time.perf_counter()
         
+        if not self.breaker.allow_request():
+            self._last_timing = 0.0
+            print(f"⚡ 知識點檢測：斷路器開啟，跳過 API 調用")
+            raise CircuitOpenError(self.breaker.name)
+        
         # 構建知識點列表字串
         knowledge_list = "\n".join([f"- {kp}" for kp in self.knowledge_points])
         
@@ -106,17 +120,41 @@ class KnowledgeDetector:
         
         # 調用 API（添加日誌）
         print(f"🔍 知識點檢測：開始分析查詢...")
-        response = self.client.chat.completions.create(
+        # 記錄到目前請求的追蹤器（並發請求各自獨立；未在請求中時使用注入的計時器）
+        span = start_span(
+            "知識點 API 調用",
+            tracer=get_current_tracer() or (self.timer.tracer if self.timer else None),
+            thread='E',
             model="gpt-4o-mini",
-            messages=[
-                {"role": "system", "content": "你是知識點分析專家。根據問題內容，識別涉及的知識點。支援直接匹配和語義匹配（相似度≥80%）。"},
-                {"role": "user", "content": prompt}
-            ],
-            functions=functions,
-            function_call={"name": "return_knowledge_points"},
-            temperature=0,
-            max_tokens=300  # 增加到 300 避免截斷
+            upstream=True
         )
+        t_api_start = time.perf_counter()
+        try:
+            response = await self.client.chat.completions.create(
+                model="gpt-4o-mini",
+                messages=[
+                    {"role": "system", "content": "你是知識點分析專家。根據問題內容，識別涉及的知識點。支援直接匹配和語義匹配（相似度≥80%）。"},
+                    {"role": "user", "content": prompt}
+                ],
+                functions=functions,
+                function_call={"name": "return_knowledge_points"},
+                temperature=0,
+                max_tokens=300,  # 增加到 300 避免截斷
+                timeout=Config.UPSTREAM_TIMEOUT
+            )
+        except asyncio.CancelledError:
+            # 呼叫端取消（例如客戶端斷線）不代表上游故障：只釋放探測名額
+            self.breaker.release()
+            raise
+        except Exception as e:
+            self.breaker.record_failure()
+            self._last_timing = time.perf_counter() - t_start
+            span.set_attribute("error", type(e).__name__)
+            raise
+        finally:
+            span.end()
+        self.breaker.record_success()
+        record_usage(span, response, elapsed=time.perf_counter() - t_api_start)
         
         t_end = time.perf_counter()
         self._last_timing = t_end - t_start
@@ -159,6 +197,7 @@ class KnowledgeDetector:
             print(f"⚠️  知識點檢測：過濾掉 {len(invalid_points)} 個無效知識點: {invalid_points}")
         
         print(f"✅ 知識點檢測：最終返回 {len(valid_points)} 個有效知識點: {valid_points}")
+        span.set_attribute("knowledge_point_count", len(valid_points))
         print(f"⏱️  知識點檢測耗時: {self._last_timing:.3f} 秒")
         
         return valid_points
@@ -1,50 +1,90 @@
 """
 重複性檢測工具
-檢查當前知識點是否與前兩次歷史記錄重複
+以滑動視窗檢查當前知識點是否在最近幾次詢問中重複出現：
+視窗保留最近 REPETITION_WINDOW 次的知識點集合，並增量維護各知識點在視窗中出現的次數；
+當前任一知識點「視窗中次數 + 本次」達到 REPETITION_THRESHOLD 即判定為重複。
+默認視窗 2、閾值 3：同一知識點連續出現在三次詢問中即為重複
 """
 from typing import List
-from collections import deque
+from collections import Counter, deque
+
+from config import Config
 
 
 class RepetitionChecker:
-    """重複性檢測器"""
-    
-    def __init__(self):
-        """初始化重複性檢測器"""
-        # 只記錄最近兩次的知識點集合
-        self.history = deque(maxlen=2)
-    
+    """重複性檢測器（每個會話一個）"""
+
+    def __init__(self, window: int = None, threshold: int = None):
+        """
+        初始化重複性檢測器
+
+        Args:
+            window: 視窗長度（比較前幾次詢問，默認從配置讀取）
+            threshold: 重複閾值（含本次的出現次數，默認從配置讀取）
+
+        Raises:
+            ValueError: 視窗為負數，或閾值不在 1 ~ window + 1 之間（超過時永遠不可能判定為重複）
+        """
+        self.window = Config.REPETITION_WINDOW if window is None else window
+        self.threshold = Config.REPETITION_THRESHOLD if threshold is None else threshold
+        if self.window < 0 or not 1 <= self.threshold <= self.window + 1:
+            raise ValueError(f"無效的重複性設定: window={self.window}, threshold={self.threshold}"
+                             f"（閾值需介於 1 與 window + 1 之間）")
+
+        # 最近 window 次的知識點集合，以及各知識點在視窗中出現的次數
+        self.history = deque()
+        self.counts = Counter()
+
     def check_and_update(self, current_kps: List[str]) -> int:
         """
-        檢查是否重複，然後更新歷史記錄
-        
-        邏輯：
-        1. 檢查當前知識點是否與前兩次共同出現的知識點重疊
-        2. 若有重疊 → 重複（返回1）
-        3. 若無重疊 → 正常（返回0）
-        4. 將當前知識點加入佇列（自動維持僅兩筆記錄）
-        
+        檢查是否重複，然後將當前知識點移入視窗
+
+        成本為 O(當前知識點數 + 移出視窗的知識點數)，與視窗長度無關
+
         Args:
             current_kps: 當前知識點列表，例如 ["深度學習", "機器學習基礎"]
-            
+
         Returns:
             int: 0=正常, 1=重複
         """
-        # 如果歷史記錄少於2筆，返回正常
-        if len(self.history) < 2:
-            self.history.append(set(current_kps))
-            return 0
-        
-        # 找出前兩次共同出現的知識點
-        common = set(self.history[0]) & set(self.history[1])
-        
-        # 檢查當前知識點是否與共同知識點重疊
         current_set = set(current_kps)
-        if current_set & common:
-            # 有重疊 → 重複
-            self.history.append(current_set)
-            return 1
-        
-        # 無重疊 → 正常
-        self.history.append(current_set)
-        return 0
+        repeated = any(self.counts[kp] + 1 >= self.threshold for kp in current_set)
+        self._push(current_set)
+        return 1 if repeated else 0
+
+    def _push(self, kps: set):
+        """將一次詢問的知識點移入視窗（超出長度時移出最舊的一次）"""
+        if self.window == 0:
+            return
+        if len(self.history) == self.window:
+            for kp in self.history.popleft():
+                self.counts[kp] -= 1
+                if not self.counts[kp]:
+                    del self.counts[kp]
+        self.history.append(kps)
+        for kp in kps:
+            self.counts[kp] += 1
+
+    def to_dict(self) -> dict:
+        """轉換為字典（供會話狀態持久化；計數由視窗重建，不另外保存）"""
+        return {
+            "window": self.window,
+            "threshold": self.threshold,
+            "history": [sorted(kps) for kps in self.history]
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict):
+        """
+        從字典還原（使用目前配置的視窗與閾值；視窗變短時只保留最近的記錄）
+
+        Args:
+            data: to_dict 的輸出
+
+        Returns:
+            RepetitionChecker 實例
+        """
+        checker = cls()
+        for kps in data.get("history", []):
+            checker._push(set(kps))
+        return checker
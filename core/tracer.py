@@ -0,0 +1,544 @@
+"""
+請求追蹤模組（span-based tracer）
+以巢狀 span 記錄單次請求的各階段：
+- 每個 span 有名稱、起訖時間、屬性（model、tokens、cache_hit、doc_count…）與事件
+- 父子關係透過 contextvars 傳遞，asyncio.gather 的各分支自動掛在建立任務時的 span 之下
+- 關鍵路徑與重疊分析直接由實際時間戳計算
+
+匯出器：
+- Tracer.to_dict(): span 列表 + 分析結果
+- Tracer.to_chrome_trace(): Chrome trace-event JSON（chrome://tracing / Perfetto 離線開啟）
+- TimerReport.from_tracer(): 相容舊版 Timer 報告格式（core/timer_utils.py）
+"""
+import itertools
+import json
+import os
+import time
+import uuid
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterator, List, Optional
+
+
+@dataclass
+class SpanEvent:
+    """span 內的時間點事件（例如首個 token）"""
+    name: str
+    timestamp: float
+    attributes: Dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass
+class Span:
+    """單一階段的追蹤記錄"""
+    name: str
+    span_id: int
+    parent_id: Optional[int] = None
+    start_time: float = field(default_factory=time.perf_counter)
+    end_time: Optional[float] = None
+    attributes: Dict[str, Any] = field(default_factory=dict)
+    events: List[SpanEvent] = field(default_factory=list)
+
+    @property
+    def finished(self) -> bool:
+        """是否已結束"""
+        return self.end_time is not None
+
+    @property
+    def duration(self) -> float:
+        """持續時間（未結束時計算到目前為止）"""
+        end = self.end_time if self.end_time is not None else time.perf_counter()
+        return end - self.start_time
+
+    def set_attribute(self, key: str, value: Any):
+        """設定單一屬性"""
+        self.attributes[key] = value
+
+    def set_attributes(self, **attributes):
+        """設定多個屬性"""
+        self.attributes.update(attributes)
+
+    def add_event(self, name: str, **attributes):
+        """記錄時間點事件"""
+        self.events.append(SpanEvent(name, time.perf_counter(), attributes))
+
+    def end(self) -> float:
+        """結束 span（重複呼叫不會改變結束時間）"""
+        if self.end_time is None:
+            self.end_time = time.perf_counter()
+        return self.duration
+
+    def to_dict(self, origin: float) -> dict:
+        """
+        轉換為字典格式
+
+        Args:
+            origin: 時間原點（追蹤開始的 perf_counter 值）
+        """
+        return {
+            "name": self.name,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start": round(self.start_time - origin, 6),
+            "duration": round(self.duration, 6),
+            "attributes": self.attributes,
+            "events": [
+                {
+                    "name": event.name,
+                    "time": round(event.timestamp - origin, 6),
+                    "attributes": event.attributes
+                }
+                for event in self.events
+            ]
+        }
+
+
+class _NoopSpan(Span):
+    """未在追蹤範圍內時使用的空 span（所有記錄操作皆忽略）"""
+
+    def set_attribute(self, key: str, value: Any):
+        pass
+
+    def set_attributes(self, **attributes):
+        pass
+
+    def add_event(self, name: str, **attributes):
+        pass
+
+
+# 目前請求的追蹤器與 span（asyncio 任務建立時會複製當下的 context）
+_current_tracer: ContextVar[Optional["Tracer"]] = ContextVar("current_tracer", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """單次請求的追蹤器"""
+
+    def __init__(self, name: str = "request", trace_id: str = None):
+        """
+        初始化追蹤器
+
+        Args:
+            name: 追蹤名稱
+            trace_id: 追蹤 ID（默認隨機產生）
+        """
+        self.name = name
+        self.trace_id = trace_id or uuid.uuid4().hex
+        self.origin = time.perf_counter()
+        self.wall_origin = time.time()
+        self.spans: List[Span] = []
+        self._spans_by_id: Dict[int, Span] = {}
+        self._ids = itertools.count(1)
+
+    def start_span(self, name: str, parent: Optional[Span] = None, **attributes) -> Span:
+        """
+        開始一個 span（不改變目前的 span，需自行呼叫 end）
+
+        Args:
+            name: span 名稱
+            parent: 父 span（默認為目前 context 中屬於此追蹤器的 span）
+            **attributes: 初始屬性
+
+        Returns:
+            Span 實例
+        """
+        if parent is None:
+            current = _current_span.get()
+            if current is not None and self._spans_by_id.get(current.span_id) is current:
+                parent = current
+
+        span = Span(
+            name=name,
+            span_id=next(self._ids),
+            parent_id=parent.span_id if parent else None,
+            attributes=dict(attributes)
+        )
+        self.spans.append(span)
+        self._spans_by_id[span.span_id] = span
+        return span
+
+    @contextmanager
+    def span(self, name: str, parent: Optional[Span] = None, **attributes) -> Iterator[Span]:
+        """
+        以 with 區塊記錄一個 span，區塊內建立的 span / 任務皆為其子節點
+
+        注意不要跨越 async generator 的 yield 持有此範圍（生成器可能在不同 context 中被關閉），
+        此時請改用 start_span / end 搭配 use_span
+
+        Args:
+            name: span 名稱
+            parent: 父 span（默認為目前的 span）
+            **attributes: 初始屬性
+
+        Yields:
+            Span 實例
+        """
+        span = self.start_span(name, parent=parent, **attributes)
+        token = _current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            span.set_attribute("error", type(e).__name__)
+            raise
+        finally:
+            span.end()
+            _current_span.reset(token)
+
+    def find_span(self, name: str, open_only: bool = False, **attributes) -> Optional[Span]:
+        """
+        查找最近一個符合條件的 span
+
+        Args:
+            name: span 名稱
+            open_only: 只查找尚未結束的 span
+            **attributes: 需相符的屬性（值為 None 表示該屬性不存在）
+
+        Returns:
+            Span 實例，找不到時返回 None
+        """
+        for span in reversed(self.spans):
+            if span.name != name or (open_only and span.finished):
+                continue
+            if all(span.attributes.get(k) == v for k, v in attributes.items()):
+                return span
+        return None
+
+    def depth(self, span: Span) -> int:
+        """span 的巢狀深度（根節點為 0）"""
+        depth = 0
+        while span.parent_id is not None and span.parent_id in self._spans_by_id:
+            span = self._spans_by_id[span.parent_id]
+            depth += 1
+        return depth
+
+    def _children(self) -> Dict[Optional[int], List[Span]]:
+        """依父節點分組的已結束 span"""
+        children: Dict[Optional[int], List[Span]] = {}
+        for span in self.spans:
+            if span.finished:
+                children.setdefault(span.parent_id, []).append(span)
+        return children
+
+    def critical_path(self) -> List[Span]:
+        """
+        計算關鍵路徑（決定總延遲的 span 序列）
+
+        從最長的根節點開始，每層由結束時間往回找：選擇最晚結束、且不晚於目前游標的子節點，
+        游標移到該子節點的開始時間後繼續；被選中的子節點再遞迴展開
+
+        Returns:
+            依時間排序的葉節點 span 列表
+        """
+        children = self._children()
+        roots = children.get(None, [])
+        if not roots:
+            return []
+        root = max(roots, key=lambda s: s.duration)
+        return self._critical_path(root, children)
+
+    def _critical_path(self, span: Span, children: Dict[Optional[int], List[Span]]) -> List[Span]:
+        kids = children.get(span.span_id, [])
+        if not kids:
+            return [span]
+
+        path: List[Span] = []
+        cursor = span.end_time
+        for kid in sorted(kids, key=lambda s: s.end_time, reverse=True):
+            if kid.end_time <= cursor + 1e-6:
+                path = self._critical_path(kid, children) + path
+                cursor = kid.start_time
+        return path or [span]
+
+    def overlap(self) -> List[Dict]:
+        """
+        計算每個擁有多個子節點的 span 中，子節點之間的重疊程度
+
+        Returns:
+            列表，每項包含子節點耗時總和、聯集長度、重疊時間與並行效率
+        """
+        children = self._children()
+        results = []
+        for span in self.spans:
+            kids = children.get(span.span_id, [])
+            if len(kids) < 2:
+                continue
+
+            total = sum(kid.duration for kid in kids)
+            union = 0.0
+            cur_start, cur_end = None, None
+            for kid in sorted(kids, key=lambda s: s.start_time):
+                if cur_end is None or kid.start_time > cur_end:
+                    if cur_end is not None:
+                        union += cur_end - cur_start
+                    cur_start, cur_end = kid.start_time, kid.end_time
+                else:
+                    cur_end = max(cur_end, kid.end_time)
+            union += cur_end - cur_start
+
+            results.append({
+                "span": span.name,
+                "children": [kid.name for kid in kids],
+                "sum": round(total, 6),
+                "union": round(union, 6),
+                "longest_child": round(max(kid.duration for kid in kids), 6),
+                "overlap": round(total - union, 6),
+                "concurrency": round(total / union, 3) if union > 0 else 0.0,
+                "parallel_efficiency": round(1 - union / total, 3) if total > 0 else 0.0
+            })
+        return results
+
+    def analyze(self) -> Dict:
+        """
+        關鍵路徑與重疊分析
+
+        Returns:
+            分析結果字典
+        """
+        path = self.critical_path()
+        children = self._children()
+        roots = children.get(None, [])
+        wall_time = max((s.duration for s in roots), default=0.0)
+        path_time = sum(span.duration for span in path)
+        return {
+            "wall_time": round(wall_time, 6),
+            "critical_path": [
+                {"name": span.name, "duration": round(span.duration, 6)} for span in path
+            ],
+            "critical_path_time": round(path_time, 6),
+            # 關鍵路徑以外、未被任何子 span 覆蓋的時間（本地處理或排程等待）
+            "untraced_time": round(max(wall_time - path_time, 0.0), 6),
+            "overlap": self.overlap()
+        }
+
+    def to_dict(self) -> Dict:
+        """匯出為字典（span 列表 + 分析結果）"""
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "start_timestamp": self.wall_origin,
+            "spans": [span.to_dict(self.origin) for span in self.spans],
+            "analysis": self.analyze()
+        }
+
+    def _assign_lanes(self, spans: List[Span]) -> Dict[int, int]:
+        """
+        為 span 分配顯示列（tid）：同一列上的 span 必須完全巢狀，
+        與兄弟節點時間重疊的分支（例如 gather 的各分支）放到新的一列
+
+        Returns:
+            span_id → 列編號
+        """
+        lanes: Dict[int, int] = {}
+        occupied: Dict[int, List[Span]] = {}
+        for span in sorted(spans, key=lambda s: (s.start_time, self.depth(s))):
+            lane = lanes.get(span.parent_id, 0)
+            while any(
+                other.start_time < span.end_time and span.start_time < other.end_time
+                and not self._is_ancestor(other, span)
+                for other in occupied.get(lane, [])
+            ):
+                lane += 1
+            lanes[span.span_id] = lane
+            occupied.setdefault(lane, []).append(span)
+        return lanes
+
+    def _is_ancestor(self, ancestor: Span, span: Span) -> bool:
+        """判斷 ancestor 是否為 span 的祖先節點"""
+        while span.parent_id is not None:
+            if span.parent_id == ancestor.span_id:
+                return True
+            span = self._spans_by_id.get(span.parent_id)
+            if span is None:
+                return False
+        return False
+
+    def to_chrome_trace(self) -> Dict:
+        """
+        匯出為 Chrome trace-event 格式
+
+        每個已結束的 span 為一個完整事件（ph=X），span 內的事件（例如 first_token）為瞬時事件（ph=i）；
+        時間單位為微秒，以追蹤開始為原點
+
+        Returns:
+            可直接 json.dump 的字典
+        """
+        spans = [span for span in self.spans if span.finished]
+        lanes = self._assign_lanes(spans)
+
+        events: List[Dict] = []
+        lane_names: Dict[int, str] = {}
+        for span in spans:
+            tid = lanes[span.span_id]
+            lane_names.setdefault(tid, span.name)
+            events.append({
+                "name": span.name,
+                "cat": span.attributes.get("thread", "main"),
+                "ph": "X",
+                "ts": round((span.start_time - self.origin) * 1e6, 3),
+                "dur": round(span.duration * 1e6, 3),
+                "pid": 1,
+                "tid": tid,
+                "args": {"span_id": span.span_id, "parent_id": span.parent_id, **span.attributes}
+            })
+            for event in span.events:
+                events.append({
+                    "name": event.name,
+                    "cat": "event",
+                    "ph": "i",
+                    "s": "t",
+                    "ts": round((event.timestamp - self.origin) * 1e6, 3),
+                    "pid": 1,
+                    "tid": tid,
+                    "args": event.attributes
+                })
+
+        # 行程 / 列名稱（metadata 事件）
+        events.append({"name": "process_name", "ph": "M", "pid": 1, "args": {"name": f"{self.name} {self.trace_id}"}})
+        for tid, name in lane_names.items():
+            events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": name}})
+
+        return {
+            "traceEvents": events,
+            "displayTimeUnit": "ms",
+            "otherData": {
+                "trace_id": self.trace_id,
+                "start_timestamp": self.wall_origin,
+                "analysis": self.analyze()
+            }
+        }
+
+
+def write_chrome_trace(tracer: Tracer, directory: str) -> str:
+    """
+    將追蹤寫成 Chrome trace-event JSON 檔案
+
+    Args:
+        tracer: 追蹤器
+        directory: 輸出目錄（不存在時自動建立）
+
+    Returns:
+        寫入的檔案路徑
+    """
+    os.makedirs(directory, exist_ok=True)
+    timestamp = time.strftime("%Y%m%d_%H%M%S", time.localtime(tracer.wall_origin))
+    path = os.path.join(directory, f"trace_{timestamp}_{tracer.trace_id[:8]}.json")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(tracer.to_chrome_trace(), f, ensure_ascii=False)
+    return path
+
+
+def get_current_tracer() -> Optional[Tracer]:
+    """
+    獲取目前請求的追蹤器
+
+    Returns:
+        Tracer 實例；不在追蹤範圍內時返回 None
+    """
+    return _current_tracer.get()
+
+
+def get_current_span() -> Optional[Span]:
+    """獲取目前的 span（不在 span 範圍內時返回 None）"""
+    return _current_span.get()
+
+
+@contextmanager
+def use_tracer(tracer: Tracer) -> Iterator[Tracer]:
+    """
+    在此範圍內將指定追蹤器設為目前請求的追蹤器
+
+    Args:
+        tracer: 追蹤器
+
+    Yields:
+        追蹤器
+    """
+    token = _current_tracer.set(tracer)
+    try:
+        yield tracer
+    finally:
+        _current_tracer.reset(token)
+
+
+@contextmanager
+def use_span(span: Span) -> Iterator[Span]:
+    """
+    在此範圍內將指定 span 設為目前的 span（範圍內建立的任務以它為父節點）
+
+    Args:
+        span: 由 Tracer.start_span 建立的 span
+
+    Yields:
+        span
+    """
+    token = _current_span.set(span)
+    try:
+        yield span
+    finally:
+        _current_span.reset(token)
+
+
+def start_span(name: str, tracer: Optional[Tracer] = None, **attributes) -> Span:
+    """
+    在目前請求的追蹤器上開始一個 span（需自行呼叫 end）；不在追蹤範圍內時返回空 span
+
+    Args:
+        name: span 名稱
+        tracer: 追蹤器（默認為目前請求的追蹤器）
+        **attributes: 初始屬性
+
+    Returns:
+        Span 實例
+    """
+    tracer = tracer or get_current_tracer()
+    if tracer is None:
+        return _NoopSpan(name=name, span_id=0)
+    return tracer.start_span(name, **attributes)
+
+
+def record_usage(span: Span, response: Any, elapsed: Optional[float] = None):
+    """
+    將 OpenAI 回應中的 token 用量記錄為 span 屬性
+
+    非流式調用的首個 token 即整個回應，給定 elapsed 時同時記錄 ttft 與 tokens_per_second
+
+    Args:
+        span: 目標 span
+        response: chat.completions 回應（沒有 usage 時忽略）
+        elapsed: API 調用耗時（秒）
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return
+    completion_tokens = getattr(usage, "completion_tokens", 0) or 0
+    span.set_attributes(
+        prompt_tokens=getattr(usage, "prompt_tokens", 0),
+        completion_tokens=completion_tokens
+    )
+    if elapsed:
+        span.set_attributes(
+            ttft=round(elapsed, 6),
+            tokens_per_second=round(completion_tokens / elapsed, 2)
+        )
+
+
+@contextmanager
+def trace_span(name: str, tracer: Optional[Tracer] = None, **attributes) -> Iterator[Span]:
+    """
+    在目前請求的追蹤器上記錄一個 span；不在追蹤範圍內時為空操作
+
+    Args:
+        name: span 名稱
+        tracer: 追蹤器（默認為目前請求的追蹤器）
+        **attributes: 初始屬性
+
+    Yields:
+        Span 實例（不在追蹤範圍內時為空 span）
+    """
+    tracer = tracer or get_current_tracer()
+    if tracer is None:
+        yield _NoopSpan(name=name, span_id=0)
+        return
+    with tracer.span(name, **attributes) as span:
+        yield span
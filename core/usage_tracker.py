@@ -0,0 +1,182 @@
+"""
+用量與成本統計模組
+從每次查詢的追蹤資料取出各上游調用的 token 用量（embedding、C 值、知識點、最終生成），
+依 Config.MODEL_PRICING 計算成本，並依階段、模型、情境與會話累計（/api/usage）
+"""
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from config import Config
+
+
+def calculate_cost(model: str, prompt_tokens: int, completion_tokens: int) -> float:
+    """
+    計算一次調用的成本
+
+    Args:
+        model: 模型名稱
+        prompt_tokens: 輸入 token 數
+        completion_tokens: 輸出 token 數
+
+    Returns:
+        成本（美元，未設定單價的模型為 0）
+    """
+    pricing = Config.MODEL_PRICING.get(model)
+    if not pricing:
+        return 0.0
+    return (prompt_tokens * pricing.get("input", 0.0) + completion_tokens * pricing.get("output", 0.0)) / 1e6
+
+
+def _empty_totals() -> Dict:
+    return {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "estimated_tokens": 0, "cost_usd": 0.0}
+
+
+def _rounded(totals: Dict) -> Dict:
+    """輸出用的複本（成本取到 1e-8 美元）"""
+    return {**totals, "cost_usd": round(totals["cost_usd"], 8)}
+
+
+def _add(totals: Dict, usage: Dict):
+    """將一筆用量累加到統計（就地修改）"""
+    for key in ("calls", "prompt_tokens", "completion_tokens", "estimated_tokens", "cost_usd"):
+        totals[key] += usage.get(key, 0)
+
+
+def summarize_trace(tracer) -> Dict:
+    """
+    彙總單次查詢的用量
+
+    帶有 prompt_tokens / completion_tokens 屬性的 span 視為一次上游調用；
+    usage_estimated 為真的調用（沒有上游 usage）計入 estimated_tokens
+
+    Args:
+        tracer: core.tracer.Tracer
+
+    Returns:
+        {"session_id", "scenario_number", "stages": {階段: 用量}, "total": 用量}
+    """
+    root = tracer.spans[0] if tracer.spans else None
+    summary = {
+        "session_id": root.attributes.get("session_id", Config.DEFAULT_SESSION_ID) if root else Config.DEFAULT_SESSION_ID,
+        "scenario_number": root.attributes.get("scenario_number") if root else None,
+        "stages": {},
+        "total": _empty_totals()
+    }
+    for span in tracer.spans:
+        attributes = span.attributes
+        if "prompt_tokens" not in attributes and "completion_tokens" not in attributes:
+            continue
+        prompt_tokens = attributes.get("prompt_tokens", 0) or 0
+        completion_tokens = attributes.get("completion_tokens", 0) or 0
+        model = attributes.get("model", "")
+        usage = {
+            "calls": 1,
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "estimated_tokens": prompt_tokens + completion_tokens if attributes.get("usage_estimated") else 0,
+            "cost_usd": calculate_cost(model, prompt_tokens, completion_tokens)
+        }
+        stage = summary["stages"].setdefault(span.name, {"model": model, **_empty_totals()})
+        _add(stage, usage)
+        _add(summary["total"], usage)
+    summary["stages"] = {name: _rounded(stage) for name, stage in summary["stages"].items()}
+    summary["total"] = _rounded(summary["total"])
+    return summary
+
+
+class UsageTracker:
+    """累計用量（全局單例，見 get_usage_tracker）"""
+
+    def __init__(self, max_sessions: int = None):
+        """
+        初始化
+
+        Args:
+            max_sessions: 最多保留的會話數（默認從配置讀取）
+        """
+        self.max_sessions = max_sessions or Config.USAGE_MAX_SESSIONS
+        self._lock = threading.Lock()
+        self.clear()
+
+    def record(self, summary: Dict):
+        """
+        累計一次查詢的用量
+
+        Args:
+            summary: summarize_trace 的結果
+        """
+        with self._lock:
+            self.queries += 1
+            _add(self.total, summary["total"])
+            for name, stage in summary["stages"].items():
+                _add(self.by_stage.setdefault(name, _empty_totals()), stage)
+                _add(self.by_model.setdefault(stage["model"] or "unknown", _empty_totals()), stage)
+
+            scenario = str(summary.get("scenario_number"))
+            _add(self.by_scenario.setdefault(scenario, {"queries": 0, **_empty_totals()}), summary["total"])
+            self.by_scenario[scenario]["queries"] += 1
+
+            session_id = summary["session_id"]
+            session = self.by_session.pop(session_id, None) or {"queries": 0, **_empty_totals()}
+            _add(session, summary["total"])
+            session["queries"] += 1
+            self.by_session[session_id] = session
+            while len(self.by_session) > self.max_sessions:
+                self.by_session.popitem(last=False)
+
+    def record_trace(self, tracer):
+        """彙總並累計一次查詢的追蹤資料"""
+        self.record(summarize_trace(tracer))
+
+    def get_summary(self, session_id: Optional[str] = None) -> Dict:
+        """
+        獲取用量統計
+
+        Args:
+            session_id: 只返回指定會話的用量（None 表示全部）
+
+        Returns:
+            用量統計字典（成本單位：美元）
+        """
+        with self._lock:
+            if session_id is not None:
+                session = self.by_session.get(session_id)
+                return {"session_id": session_id, **_rounded(session or {"queries": 0, **_empty_totals()})}
+
+            queries = self.queries
+            return {
+                "queries": queries,
+                "total": _rounded(self.total),
+                "average_cost_per_query": round(self.total["cost_usd"] / queries, 8) if queries else 0.0,
+                "by_stage": {k: _rounded(v) for k, v in self.by_stage.items()},
+                "by_model": {k: _rounded(v) for k, v in self.by_model.items()},
+                "by_scenario": {k: _rounded(v) for k, v in sorted(self.by_scenario.items())},
+                "sessions": len(self.by_session),
+                "top_sessions": [
+                    {"session_id": k, **_rounded(v)}
+                    for k, v in sorted(self.by_session.items(), key=lambda item: -item[1]["cost_usd"])[:10]
+                ]
+            }
+
+    def clear(self):
+        """清空統計"""
+        with self._lock:
+            self.queries = 0
+            self.total = _empty_totals()
+            self.by_stage: Dict[str, Dict] = {}
+            self.by_model: Dict[str, Dict] = {}
+            self.by_scenario: Dict[str, Dict] = {}
+            self.by_session: "OrderedDict[str, Dict]" = OrderedDict()
+
+
+# 全局用量統計
+_tracker: Optional[UsageTracker] = None
+
+
+def get_usage_tracker() -> UsageTracker:
+    """獲取全局用量統計"""
+    global _tracker
+    if _tracker is None:
+        _tracker = UsageTracker()
+    return _tracker
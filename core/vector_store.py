@@ -2,13 +2,16 @@
 向量儲存模組
 負責生成、儲存和載入文件的向量表示
 """
+import asyncio
 import os
 import pickle
 import json
 from typing import List, Dict, Optional
 import numpy as np
 from openai import OpenAI
-from config import get_shared_client
+from config import Config, get_shared_async_client
+from .circuit_breaker import CircuitOpenError, get_breaker
+from .tracer import record_usage, trace_span
 
 
 class VectorStore:
@@ -27,6 +30,9 @@ class VectorStore:
         self.use_local = use_local
         self.vectors: Dict[str, dict] = {}
         
+        # 上游斷路器（僅 OpenAI API 模式使用）
+        self.breaker = get_breaker("embedding")
+        
         if use_local:
             # 使用本地模型（fastembed - 輕量級）
             try:
@@ -40,11 +46,11 @@ class VectorStore:
                 print(f"⚠️  本地模型載入失敗: {e}")
                 print("⚠️  切換到 OpenAI API")
                 self.use_local = False
-                self.client = get_shared_client(api_key)
+                self.client = get_shared_async_client(api_key)
                 self.embedding_model = "text-embedding-3-small"
         else:
             # 使用 OpenAI API
-            self.client = get_shared_client(api_key)
+            self.client = get_shared_async_client(api_key)
             self.embedding_model = "text-embedding-3-small"
     
     async def create_embedding(self, text: str) -> List[float]:
@@ -56,20 +62,40 @@ class VectorStore:
             
         Returns:
             向量列表
+            
+        Raises:
+            CircuitOpenError: OpenAI 模式下斷路器開啟時立即拋出
         """
         import time
         t_start = time.perf_counter()
         
         if self.use_local:
             # 使用本地模型（fastembed）
-            embeddings = list(self.local_model.embed([text]))
-            result = embeddings[0].tolist()
+            # 推論在執行緒中進行，不阻塞事件迴圈
+            with trace_span("本地 Embedding", model="fastembed"):
+                embeddings = await asyncio.to_thread(lambda: list(self.local_model.embed([text])))
+                result = embeddings[0].tolist()
         else:
             # 使用 OpenAI API
-            response = self.client.embeddings.create(
-                model=self.embedding_model,
-                input=text
-            )
+            if not self.breaker.allow_request():
+                self._last_embedding_time = 0.0
+                raise CircuitOpenError(self.breaker.name)
+            with trace_span("Embedding API 調用", model=self.embedding_model, upstream=True) as span:
+                try:
+                    response = await self.client.embeddings.create(
+                        model=self.embedding_model,
+                        input=text,
+                        timeout=Config.UPSTREAM_TIMEOUT
+                    )
+                except asyncio.CancelledError:
+                    # 呼叫端取消（例如客戶端斷線）不代表上游故障：只釋放探測名額
+                    self.breaker.release()
+                    raise
+                except Exception:
+                    self.breaker.record_failure()
+                    raise
+                self.breaker.record_success()
+                record_usage(span, response)
             result = response.data[0].embedding
         
         t_end = time.perf_counter()
@@ -136,13 +162,14 @@ class VectorStore:
         print(f"✅ 已載入 {len(self.vectors)} 個向量")
         return True
     
-    def export_to_json(self, json_path: str = "vectors.json"):
+    def export_to_json(self, json_path: str = None):
         """
         導出向量為 JSON 格式（不包含實際向量，僅元數據）
         
         Args:
-            json_path: JSON 文件路徑
+            json_path: JSON 文件路徑（默認與向量儲存同目錄、同名的 .json）
         """
+        json_path = json_path or os.path.splitext(self.storage_path)[0] + ".json"
         export_data = {}
         for doc_id, data in self.vectors.items():
             export_data[doc_id] = {
@@ -6,19 +6,28 @@
 """
 import asyncio
 import os
+import random
 import time
+import weakref
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import AsyncIterator, Dict, List, Optional, Tuple
 from pathlib import Path
 from openai import OpenAI
 
 from core.vector_store import VectorStore
 from core.rag_module import RAGRetriever, RAGCache
 from core.scenario_classifier import ScenarioClassifier
-from core.ontology_manager import OntologyManager
-from core.history_manager import HistoryManager
-from core.timer_utils import Timer
-from config import Config, get_shared_client
+from core.knowledge_graph import get_knowledge_graph
+from core.history_manager import get_history_manager
+from core.timer_utils import Timer, TimerReport
+from core.metrics import get_metrics, record_trace
+from core.tracer import Tracer, trace_span, use_span, use_tracer, write_chrome_trace
+from core.circuit_breaker import CircuitOpenError, get_breaker
+from core.session_store import SessionState, create_session_store
+from core.token_stats import TokenStreamStats, span_token_stats
+from core.usage_tracker import get_usage_tracker, summarize_trace
+from core.profiler import ProfilerBusy, RequestProfile, choose_profile_mode
+from config import Config, get_shared_client, get_shared_async_client
 
 
 class ResponsesRAGSystem:
@@ -34,20 +43,28 @@ class ResponsesRAGSystem:
         self.api_key = api_key
         # 使用共享的 OpenAI client
         self.client = get_shared_client(api_key)
+        # 最終回合流式生成使用非同步 client（不阻塞事件迴圈，可隨時取消）
+        self.async_client = get_shared_async_client(api_key)
         
         # 初始化各模組
-        self.vector_store = VectorStore(api_key=api_key)
+        self.vector_store = VectorStore(storage_path=Config.VECTOR_STORAGE_PATH, api_key=api_key)
         self.rag_retriever = RAGRetriever(self.vector_store)
         self.rag_cache = RAGCache()
         self.scenario_classifier = ScenarioClassifier(api_key=api_key)
-        self.ontology_manager = OntologyManager()
-        self.history_manager = HistoryManager()
+        self.knowledge_graph = get_knowledge_graph()
+        self.history_manager = get_history_manager()
         
-        # 計時器
-        self.timer = Timer()
+        # 會話狀態（每個 session id 各自的重複性視窗與向量快取）
+        self.session_store = create_session_store()
+        # 每個會話一把鎖，序列化同一會話的「讀取 → 更新重複性視窗 → 寫回」；
+        # 沒有請求持有時自動回收。跨 worker（SQLite 後端）不在此序列化範圍內，仍為後寫者勝出
+        self._session_locks: "weakref.WeakValueDictionary[str, asyncio.Lock]" = weakref.WeakValueDictionary()
+        
+        # 最終生成的上游斷路器
+        self.generation_breaker = get_breaker("final_generation")
         
-        # 將計時器注入到 scenario_classifier
-        self.scenario_classifier.set_timer(self.timer)
+        # 啟動階段計時器（向量化等）；每個查詢另建獨立追蹤器，經 contextvars 傳給各分支
+        self.timer = Timer()
         
         print("🚀 RAG 系統已初始化（K, C, R 三維度分類）")
     
@@ -99,12 +116,13 @@ class ResponsesRAGSystem:
         
         self.timer.stop_stage("向量化")
     
-    async def main_thread_rag(self, query: str) -> Dict:
+    async def main_thread_rag(self, query: str, session: Optional[SessionState] = None) -> Dict:
         """
         主線（Thread 1）：RAG 檢索（不生成草稿）
         
         Args:
             query: 用戶查詢
+            session: 會話狀態（可選，提供查詢向量快取）
             
         Returns:
             RAG 檢索結果
@@ -112,27 +130,40 @@ class ResponsesRAGSystem:
         import time
         t_start = time.perf_counter()
         
-        self.timer.start_stage("RAG檢索", thread='A')
-        
-        # RAG 檢索
-        retrieved_docs = await self.rag_retriever.retrieve(query, top_k=3)
-        context = self.rag_retriever.format_context(retrieved_docs)
-        matched_doc_ids = self.rag_retriever.get_matched_doc_ids(retrieved_docs)
-        
-        # 提取知識點
-        knowledge_points = []
-        for doc_id in matched_doc_ids:
-            if doc_id in Config.KNOWLEDGE_POINTS:
-                knowledge_points.append(Config.KNOWLEDGE_POINTS[doc_id])
-        
-        self.timer.stop_stage("RAG檢索", thread='A')
+        with trace_span("RAG檢索", thread='A', top_k=3) as span:
+            # RAG 檢索（Embedding 上游不可用時返回空結果）
+            try:
+                retrieved_docs = await self.rag_retriever.retrieve(
+                    query,
+                    top_k=3,
+                    embedding_cache=session.embedding_cache if session else None
+                )
+            except CircuitOpenError:
+                retrieved_docs = []
+                span.set_attribute("fallback", True)
+            except Exception as e:
+                print(f"⚠️  RAG 檢索失敗，改用空檢索結果: {e}")
+                retrieved_docs = []
+                span.set_attribute("fallback", True)
+            context = self.rag_retriever.format_context(retrieved_docs)
+            matched_doc_ids = self.rag_retriever.get_matched_doc_ids(retrieved_docs)
+            
+            # 提取知識點
+            knowledge_points = []
+            for doc_id in matched_doc_ids:
+                if doc_id in Config.KNOWLEDGE_POINTS:
+                    knowledge_points.append(Config.KNOWLEDGE_POINTS[doc_id])
+            
+            # 獲取 RAG 內部計時
+            rag_timing = getattr(self.rag_retriever, '_last_timing', {})
+            span.set_attributes(
+                doc_count=len(matched_doc_ids),
+                cache_hit=rag_timing.get("embedding_cache_hit", False)
+            )
         
         t_end = time.perf_counter()
         rag_total_time = t_end - t_start
         
-        # 獲取 RAG 內部計時
-        rag_timing = getattr(self.rag_retriever, '_last_timing', {})
-        
         return {
             "context": context,
             "matched_docs": matched_doc_ids,
@@ -141,10 +172,33 @@ class ResponsesRAGSystem:
             "timing": {
                 "total": rag_total_time,
                 "embedding_api": rag_timing.get("embedding_api", 0),
-                "similarity_calc": rag_timing.get("similarity_calc", 0)
+                "similarity_calc": rag_timing.get("similarity_calc", 0),
+                "embedding_cache_hit": rag_timing.get("embedding_cache_hit", False)
             }
         }
     
+    async def _detect_with_fallback(self, coro, name: str):
+        """
+        執行單一維度檢測，斷路器開啟或調用失敗時返回 None（交由本地降級）
+        
+        Args:
+            coro: 檢測協程
+            name: 檢測名稱（用於日誌）
+            
+        Returns:
+            檢測結果，或 None 表示需使用本地降級結果
+        """
+        with trace_span(name) as span:
+            try:
+                return await coro
+            except CircuitOpenError:
+                span.set_attribute("fallback", True)
+                return None
+            except Exception as e:
+                print(f"⚠️  {name}失敗，改用本地降級結果: {e}")
+                span.set_attribute("fallback", True)
+                return None
+    
     async def parallel_dimension_classification(self, query: str, matched_docs: List[str]) -> Dict:
         """
         並行執行 K/C/R 三維度判定
@@ -161,14 +215,9 @@ class ResponsesRAGSystem:
         
         return result
     
-    async def final_round_generate(
-        self, 
-        rag_result: Dict, 
-        scenario_result: Dict, 
-        query: str
-    ) -> str:
+    def _build_final_prompt(self, rag_result: Dict, scenario_result: Dict, query: str) -> str:
         """
-        最終回合：簡單告訴 AI 當前情境，結合 RAG + 本體論生成答案
+        構建最終回合提示詞（當前情境 + RAG + 知識點關係）
         
         Args:
             rag_result: 主線的 RAG 結果
@@ -176,26 +225,22 @@ class ResponsesRAGSystem:
             query: 用戶問題
             
         Returns:
-            最終答案
+            最終提示詞
         """
-        print("\n【最終回合】整合 RAG + 本體論生成答案...")
-        
         # 提取結果
         context = rag_result['context']
         knowledge_points = rag_result['knowledge_points']
         
         scenario_number = scenario_result['scenario_number']
-        dimensions = scenario_result['dimensions']
         
         # 獲取情境提示詞
         scenario_prompt = scenario_result.get('prompt', '')
-        scenario_label = scenario_result.get('label', '')
         
-        # 載入本體論
-        ontology_content = self.ontology_manager.get_ontology_content()
+        # 知識圖譜中與匹配知識點相關的結構化關係
+        relations_context = self.knowledge_graph.get_context_for_prompt(knowledge_points)
         
         # 構建最終提示詞（加入當前情境編號 + 測試說明）
-        final_prompt = f"""
+        return f"""
         【當前是第 {scenario_number} 種情境】
 
         {scenario_prompt}
@@ -203,8 +248,8 @@ class ResponsesRAGSystem:
         【RAG 檢索到的教材片段】
         {context}
 
-        【知識本體論】
-        {ontology_content}
+        【知識點關係】
+        {relations_context}
 
         【匹配的知識點】
         {', '.join(knowledge_points) if knowledge_points else '無'}
@@ -214,175 +259,386 @@ class ResponsesRAGSystem:
 
         ⚠️ 注意：這是測試環境，請將回答控制在約 100 字左右，以便測試系統響應時間。請根據教材內容簡潔回答問題。
         """
+    
+    async def stream_final_answer(
+        self,
+        rag_result: Dict,
+        scenario_result: Dict,
+        query: str,
+        stats: Optional[TokenStreamStats] = None
+    ) -> AsyncIterator[str]:
+        """
+        最終回合（流式）：逐段產出答案內容
         
-        print(f"【最終回合】情境 {scenario_number}：{scenario_label}")
-        print(f"【最終回合】提示：{scenario_prompt}")
-        
-        # 使用 Responses API 生成最終答案（流式）
-        response = self.client.chat.completions.create(
-            model=Config.LLM_MODEL,
-            messages=[
-                {"role": "system", "content": "你是專業知識助手。"},
-                {"role": "user", "content": final_prompt}
-            ],
-            temperature=Config.LLM_TEMPERATURE,
-            max_tokens=Config.LLM_FINAL_MAX_TOKENS,  # 使用配置中的最大 token 數
-            stream=True
-        )
+        上游不可用時產出一次本地降級答案；呼叫端提前關閉生成器時會一併關閉上游串流
         
-        print("\n💬 生成最終答案（流式輸出）...")
-        print("-" * 60)
+        Args:
+            rag_result: 主線的 RAG 結果
+            scenario_result: 分支的情境判定結果
+            query: 用戶問題
+            stats: token 串流統計（記錄 TTFT、token 間隔與 usage，可選）
+            
+        Yields:
+            答案片段（token delta）
+        """
+        final_prompt = self._build_final_prompt(rag_result, scenario_result, query)
+        stats = stats or TokenStreamStats()
+        stats.on_prompt(final_prompt)
+        
+        if not self.generation_breaker.allow_request():
+            yield self._get_fallback_answer(rag_result)
+            return
         
-        final_answer = ""
-        for chunk in response:
-            if chunk.choices[0].delta.content:
-                content = chunk.choices[0].delta.content
-                print(content, end="", flush=True)
-                final_answer += content
+        extra_options = {}
+        if Config.STREAM_INCLUDE_USAGE:
+            extra_options["stream_options"] = {"include_usage": True}
+        
+        try:
+            response = await self.async_client.chat.completions.create(
+                model=Config.LLM_MODEL,
+                messages=[
+                    {"role": "system", "content": "你是專業知識助手。"},
+                    {"role": "user", "content": final_prompt}
+                ],
+                temperature=Config.LLM_TEMPERATURE,
+                max_tokens=Config.LLM_FINAL_MAX_TOKENS,  # 使用配置中的最大 token 數
+                stream=True,
+                timeout=Config.UPSTREAM_TIMEOUT,
+                **extra_options
+            )
+        except asyncio.CancelledError:
+            # 等待上游回應時被取消（客戶端斷線）：釋放探測名額
+            self.generation_breaker.release()
+            raise
+        except Exception as e:
+            self.generation_breaker.record_failure()
+            print(f"❌ 最終生成失敗，返回本地降級答案: {e}")
+            yield self._get_fallback_answer(rag_result)
+            return
         
-        print("\n" + "-" * 60)
+        received = False
+        try:
+            async for chunk in response:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    received = True
+                    stats.on_token(chunk.choices[0].delta.content)
+                    yield chunk.choices[0].delta.content
+                elif getattr(chunk, "usage", None):
+                    # include_usage 時最後一個 chunk 只帶 usage（choices 為空）
+                    stats.on_usage(chunk.usage)
+        except (GeneratorExit, asyncio.CancelledError):
+            # 呼叫端取消不代表上游故障
+            self.generation_breaker.release()
+            raise
+        except Exception as e:
+            self.generation_breaker.record_failure()
+            print(f"❌ 最終生成串流中斷: {e}")
+            if not received:
+                yield self._get_fallback_answer(rag_result)
+            return
+        finally:
+            # 呼叫端提前關閉（例如客戶端斷線）時，取消上游生成
+            await response.close()
         
-        return final_answer
+        self.generation_breaker.record_success()
     
-    async def process_query(self, query: str) -> Dict:
+    async def final_round_generate(
+        self, 
+        rag_result: Dict, 
+        scenario_result: Dict, 
+        query: str
+    ) -> str:
         """
-        處理查詢（3 個獨立並行執行緒 + 最終生成）
+        最終回合：簡單告訴 AI 當前情境，結合 RAG + 本體論生成答案
+        
+        Args:
+            rag_result: 主線的 RAG 結果
+            scenario_result: 分支的情境判定結果
+            query: 用戶問題
+            
+        Returns:
+            最終答案
+        """
+        chunks = []
+        async for delta in self.stream_final_answer(rag_result, scenario_result, query):
+            chunks.append(delta)
+        return "".join(chunks)
+    
+    def _get_fallback_answer(self, rag_result: Dict) -> str:
+        """
+        上游不可用時的本地降級答案（直接提供檢索到的教材片段）
+        
+        Args:
+            rag_result: 主線的 RAG 結果
+            
+        Returns:
+            降級答案文本
+        """
+        knowledge_points = rag_result.get('knowledge_points', [])
+        if not rag_result.get('retrieved_docs'):
+            return "抱歉，答案生成服務暫時無法使用，請稍後再試。"
+        
+        return (
+            "抱歉，答案生成服務暫時無法使用。以下是與您問題相關的教材內容"
+            f"（{', '.join(knowledge_points) if knowledge_points else '相關文件'}）：\n\n"
+            f"{rag_result['context']}"
+        )
+    
+    async def process_query_stream(
+        self,
+        query: str,
+        session: Optional[SessionState] = None,
+        export_trace: bool = False,
+        profile: Optional[str] = None
+    ) -> AsyncIterator[Dict]:
+        """
+        處理查詢（流式事件版本）
         
         第一回合：並行執行 3 個 API
           - Thread 1: RAG Embedding
           - Thread 2: C 值檢測
           - Thread 3: 知識點檢測
-        第二回合：整合結果，生成最終答案
+        第二回合：整合結果，流式生成最終答案
+        
+        依序產出的事件：
+          - {"type": "retrieval", ...}    RAG 檢索完成
+          - {"type": "first_round", ...}  第一回合（C 值、知識點）完成
+          - {"type": "scenario", ...}     情境判定完成
+          - {"type": "delta", "content"}  每個答案片段
+          - {"type": "done", "result"}    完整結果（與 process_query 返回值相同）
         
         Args:
             query: 用戶查詢
+            session: 會話狀態（可選；未提供時使用預設會話）
+            export_trace: 是否寫出本次查詢的 Chrome trace-event 檔案（另見 Config.TRACE_SAMPLE_RATE）
+            profile: 剖析模式（"cprofile" / "sample"，另見 Config.PROFILE_SAMPLE_RATE）；
+                結果的 profile_id 可在 /admin/profiles 查看
             
-        Returns:
-            處理結果
+        Yields:
+            事件字典
         """
-        print(f"\n{'='*70}")
-        print(f"📥 收到查詢: {query}")
-        print(f"{'='*70}")
-        
-        # 第一回合：並行執行 3 個獨立 API
-        self.timer.start_stage("並行處理")
+        metrics = get_metrics()
+        metrics.add_gauge("rag_inflight_requests", 1)
+        request_profile = self._start_profile(profile, query)
+        events = self._run_query_stream(query, session, export_trace)
+        try:
+            async for event in events:
+                if event["type"] == "done" and request_profile is not None:
+                    result = event["result"]
+                    result["profile_id"] = request_profile.stop(result["trace"]["trace_id"]).profile_id
+                    request_profile = None
+                yield event
+        finally:
+            # 呼叫端提前關閉時一併關閉內部生成器（取消未完成的分支與上游串流）
+            await events.aclose()
+            if request_profile is not None:
+                request_profile.stop()
+            metrics.add_gauge("rag_inflight_requests", -1)
+    
+    def _session_lock(self, session_id: str) -> asyncio.Lock:
+        """獲取會話的更新鎖（不存在時建立）"""
+        lock = self._session_locks.get(session_id)
+        if lock is None:
+            lock = self._session_locks[session_id] = asyncio.Lock()
+        return lock
+    
+    async def _record_turn(self, session_id: str, knowledge_points: List[str]) -> Tuple[SessionState, int]:
+        """
+        計算 R 值並記錄本輪知識點（同一會話的並發請求依序進行）
         
-        import time
+        在鎖內重新讀取會話：其他請求可能在本次等待上游時已寫回，沿用請求開始時的狀態會覆蓋其更新
         
-        # 記錄開始時間
-        t_parallel_start = time.perf_counter()
+        Args:
+            session_id: 會話 ID
+            knowledge_points: 本輪知識點
+            
+        Returns:
+            (更新後的會話狀態, R 值)
+        """
+        async with self._session_lock(session_id):
+            session = await self.session_store.get_async(session_id)
+            r_value = session.repetition_checker.check_and_update(knowledge_points)
+            session.record_turn(knowledge_points)
+            await self.session_store.save_async(session)
+        return session, r_value
+    
+    def _start_profile(self, requested: Optional[str], query: str) -> Optional[RequestProfile]:
+        """
+        依要求或取樣率開始剖析本次請求
         
-        # 3 個獨立的執行緒
-        rag_task = self.main_thread_rag(query)  # Thread 1: RAG
+        Args:
+            requested: 呼叫端要求的剖析模式（None 表示未要求）
+            query: 用戶查詢
+            
+        Returns:
+            RequestProfile，不剖析（或確定性剖析忙碌）時為 None
+        """
+        mode = choose_profile_mode(requested)
+        if mode is None:
+            return None
+        inflight = int(get_metrics().get_gauge("rag_inflight_requests"))
+        try:
+            return RequestProfile(mode, query, concurrent_requests=max(inflight - 1, 0)).start()
+        except ProfilerBusy:
+            print("⚠️  已有其他確定性剖析進行中，本次請求不剖析")
+            return None
+    
+    async def _run_query_stream(
+        self,
+        query: str,
+        session: Optional[SessionState],
+        export_trace: bool
+    ) -> AsyncIterator[Dict]:
+        """process_query_stream 的實際處理流程（見其說明）"""
+        if session is None:
+            session = await self.session_store.get_async(Config.DEFAULT_SESSION_ID)
+        
+        # 本次請求獨立的追蹤器（並發請求互不干擾）
+        # 生成器可能在其他 context 中被關閉，這裡只以 start_span / end 記錄，不跨 yield 持有 context
+        tracer = Tracer("query")
+        root_span = tracer.start_span("總流程", session_id=session.session_id)
         
-        t_c_start = time.perf_counter()
-        c_task = self.scenario_classifier.dimension_classifier.correctness_detector.detect(query)  # Thread 2: C值
+        # 第一回合：並行執行 3 個獨立 API
+        parallel_span = tracer.start_span("並行處理", parent=root_span)
         
-        t_k_start = time.perf_counter()
-        knowledge_task = self.scenario_classifier.dimension_classifier.knowledge_detector.detect(query)  # Thread 3: 知識點
+        t_parallel_start = time.perf_counter()
         
-        # 等待 3 個任務都完成
-        rag_result, c_value, knowledge_points = await asyncio.gather(
-            rag_task,
-            c_task,
-            knowledge_task
-        )
+        detectors = self.scenario_classifier.dimension_classifier
+        
+        # 3 個獨立的執行緒（任務建立時繼承本次請求的追蹤器，並以「並行處理」為父節點）
+        with use_tracer(tracer), use_span(parallel_span):
+            rag_task = asyncio.ensure_future(self.main_thread_rag(query, session))  # Thread 1: RAG
+            c_task = asyncio.ensure_future(self._detect_with_fallback(
+                detectors.correctness_detector.detect(query), "C值檢測"
+            ))  # Thread 2: C值
+            knowledge_task = asyncio.ensure_future(self._detect_with_fallback(
+                detectors.knowledge_detector.detect(query), "知識點檢測"
+            ))  # Thread 3: 知識點
+        
+        try:
+            rag_result = await rag_task
+            yield {
+                "type": "retrieval",
+                "matched_docs": rag_result['matched_docs'],
+                "knowledge_points": rag_result['knowledge_points'],
+                "timing": rag_result['timing']
+            }
+            
+            # 等待另外 2 個任務完成
+            c_value, knowledge_points = await asyncio.gather(c_task, knowledge_task)
+        finally:
+            # 呼叫端提前關閉時，取消尚未完成的分支
+            for task in (rag_task, c_task, knowledge_task):
+                if not task.done():
+                    task.cancel()
+        # 並行分支到此全部完成；之後的本地計算與整合是循序階段，不屬於並行群組
+        parallel_span.end()
         
         t_parallel_end = time.perf_counter()
         parallel_total_time = t_parallel_end - t_parallel_start
+        c_timing = tracer.find_span("C值檢測").duration
+        k_timing = tracer.find_span("知識點檢測").duration
+        
+        # 上游不可用時的本地降級：C 預設正確，知識點改由 RAG 匹配文件推得
+        fallbacks = []
+        if c_value is None:
+            c_value = 0
+            fallbacks.append("C")
+        if knowledge_points is None:
+            knowledge_points = list(rag_result['knowledge_points'])
+            fallbacks.append("K")
+        
+        yield {
+            "type": "first_round",
+            "C": c_value,
+            "knowledge_points": knowledge_points,
+            "fallbacks": fallbacks,
+            "parallel_total": parallel_total_time
+        }
         
         # 本地計算 K 值和 R 值（不需要 API）
-        t_local_start = time.perf_counter()
-        k_value = self.scenario_classifier.dimension_classifier.knowledge_detector.calculate_k_value(knowledge_points)
-        r_value = self.scenario_classifier.dimension_classifier.repetition_checker.check_and_update(knowledge_points)
-        
-        # 計算情境編號
-        scenario_number = self.scenario_classifier.dimension_classifier.scenario_calculator.calculate(k_value, c_value, r_value)
-        t_local_end = time.perf_counter()
-        local_calc_time = t_local_end - t_local_start
-        
-        # 記錄情境計算完成時間點
-        t_scenario_calc_done = time.perf_counter()
-        
-        # 打印維度分類結果
-        print(f"\n🔍 維度分類結果：")
-        print(f"  K (知識點數量): {k_value} ({['零個', '一個', '多個'][k_value]})")
-        print(f"  C (正確性): {c_value} ({['正確', '不正確'][c_value]})")
-        print(f"  R (重複性): {r_value} ({['正常', '重複'][r_value]})")
-        print(f"  知識點: {knowledge_points if knowledge_points else '無'}")
-        print(f"✅ 計算得出情境編號：{scenario_number}")
-        
-        # 獲取情境詳細信息
-        scenario = self.scenario_classifier.get_scenario_by_number(scenario_number)
+        with tracer.span("本地計算", parent=root_span) as local_span:
+            k_value = detectors.knowledge_detector.calculate_k_value(knowledge_points)
+            session, r_value = await self._record_turn(session.session_id, knowledge_points)
+            
+            # 計算情境編號
+            scenario_number = detectors.scenario_calculator.calculate(k_value, c_value, r_value)
+            local_span.set_attributes(K=k_value, C=c_value, R=r_value, scenario_number=scenario_number)
+        root_span.set_attribute("scenario_number", scenario_number)
+        local_calc_time = local_span.duration
+        
+        with tracer.span("結果整合", parent=root_span) as integration_span:
+            # 獲取情境詳細信息
+            scenario = self.scenario_classifier.get_scenario_by_number(scenario_number)
+            
+            # 構建 scenario_result
+            scenario_result = {
+                "scenario_number": scenario_number,
+                "dimensions": {
+                    "K": k_value,
+                    "C": c_value,
+                    "R": r_value
+                },
+                "knowledge_points": knowledge_points,
+                "label": scenario.get('label', '') if scenario else '',
+                "role": scenario.get('role', '') if scenario else '',
+                "prompt": scenario.get('prompt', '') if scenario else ''
+            }
+        integration_time = integration_span.duration
         
-        # 構建 scenario_result
-        scenario_result = {
+        yield {
+            "type": "scenario",
             "scenario_number": scenario_number,
-            "dimensions": {
-                "K": k_value,
-                "C": c_value,
-                "R": r_value
-            },
-            "knowledge_points": knowledge_points,
-            "label": scenario.get('label', '') if scenario else '',
-            "role": scenario.get('role', '') if scenario else '',
-            "prompt": scenario.get('prompt', '') if scenario else ''
+            "label": scenario_result['label'],
+            "role": scenario_result['role'],
+            "dimensions": scenario_result['dimensions'],
+            "knowledge_points": knowledge_points
         }
         
-        # 記錄整合準備完成時間
-        t_integration_done = time.perf_counter()
-        integration_time = t_integration_done - t_scenario_calc_done
-        
-        self.timer.stop_stage("並行處理")
-        
         # 收集所有計時信息
         rag_timing = rag_result.get("timing", {})
-        c_timing = getattr(self.scenario_classifier.dimension_classifier.correctness_detector, '_last_timing', 0)
-        k_timing = getattr(self.scenario_classifier.dimension_classifier.knowledge_detector, '_last_timing', 0)
         
-        # 第二回合：生成答案
-        self.timer.start_stage("最終回合生成")
+        # 第二回合：流式生成答案（片段收集到列表，最後一次合併）
+        generation_span = tracer.start_span(
+            "最終回合生成", parent=root_span, model=Config.LLM_MODEL, upstream=True
+        )
         t_final_start = time.perf_counter()
         
-        final_answer = await self.final_round_generate(rag_result, scenario_result, query)
+        chunks = []
+        ttft = 0.0
+        stream_stats = TokenStreamStats()
+        answer_stream = self.stream_final_answer(rag_result, scenario_result, query, stats=stream_stats)
+        try:
+            async for delta in answer_stream:
+                if not chunks:
+                    # 首個 token 時間（從收到查詢起算）
+                    ttft = time.perf_counter() - root_span.start_time
+                    generation_span.add_event("first_token", ttft=round(ttft, 6))
+                    root_span.set_attribute("ttft", round(ttft, 6))
+                chunks.append(delta)
+                yield {"type": "delta", "content": delta}
+        finally:
+            await answer_stream.aclose()
+        final_answer = "".join(chunks)
         
         t_final_end = time.perf_counter()
         final_generation_time = t_final_end - t_final_start
         
-        self.timer.stop_stage("最終回合生成")
-        self.timer.stop_stage("總流程")
-        
-        # 打印詳細計時報告（包含並行執行詳情）
-        print(f"\n{'='*70}")
-        print(f"⏱️  詳細時間分析報告（3 個並行執行緒）")
-        print(f"{'='*70}\n")
+        generation_span.set_attributes(**stream_stats.to_attributes())
+        generation_span.end()
+        root_span.end()
         
-        print(f"【並行執行詳情】")
-        print(f"  Thread 1 - RAG 檢索:")
-        print(f"    ├─ Embedding API 調用: {rag_timing.get('embedding_api', 0):.3f}s")
-        print(f"    ├─ 相似度計算: {rag_timing.get('similarity_calc', 0):.3f}s")
-        print(f"    └─ 總耗時: {rag_timing.get('total', 0):.3f}s")
-        print(f"")
-        print(f"  Thread 2 - C 值檢測:")
-        print(f"    └─ API 調用耗時: {c_timing:.3f}s")
-        print(f"")
-        print(f"  Thread 3 - 知識點檢測:")
-        print(f"    └─ API 調用耗時: {k_timing:.3f}s")
-        print(f"")
-        print(f"  本地計算 (K/R 值):")
-        print(f"    └─ 計算耗時: {local_calc_time:.6f}s")
-        print(f"")
-        print(f"  並行執行總時間: {parallel_total_time:.3f}s")
-        print(f"  理論最大時間: {max(rag_timing.get('total', 0), c_timing, k_timing):.3f}s")
-        print(f"  並行效率: {(1 - parallel_total_time / (rag_timing.get('total', 0) + c_timing + k_timing)) * 100:.1f}%")
-        print(f"")
-        print(f"【後處理階段】")
-        print(f"  情境計算 + 結果整合: {integration_time:.3f}s")
-        print(f"  最終答案生成: {final_generation_time:.3f}s")
-        print(f"  後處理總時間: {integration_time + final_generation_time:.3f}s")
-        print(f"\n{'='*70}\n")
+        # 彙總到指標與用量統計（排程到下一輪事件迴圈，不佔用本次請求路徑）
+        usage = summarize_trace(tracer)
+        loop = asyncio.get_running_loop()
+        loop.call_soon(record_trace, tracer)
+        loop.call_soon(get_usage_tracker().record, usage)
         
-        # 舊版時間報告已移除，僅保留上方新版「詳細時間分析報告（3 個並行執行緒）」
+        # 依標頭 / 取樣率 / 慢請求閾值決定是否寫出追蹤檔（寫檔在執行緒中進行，不阻塞事件迴圈）
+        trace_file = None
+        if self._should_export_trace(export_trace, root_span.duration):
+            trace_file = await asyncio.to_thread(write_chrome_trace, tracer, Config.TRACE_OUTPUT_DIR)
+            print(f"🧭 已輸出追蹤檔: {trace_file}")
         
         # 記錄到歷史（簡化版，只記錄基本信息）
         dimensions_dict = {
@@ -395,12 +651,15 @@ class ResponsesRAGSystem:
             query,
             rag_result['matched_docs'],
             dimensions_dict,
-            scenario_result.get('knowledge_points', [])
+            scenario_result.get('knowledge_points', []),
+            session_id=session.session_id
         )
         
         # ============ 返回結果 ============
         result = {
             "query": query,
+            "session_id": session.session_id,
+            "session": session.to_dict(),
             "final_answer": final_answer,
             "scenario_number": scenario_result['scenario_number'],
             "scenario_label": scenario_result.get('label', ''),
@@ -409,11 +668,174 @@ class ResponsesRAGSystem:
             "dimensions": scenario_result['dimensions'],
             "matched_docs": rag_result['matched_docs'],
             "knowledge_points": rag_result['knowledge_points'],
-            "time_report": self.timer.get_report().to_dict()
+            "detected_knowledge_points": knowledge_points,
+            "fallbacks": fallbacks,
+            "timing": {
+                "rag": rag_timing,
+                "c_detection": c_timing,
+                "k_detection": k_timing,
+                "local_calc": local_calc_time,
+                "parallel_total": parallel_total_time,
+                "integration": integration_time,
+                "final_generation": final_generation_time,
+                "ttft": ttft,
+                "tokens": {
+                    "generation": span_token_stats(generation_span),
+                    "c_detection": span_token_stats(tracer.find_span("C值 API 調用（正確性檢測）")),
+                    "k_detection": span_token_stats(tracer.find_span("知識點 API 調用"))
+                }
+            },
+            "usage": usage,
+            "time_report": TimerReport.from_tracer(tracer).to_dict(),
+            "trace": tracer.to_dict(),
+            "trace_file": trace_file
         }
         
+        yield {"type": "done", "result": result}
+    
+    def _should_export_trace(self, requested: bool, total_time: float) -> bool:
+        """
+        判斷是否寫出本次查詢的追蹤檔
+        
+        Args:
+            requested: 呼叫端是否明確要求（例如 X-Trace-Export 標頭）
+            total_time: 本次查詢總耗時（秒）
+            
+        Returns:
+            是否寫出
+        """
+        if requested:
+            return True
+        if Config.TRACE_SLOW_THRESHOLD and total_time >= Config.TRACE_SLOW_THRESHOLD:
+            return True
+        return Config.TRACE_SAMPLE_RATE > 0 and random.random() < Config.TRACE_SAMPLE_RATE
+    
+    async def process_query(
+        self,
+        query: str,
+        session_id: Optional[str] = None,
+        export_trace: bool = False,
+        profile: Optional[str] = None
+    ) -> Dict:
+        """
+        處理查詢（3 個獨立並行執行緒 + 最終生成）
+        
+        消費 process_query_stream 的事件並返回完整結果
+        
+        Args:
+            query: 用戶查詢
+            session_id: 會話 ID（可選；未提供時使用預設會話）
+            export_trace: 是否寫出本次查詢的 Chrome trace-event 檔案
+            profile: 剖析模式（"cprofile" / "sample"，可選）
+            
+        Returns:
+            處理結果
+        """
+        session = await self.session_store.get_async(session_id or Config.DEFAULT_SESSION_ID)
+        
+        print(f"\n{'='*70}")
+        print(f"📥 收到查詢: {query}")
+        print(f"{'='*70}")
+        
+        result = {}
+        async for event in self.process_query_stream(
+            query, session=session, export_trace=export_trace, profile=profile
+        ):
+            if event["type"] == "done":
+                result = event["result"]
+        
+        self.print_dimension_result(result)
+        self.print_timing_report(result["timing"], result["trace"]["analysis"])
+        
         return result
     
+    def print_dimension_result(self, result: Dict):
+        """打印維度分類結果"""
+        dims = result['dimensions']
+        knowledge_points = result.get('detected_knowledge_points', [])
+        
+        if result.get('fallbacks'):
+            print(f"\n⚡ 使用本地降級結果: {', '.join(result['fallbacks'])}")
+        print(f"\n🔍 維度分類結果：")
+        print(f"  K (知識點數量): {dims['K']} ({['零個', '一個', '多個'][dims['K']]})")
+        print(f"  C (正確性): {dims['C']} ({['正確', '不正確'][dims['C']]})")
+        print(f"  R (重複性): {dims['R']} ({['正常', '重複'][dims['R']]})")
+        print(f"  知識點: {knowledge_points if knowledge_points else '無'}")
+        print(f"✅ 計算得出情境編號：{result['scenario_number']}")
+    
+    def print_timing_report(self, timing: Dict, analysis: Optional[Dict] = None):
+        """
+        打印詳細計時報告（包含並行執行詳情）
+        
+        Args:
+            timing: 結果中的 timing 字典
+            analysis: 追蹤分析結果（result["trace"]["analysis"]，提供關鍵路徑與重疊）
+        """
+        rag_timing = timing.get("rag", {})
+        c_timing = timing.get("c_detection", 0)
+        k_timing = timing.get("k_detection", 0)
+        parallel_total_time = timing.get("parallel_total", 0)
+        integration_time = timing.get("integration", 0)
+        final_generation_time = timing.get("final_generation", 0)
+        
+        print(f"\n{'='*70}")
+        print(f"⏱️  詳細時間分析報告（3 個並行執行緒）")
+        print(f"{'='*70}\n")
+        
+        print(f"【並行執行詳情】")
+        print(f"  Thread 1 - RAG 檢索:")
+        print(f"    ├─ Embedding API 調用: {rag_timing.get('embedding_api', 0):.3f}s")
+        print(f"    ├─ 相似度計算: {rag_timing.get('similarity_calc', 0):.3f}s")
+        print(f"    └─ 總耗時: {rag_timing.get('total', 0):.3f}s")
+        print(f"")
+        print(f"  Thread 2 - C 值檢測:")
+        print(f"    └─ API 調用耗時: {c_timing:.3f}s")
+        print(f"")
+        print(f"  Thread 3 - 知識點檢測:")
+        print(f"    └─ API 調用耗時: {k_timing:.3f}s")
+        print(f"")
+        print(f"  本地計算 (K/R 值):")
+        print(f"    └─ 計算耗時: {timing.get('local_calc', 0):.6f}s")
+        print(f"")
+        print(f"  並行執行總時間: {parallel_total_time:.3f}s")
+        print(f"")
+        print(f"【後處理階段】")
+        print(f"  情境計算 + 結果整合: {integration_time:.3f}s")
+        print(f"  最終答案生成: {final_generation_time:.3f}s")
+        print(f"  首個 token 時間 (TTFT): {timing.get('ttft', 0):.3f}s")
+        print(f"  後處理總時間: {integration_time + final_generation_time:.3f}s")
+        
+        tokens = timing.get("tokens", {})
+        if tokens:
+            print(f"")
+            print(f"【Token 統計】")
+            labels = {"generation": "最終生成", "c_detection": "C 值檢測", "k_detection": "知識點檢測"}
+            for key, label in labels.items():
+                stats = tokens.get(key) or {}
+                if "completion_tokens" not in stats:
+                    continue
+                estimated = "（估算）" if stats.get("usage_estimated") else ""
+                print(f"  {label}: prompt {stats.get('prompt_tokens', 0)} / completion {stats['completion_tokens']}{estimated}，"
+                      f"{stats.get('tokens_per_second', 0):.1f} tokens/s")
+                if "gap_mean" in stats:
+                    print(f"    └─ 上游 TTFT {stats['ttft_generation']:.3f}s，token 間隔 平均 {stats['gap_mean'] * 1000:.1f}ms / "
+                          f"p95 {stats['gap_p95'] * 1000:.1f}ms / 最大 {stats['gap_max'] * 1000:.1f}ms")
+        
+        if analysis:
+            print(f"")
+            print(f"【並行分析（由追蹤資料計算）】")
+            for group in analysis.get("overlap", []):
+                print(f"  {group['span']}（{len(group['children'])} 個子階段）:")
+                print(f"    ├─ 子階段耗時總和: {group['sum']:.3f}s")
+                print(f"    ├─ 實際佔用時間: {group['union']:.3f}s（最長子階段 {group['longest_child']:.3f}s）")
+                print(f"    └─ 並行度: {group['concurrency']:.2f}x，並行效率: {group['parallel_efficiency'] * 100:.1f}%")
+            path = " → ".join(
+                f"{step['name']} ({step['duration']:.3f}s)" for step in analysis.get("critical_path", [])
+            )
+            print(f"  關鍵路徑: {path}")
+            print(f"  關鍵路徑耗時: {analysis['critical_path_time']:.3f}s / 總耗時 {analysis['wall_time']:.3f}s")
+        print(f"\n{'='*70}\n")
+    
     def print_summary(self, result: Dict):
         """打印結果摘要"""
         print("\n" + "="*70)
@@ -458,6 +880,15 @@ class ResponsesRAGSystem:
             print(f"      {'支線小計':30s}: {time_report['thread_b']['total_time']:6.3f}s")
         
         print(f"\n  🎯 總計時間: {time_report['total_time']:.3f}s")
+        
+        usage = result.get('usage')
+        if usage:
+            total = usage['total']
+            print(f"\n💰 Token 用量：prompt {total['prompt_tokens']} / completion {total['completion_tokens']}，"
+                  f"成本 ${total['cost_usd']:.6f}（{total['calls']} 次上游調用）")
+            for stage, stage_usage in usage['stages'].items():
+                print(f"   {stage:30s}: {stage_usage['prompt_tokens'] + stage_usage['completion_tokens']:6d} tokens  "
+                      f"${stage_usage['cost_usd']:.6f}")
         print("="*70)
 
 
@@ -480,7 +911,24 @@ async def main():
     ]
     
     for query in test_queries:
-        result = await system.process_query(query)
+        print(f"\n{'='*70}")
+        print(f"📥 收到查詢: {query}")
+        print(f"{'='*70}")
+        
+        result = {}
+        async for event in system.process_query_stream(query):
+            if event["type"] == "scenario":
+                print(f"\n【最終回合】情境 {event['scenario_number']}：{event['label']}")
+                print("\n💬 生成最終答案（流式輸出）...")
+                print("-" * 60)
+            elif event["type"] == "delta":
+                print(event["content"], end="", flush=True)
+            elif event["type"] == "done":
+                print("\n" + "-" * 60)
+                result = event["result"]
+        
+        system.print_dimension_result(result)
+        system.print_timing_report(result["timing"], result["trace"]["analysis"])
         system.print_summary(result)
         print("\n")
 
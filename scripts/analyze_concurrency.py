@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+第一回合並行度分析工具
+對模擬上游執行 N 個查詢，以追蹤資料中各分支實際的起訖時間戳計算：
+- 重疊率：(分支耗時總和 - 聯集長度) / (分支耗時總和 - 最長分支)
+  1.0 表示完全並行（聯集 = 最長分支），0.0 表示完全串行（聯集 = 總和）
+- 關鍵分支：最晚結束、決定第一回合耗時的分支
+- 閒置間隙：第一回合時間窗內沒有任何分支在執行的時間
+- 串行化的分支組合：兩個分支幾乎沒有重疊（通常是協程內的同步調用阻塞了事件迴圈）
+
+以下情況以非零狀態碼結束，可作為並行度的回歸檢查：
+- 重疊率中位數低於門檻
+- 出現串行化分支的查詢比例超過上限（事件迴圈被阻塞時，等待中的非同步分支會被拉長而「覆蓋」
+  其他分支，重疊率看起來仍然很高，只有逐對檢查才看得出串行）
+
+使用方式：
+    python scripts/analyze_concurrency.py --queries 20 --latency uniform:0.05,0.3
+    python scripts/analyze_concurrency.py --min-overlap 0.8 --output results/concurrency.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import statistics
+import sys
+from collections import Counter
+from typing import Dict, List, Sequence
+
+# 添加父目錄到路徑，以便導入 config 與 scripts 套件
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from scripts.mock_openai_server import MockSettings
+from scripts.offline_system import OfflineSystem, quiet
+
+# 第一回合並行的分支（並行處理 span 之下）
+FIRST_ROUND_BRANCHES = ("RAG檢索", "C值檢測", "知識點檢測")
+
+# 分析用的查詢（每個查詢使用獨立會話，避免重複性判定影響流程）
+DEFAULT_QUERIES = [
+    "什麼是 IPv4？",
+    "IPv4 和 IPv6 有什麼區別？",
+    "請詳細解釋 DNS 解析的工作原理。",
+    "子網路遮罩的用途是什麼？",
+    "DHCP 如何分配 IP 位址？",
+    "NAT 是什麼？",
+    "IPv4 位址是 128 位元",
+    "私有 IP 位址有哪些範圍？",
+]
+
+# 重疊時間小於較短分支耗時的此比例時，視為串行
+SERIAL_TOLERANCE = 0.1
+
+# 小於此長度（秒）的閒置間隙不列出
+MIN_GAP = 0.001
+
+
+def analyze_first_round(trace: Dict, branches: Sequence[str] = FIRST_ROUND_BRANCHES) -> Dict:
+    """
+    分析單次查詢的第一回合並行情況
+
+    Args:
+        trace: Tracer.to_dict() 的結果（process_query 返回的 result["trace"]）
+        branches: 要分析的分支名稱
+
+    Returns:
+        分析結果字典（時間相對於並行處理 span 的開始）
+    """
+    spans = trace["spans"]
+    parallel = next(span for span in spans if span["name"] == "並行處理")
+    origin = parallel["start"]
+    intervals = {
+        span["name"]: (span["start"] - origin, span["start"] - origin + span["duration"])
+        for span in spans
+        if span["parent_id"] == parallel["span_id"] and span["name"] in branches
+    }
+    if not intervals:
+        raise ValueError("追蹤資料中沒有第一回合分支")
+
+    durations = {name: end - start for name, (start, end) in intervals.items()}
+    total = sum(durations.values())
+    longest = max(durations.values())
+
+    # 聯集與閒置間隙（從並行處理開始到最後一個分支結束）
+    union = 0.0
+    gaps = []
+    cursor = 0.0
+    for start, end in sorted(intervals.values()):
+        if start > cursor:
+            if start - cursor >= MIN_GAP:
+                gaps.append((round(cursor, 6), round(start, 6)))
+        union += max(0.0, end - max(start, cursor))
+        cursor = max(cursor, end)
+
+    serialized = []
+    for (a, (a_start, a_end)), (b, (b_start, b_end)) in itertools.combinations(intervals.items(), 2):
+        shared = max(0.0, min(a_end, b_end) - max(a_start, b_start))
+        shorter = min(a_end - a_start, b_end - b_start)
+        if shorter > 0 and shared < SERIAL_TOLERANCE * shorter:
+            first, second = (a, b) if a_start <= b_start else (b, a)
+            serialized.append({"first": first, "then": second, "shared": round(shared, 6)})
+
+    starts = [start for start, _ in intervals.values()]
+    return {
+        "branches": {
+            name: {"start": round(start, 6), "end": round(end, 6), "duration": round(end - start, 6)}
+            for name, (start, end) in intervals.items()
+        },
+        "sum": round(total, 6),
+        "union": round(union, 6),
+        "longest": round(longest, 6),
+        "overlap_ratio": round((total - union) / (total - longest), 3) if total > longest else 1.0,
+        "critical_branch": max(intervals, key=lambda name: intervals[name][1]),
+        "start_skew": round(max(starts) - min(starts), 6),
+        "idle_gaps": gaps,
+        "idle_time": round(sum(end - start for start, end in gaps), 6),
+        "serialized": serialized
+    }
+
+
+def summarize(analyses: List[Dict]) -> Dict:
+    """
+    彙總多次查詢的分析結果
+
+    Args:
+        analyses: analyze_first_round 的結果列表
+
+    Returns:
+        彙總字典
+    """
+    ratios = sorted(a["overlap_ratio"] for a in analyses)
+    serialized = Counter(f"{s['first']} → {s['then']}" for a in analyses for s in a["serialized"])
+    return {
+        "queries": len(analyses),
+        "overlap_ratio": {
+            "median": round(statistics.median(ratios), 3),
+            "min": ratios[0],
+            "p10": ratios[int(0.1 * (len(ratios) - 1))]
+        },
+        "critical_branch": dict(Counter(a["critical_branch"] for a in analyses).most_common()),
+        "serialized_queries": sum(1 for a in analyses if a["serialized"]),
+        "serialized_pairs": dict(serialized.most_common()),
+        "mean_start_skew": round(statistics.mean(a["start_skew"] for a in analyses), 6),
+        "mean_idle_time": round(statistics.mean(a["idle_time"] for a in analyses), 6),
+        "mean_union": round(statistics.mean(a["union"] for a in analyses), 6),
+        "mean_longest": round(statistics.mean(a["longest"] for a in analyses), 6)
+    }
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    """對模擬上游執行查詢並分析"""
+    settings = MockSettings(
+        latency=args.latency,
+        embedding_latency=args.embedding_latency,
+        token_rate=args.token_rate,
+        seed=args.seed
+    )
+    analyses = []
+    async with OfflineSystem(settings, verbose=args.verbose) as system:
+        semaphore = asyncio.Semaphore(args.concurrency)
+
+        async def one(i: int):
+            query = DEFAULT_QUERIES[i % len(DEFAULT_QUERIES)]
+            async with semaphore:
+                result = await system.process_query(query, session_id=f"analyze-{i}")
+            analyses.append(analyze_first_round(result["trace"]))
+
+        with quiet(not args.verbose):
+            await asyncio.gather(*(one(i) for i in range(args.queries)))
+    return {"summary": summarize(analyses), "queries": analyses}
+
+
+def print_report(report: Dict, min_overlap: float):
+    """打印分析報告"""
+    summary = report["summary"]
+    ratio = summary["overlap_ratio"]
+    print("\n" + "=" * 70)
+    print("🔀 第一回合並行度分析（由追蹤時間戳計算）")
+    print("=" * 70)
+    print(f"  查詢數: {summary['queries']}")
+    print(f"  重疊率: 中位數 {ratio['median']:.3f}，p10 {ratio['p10']:.3f}，最小 {ratio['min']:.3f}（門檻 {min_overlap:.2f}）")
+    print(f"  分支聯集 / 最長分支: {summary['mean_union']:.3f}s / {summary['mean_longest']:.3f}s（平均）")
+    print(f"  分支啟動時間差: {summary['mean_start_skew'] * 1000:.1f}ms（平均）")
+    print(f"  閒置間隙: {summary['mean_idle_time'] * 1000:.1f}ms（平均）")
+    print(f"  關鍵分支:")
+    for name, count in summary["critical_branch"].items():
+        print(f"    ├─ {name}: {count} 次")
+    if summary["serialized_pairs"]:
+        print(f"  ⚠️  串行化的分支（{summary['serialized_queries']} 個查詢）:")
+        for pair, count in summary["serialized_pairs"].items():
+            print(f"    ├─ {pair}: {count} 次")
+    else:
+        print(f"  ✅ 沒有串行化的分支")
+    print("=" * 70)
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="第一回合並行度分析（並行度回歸檢查）")
+    parser.add_argument("--queries", type=int, default=10, help="查詢數")
+    parser.add_argument("--concurrency", type=int, default=1, help="同時進行的查詢數")
+    parser.add_argument("--latency", default="uniform:0.05,0.3", help="模擬 chat 延遲分布")
+    parser.add_argument("--embedding-latency", default="uniform:0.02,0.1", help="模擬 embedding 延遲分布")
+    parser.add_argument("--token-rate", type=float, default=0, help="模擬流式 tokens/秒（<=0 不限速）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--min-overlap", type=float, default=Config.CONCURRENCY_MIN_OVERLAP,
+                        help="重疊率中位數門檻，低於此值時返回非零狀態碼")
+    parser.add_argument("--max-serialized", type=float, default=Config.CONCURRENCY_MAX_SERIALIZED,
+                        help="出現串行化分支的查詢比例上限，超過時返回非零狀態碼")
+    parser.add_argument("--output", help="將完整分析結果寫入 JSON 檔")
+    parser.add_argument("--verbose", action="store_true", help="輸出系統日誌")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report, args.min_overlap)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 分析結果已儲存: {args.output}")
+
+    summary = report["summary"]
+    failed = False
+    if summary["overlap_ratio"]["median"] < args.min_overlap:
+        print(f"❌ 重疊率低於門檻 {args.min_overlap:.2f}：第一回合分支沒有真正並行")
+        failed = True
+    serialized_ratio = summary["serialized_queries"] / summary["queries"]
+    if serialized_ratio > args.max_serialized:
+        print(f"❌ {serialized_ratio * 100:.0f}% 的查詢出現串行化分支（上限 {args.max_serialized * 100:.0f}%）："
+              f"檢查協程中的同步調用")
+        failed = True
+    if failed:
+        sys.exit(1)
+    print(f"✅ 第一回合分支並行執行")
+
+
+if __name__ == "__main__":
+    main()
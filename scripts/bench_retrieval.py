@@ -0,0 +1,556 @@
+#!/usr/bin/env python3
+"""
+向量檢索規模基準測試
+以合成語料（預設為實際 Embedding 維度 1536，text-embedding-3-small）比較不同檢索方式
+在 1k ~ 1M 向量規模下的延遲分位數、吞吐量、記憶體與 recall@k：
+- loop：目前的逐文件迴圈（直接調用 RAGRetriever.retrieve，向量以 list 保存，與 vectors.pkl 相同）
+- matrix：正規化後的 float32 矩陣，一次矩陣乘法 + argpartition 取 top-k（精確搜尋，作為 recall 基準）
+- int8：每維度對稱量化為 int8（記憶體為 1/4），分塊反量化後計算
+- ivf：numpy 實作的倒排索引（球面 k-means 分群，只搜尋最近的 nprobe 個群）
+- hnswlib / faiss：已安裝時加入 HNSW 索引比較，未安裝則標記為 skipped
+
+合成語料由數個主題中心加上雜訊產生（接近真實 Embedding 的群聚分布），
+查詢為語料中隨機文件加上雜訊，recall@k 以 matrix 的精確結果為準。
+記憶體不足以容納的規模（例如 1M × 1536 約需 6GB）會標記為 skipped 並寫明原因；
+逐文件迴圈超過 --loop-max-docs 時同樣略過（list 形式的向量每個數值約佔 32 bytes）。
+
+結果寫入 JSON（預設 results/bench_retrieval.json），每個 規模 × 方法 一筆記錄。
+
+使用方式：
+    python scripts/bench_retrieval.py
+    python scripts/bench_retrieval.py --sizes 1000,10000 --methods loop,matrix,int8 --queries 50
+    python scripts/bench_retrieval.py --dim 384 --sizes 1000000 --methods matrix,int8,ivf
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import sys
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# 添加父目錄到路徑，以便導入 core 與 config
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+
+DEFAULT_SIZES = "1000,10000,100000,1000000"
+DEFAULT_METHODS = "loop,matrix,int8,ivf,hnswlib,faiss"
+
+# 合成語料：每個主題中心平均對應的文件數，與雜訊相對於中心的比例
+DOCS_PER_TOPIC = 500
+DOC_NOISE = 0.6
+QUERY_NOISE = 0.3
+
+# 分塊計算的列數（避免一次配置整個語料大小的暫存陣列）
+CHUNK_ROWS = 16384
+
+# 每個規模預估的峰值記憶體 = 語料 float32 大小 × 此倍數（語料 + 一個索引副本 + 暫存）
+MEMORY_FACTOR = 2.2
+
+
+# ==================== 合成語料 ====================
+
+def _normalize(matrix: np.ndarray) -> np.ndarray:
+    """就地將每列正規化為單位向量"""
+    matrix /= np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix
+
+
+def make_corpus(size: int, dim: int, seed: int = 42) -> np.ndarray:
+    """
+    產生群聚分布的合成語料
+
+    Args:
+        size: 向量數
+        dim: 向量維度
+        seed: 隨機種子
+
+    Returns:
+        (size, dim) 的 float32 單位向量矩陣
+    """
+    rng = np.random.default_rng(seed)
+    topics = _normalize(rng.standard_normal((max(8, size // DOCS_PER_TOPIC), dim), dtype=np.float32))
+    corpus = np.empty((size, dim), dtype=np.float32)
+    noise_scale = DOC_NOISE / float(np.sqrt(dim))
+    for start in range(0, size, CHUNK_ROWS):
+        end = min(size, start + CHUNK_ROWS)
+        chunk = topics[rng.integers(0, len(topics), end - start)]
+        chunk += rng.standard_normal((end - start, dim), dtype=np.float32) * noise_scale
+        corpus[start:end] = _normalize(chunk)
+    return corpus
+
+
+def make_queries(corpus: np.ndarray, count: int, seed: int = 42) -> np.ndarray:
+    """以語料中的隨機文件加上雜訊作為查詢"""
+    rng = np.random.default_rng(seed + 1)
+    picks = corpus[rng.integers(0, len(corpus), count)]
+    noise = rng.standard_normal(picks.shape, dtype=np.float32) * (QUERY_NOISE / float(np.sqrt(corpus.shape[1])))
+    return _normalize(picks + noise)
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, k: int) -> np.ndarray:
+    """精確 top-k（批次矩陣乘法，作為 recall 基準）"""
+    truth = np.empty((len(queries), k), dtype=np.int64)
+    for start in range(0, len(queries), 256):
+        scores = queries[start:start + 256] @ corpus.T
+        top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+        order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+        truth[start:start + 256] = np.take_along_axis(top, order, axis=1)
+    return truth
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """由分數取得排序後的 top-k 位置"""
+    k = min(k, len(scores))
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+# ==================== 檢索方式 ====================
+
+class SearchMethod:
+    """檢索方式基底類別"""
+
+    name = ""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.index_bytes: Optional[int] = None
+
+    def unavailable(self, size: int) -> Optional[str]:
+        """此規模不執行時返回原因"""
+        return None
+
+    def build(self, corpus: np.ndarray):
+        raise NotImplementedError
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        raise NotImplementedError
+
+    def close(self):
+        """結束時釋放索引"""
+        pass
+
+
+class _CorpusStore:
+    """以 VectorStore 的儲存格式保存合成語料，供 RAGRetriever 使用"""
+
+    def __init__(self, vectors: Dict[str, dict]):
+        self.vectors = vectors
+
+    def get_all_documents(self) -> Dict[str, dict]:
+        return self.vectors
+
+    async def create_embedding(self, text: str) -> List[float]:
+        raise RuntimeError("基準測試的查詢向量應由快取提供")
+
+
+class _QueryEmbedding:
+    """只包含目前查詢向量的 embedding_cache（跳過 Embedding API）"""
+
+    def __init__(self):
+        self.embedding: Optional[List[float]] = None
+
+    def get(self, query: str) -> Optional[List[float]]:
+        return self.embedding
+
+    def put(self, query: str, embedding: List[float]):
+        self.embedding = embedding
+
+
+class LoopSearch(SearchMethod):
+    """目前的逐文件迴圈（RAGRetriever.retrieve + cosine_similarity）"""
+
+    name = "loop"
+
+    def unavailable(self, size: int) -> Optional[str]:
+        if size > self.args.loop_max_docs:
+            return f"超過 --loop-max-docs {self.args.loop_max_docs}（list 形式的向量記憶體與耗時過高）"
+        return None
+
+    def build(self, corpus: np.ndarray):
+        from core.rag_module import RAGRetriever
+
+        vectors = {
+            f"doc_{i}": {"content": "", "metadata": {"index": i}, "embedding": row.tolist()}
+            for i, row in enumerate(corpus)
+        }
+        self.retriever = RAGRetriever(_CorpusStore(vectors))
+        self.cache = _QueryEmbedding()
+        self.loop = asyncio.new_event_loop()
+
+    async def retrieve(self, query: np.ndarray, k: int) -> List[Dict]:
+        """以 query 作為快取中的查詢向量調用 RAGRetriever.retrieve（可在事件迴圈中 await）"""
+        self.cache.embedding = query.tolist()
+        return await self.retriever.retrieve("q", top_k=k, embedding_cache=self.cache)
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        docs = self.loop.run_until_complete(self.retrieve(query, k))
+        return np.array([doc["metadata"]["index"] for doc in docs])
+
+    def close(self):
+        self.loop.close()
+        self.retriever = None
+
+
+class MatrixSearch(SearchMethod):
+    """float32 矩陣乘法精確搜尋"""
+
+    name = "matrix"
+
+    def build(self, corpus: np.ndarray):
+        self.matrix = corpus
+        self.index_bytes = corpus.nbytes
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        return _top_k(self.matrix @ query, k)
+
+    def close(self):
+        self.matrix = None
+
+
+class Int8Search(SearchMethod):
+    """每維度對稱 int8 量化（分數 = Q_int8 @ (q × scale)）"""
+
+    name = "int8"
+
+    def build(self, corpus: np.ndarray):
+        self.scale = np.abs(corpus).max(axis=0) / 127.0
+        self.scale[self.scale == 0] = 1.0
+        self.codes = np.empty(corpus.shape, dtype=np.int8)
+        for start in range(0, len(corpus), CHUNK_ROWS):
+            chunk = corpus[start:start + CHUNK_ROWS] / self.scale
+            self.codes[start:start + CHUNK_ROWS] = np.clip(np.rint(chunk), -127, 127)
+        self.scores = np.empty(len(corpus), dtype=np.float32)
+        self.index_bytes = self.codes.nbytes + self.scale.nbytes
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        scaled = (query * self.scale).astype(np.float32)
+        for start in range(0, len(self.codes), CHUNK_ROWS):
+            self.scores[start:start + CHUNK_ROWS] = self.codes[start:start + CHUNK_ROWS].astype(np.float32) @ scaled
+        return _top_k(self.scores, k)
+
+    def close(self):
+        self.codes = None
+
+
+class IVFSearch(SearchMethod):
+    """倒排索引：球面 k-means 分群後只搜尋最近的 nprobe 個群"""
+
+    name = "ivf"
+
+    KMEANS_ITERATIONS = 10
+    TRAIN_PER_LIST = 40
+    MIN_NPROBE = 8
+
+    def build(self, corpus: np.ndarray):
+        rng = np.random.default_rng(self.args.seed)
+        nlist = self.args.nlist or max(1, int(np.sqrt(len(corpus))))
+        self.nprobe = min(nlist, self.args.nprobe or max(self.MIN_NPROBE, nlist // 16))
+
+        # 以取樣訓練群中心
+        sample = corpus[rng.choice(len(corpus), min(len(corpus), nlist * self.TRAIN_PER_LIST), replace=False)]
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+        for _ in range(self.KMEANS_ITERATIONS):
+            assign = np.argmax(sample @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = sample[assign == c]
+                if len(members):
+                    centroids[c] = members.sum(axis=0)
+            _normalize(centroids)
+
+        # 將語料依所屬群重新排列，每個群是一段連續區間
+        assign = np.concatenate([
+            np.argmax(corpus[start:start + CHUNK_ROWS] @ centroids.T, axis=1)
+            for start in range(0, len(corpus), CHUNK_ROWS)
+        ])
+        self.order = np.argsort(assign, kind="stable")
+        self.vectors = corpus[self.order]
+        self.offsets = np.searchsorted(assign[self.order], np.arange(nlist + 1))
+        self.centroids = centroids
+        self.index_bytes = self.vectors.nbytes + self.order.nbytes + self.offsets.nbytes + centroids.nbytes
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        probes = _top_k(self.centroids @ query, self.nprobe)
+        ranges = [np.arange(self.offsets[c], self.offsets[c + 1]) for c in probes]
+        candidates = np.concatenate(ranges)
+        if len(candidates) == 0:
+            return candidates
+        best = _top_k(self.vectors[candidates] @ query, k)
+        return self.order[candidates[best]]
+
+    def close(self):
+        self.vectors = None
+
+
+class HnswlibSearch(SearchMethod):
+    """hnswlib HNSW 索引（內積）"""
+
+    name = "hnswlib"
+
+    def unavailable(self, size: int) -> Optional[str]:
+        try:
+            import hnswlib  # noqa: F401
+        except ImportError:
+            return "未安裝 hnswlib"
+        return None
+
+    def build(self, corpus: np.ndarray):
+        import hnswlib
+
+        self.index = hnswlib.Index(space="ip", dim=corpus.shape[1])
+        self.index.init_index(max_elements=len(corpus), ef_construction=self.args.ef_construction, M=self.args.hnsw_m)
+        self.index.add_items(corpus, np.arange(len(corpus)))
+        self.index.set_ef(max(self.args.ef_search, self.args.top_k))
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        labels, _ = self.index.knn_query(query, k=k)
+        return labels[0]
+
+    def close(self):
+        self.index = None
+
+
+class FaissSearch(SearchMethod):
+    """faiss HNSW 索引（內積）"""
+
+    name = "faiss"
+
+    def unavailable(self, size: int) -> Optional[str]:
+        try:
+            import faiss  # noqa: F401
+        except ImportError:
+            return "未安裝 faiss"
+        return None
+
+    def build(self, corpus: np.ndarray):
+        import faiss
+
+        self.index = faiss.IndexHNSWFlat(corpus.shape[1], self.args.hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        self.index.hnsw.efConstruction = self.args.ef_construction
+        self.index.add(corpus)
+        self.index.hnsw.efSearch = max(self.args.ef_search, self.args.top_k)
+
+    def search(self, query: np.ndarray, k: int) -> np.ndarray:
+        _, labels = self.index.search(query[None, :], k)
+        return labels[0]
+
+    def close(self):
+        self.index = None
+
+
+METHODS = {cls.name: cls for cls in (LoopSearch, MatrixSearch, Int8Search, IVFSearch, HnswlibSearch, FaissSearch)}
+
+
+# ==================== 量測 ====================
+
+def _rss_bytes() -> Optional[int]:
+    """目前行程的常駐記憶體（僅 Linux，讀取 /proc/self/statm）"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
+
+
+def _available_bytes() -> Optional[int]:
+    """可用的實體記憶體（僅 Linux，讀取 /proc/meminfo）"""
+    try:
+        with open("/proc/meminfo") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) * 1024
+    except (OSError, ValueError):
+        pass
+    return None
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩法分位數（輸入需已排序）"""
+    index = min(len(sorted_values) - 1, max(0, int(round(q * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def recall_at_k(found: List[np.ndarray], truth: np.ndarray, k: int) -> float:
+    """平均 recall@k（找到的結果與精確 top-k 的交集比例）"""
+    hits = sum(len(set(ids[:k].tolist()) & set(row[:k].tolist())) for ids, row in zip(found, truth))
+    return hits / (len(truth) * k)
+
+
+def bench_method(method: SearchMethod, corpus: np.ndarray, queries: np.ndarray,
+                 truth: np.ndarray, k: int) -> Dict:
+    """
+    建立索引並量測單一檢索方式
+
+    Args:
+        method: 檢索方式
+        corpus: 語料矩陣
+        queries: 查詢矩陣
+        truth: 精確 top-k（與 queries 對應）
+        k: top-k
+
+    Returns:
+        量測結果字典
+    """
+    gc.collect()
+    rss_before = _rss_bytes()
+    t0 = time.perf_counter()
+    method.build(corpus)
+    build_seconds = time.perf_counter() - t0
+    rss_after = _rss_bytes()
+
+    method.search(queries[0], k)  # 預熱
+    latencies = []
+    found = []
+    t_start = time.perf_counter()
+    for query in queries:
+        t0 = time.perf_counter()
+        found.append(method.search(query, k))
+        latencies.append(time.perf_counter() - t0)
+    elapsed = time.perf_counter() - t_start
+    method.close()
+
+    latencies.sort()
+    return {
+        "status": "ok",
+        "queries": len(queries),
+        "build_seconds": round(build_seconds, 4),
+        "index_bytes": method.index_bytes,
+        "rss_delta_bytes": rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+        "latency_ms": {
+            "mean": round(sum(latencies) / len(latencies) * 1000, 4),
+            "p50": round(_percentile(latencies, 0.50) * 1000, 4),
+            "p95": round(_percentile(latencies, 0.95) * 1000, 4),
+            "p99": round(_percentile(latencies, 0.99) * 1000, 4),
+            "max": round(latencies[-1] * 1000, 4)
+        },
+        "qps": round(len(queries) / elapsed, 2),
+        f"recall_at_{k}": round(recall_at_k(found, truth, k), 4)
+    }
+
+
+def run(args: argparse.Namespace) -> Dict:
+    """依序對每個規模執行所有檢索方式"""
+    sizes = [int(size) for size in args.sizes.split(",")]
+    names = [name.strip() for name in args.methods.split(",")]
+    unknown = [name for name in names if name not in METHODS]
+    if unknown:
+        raise SystemExit(f"❌ 未知的檢索方式: {', '.join(unknown)}（可用: {', '.join(METHODS)}）")
+
+    results = []
+    for size in sizes:
+        needed = int(size * args.dim * 4 * MEMORY_FACTOR)
+        available = _available_bytes()
+        if available is not None and needed > available * args.max_memory_fraction:
+            reason = f"預估需要 {needed / 1e9:.1f}GB 記憶體，可用 {available / 1e9:.1f}GB"
+            print(f"⏭️  {size:,} 個向量: {reason}，略過")
+            results.extend({"size": size, "dim": args.dim, "method": name, "status": "skipped", "reason": reason}
+                           for name in names)
+            continue
+
+        print(f"\n📦 產生 {size:,} × {args.dim} 合成語料...")
+        corpus = make_corpus(size, args.dim, args.seed)
+        queries = make_queries(corpus, args.queries, args.seed)
+        truth = exact_top_k(corpus, queries, args.top_k)
+
+        for name in names:
+            method = METHODS[name](args)
+            record = {"size": size, "dim": args.dim, "method": name}
+            reason = method.unavailable(size)
+            if reason:
+                print(f"  ⏭️  {name}: {reason}")
+                results.append({**record, "status": "skipped", "reason": reason})
+                continue
+
+            # 逐文件迴圈較慢，只使用部分查詢
+            count = min(len(queries), args.loop_queries) if name == "loop" else len(queries)
+            record.update(bench_method(method, corpus, queries[:count], truth[:count], args.top_k))
+            if name == "ivf":
+                record["nprobe"] = method.nprobe
+                record["nlist"] = len(method.centroids)
+            results.append(record)
+            latency = record["latency_ms"]
+            print(f"  ⏱️  {name:<8} p50 {latency['p50']:>9.3f}ms  p99 {latency['p99']:>9.3f}ms  "
+                  f"{record['qps']:>9.1f} q/s  recall@{args.top_k} {record[f'recall_at_{args.top_k}']:.3f}")
+
+        del corpus, queries, truth
+        gc.collect()
+
+    return {
+        "benchmark": "retrieval",
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "environment": {
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count()
+        },
+        "params": {
+            "sizes": sizes,
+            "dim": args.dim,
+            "methods": names,
+            "queries": args.queries,
+            "loop_queries": args.loop_queries,
+            "top_k": args.top_k,
+            "seed": args.seed
+        },
+        "results": results
+    }
+
+
+def print_report(report: Dict):
+    """打印各規模的比較表"""
+    k = report["params"]["top_k"]
+    print("\n" + "=" * 70)
+    print(f"📊 檢索規模基準（dim={report['params']['dim']}，top_k={k}）")
+    print("=" * 70)
+    print(f"  {'規模':>9}  {'方式':<8} {'p50(ms)':>10} {'p99(ms)':>10} {'q/s':>10} {'索引(MB)':>10} {'recall':>7}")
+    for record in report["results"]:
+        if record["status"] != "ok":
+            print(f"  {record['size']:>9,}  {record['method']:<8} ⏭️  {record['reason']}")
+            continue
+        index_mb = f"{record['index_bytes'] / 1e6:.1f}" if record["index_bytes"] is not None else "-"
+        print(f"  {record['size']:>9,}  {record['method']:<8} {record['latency_ms']['p50']:>10.3f} "
+              f"{record['latency_ms']['p99']:>10.3f} {record['qps']:>10.1f} {index_mb:>10} "
+              f"{record[f'recall_at_{k}']:>7.3f}")
+    print("=" * 70)
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="向量檢索規模基準測試")
+    parser.add_argument("--sizes", default=DEFAULT_SIZES, help="語料規模（逗號分隔）")
+    parser.add_argument("--dim", type=int, default=1536, help="向量維度（text-embedding-3-small 為 1536，bge-small 為 384）")
+    parser.add_argument("--methods", default=DEFAULT_METHODS, help=f"檢索方式（逗號分隔，可用: {', '.join(METHODS)}）")
+    parser.add_argument("--queries", type=int, default=200, help="每個規模的查詢數")
+    parser.add_argument("--loop-queries", type=int, default=20, help="逐文件迴圈使用的查詢數")
+    parser.add_argument("--loop-max-docs", type=int, default=10000, help="逐文件迴圈的最大語料規模")
+    parser.add_argument("--top-k", type=int, default=Config.RAG_TOP_K)
+    parser.add_argument("--nlist", type=int, default=0, help="IVF 群數（0 表示 sqrt(N)）")
+    parser.add_argument("--nprobe", type=int, default=0, help="IVF 搜尋的群數（0 表示 nlist/16，至少 8）")
+    parser.add_argument("--hnsw-m", type=int, default=16, help="HNSW 每個節點的連結數")
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--ef-search", type=int, default=64)
+    parser.add_argument("--max-memory-fraction", type=float, default=0.8,
+                        help="預估記憶體超過可用記憶體的此比例時略過該規模")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="results/bench_retrieval.json", help="結果 JSON 檔")
+    args = parser.parse_args()
+
+    report = run(args)
+    print_report(report)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 基準結果已儲存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
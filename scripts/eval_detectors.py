@@ -0,0 +1,464 @@
+#!/usr/bin/env python3
+"""
+維度檢測器準確度 / 延遲評估工具
+以標註好 C 值與知識點的查詢集合，並列比較各種檢測實作的品質、延遲與成本：
+- current：目前的 CorrectnessDetector + KnowledgeDetector（兩次上游調用並行）
+- fused：單次 function call 同時返回 C 值與知識點
+- local：不呼叫上游，以知識點名稱字面匹配（長名稱優先），C 值一律預設正確
+- cached：current 加上行程內查詢結果快取（第二輪起命中）
+
+報告：
+- C 值：一致率（accuracy），以及 C=1（不正確）的 precision / recall
+- 知識點：micro precision / recall、知識點集合完全一致率、K 值一致率
+- 延遲分位數（每個查詢的檢測耗時）與每個查詢的平均成本（依 Config.MODEL_PRICING）
+
+默認使用模擬上游（scripts/mock_openai_server.py），結果可重現；--live 使用實際上游。
+
+標註格式（JSON Lines，每行一個查詢）：
+    {"query": "IPv4 位址長度是 128 位元", "C": 1, "knowledge_points": ["IPv4"]}
+
+使用方式：
+    python scripts/eval_detectors.py
+    python scripts/eval_detectors.py --variants current,fused --passes 3
+    python scripts/eval_detectors.py --live --output results/eval_detectors_live.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+# 添加父目錄到路徑，以便導入 config、core 與 scripts 套件
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from config import Config, get_shared_async_client
+from core.tracer import Tracer, record_usage, start_span, use_tracer
+from core.usage_tracker import summarize_trace
+from scripts.load_test import distribution
+from scripts.mock_openai_server import MockServerThread, MockSettings
+from scripts.offline_system import quiet
+
+DEFAULT_DATASET = os.path.join(BASE_DIR, "data", "eval", "detector_queries.jsonl")
+VARIANTS = ("current", "fused", "local", "cached")
+
+
+@dataclass
+class LabeledQuery:
+    """一筆標註查詢"""
+    query: str
+    c_value: int
+    knowledge_points: List[str] = field(default_factory=list)
+
+
+@dataclass
+class Prediction:
+    """一次檢測結果"""
+    item: LabeledQuery
+    latency: float
+    c_value: Optional[int] = None
+    knowledge_points: List[str] = field(default_factory=list)
+    cost: float = 0.0
+    cache_hit: bool = False
+    error: Optional[str] = None
+
+
+def load_dataset(path: str) -> List[LabeledQuery]:
+    """
+    載入標註查詢集合
+
+    Args:
+        path: JSON Lines 檔案路徑（空行與 # 開頭的行略過）
+
+    Returns:
+        LabeledQuery 列表
+    """
+    items = []
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#"):
+                continue
+            record = json.loads(line)
+            items.append(LabeledQuery(
+                query=record["query"],
+                c_value=int(record.get("C", 0)),
+                knowledge_points=list(record.get("knowledge_points", []))
+            ))
+    return items
+
+
+def load_knowledge_points() -> List[str]:
+    """載入知識點清單（與 KnowledgeDetector 使用同一份 data/knowledge_points.json）"""
+    with open(os.path.join(BASE_DIR, "data", "knowledge_points.json"), "r", encoding="utf-8") as f:
+        nodes = json.load(f).get("nodes", [])
+    return [str(n).strip() for n in nodes if isinstance(n, str) and str(n).strip()]
+
+
+# ==================== 檢測實作 ====================
+
+class CurrentDetector:
+    """目前的實作：CorrectnessDetector 與 KnowledgeDetector 並行（同 DimensionClassifier）"""
+
+    name = "current"
+
+    def __init__(self, api_key: str = None):
+        from core.tools.correctness_detector import CorrectnessDetector
+        from core.tools.knowledge_detector import KnowledgeDetector
+
+        self.correctness_detector = CorrectnessDetector(api_key)
+        self.knowledge_detector = KnowledgeDetector(api_key)
+
+    async def detect(self, query: str) -> Tuple[int, List[str]]:
+        return tuple(await asyncio.gather(
+            self.correctness_detector.detect(query),
+            self.knowledge_detector.detect(query)
+        ))
+
+
+class FusedDetector:
+    """合併檢測：一次 function call 同時返回 C 值與知識點"""
+
+    name = "fused"
+
+    def __init__(self, knowledge_points: List[str], api_key: str = None):
+        self.client = get_shared_async_client(api_key)
+        self.knowledge_points = knowledge_points
+
+    async def detect(self, query: str) -> Tuple[int, List[str]]:
+        knowledge_list = "\n".join(f"- {kp}" for kp in self.knowledge_points)
+        prompt = f"""問題：「{query}」
+
+知識點列表：
+{knowledge_list}
+
+任務：
+1. 判斷這句話是否有明顯事實或邏輯錯誤（疑問句/開放性問題 → 0，明顯錯誤 → 1，預設 0）
+2. 找出問題直接涉及、或語義上明顯相關（相似度 ≥ 80%）的知識點；沒有則返回空陣列"""
+        functions = [{
+            "name": "return_dimensions",
+            "description": "返回正確性判斷與涉及的知識點",
+            "parameters": {
+                "type": "object",
+                "properties": {
+                    "correct": {"type": "integer", "enum": [0, 1], "description": "0=正確，1=有明顯錯誤"},
+                    "knowledge_points": {"type": "array", "items": {"type": "string"}}
+                },
+                "required": ["correct", "knowledge_points"]
+            }
+        }]
+
+        span = start_span("合併檢測 API 調用", thread='CE', model=Config.CLASSIFIER_MODEL, upstream=True)
+        t_start = time.perf_counter()
+        try:
+            response = await self.client.chat.completions.create(
+                model=Config.CLASSIFIER_MODEL,
+                messages=[
+                    {"role": "system", "content": "你是問題分析專家，同時判斷正確性與涉及的知識點。"},
+                    {"role": "user", "content": prompt}
+                ],
+                functions=functions,
+                function_call={"name": "return_dimensions"},
+                temperature=0,
+                max_tokens=300,
+                timeout=Config.UPSTREAM_TIMEOUT
+            )
+        except Exception as e:
+            span.set_attribute("error", type(e).__name__)
+            raise
+        finally:
+            span.end()
+        record_usage(span, response, elapsed=time.perf_counter() - t_start)
+
+        function_call = response.choices[0].message.function_call
+        arguments = json.loads(function_call.arguments) if function_call and function_call.arguments else {}
+        c_value = 1 if arguments.get("correct") == 1 else 0
+        points = [kp for kp in arguments.get("knowledge_points", []) if kp in self.knowledge_points]
+        return c_value, points
+
+
+def match_knowledge_points(query: str, knowledge_points: List[str]) -> List[str]:
+    """
+    以字面匹配找出問題中出現的知識點（不分大小寫；長名稱優先，
+    已匹配的文字不再參與較短名稱的匹配，避免「NAT」重複命中「NAT64 / DNS64」）
+
+    Args:
+        query: 用戶問題
+        knowledge_points: 知識點清單
+
+    Returns:
+        依清單順序排列的知識點名稱列表
+    """
+    text = query.lower()
+    found = set()
+    for kp in sorted(knowledge_points, key=len, reverse=True):
+        key = kp.lower()
+        if key in text:
+            found.add(kp)
+            text = text.replace(key, " ")
+    return [kp for kp in knowledge_points if kp in found]
+
+
+class LocalDetector:
+    """本地檢測：不呼叫上游，知識點以字面匹配，C 值一律預設正確"""
+
+    name = "local"
+
+    def __init__(self, knowledge_points: List[str]):
+        self.knowledge_points = knowledge_points
+
+    async def detect(self, query: str) -> Tuple[int, List[str]]:
+        return 0, match_knowledge_points(query, self.knowledge_points)
+
+
+class CachedDetector:
+    """查詢結果快取：相同查詢（去除前後空白）直接返回上次的結果"""
+
+    name = "cached"
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.cache: Dict[str, Tuple[int, List[str]]] = {}
+        self.last_hit = False
+
+    async def detect(self, query: str) -> Tuple[int, List[str]]:
+        key = query.strip()
+        self.last_hit = key in self.cache
+        if not self.last_hit:
+            self.cache[key] = await self.inner.detect(query)
+        c_value, points = self.cache[key]
+        return c_value, list(points)
+
+
+def build_detector(name: str, knowledge_points: List[str], api_key: str = None):
+    """依名稱建立檢測實作"""
+    if name == "current":
+        return CurrentDetector(api_key)
+    if name == "fused":
+        return FusedDetector(knowledge_points, api_key)
+    if name == "local":
+        return LocalDetector(knowledge_points)
+    if name == "cached":
+        return CachedDetector(CurrentDetector(api_key))
+    raise ValueError(f"未知的檢測實作: {name}（可用: {', '.join(VARIANTS)}）")
+
+
+# ==================== 評估 ====================
+
+async def evaluate(detector, items: List[LabeledQuery], passes: int = 1) -> List[Prediction]:
+    """
+    依序對每個查詢執行檢測（逐一執行，延遲不受並發影響）
+
+    Args:
+        detector: 具有 async detect(query) -> (C, 知識點) 的檢測實作
+        items: 標註查詢
+        passes: 重複輪數（快取實作第二輪起命中）
+
+    Returns:
+        每個查詢每一輪的 Prediction
+    """
+    predictions = []
+    for _ in range(passes):
+        for item in items:
+            tracer = Tracer("eval_detectors")
+            t_start = time.perf_counter()
+            try:
+                with use_tracer(tracer):
+                    c_value, points = await detector.detect(item.query)
+                prediction = Prediction(item, time.perf_counter() - t_start, c_value, points)
+            except Exception as e:
+                prediction = Prediction(item, time.perf_counter() - t_start, error=f"{type(e).__name__}: {e}")
+            prediction.cost = summarize_trace(tracer)["total"]["cost_usd"]
+            prediction.cache_hit = bool(getattr(detector, "last_hit", False))
+            predictions.append(prediction)
+    return predictions
+
+
+def _ratio(numerator: int, denominator: int) -> Optional[float]:
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def correctness_metrics(gold: List[int], predicted: List[int]) -> Dict:
+    """
+    C 值指標（C=1「不正確」為正類）
+
+    Args:
+        gold: 標註 C 值
+        predicted: 檢測 C 值
+
+    Returns:
+        {"n", "agreement", "precision", "recall"}（分母為 0 時為 None）
+    """
+    pairs = list(zip(gold, predicted))
+    true_positive = sum(1 for g, p in pairs if g == 1 and p == 1)
+    return {
+        "n": len(pairs),
+        "agreement": _ratio(sum(1 for g, p in pairs if g == p), len(pairs)),
+        "precision": _ratio(true_positive, sum(1 for _, p in pairs if p == 1)),
+        "recall": _ratio(true_positive, sum(1 for g, _ in pairs if g == 1))
+    }
+
+
+def _k_value(points: List[str]) -> int:
+    """K 值（同 KnowledgeDetector.calculate_k_value：0=零個，1=一個，2=多個）"""
+    return min(len(points), 2)
+
+
+def knowledge_metrics(gold: List[List[str]], predicted: List[List[str]]) -> Dict:
+    """
+    知識點指標（micro 平均）
+
+    Args:
+        gold: 標註知識點
+        predicted: 檢測知識點
+
+    Returns:
+        {"n", "precision", "recall", "exact_match", "k_agreement"}（分母為 0 時為 None）
+    """
+    pairs = [(set(g), set(p)) for g, p in zip(gold, predicted)]
+    true_positive = sum(len(g & p) for g, p in pairs)
+    return {
+        "n": len(pairs),
+        "precision": _ratio(true_positive, sum(len(p) for _, p in pairs)),
+        "recall": _ratio(true_positive, sum(len(g) for g, _ in pairs)),
+        "exact_match": _ratio(sum(1 for g, p in pairs if g == p), len(pairs)),
+        "k_agreement": _ratio(sum(1 for g, p in pairs if _k_value(g) == _k_value(p)), len(pairs))
+    }
+
+
+def _mismatches(predictions: List[Prediction]) -> List[Dict]:
+    """與標註不一致的查詢（多輪時每個查詢只列一次）"""
+    seen, mismatches = set(), []
+    for p in predictions:
+        if p.item.query in seen:
+            continue
+        seen.add(p.item.query)
+        if p.c_value != p.item.c_value or set(p.knowledge_points) != set(p.item.knowledge_points):
+            mismatches.append({
+                "query": p.item.query,
+                "gold": {"C": p.item.c_value, "knowledge_points": p.item.knowledge_points},
+                "predicted": {"C": p.c_value, "knowledge_points": p.knowledge_points}
+            })
+    return mismatches
+
+
+def summarize(name: str, predictions: List[Prediction]) -> Dict:
+    """
+    彙總單一實作的評估結果（品質只計成功的檢測，失敗另計錯誤數）
+
+    Args:
+        name: 實作名稱
+        predictions: evaluate 的結果
+
+    Returns:
+        評估摘要
+    """
+    ok = [p for p in predictions if p.error is None]
+    return {
+        "variant": name,
+        "queries": len(predictions),
+        "errors": len(predictions) - len(ok),
+        "correctness": correctness_metrics([p.item.c_value for p in ok], [p.c_value for p in ok]),
+        "knowledge": knowledge_metrics([p.item.knowledge_points for p in ok], [p.knowledge_points for p in ok]),
+        "latency": distribution([p.latency for p in ok]),
+        "cost_per_query": round(sum(p.cost for p in predictions) / len(predictions), 8) if predictions else 0.0,
+        "cache_hit_rate": _ratio(sum(1 for p in predictions if p.cache_hit), len(predictions)),
+        "mismatches": _mismatches(ok),
+        "error_samples": [p.error for p in predictions if p.error][:3]
+    }
+
+
+def _pct(value: Optional[float]) -> str:
+    return f"{value * 100:5.1f}%" if value is not None else "    -"
+
+
+def _ms(dist: Optional[Dict], key: str) -> str:
+    return f"{dist[key] * 1000:7.1f}" if dist else "      -"
+
+
+def print_report(summaries: List[Dict], dataset: str, mock: bool):
+    """打印並列比較表"""
+    print("\n" + "=" * 100)
+    print(f"🎯 維度檢測器評估（{os.path.basename(dataset)}，{'模擬上游' if mock else '實際上游'}）")
+    print("=" * 100)
+    print(f"{'實作':<8} {'C 一致':>7} {'C 精確':>7} {'C 召回':>7} {'KP 精確':>7} {'KP 召回':>7} "
+          f"{'KP 全對':>7} {'K 一致':>7} {'p50 ms':>7} {'p95 ms':>7} {'p99 ms':>7} {'$/查詢':>10} {'錯誤':>4}")
+    for s in summaries:
+        c, k = s["correctness"], s["knowledge"]
+        print(f"{s['variant']:<8} {_pct(c['agreement']):>7} {_pct(c['precision']):>7} {_pct(c['recall']):>7} "
+              f"{_pct(k['precision']):>7} {_pct(k['recall']):>7} {_pct(k['exact_match']):>7} "
+              f"{_pct(k['k_agreement']):>7} {_ms(s['latency'], 'p50')} {_ms(s['latency'], 'p95')} "
+              f"{_ms(s['latency'], 'p99')} {s['cost_per_query']:>10.7f} {s['errors']:>4}")
+    for s in summaries:
+        if s["cache_hit_rate"]:
+            print(f"  💾 {s['variant']}: 快取命中率 {s['cache_hit_rate'] * 100:.1f}%")
+        if s["error_samples"]:
+            print(f"  ⚠️  {s['variant']} 錯誤範例: {s['error_samples'][0]}")
+    print("=" * 100)
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    """啟動模擬上游（除非 --live）並依序評估各實作"""
+    items = load_dataset(args.dataset)
+    if args.limit:
+        items = items[:args.limit]
+    if not items:
+        raise SystemExit(f"❌ {args.dataset} 中沒有標註查詢")
+    names = [n.strip() for n in args.variants.split(",") if n.strip()]
+    knowledge_points = load_knowledge_points()
+    print(f"📂 載入 {len(items)} 個標註查詢，評估: {', '.join(names)}（每個 {args.passes} 輪）")
+
+    server = None
+    if not args.live:
+        settings = MockSettings(latency=args.latency, error_rate=args.error_rate, seed=args.seed)
+        server = MockServerThread(settings).start()
+        Config.OPENAI_BASE_URL = server.base_url
+    try:
+        summaries = []
+        for name in names:
+            with quiet(not args.verbose):
+                detector = build_detector(name, knowledge_points)
+                predictions = await evaluate(detector, items, args.passes)
+            summaries.append(summarize(name, predictions))
+            print(f"  ✓ {name} 完成")
+    finally:
+        if server is not None:
+            server.stop()
+    return {
+        "dataset": os.path.relpath(args.dataset, BASE_DIR),
+        "mock": not args.live,
+        "passes": args.passes,
+        "variants": summaries
+    }
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="維度檢測器準確度 / 延遲 / 成本評估")
+    parser.add_argument("dataset", nargs="?", default=DEFAULT_DATASET, help="標註查詢（JSON Lines）")
+    parser.add_argument("--variants", default=",".join(VARIANTS), help=f"要評估的實作（可用: {', '.join(VARIANTS)}）")
+    parser.add_argument("--passes", type=int, default=2, help="每個實作重複的輪數（快取實作第二輪起命中）")
+    parser.add_argument("--limit", type=int, help="只評估前 N 個查詢")
+    parser.add_argument("--live", action="store_true", help="使用實際上游（默認為模擬上游）")
+    parser.add_argument("--latency", default="uniform:0.05,0.3", help="模擬 chat 延遲分布")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模擬上游 500 錯誤比例")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="results/eval_detectors.json", help="結果 JSON 檔")
+    parser.add_argument("--verbose", action="store_true", help="輸出檢測器日誌")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    print_report(report["variants"], args.dataset, report["mock"])
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 評估結果已儲存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,488 @@
+#!/usr/bin/env python3
+"""
+web_api 端到端壓力測試
+對 /api/query 與 /api/query/stream（SSE）施加逐步提高的負載，量測單一 worker 的服務能力：
+- 閉環（closed）：每一階為 N 個同時的使用者（學生），各自收到回應後立即送出下一個查詢
+- 開環（open）：每一階為每秒 N 個請求的 Poisson 到達，不等待回應（延遲從預定到達時間起算，
+  避免 coordinated omission 低估排隊時間）
+
+每一階報告吞吐量、延遲分位數、首字時間（TTFT，流式請求收到第一個 delta 事件）與錯誤率，
+並找出延遲開始惡化的拐點（knee）：p95 超過第一階的 --knee-factor 倍、錯誤率超過上限，
+或吞吐量不再隨負載增加（閉環增幅低於 --min-gain；開環達成率低於 --min-achieved）。
+
+預設完全離線：以子行程啟動模擬上游（scripts/mock_openai_server.py）與 web_api
+（scripts/offline_system.py，向量、歷史與會話寫到暫存目錄），壓力產生器在另一個行程中，
+不與被測服務共用 GIL。也可以用 --target 對已在執行的服務施壓。
+
+使用方式：
+    python scripts/load_test.py --steps 1,2,4,8,16 --duration 15
+    python scripts/load_test.py --mode open --steps 2,5,10,20 --mix query:0.3,stream:0.7
+    python scripts/load_test.py --target http://127.0.0.1:8000 --queries-file data/eval/queries.txt
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+# 添加父目錄到路徑，以便導入 scripts 套件
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from scripts.analyze_concurrency import DEFAULT_QUERIES
+from scripts.offline_system import free_port
+
+ENDPOINTS = {
+    "query": "/api/query",
+    "stream": "/api/query/stream",
+}
+
+PERCENTILES = (0.5, 0.9, 0.95, 0.99)
+
+
+# ==================== 請求 ====================
+
+@dataclass
+class RequestRecord:
+    """單一請求的結果"""
+    endpoint: str
+    ok: bool
+    latency: float
+    ttft: Optional[float] = None
+    error: Optional[str] = None
+
+
+class RequestPicker:
+    """依端點權重與查詢集合挑選下一個請求（固定種子可重現）"""
+
+    def __init__(self, mix: List[Tuple[str, float]], queries: List[str], seed: int = 42):
+        self.endpoints = [name for name, _ in mix]
+        self.weights = [weight for _, weight in mix]
+        self.queries = queries
+        self.rng = random.Random(seed)
+
+    def next(self) -> Tuple[str, str]:
+        endpoint = self.rng.choices(self.endpoints, weights=self.weights)[0]
+        return endpoint, self.rng.choice(self.queries)
+
+
+def parse_mix(spec: str) -> List[Tuple[str, float]]:
+    """
+    解析端點權重，例如 "query:0.5,stream:0.5"（省略權重時為 1）
+
+    Args:
+        spec: 權重字串
+
+    Returns:
+        (端點, 權重) 列表
+    """
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition(":")
+        if name not in ENDPOINTS:
+            raise ValueError(f"未知的端點 {name!r}（可用: {', '.join(ENDPOINTS)}）")
+        mix.append((name, float(weight) if weight else 1.0))
+    return mix
+
+
+def load_queries(path: Optional[str]) -> List[str]:
+    """讀取查詢集合（每行一個查詢；未指定時使用內建查詢）"""
+    if not path:
+        return list(DEFAULT_QUERIES)
+    with open(path, "r", encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+async def send_request(client: httpx.AsyncClient, endpoint: str, query: str,
+                       session_id: str, started: float = None) -> RequestRecord:
+    """
+    送出一個查詢並記錄結果
+
+    Args:
+        client: HTTP client（base_url 為被測服務）
+        endpoint: "query" 或 "stream"
+        query: 查詢文本
+        session_id: 會話 ID
+        started: 計時起點（開環測試為預定到達時間，默認為現在）
+
+    Returns:
+        請求結果
+    """
+    started = started or time.perf_counter()
+    payload = {"query": query, "session_id": session_id}
+    ttft = None
+    try:
+        if endpoint == "query":
+            response = await client.post(ENDPOINTS[endpoint], json=payload)
+            error = None if response.status_code == 200 else f"HTTP {response.status_code}"
+        else:
+            error = "incomplete"
+            async with client.stream("POST", ENDPOINTS[endpoint], json=payload) as response:
+                if response.status_code != 200:
+                    error = f"HTTP {response.status_code}"
+                else:
+                    async for line in response.aiter_lines():
+                        if not line.startswith("event:"):
+                            continue
+                        event = line[len("event:"):].strip()
+                        if event == "delta" and ttft is None:
+                            ttft = time.perf_counter() - started
+                        elif event == "error":
+                            error = "stream_error"
+                        elif event == "done":
+                            error = None if error == "incomplete" else error
+    except httpx.TimeoutException:
+        error = "timeout"
+    except httpx.HTTPError as e:
+        error = type(e).__name__
+    return RequestRecord(endpoint, error is None, time.perf_counter() - started, ttft, error)
+
+
+# ==================== 負載模式 ====================
+
+async def run_closed_step(client: httpx.AsyncClient, picker: RequestPicker, users: int,
+                          duration: float, step: int) -> Tuple[List[RequestRecord], float]:
+    """閉環：users 個使用者在 duration 秒內連續送出查詢（只計入截止前送出的請求）"""
+    records: List[RequestRecord] = []
+    t_start = time.perf_counter()
+    deadline = t_start + duration
+
+    async def user(i: int):
+        session_id = f"load-{step}-{i}"
+        while time.perf_counter() < deadline:
+            endpoint, query = picker.next()
+            records.append(await send_request(client, endpoint, query, session_id))
+
+    await asyncio.gather(*(user(i) for i in range(users)))
+    return records, time.perf_counter() - t_start
+
+
+def arrival_times(rate: float, duration: float, seed: int) -> List[float]:
+    """Poisson 到達時間（相對於開始，單位秒）"""
+    rng = random.Random(seed)
+    times = []
+    t = rng.expovariate(rate)
+    while t < duration:
+        times.append(t)
+        t += rng.expovariate(rate)
+    return times
+
+
+async def run_open_step(client: httpx.AsyncClient, picker: RequestPicker, rate: float, duration: float,
+                        step: int, sessions: int, seed: int) -> Tuple[List[RequestRecord], float]:
+    """開環：以每秒 rate 個請求的 Poisson 到達送出查詢，不等待回應"""
+    t_start = time.perf_counter()
+    tasks = []
+    for i, offset in enumerate(arrival_times(rate, duration, seed + step)):
+        scheduled = t_start + offset
+        await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+        endpoint, query = picker.next()
+        session_id = f"load-{step}-{i % sessions}"
+        tasks.append(asyncio.create_task(send_request(client, endpoint, query, session_id, started=scheduled)))
+    records = list(await asyncio.gather(*tasks))
+    return records, time.perf_counter() - t_start
+
+
+# ==================== 統計 ====================
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    """最近秩法分位數（輸入需已排序）"""
+    index = min(len(sorted_values) - 1, max(0, int(q * len(sorted_values) + 0.999999) - 1))
+    return sorted_values[index]
+
+
+def distribution(values: List[float]) -> Optional[Dict[str, float]]:
+    """延遲分布（秒）；沒有資料時為 None"""
+    if not values:
+        return None
+    values = sorted(values)
+    summary = {f"p{int(q * 100)}": round(_percentile(values, q), 4) for q in PERCENTILES}
+    summary["mean"] = round(sum(values) / len(values), 4)
+    summary["max"] = round(values[-1], 4)
+    return summary
+
+
+def summarize_step(records: List[RequestRecord], level: float, elapsed: float) -> Dict:
+    """
+    彙總單一負載階段
+
+    Args:
+        records: 該階段的請求結果
+        level: 負載大小（閉環為使用者數，開環為每秒請求數）
+        elapsed: 該階段實際經過的時間（秒）
+
+    Returns:
+        統計字典（延遲只計入成功的請求）
+    """
+    ok = [r for r in records if r.ok]
+    errors = Counter(r.error for r in records if not r.ok)
+    by_endpoint = {}
+    for endpoint in sorted({r.endpoint for r in records}):
+        subset = [r for r in records if r.endpoint == endpoint]
+        by_endpoint[endpoint] = {
+            "requests": len(subset),
+            "errors": sum(1 for r in subset if not r.ok),
+            "latency": distribution([r.latency for r in subset if r.ok])
+        }
+    return {
+        "level": level,
+        "requests": len(records),
+        "ok": len(ok),
+        "error_rate": round(len(records) and (len(records) - len(ok)) / len(records), 4),
+        "errors": dict(errors.most_common()),
+        "elapsed": round(elapsed, 3),
+        "throughput": round(len(ok) / elapsed, 3) if elapsed > 0 else 0.0,
+        "latency": distribution([r.latency for r in ok]),
+        "ttft": distribution([r.ttft for r in ok if r.ttft is not None]),
+        "endpoints": by_endpoint
+    }
+
+
+def find_knee(steps: List[Dict], mode: str = "closed", knee_factor: float = 2.0,
+              max_error_rate: float = 0.01, min_gain: float = 0.1, min_achieved: float = 0.9) -> Dict:
+    """
+    找出延遲開始惡化的拐點
+
+    Args:
+        steps: summarize_step 的結果（依負載遞增）
+        mode: "closed" 或 "open"
+        knee_factor: p95 延遲超過第一階的此倍數時視為惡化
+        max_error_rate: 錯誤率上限
+        min_gain: 閉環時吞吐量相對前一階的最小增幅
+        min_achieved: 開環時實際吞吐量 / 目標速率的下限
+
+    Returns:
+        {"level": 最後一個健康的負載, "degraded_at": 開始惡化的負載, "reasons": [...], ...}
+    """
+    baseline = steps[0]["latency"]["p95"] if steps and steps[0]["latency"] else None
+    healthy = None
+    for i, step in enumerate(steps):
+        reasons = []
+        if step["error_rate"] > max_error_rate:
+            reasons.append(f"錯誤率 {step['error_rate'] * 100:.1f}%")
+        if step["latency"] is None:
+            reasons.append("沒有成功的請求")
+        elif baseline and step["latency"]["p95"] > knee_factor * baseline:
+            reasons.append(f"p95 {step['latency']['p95']:.3f}s 超過基準 {baseline:.3f}s 的 {knee_factor:g} 倍")
+        if mode == "open":
+            if step["throughput"] < min_achieved * step["level"]:
+                reasons.append(f"吞吐量 {step['throughput']:.2f}/s 未達目標 {step['level']:g}/s")
+        elif i > 0 and steps[i - 1]["throughput"] > 0:
+            gain = step["throughput"] / steps[i - 1]["throughput"] - 1
+            if gain < min_gain:
+                reasons.append(f"吞吐量增幅 {gain * 100:+.1f}%")
+        if reasons:
+            return _knee(healthy, step["level"], reasons)
+        healthy = step
+    return _knee(healthy, None, [])
+
+
+def _knee(healthy: Optional[Dict], degraded_at: Optional[float], reasons: List[str]) -> Dict:
+    """組合拐點結果"""
+    return {
+        "level": healthy["level"] if healthy else None,
+        "throughput": healthy["throughput"] if healthy else None,
+        "p95": healthy["latency"]["p95"] if healthy else None,
+        "degraded_at": degraded_at,
+        "reasons": reasons
+    }
+
+
+# ==================== 被測服務 ====================
+
+class LocalStack:
+    """以子行程啟動模擬上游與 web_api（with 使用，結束時關閉）"""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.mock_port = free_port()
+        self.api_port = free_port()
+        self.processes: List[subprocess.Popen] = []
+        self.log = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.api_port}"
+
+    def __enter__(self) -> "LocalStack":
+        args = self.args
+        self.log = open(args.server_log, "w", encoding="utf-8") if args.server_log else subprocess.DEVNULL
+        mock_cmd = [
+            sys.executable, os.path.join(BASE_DIR, "scripts", "mock_openai_server.py"),
+            "--port", str(self.mock_port),
+            "--latency", args.latency,
+            "--embedding-latency", args.embedding_latency,
+            "--token-rate", str(args.token_rate),
+            "--error-rate", str(args.error_rate),
+            "--seed", str(args.seed)
+        ]
+        api_cmd = [sys.executable, os.path.join(BASE_DIR, "scripts", "offline_system.py"), "--port", str(self.api_port)]
+        env = {**os.environ, "OPENAI_BASE_URL": f"http://127.0.0.1:{self.mock_port}/v1", "PYTHONUNBUFFERED": "1"}
+
+        try:
+            self.processes.append(subprocess.Popen(mock_cmd, stdout=self.log, stderr=subprocess.STDOUT))
+            _wait_ready(f"http://127.0.0.1:{self.mock_port}/health", self.processes[-1], timeout=30)
+            self.processes.append(subprocess.Popen(api_cmd, stdout=self.log, stderr=subprocess.STDOUT, env=env))
+            _wait_ready(f"{self.base_url}/api/health", self.processes[-1], timeout=args.startup_timeout)
+        except Exception:
+            self.__exit__(None, None, None)
+            raise
+        return self
+
+    def __exit__(self, *exc_info):
+        for process in reversed(self.processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if self.log not in (None, subprocess.DEVNULL):
+            self.log.close()
+        return False
+
+
+def _wait_ready(url: str, process: subprocess.Popen, timeout: float):
+    """等待服務回應 200（子行程提前結束或逾時時拋出 RuntimeError）"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"服務啟動失敗（結束碼 {process.returncode}），請以 --server-log 查看輸出")
+        try:
+            if httpx.get(url, timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"等待 {url} 就緒逾時")
+
+
+# ==================== 主流程 ====================
+
+async def run_steps(base_url: str, args: argparse.Namespace) -> List[Dict]:
+    """依序執行每一階負載"""
+    picker = RequestPicker(parse_mix(args.mix), load_queries(args.queries_file), args.seed)
+    levels = [float(level) for level in args.steps.split(",")]
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    steps = []
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        for i in range(args.warmup):
+            endpoint, query = picker.next()
+            await send_request(client, endpoint, query, f"load-warmup-{i}")
+
+        for step, level in enumerate(levels):
+            if args.mode == "closed":
+                records, elapsed = await run_closed_step(client, picker, int(level), args.duration, step)
+            else:
+                records, elapsed = await run_open_step(
+                    client, picker, level, args.duration, step, args.sessions, args.seed
+                )
+            summary = summarize_step(records, level, elapsed)
+            steps.append(summary)
+            print_step(summary, args.mode)
+            await asyncio.sleep(args.cooldown)
+    return steps
+
+
+def print_step(step: Dict, mode: str):
+    """打印單一階段的結果"""
+    unit = "使用者" if mode == "closed" else "req/s"
+    latency = step["latency"] or {}
+    ttft = step["ttft"] or {}
+    print(f"  📶 {step['level']:>6g} {unit:<4} │ {step['throughput']:>7.2f} req/s │ "
+          f"p50 {latency.get('p50', 0):.3f}s  p95 {latency.get('p95', 0):.3f}s  p99 {latency.get('p99', 0):.3f}s │ "
+          f"TTFT p50 {ttft.get('p50', 0):.3f}s │ 錯誤 {step['error_rate'] * 100:.1f}%")
+
+
+def print_report(report: Dict):
+    """打印拐點摘要"""
+    knee = report["knee"]
+    unit = "個同時使用者" if report["params"]["mode"] == "closed" else " req/s"
+    print("\n" + "=" * 70)
+    print("📈 壓力測試結果")
+    print("=" * 70)
+    if knee["level"] is None:
+        print(f"  ❌ 第一階負載即已惡化: {'；'.join(knee['reasons'])}")
+    else:
+        print(f"  ✅ 延遲維持穩定的最大負載: {knee['level']:g}{unit}"
+              f"（{knee['throughput']:.2f} req/s，p95 {knee['p95']:.3f}s）")
+        if knee["degraded_at"] is not None:
+            print(f"  ⚠️  {knee['degraded_at']:g}{unit} 開始惡化: {'；'.join(knee['reasons'])}")
+        else:
+            print(f"  ℹ️  測試範圍內未出現拐點，可提高 --steps 上限")
+    print("=" * 70)
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="web_api 端到端壓力測試（並行度逐步提高）")
+    parser.add_argument("--mode", choices=("closed", "open"), default="closed",
+                        help="closed：固定同時使用者數；open：固定到達速率（Poisson）")
+    parser.add_argument("--steps", default="1,2,4,8,16", help="各階負載（閉環為使用者數，開環為每秒請求數）")
+    parser.add_argument("--duration", type=float, default=15.0, help="每一階的持續時間（秒）")
+    parser.add_argument("--warmup", type=int, default=3, help="開始前的暖身請求數")
+    parser.add_argument("--cooldown", type=float, default=1.0, help="階段之間的間隔（秒）")
+    parser.add_argument("--mix", default="query:0.5,stream:0.5", help="端點權重，例如 query:0.3,stream:0.7")
+    parser.add_argument("--queries-file", help="查詢集合（每行一個查詢，默認為內建查詢）")
+    parser.add_argument("--sessions", type=int, default=32, help="開環時輪流使用的會話數")
+    parser.add_argument("--timeout", type=float, default=60.0, help="單一請求逾時（秒）")
+    parser.add_argument("--knee-factor", type=float, default=2.0, help="p95 超過第一階的此倍數視為惡化")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="錯誤率上限")
+    parser.add_argument("--min-gain", type=float, default=0.1, help="閉環吞吐量相對前一階的最小增幅")
+    parser.add_argument("--min-achieved", type=float, default=0.9, help="開環實際吞吐量 / 目標速率的下限")
+    parser.add_argument("--target", help="對已在執行的服務施壓（例如 http://127.0.0.1:8000），不啟動本地服務")
+    parser.add_argument("--latency", default="uniform:0.05,0.3", help="模擬 chat 延遲分布")
+    parser.add_argument("--embedding-latency", default="uniform:0.02,0.1", help="模擬 embedding 延遲分布")
+    parser.add_argument("--token-rate", type=float, default=100, help="模擬流式 tokens/秒（<=0 不限速）")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模擬上游 500 錯誤比例")
+    parser.add_argument("--startup-timeout", type=float, default=120.0, help="等待 web_api 啟動的時間（秒）")
+    parser.add_argument("--server-log", help="將模擬上游與 web_api 的輸出寫入此檔案")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="results/load_test.json", help="結果 JSON 檔")
+    args = parser.parse_args()
+
+    print("=" * 70)
+    print(f"🏋️  web_api 壓力測試（{args.mode} loop，各階 {args.duration:g}s，端點 {args.mix}）")
+    print("=" * 70)
+    if args.target:
+        steps = asyncio.run(run_steps(args.target.rstrip("/"), args))
+    else:
+        print("🚀 啟動模擬上游與 web_api...")
+        with LocalStack(args) as stack:
+            steps = asyncio.run(run_steps(stack.base_url, args))
+
+    report = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "target": args.target or "local",
+        "params": {
+            "mode": args.mode,
+            "steps": [step["level"] for step in steps],
+            "duration": args.duration,
+            "mix": args.mix,
+            "queries_file": args.queries_file,
+            "latency": args.latency,
+            "token_rate": args.token_rate,
+            "seed": args.seed
+        },
+        "steps": steps,
+        "knee": find_knee(steps, args.mode, args.knee_factor, args.max_error_rate, args.min_gain, args.min_achieved)
+    }
+    print_report(report)
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"💾 壓力測試結果已儲存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
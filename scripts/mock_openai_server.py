@@ -0,0 +1,410 @@
+#!/usr/bin/env python3
+"""
+本地模擬 OpenAI 相容伺服器
+用於離線壓力測試與延遲測試，實作以下端點：
+- POST /v1/chat/completions（一般、流式、function call、JSON 模式）
+- POST /v1/embeddings
+
+支援可設定的延遲分布、token 速率、錯誤注入，輸出完全由輸入決定（可重現）
+
+使用方式：
+    python scripts/mock_openai_server.py --port 8001 --latency lognormal:-1.5,0.5 --token-rate 60
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 python web_api.py
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import os
+import random
+import re
+import sys
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# 添加父目錄到路徑，以便讀取 data/ 與 config
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+
+# ==================== 延遲分布 ====================
+
+class LatencyDistribution:
+    """
+    延遲分布（秒）
+
+    規格字串格式：
+        fixed:0.2
+        uniform:0.1,0.5
+        normal:0.3,0.05
+        lognormal:-1.5,0.5      # 參數為 ln(秒) 的 mu, sigma
+        pareto:0.1,2.5          # 最小值, alpha（重尾）
+    """
+
+    KINDS = ("fixed", "uniform", "normal", "lognormal", "pareto")
+
+    def __init__(self, spec: str):
+        kind, _, params = spec.partition(":")
+        kind = kind.strip().lower()
+        if kind not in self.KINDS:
+            raise ValueError(f"未知的延遲分布: {kind}（可用: {', '.join(self.KINDS)}）")
+        self.kind = kind
+        self.params = [float(p) for p in params.split(",") if p.strip()] if params else [0.0]
+        self.spec = spec
+
+    def sample(self, rng: random.Random) -> float:
+        """抽樣一次延遲"""
+        p = self.params
+        if self.kind == "fixed":
+            value = p[0]
+        elif self.kind == "uniform":
+            value = rng.uniform(p[0], p[1])
+        elif self.kind == "normal":
+            value = rng.gauss(p[0], p[1])
+        elif self.kind == "lognormal":
+            value = rng.lognormvariate(p[0], p[1])
+        else:
+            value = p[0] * rng.paretovariate(p[1])
+        return max(0.0, value)
+
+
+@dataclass
+class MockSettings:
+    """模擬伺服器設定"""
+    latency: str = "fixed:0.05"              # 首字節延遲（chat / function call）
+    embedding_latency: str = "fixed:0.02"    # Embedding 延遲
+    token_rate: float = 50.0                 # 流式輸出速率（tokens/秒），<=0 表示不限速
+    completion_tokens: int = 120             # 一般回答的 token 數（受 max_tokens 限制）
+    embedding_dim: int = 0                   # Embedding 維度（0 表示依模型自動決定）
+    error_rate: float = 0.0                  # 返回 500 的機率
+    rate_limit_rate: float = 0.0             # 返回 429 的機率
+    timeout_rate: float = 0.0                # 卡住 hang_seconds 秒的機率
+    hang_seconds: float = 30.0
+    seed: int = 42
+
+
+# ==================== 可重現輸出 ====================
+
+# 模擬回答使用的詞彙（每個元素視為一個 token）
+_VOCAB = [
+    "位址", "網路", "協定", "封包", "路由", "子網", "主機", "設定", "解析", "伺服器",
+    "分配", "轉譯", "記錄", "快取", "版本", "結構", "欄位", "範圍", "用途", "例如",
+    "，", "。", "可以", "用來", "表示", "通常", "需要", "透過", "以及", "因此",
+]
+
+_EMBEDDING_DIMS = {
+    "text-embedding-3-small": 1536,
+    "text-embedding-3-large": 3072,
+    "text-embedding-ada-002": 1536,
+}
+
+
+def _digest(text: str) -> int:
+    """穩定雜湊（不受 PYTHONHASHSEED 影響）"""
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "big")
+
+
+def estimate_tokens(text: str) -> int:
+    """粗估 token 數：CJK 每字約 1 token，其餘約每 4 字元 1 token"""
+    cjk = sum(1 for ch in text if "一" <= ch <= "鿿")
+    return cjk + max(0, len(text) - cjk) // 4 + 1
+
+
+def mock_embedding(text: str, dim: int) -> List[float]:
+    """
+    字元 bigram 特徵雜湊向量（已正規化）
+    相似的文字會得到相似的向量，使 RAG 檢索結果有意義且可重現
+    """
+    vec = [0.0] * dim
+    chars = text.strip()
+    grams = [chars[i:i + 2] for i in range(max(1, len(chars) - 1))]
+    for gram in grams:
+        h = _digest(gram)
+        vec[h % dim] += 1.0 if (h >> 32) & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vec)) or 1.0
+    return [v / norm for v in vec]
+
+
+def _load_knowledge_points() -> List[str]:
+    """載入知識點名稱（供 function call 模擬使用）"""
+    try:
+        with open(os.path.join(BASE_DIR, "data", "knowledge_points.json"), "r", encoding="utf-8") as f:
+            return [n for n in json.load(f).get("nodes", []) if isinstance(n, str)]
+    except Exception:
+        return []
+
+
+KNOWLEDGE_POINTS = _load_knowledge_points()
+
+
+def _extract_question(text: str) -> str:
+    """從提示詞中抽出「」包住的使用者問題"""
+    match = re.search(r"「(.+?)」", text, re.S)
+    return match.group(1) if match else text
+
+
+def detect_knowledge_points(text: str) -> List[str]:
+    """以字面匹配模擬知識點檢測（長名稱優先，避免「NAT」吃掉「NAT64 / DNS64」）"""
+    question = _extract_question(text).lower()
+    found = []
+    for kp in sorted(KNOWLEDGE_POINTS, key=len, reverse=True):
+        key = kp.lower()
+        if key in question:
+            found.append(kp)
+            question = question.replace(key, " ")
+    return found
+
+
+def detect_correctness(text: str) -> int:
+    """模擬 C 值：疑問句一律正確，陳述句依雜湊約 1/3 判為不正確"""
+    question = _extract_question(text)
+    if any(mark in question for mark in ("？", "?", "什麼", "如何", "為什麼")):
+        return 0
+    return 1 if _digest(question) % 3 == 0 else 0
+
+
+def mock_answer_tokens(prompt: str, n_tokens: int) -> List[str]:
+    """依提示詞產生可重現的回答 token 序列"""
+    rng = random.Random(_digest(prompt))
+    return ["【模擬回答】"] + [rng.choice(_VOCAB) for _ in range(max(0, n_tokens - 1))]
+
+
+# ==================== 應用程式 ====================
+
+def create_app(settings: Optional[MockSettings] = None) -> FastAPI:
+    """
+    建立模擬伺服器應用
+
+    Args:
+        settings: 模擬設定（默認值見 MockSettings）
+
+    Returns:
+        FastAPI 應用
+    """
+    settings = settings or MockSettings()
+    app = FastAPI(title="Mock OpenAI API", version="1.0.0")
+    app.state.settings = settings
+    app.state.rng = random.Random(settings.seed)
+    app.state.request_count = 0
+
+    chat_latency = LatencyDistribution(settings.latency)
+    embedding_latency = LatencyDistribution(settings.embedding_latency)
+
+    async def inject_fault() -> Optional[JSONResponse]:
+        """依設定機率注入錯誤或卡住"""
+        rng = app.state.rng
+        roll = rng.random()
+        if roll < settings.error_rate:
+            return JSONResponse(status_code=500, content={"error": {"message": "mock injected error", "type": "server_error"}})
+        roll -= settings.error_rate
+        if roll < settings.rate_limit_rate:
+            return JSONResponse(status_code=429, content={"error": {"message": "mock rate limit", "type": "rate_limit_error"}})
+        roll -= settings.rate_limit_rate
+        if roll < settings.timeout_rate:
+            await asyncio.sleep(settings.hang_seconds)
+        return None
+
+    def completion_id() -> str:
+        app.state.request_count += 1
+        return f"chatcmpl-mock-{app.state.request_count}"
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok", "requests": app.state.request_count, "settings": settings.__dict__}
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        body = await request.json()
+        fault = await inject_fault()
+        if fault is not None:
+            return fault
+        await asyncio.sleep(embedding_latency.sample(app.state.rng))
+
+        inputs = body.get("input", "")
+        if isinstance(inputs, str):
+            inputs = [inputs]
+        model = body.get("model", "text-embedding-3-small")
+        dim = settings.embedding_dim or _EMBEDDING_DIMS.get(model, 1536)
+        prompt_tokens = sum(estimate_tokens(str(t)) for t in inputs)
+        return {
+            "object": "list",
+            "data": [
+                {"object": "embedding", "index": i, "embedding": mock_embedding(str(text), dim)}
+                for i, text in enumerate(inputs)
+            ],
+            "model": model,
+            "usage": {"prompt_tokens": prompt_tokens, "total_tokens": prompt_tokens},
+        }
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        fault = await inject_fault()
+        if fault is not None:
+            return fault
+
+        model = body.get("model", "gpt-4o-mini")
+        messages = body.get("messages", [])
+        prompt_text = "\n".join(str(m.get("content", "")) for m in messages)
+        user_text = next((str(m.get("content", "")) for m in reversed(messages) if m.get("role") == "user"), "")
+        prompt_tokens = estimate_tokens(prompt_text)
+        max_tokens = body.get("max_tokens") or settings.completion_tokens
+        created = int(time.time())
+        cid = completion_id()
+
+        await asyncio.sleep(chat_latency.sample(app.state.rng))
+
+        # Function call（知識點檢測）
+        functions = body.get("functions") or [t.get("function", {}) for t in body.get("tools", []) if t.get("type") == "function"]
+        if functions:
+            name = functions[0].get("name", "function")
+            # 依函數參數填值：知識點一律返回，參數中有 correct 時一併返回 C 值（合併檢測）
+            result = {"knowledge_points": detect_knowledge_points(user_text)}
+            if "correct" in (functions[0].get("parameters") or {}).get("properties", {}):
+                result["correct"] = detect_correctness(user_text)
+            arguments = json.dumps(result, ensure_ascii=False)
+            completion_tokens = estimate_tokens(arguments)
+            message = {"role": "assistant", "content": None}
+            finish_reason = "function_call"
+            if body.get("tools"):
+                message["tool_calls"] = [{"id": f"call_{cid}", "type": "function", "function": {"name": name, "arguments": arguments}}]
+                finish_reason = "tool_calls"
+            else:
+                message["function_call"] = {"name": name, "arguments": arguments}
+            return {
+                "id": cid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": message, "finish_reason": finish_reason}],
+                "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                          "total_tokens": prompt_tokens + completion_tokens},
+            }
+
+        # JSON 模式（C 值檢測）
+        if (body.get("response_format") or {}).get("type") == "json_object":
+            content = json.dumps({"correct": detect_correctness(user_text)})
+            tokens = [content]
+        else:
+            tokens = mock_answer_tokens(prompt_text, min(int(max_tokens), settings.completion_tokens))
+            content = "".join(tokens)
+        completion_tokens = len(tokens)
+        usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                 "total_tokens": prompt_tokens + completion_tokens}
+
+        if not body.get("stream"):
+            if settings.token_rate > 0:
+                await asyncio.sleep(completion_tokens / settings.token_rate)
+            return {
+                "id": cid, "object": "chat.completion", "created": created, "model": model,
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+                "usage": usage,
+            }
+
+        include_usage = bool((body.get("stream_options") or {}).get("include_usage"))
+        interval = 1.0 / settings.token_rate if settings.token_rate > 0 else 0.0
+
+        def chunk(delta: dict, finish_reason=None, chunk_usage=None) -> str:
+            payload = {
+                "id": cid, "object": "chat.completion.chunk", "created": created, "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}] if chunk_usage is None else [],
+            }
+            if chunk_usage is not None:
+                payload["usage"] = chunk_usage
+            return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+        async def event_stream():
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(tokens):
+                if i and interval:
+                    await asyncio.sleep(interval)
+                yield chunk({"content": token})
+            yield chunk({}, finish_reason="stop")
+            if include_usage:
+                yield chunk({}, chunk_usage=usage)
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(event_stream(), media_type="text/event-stream")
+
+    return app
+
+
+class MockServerThread:
+    """在背景執行緒中啟動模擬伺服器（供基準測試與診斷工具使用）"""
+
+    def __init__(self, settings: Optional[MockSettings] = None, host: str = "127.0.0.1", port: int = 8001):
+        self.host = host
+        self.port = port
+        config = uvicorn.Config(create_app(settings), host=host, port=port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://{self.host}:{self.port}/v1"
+
+    def start(self, timeout: float = 10.0) -> "MockServerThread":
+        """啟動並等待伺服器就緒"""
+        self.thread.start()
+        deadline = time.monotonic() + timeout
+        while not self.server.started:
+            if time.monotonic() > deadline:
+                raise RuntimeError("模擬伺服器啟動逾時")
+            time.sleep(0.02)
+        return self
+
+    def stop(self):
+        """停止伺服器"""
+        self.server.should_exit = True
+        self.thread.join(timeout=5)
+
+
+def build_arg_parser() -> argparse.ArgumentParser:
+    """命令列參數（與 MockSettings 欄位對應）"""
+    defaults = MockSettings()
+    parser = argparse.ArgumentParser(description="本地模擬 OpenAI 相容伺服器")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--latency", default=defaults.latency, help="chat 首字節延遲分布，例如 lognormal:-1.5,0.5")
+    parser.add_argument("--embedding-latency", default=defaults.embedding_latency, help="embedding 延遲分布")
+    parser.add_argument("--token-rate", type=float, default=defaults.token_rate, help="流式 tokens/秒（<=0 不限速）")
+    parser.add_argument("--completion-tokens", type=int, default=defaults.completion_tokens)
+    parser.add_argument("--embedding-dim", type=int, default=defaults.embedding_dim)
+    parser.add_argument("--error-rate", type=float, default=defaults.error_rate)
+    parser.add_argument("--rate-limit-rate", type=float, default=defaults.rate_limit_rate)
+    parser.add_argument("--timeout-rate", type=float, default=defaults.timeout_rate)
+    parser.add_argument("--hang-seconds", type=float, default=defaults.hang_seconds)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+    return parser
+
+
+def settings_from_args(args: argparse.Namespace) -> MockSettings:
+    """從命令列參數建立 MockSettings"""
+    fields = MockSettings.__dataclass_fields__
+    return MockSettings(**{name: getattr(args, name) for name in fields if hasattr(args, name)})
+
+
+def main():
+    """主函數"""
+    args = build_arg_parser().parse_args()
+    settings = settings_from_args(args)
+
+    print("=" * 60)
+    print("🧪 模擬 OpenAI 伺服器")
+    print("=" * 60)
+    print(f"  位址: http://{args.host}:{args.port}/v1")
+    print(f"  延遲: chat={settings.latency}  embedding={settings.embedding_latency}")
+    print(f"  token 速率: {settings.token_rate}/s")
+    print(f"  錯誤注入: 500={settings.error_rate}  429={settings.rate_limit_rate}  hang={settings.timeout_rate}")
+    print(f"\n  使用方式: OPENAI_BASE_URL=http://{args.host}:{args.port}/v1 python web_api.py")
+    print("=" * 60)
+
+    uvicorn.run(create_app(settings), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+"""
+離線系統環境
+在背景啟動模擬 OpenAI 伺服器，並建立指向它的 ResponsesRAGSystem，
+供診斷、基準與壓力測試腳本共用：
+- 向量、歷史與會話資料寫到暫存目錄，不影響專案中的 vectors.pkl / history.json
+- 預設不輸出系統日誌（各模組的 print），只保留腳本自身的報告
+
+使用方式：
+    async with OfflineSystem(MockSettings(latency="uniform:0.05,0.3")) as system:
+        result = await system.process_query("什麼是 DNS？", session_id="s1")
+
+也可以直接執行，以暫存儲存啟動 web_api（上游由 OPENAI_BASE_URL 指定，供壓力測試以子行程啟動）：
+    OPENAI_BASE_URL=http://127.0.0.1:8001/v1 python scripts/offline_system.py --port 8100
+"""
+import argparse
+import contextlib
+import io
+import os
+import socket
+import sys
+import tempfile
+from typing import Optional
+
+# 添加父目錄到路徑，以便導入 main_parallel 與 config
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from config import Config
+from scripts.mock_openai_server import MockServerThread, MockSettings
+
+
+def free_port() -> int:
+    """取得一個可用的本機埠號"""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def quiet(enabled: bool = True):
+    """隱藏系統日誌輸出的上下文管理器（enabled=False 時不做任何事）"""
+    return contextlib.redirect_stdout(io.StringIO()) if enabled else contextlib.nullcontext()
+
+
+class OfflineSystem:
+    """模擬上游 + 暫存儲存的 ResponsesRAGSystem（async with 使用）"""
+
+    def __init__(self, settings: Optional[MockSettings] = None, port: int = None, verbose: bool = False,
+                 mock: bool = True):
+        """
+        初始化
+
+        Args:
+            settings: 模擬伺服器設定（延遲分布、token 速率、錯誤注入…）
+            port: 模擬伺服器埠號（默認自動選擇）
+            verbose: 是否輸出系統日誌
+            mock: 是否啟動模擬上游（False 時使用 Config 中設定的實際上游，只保留暫存儲存）
+        """
+        self.settings = settings or MockSettings()
+        self.port = port or free_port()
+        self.verbose = verbose
+        self.mock = mock
+        self.server: Optional[MockServerThread] = None
+        self.workdir: Optional[tempfile.TemporaryDirectory] = None
+        self.system = None
+
+    async def __aenter__(self):
+        from main_parallel import ResponsesRAGSystem
+
+        if self.mock:
+            self.server = MockServerThread(self.settings, port=self.port).start()
+            Config.OPENAI_BASE_URL = self.server.base_url
+        self.workdir = tempfile.TemporaryDirectory(prefix="rag-offline-")
+        Config.HISTORY_STORAGE_PATH = os.path.join(self.workdir.name, "history.json")
+        Config.HISTORY_DB_PATH = os.path.join(self.workdir.name, "history.db")
+        Config.SESSION_DB_PATH = os.path.join(self.workdir.name, "sessions.db")
+        Config.VECTOR_STORAGE_PATH = os.path.join(self.workdir.name, "vectors.pkl")
+
+        with quiet(not self.verbose):
+            self.system = ResponsesRAGSystem()
+            await self.system.initialize_documents()
+        return self.system
+
+    async def __aexit__(self, *exc_info):
+        if self.system is not None:
+            self.system.history_manager.close()
+        if self.server is not None:
+            self.server.stop()
+        if self.workdir is not None:
+            self.workdir.cleanup()
+        return False
+
+
+def serve_web_api(host: str = "127.0.0.1", port: int = 8100, log_level: str = "warning"):
+    """
+    以暫存目錄中的向量、歷史與會話資料啟動 web_api（阻塞直到結束）
+
+    Args:
+        host: 監聽位址
+        port: 監聽埠號
+        log_level: uvicorn 日誌等級
+    """
+    import uvicorn
+
+    with tempfile.TemporaryDirectory(prefix="rag-offline-api-") as workdir:
+        Config.HISTORY_STORAGE_PATH = os.path.join(workdir, "history.json")
+        Config.HISTORY_DB_PATH = os.path.join(workdir, "history.db")
+        Config.SESSION_DB_PATH = os.path.join(workdir, "sessions.db")
+        Config.VECTOR_STORAGE_PATH = os.path.join(workdir, "vectors.pkl")
+
+        from web_api import app
+        uvicorn.run(app, host=host, port=port, log_level=log_level)
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="以暫存儲存啟動 web_api（上游由 OPENAI_BASE_URL 指定）")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--log-level", default="warning")
+    args = parser.parse_args()
+    serve_web_api(args.host, args.port, args.log_level)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,436 @@
+#!/usr/bin/env python3
+"""
+效能回歸檢查
+執行固定的一組基準，與提交在版本庫中的基準檔（scripts/perf_baseline.json）比較，
+出現回歸時以非零狀態碼結束，可放在 CI 中防止 OPTIMIZATION_SUMMARY.md 中的優化悄悄退化：
+
+微基準（micro）：
+- retrieval：RAGRetriever.retrieve 在 1000 個 1536 維向量上的相似度計算（查詢向量命中快取）
+- prompt_assembly：最終回合提示詞組裝（RAG 片段格式化 + 情境提示 + 本體論）
+- history_persistence：歷史記錄已滿時新增一筆並追加寫入日誌（同步寫入，不經背景執行緒）
+- classification：K/C/R 三維度分類（模擬上游，零延遲，量測的是本地開銷）
+端到端（e2e）：
+- e2e_query：process_query 完整流程（模擬上游，零延遲、不限速）
+- e2e_stream：process_query_stream 完整流程
+
+判定方式：每個基準取多個樣本，與基準檔的樣本比較：
+- 中位數比值超過 1 + threshold（基準檔中各基準可有不同門檻），且
+- Mann-Whitney U 單尾檢定顯著（p < --alpha），兩者都成立才算回歸，避免雜訊造成誤報
+為了在不同機器上比較並抵銷執行期間的 CPU 速度變動（共用主機的雜訊往往達 ±30%），
+每個樣本之前都執行一次校準工作量（固定的純 Python 運算），樣本以「相對於校準工作量的倍數」保存與比較；
+報告中的毫秒數為倍數乘上本次的校準耗時。
+
+使用方式：
+    python scripts/perf_gate.py                      # 檢查（等同 check）
+    python scripts/perf_gate.py check --only retrieval,history_persistence
+    python scripts/perf_gate.py update --reason "改用矩陣檢索"   # 刻意更新基準檔
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+
+# 添加父目錄到路徑，以便導入 core、config 與 scripts 套件
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BASE_DIR)
+
+from config import Config
+from scripts.mock_openai_server import MockSettings
+from scripts.offline_system import OfflineSystem, quiet
+
+DEFAULT_BASELINE = os.path.join(BASE_DIR, "scripts", "perf_baseline.json")
+
+# 基準使用的查詢（固定，結果才可比較）
+GATE_QUERIES = [
+    "什麼是 IPv4？",
+    "請詳細解釋 DNS 解析的工作原理。",
+    "IPv4 位址是 128 位元",
+]
+
+# 零延遲、不限速的模擬上游：量測的是本地處理開銷，不受網路延遲影響
+GATE_MOCK = MockSettings(latency="fixed:0", embedding_latency="fixed:0", token_rate=0, seed=42)
+
+RETRIEVAL_DOCS = 1000
+RETRIEVAL_DIM = 1536
+
+
+# ==================== 基準 ====================
+
+@dataclass
+class Benchmark:
+    """單一基準：fn 執行 inner 次操作，樣本為每次操作的平均秒數"""
+    name: str
+    kind: str
+    fn: Callable[["GateContext", int], Awaitable[None]]
+    inner: int = 1
+    threshold: float = 0.2
+
+
+class GateContext:
+    """基準共用的狀態（離線系統、合成語料、暫存歷史…）"""
+
+    def __init__(self, system, workdir: str):
+        self.system = system
+        self.workdir = workdir
+        self.counter = 0
+        self._retrieval = None
+        self._prompt_inputs = None
+        self._history = None
+
+    def next_query(self) -> str:
+        self.counter += 1
+        return GATE_QUERIES[self.counter % len(GATE_QUERIES)]
+
+    def retrieval(self):
+        """1000 個合成向量的逐文件檢索（與 bench_retrieval 的 loop 相同）"""
+        if self._retrieval is None:
+            from scripts.bench_retrieval import METHODS, make_corpus, make_queries
+
+            corpus = make_corpus(RETRIEVAL_DOCS, RETRIEVAL_DIM, seed=42)
+            method = METHODS["loop"](argparse.Namespace(loop_max_docs=RETRIEVAL_DOCS))
+            method.build(corpus)
+            self._retrieval = (method, make_queries(corpus, 8, seed=42))
+        return self._retrieval
+
+    async def prompt_inputs(self):
+        """實際 RAG 與分類結果（提示詞組裝的輸入）"""
+        if self._prompt_inputs is None:
+            query = GATE_QUERIES[1]
+            rag_result = await self.system.main_thread_rag(query)
+            scenario_result = await self.system.scenario_classifier.classify(query)
+            self._prompt_inputs = (rag_result, scenario_result, query)
+        return self._prompt_inputs
+
+    def history(self):
+        """已填滿的暫存歷史記錄"""
+        if self._history is None:
+            from core.history_manager import HistoryManager
+
+            self._history = HistoryManager(storage_path=os.path.join(self.workdir, "gate_history.json"),
+                                           flush_interval=0)
+            for i in range(self._history.max_size):
+                self._history.add_query(
+                    GATE_QUERIES[i % len(GATE_QUERIES)], ["ipv4_basics"], {"K": "1", "C": "0", "R": "0"},
+                    knowledge_points=["IPv4"], session_id="gate"
+                )
+        return self._history
+
+
+async def _bench_retrieval(ctx: GateContext, n: int):
+    method, queries = ctx.retrieval()
+    for i in range(n):
+        await method.retrieve(queries[i % len(queries)], Config.RAG_TOP_K)
+
+
+async def _bench_prompt_assembly(ctx: GateContext, n: int):
+    rag_result, scenario_result, query = await ctx.prompt_inputs()
+    retriever = ctx.system.rag_retriever
+    for _ in range(n):
+        context = retriever.format_context(rag_result["retrieved_docs"])
+        ctx.system._build_final_prompt({**rag_result, "context": context}, scenario_result, query)
+
+
+async def _bench_history_persistence(ctx: GateContext, n: int):
+    history = ctx.history()
+    for i in range(n):
+        history.add_query(GATE_QUERIES[i % len(GATE_QUERIES)], ["ipv4_basics"], {"K": "1", "C": "0", "R": "0"},
+                          knowledge_points=["IPv4"], session_id="gate")
+
+
+async def _bench_classification(ctx: GateContext, n: int):
+    for _ in range(n):
+        await ctx.system.scenario_classifier.classify(ctx.next_query())
+
+
+async def _bench_e2e_query(ctx: GateContext, n: int):
+    for _ in range(n):
+        await ctx.system.process_query(ctx.next_query(), session_id=f"gate-{ctx.counter}")
+
+
+async def _bench_e2e_stream(ctx: GateContext, n: int):
+    for _ in range(n):
+        session = await ctx.system.session_store.get_async(f"gate-{ctx.counter}")
+        async for _event in ctx.system.process_query_stream(ctx.next_query(), session=session):
+            pass
+
+
+BENCHMARKS = {
+    benchmark.name: benchmark for benchmark in (
+        Benchmark("retrieval", "micro", _bench_retrieval, inner=3),
+        # 微秒級操作受快取與記憶體配置影響較大，門檻放寬
+        Benchmark("prompt_assembly", "micro", _bench_prompt_assembly, inner=2000, threshold=0.4),
+        Benchmark("history_persistence", "micro", _bench_history_persistence, inner=5),
+        Benchmark("classification", "micro", _bench_classification, inner=3, threshold=0.3),
+        Benchmark("e2e_query", "e2e", _bench_e2e_query, inner=2, threshold=0.3),
+        Benchmark("e2e_stream", "e2e", _bench_e2e_stream, inner=2, threshold=0.3),
+    )
+}
+
+
+# ==================== 量測與統計 ====================
+
+def calibrate(repeat: int = 3) -> float:
+    """校準工作量：固定的純 Python 運算（秒，取最小值，受瞬間背景負載影響最小）"""
+    timings = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        data = [(i * 7919) % 10007 for i in range(50000)]
+        data.sort()
+        json.dumps({str(i): data[i] for i in range(0, len(data), 10)})
+        timings.append(time.perf_counter() - t0)
+    return min(timings)
+
+
+async def measure(benchmark: Benchmark, ctx: GateContext, samples: int,
+                  warmup: int = 2) -> Tuple[List[float], List[float]]:
+    """
+    執行基準
+
+    Args:
+        benchmark: 基準
+        ctx: 共用狀態
+        samples: 樣本數
+        warmup: 暖身次數（不計入）
+
+    Returns:
+        (每次操作耗時相對於校準工作量的倍數, 各樣本的校準耗時)
+    """
+    for _ in range(warmup):
+        await benchmark.fn(ctx, 1)
+    results = []
+    calibrations = []
+    for _ in range(samples):
+        calibration = calibrate()
+        t0 = time.perf_counter()
+        await benchmark.fn(ctx, benchmark.inner)
+        results.append((time.perf_counter() - t0) / benchmark.inner / calibration)
+        calibrations.append(calibration)
+    return results, calibrations
+
+
+def mann_whitney_greater(current: List[float], baseline: List[float]) -> float:
+    """
+    Mann-Whitney U 單尾檢定（常態近似，含同分修正）
+
+    Args:
+        current: 本次樣本
+        baseline: 基準樣本
+
+    Returns:
+        「current 傾向大於 baseline」的 p 值
+    """
+    n1, n2 = len(current), len(baseline)
+    if n1 == 0 or n2 == 0:
+        return 1.0
+    combined = sorted((value, group) for group, values in enumerate((current, baseline)) for value in values)
+
+    # 平均秩（同分取平均）與同分修正項
+    rank_sum = 0.0
+    tie_term = 0.0
+    i = 0
+    while i < len(combined):
+        j = i
+        while j + 1 < len(combined) and combined[j + 1][0] == combined[i][0]:
+            j += 1
+        average_rank = (i + j) / 2 + 1
+        rank_sum += average_rank * sum(1 for k in range(i, j + 1) if combined[k][1] == 0)
+        tie_term += (j - i + 1) ** 3 - (j - i + 1)
+        i = j + 1
+
+    u = rank_sum - n1 * (n1 + 1) / 2
+    n = n1 + n2
+    variance = n1 * n2 / 12 * ((n + 1) - tie_term / (n * (n - 1)))
+    if variance <= 0:
+        return 1.0
+    z = (u - n1 * n2 / 2 - 0.5) / math.sqrt(variance)  # 連續性修正
+    return 0.5 * math.erfc(z / math.sqrt(2))
+
+
+def describe(samples: List[float]) -> Dict:
+    """樣本摘要（中位數與 MAD，保留 6 位有效數字）"""
+    samples = [float(f"{value:.6g}") for value in samples]
+    median = statistics.median(samples)
+    return {
+        "median": median,
+        "mad": float(f"{statistics.median(abs(value - median) for value in samples):.6g}"),
+        "samples": samples
+    }
+
+
+def compare(name: str, current: List[float], baseline: Optional[Dict], threshold: float, alpha: float) -> Dict:
+    """
+    與基準比較單一基準
+
+    Args:
+        name: 基準名稱
+        current: 本次樣本（相對於校準工作量的倍數）
+        baseline: 基準檔中的記錄（沒有時為 None）
+        threshold: 中位數比值門檻（基準檔中的設定優先）
+        alpha: 顯著水準
+
+    Returns:
+        比較結果（status 為 ok / regression / improved / new）
+    """
+    result = {"name": name, "current_median": statistics.median(current)}
+    if baseline is None:
+        return {**result, "status": "new"}
+
+    threshold = baseline.get("threshold", threshold)
+    ratio = result["current_median"] / baseline["median"] if baseline["median"] > 0 else 1.0
+    p_slower = mann_whitney_greater(current, baseline["samples"])
+    p_faster = mann_whitney_greater(baseline["samples"], current)
+    if ratio > 1 + threshold and p_slower < alpha:
+        status = "regression"
+    elif ratio < 1 - threshold and p_faster < alpha:
+        status = "improved"
+    else:
+        status = "ok"
+    return {
+        **result,
+        "baseline_median": baseline["median"],
+        "ratio": round(ratio, 4),
+        "threshold": threshold,
+        "p_value": round(p_slower, 6),
+        "status": status
+    }
+
+
+def load_baseline(path: str) -> Optional[Dict]:
+    """讀取基準檔（不存在時返回 None）"""
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+# ==================== 主流程 ====================
+
+async def run_benchmarks(names: List[str], samples: Dict[str, int]) -> Tuple[Dict[str, List[float]], float]:
+    """
+    在離線系統中依序執行基準
+
+    Returns:
+        (基準名稱 → 相對倍數樣本, 校準耗時中位數)
+    """
+    results = {}
+    calibrations = []
+    async with OfflineSystem(GATE_MOCK) as system:
+        with tempfile.TemporaryDirectory(prefix="rag-perf-gate-") as workdir:
+            ctx = GateContext(system, workdir)
+            for name in names:
+                benchmark = BENCHMARKS[name]
+                with quiet():
+                    results[name], timings = await measure(benchmark, ctx, samples[benchmark.kind])
+                calibrations.extend(timings)
+                print(f"  ⏱️  {name:<20} 中位數 {statistics.median(results[name]):>10.4f} 倍"
+                      f"（約 {statistics.median(results[name]) * statistics.median(timings) * 1000:.3f}ms）")
+    return results, statistics.median(calibrations)
+
+
+def _environment() -> Dict:
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count()
+    }
+
+
+def print_report(comparisons: List[Dict], calibration: float):
+    """打印比較結果（毫秒數 = 相對倍數 × 本次校準耗時）"""
+    icons = {"ok": "✅", "regression": "❌", "improved": "🚀", "new": "🆕"}
+    print("\n" + "=" * 70)
+    print(f"📏 效能回歸檢查（本次校準工作量 {calibration * 1000:.2f}ms）")
+    print("=" * 70)
+    print(f"  {'基準':<22}{'基準值(ms)':>12}{'本次(ms)':>12}{'比值':>8}{'p 值':>10}")
+    for item in comparisons:
+        baseline = f"{item['baseline_median'] * calibration * 1000:.3f}" if "baseline_median" in item else "-"
+        ratio = f"{item['ratio']:.2f}" if "ratio" in item else "-"
+        p_value = f"{item['p_value']:.4f}" if "p_value" in item else "-"
+        print(f"  {icons[item['status']]} {item['name']:<20}{baseline:>12}"
+              f"{item['current_median'] * calibration * 1000:>12.3f}{ratio:>8}{p_value:>10}")
+    print("=" * 70)
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="效能回歸檢查（與提交的基準檔比較）")
+    parser.add_argument("command", nargs="?", choices=("check", "update"), default="check",
+                        help="check：比較並在回歸時返回非零狀態碼；update：以本次結果覆寫基準檔")
+    parser.add_argument("--only", help=f"只執行指定基準（逗號分隔，可用: {', '.join(BENCHMARKS)}）")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基準檔路徑")
+    parser.add_argument("--samples", type=int, default=15, help="微基準樣本數")
+    parser.add_argument("--e2e-samples", type=int, default=8, help="端到端基準樣本數")
+    parser.add_argument("--threshold", type=float, default=0.2, help="預設的中位數比值門檻（基準檔中的設定優先）")
+    parser.add_argument("--alpha", type=float, default=0.01, help="Mann-Whitney U 檢定的顯著水準")
+    parser.add_argument("--reason", default="", help="更新基準檔的原因（記錄在基準檔中）")
+    parser.add_argument("--output", help="將比較結果寫入 JSON 檔")
+    args = parser.parse_args()
+
+    names = [name.strip() for name in args.only.split(",")] if args.only else list(BENCHMARKS)
+    unknown = [name for name in names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"未知的基準: {', '.join(unknown)}")
+
+    baseline = load_baseline(args.baseline)
+    if args.command == "check" and baseline is None:
+        print(f"❌ 找不到基準檔 {args.baseline}，請先執行: python scripts/perf_gate.py update")
+        sys.exit(2)
+
+    print("=" * 70)
+    print(f"📏 效能基準（{'更新基準檔' if args.command == 'update' else '回歸檢查'}）")
+    print("=" * 70)
+    results, calibration = asyncio.run(run_benchmarks(names, {"micro": args.samples, "e2e": args.e2e_samples}))
+
+    if args.command == "update":
+        # 只更新本次執行的基準，其他基準保留
+        previous = baseline or {"benchmarks": {}}
+        benchmarks = {name: record for name, record in previous["benchmarks"].items() if name not in results}
+        for name, samples in results.items():
+            benchmarks[name] = {"kind": BENCHMARKS[name].kind, "threshold": BENCHMARKS[name].threshold,
+                                **describe(samples)}
+        data = {
+            "created_at": datetime.now().isoformat(timespec="seconds"),
+            "reason": args.reason,
+            "environment": _environment(),
+            "calibration": round(calibration, 6),  # 僅供參考：建立基準時的校準耗時（秒）
+            "benchmarks": dict(sorted(benchmarks.items(), key=lambda item: list(BENCHMARKS).index(item[0])
+                                      if item[0] in BENCHMARKS else len(BENCHMARKS)))
+        }
+        with open(args.baseline, "w", encoding="utf-8") as f:
+            json.dump(data, f, ensure_ascii=False, indent=2)
+            f.write("\n")
+        print(f"💾 基準檔已更新: {args.baseline}")
+        return
+
+    comparisons = [
+        compare(name, samples, baseline["benchmarks"].get(name), args.threshold, args.alpha)
+        for name, samples in results.items()
+    ]
+    print_report(comparisons, calibration)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump({"calibration": calibration, "comparisons": comparisons}, f, ensure_ascii=False, indent=2)
+        print(f"💾 比較結果已儲存: {args.output}")
+
+    regressions = [item["name"] for item in comparisons if item["status"] == "regression"]
+    if any(item["status"] == "improved" for item in comparisons):
+        print("🚀 部分基準明顯變快，確認後可執行 update 更新基準檔")
+    if regressions:
+        print(f"❌ 效能回歸: {', '.join(regressions)}")
+        sys.exit(1)
+    print("✅ 沒有效能回歸")
+
+
+if __name__ == "__main__":
+    main()
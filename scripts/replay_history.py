@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+歷史流量重播工具
+讀取實際記錄的學生查詢（history.json 或 JSON Lines 請求日誌），依原始的到達間隔
+（或時間縮放後）重新送出，用真實的重複模式而不是合成查詢來驗證快取與擴展性的改動：
+- 同一會話內的查詢依原順序逐一送出（前一個完成後才送下一個），R 值（重複性）才有意義
+- 不同會話之間依時間戳並行
+- 目標可以是行程內的 ResponsesRAGSystem（預設使用模擬上游，完全離線）或執行中的 web API
+
+報告延遲與 TTFT 分位數（並依 Embedding 快取命中 / 未命中分開）、快取命中率
+（與記錄中同會話重複查詢比例的上限比較）、重播的 R=1 比例與記錄值的一致率，以及排程延遲。
+
+記錄格式：
+- history.json：{"history": [{"query", "session_id", "timestamp", "dimensions", ...}, ...]}
+- JSON Lines：每行一個物件，至少包含 query；timestamp 可為 ISO 8601 字串或 Unix 秒數
+
+使用方式：
+    python scripts/replay_history.py history.json --speed 10
+    python scripts/replay_history.py requests.log.jsonl --speed 0 --url http://127.0.0.1:8000
+    python scripts/replay_history.py history.json --max-gap 5 --output results/replay.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from dataclasses import dataclass, field
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import httpx
+
+# 添加父目錄到路徑，以便導入 config 與 scripts 套件
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import Config
+from scripts.load_test import distribution
+from scripts.mock_openai_server import MockSettings
+from scripts.offline_system import OfflineSystem, quiet
+
+
+@dataclass
+class ReplayEvent:
+    """一筆要重播的查詢"""
+    offset: float
+    session_id: str
+    query: str
+    recorded: Dict = field(default_factory=dict)
+
+
+@dataclass
+class ReplayResult:
+    """一筆重播結果"""
+    event: ReplayEvent
+    ok: bool
+    latency: float
+    start_lag: float
+    ttft: Optional[float] = None
+    cache_hit: Optional[bool] = None
+    dimensions: Dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+# ==================== 讀取記錄 ====================
+
+def _parse_timestamp(value) -> Optional[float]:
+    """ISO 8601 字串或 Unix 秒數 → Unix 秒數（無法解析時為 None）"""
+    if value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return datetime.fromisoformat(str(value)).timestamp()
+    except ValueError:
+        return None
+
+
+def load_workload(path: str, max_gap: float = None) -> List[ReplayEvent]:
+    """
+    讀取記錄並轉換為依時間排序的重播事件
+
+    Args:
+        path: history.json 或 JSON Lines 檔
+        max_gap: 相鄰查詢的最大間隔（秒），超過時壓縮為此值（跳過長時間的閒置）
+
+    Returns:
+        重播事件列表（offset 為相對於第一筆的秒數；沒有時間戳的記錄依檔案順序間隔 0 秒）
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        text = f.read()
+    try:
+        data = json.loads(text)
+        records = data["history"] if isinstance(data, dict) else data
+    except json.JSONDecodeError:
+        records = [json.loads(line) for line in text.splitlines() if line.strip()]
+
+    entries = []
+    for index, record in enumerate(records):
+        if not record.get("query"):
+            continue
+        entries.append((_parse_timestamp(record.get("timestamp")), index, record))
+    # 依時間戳排序；沒有時間戳的記錄沿用前一筆的時間（維持檔案順序）
+    last = 0.0
+    timed = []
+    for timestamp, index, record in entries:
+        last = timestamp if timestamp is not None else last
+        timed.append((last, index, record))
+    timed.sort(key=lambda item: (item[0], item[1]))
+
+    events = []
+    offset = 0.0
+    previous = timed[0][0] if timed else 0.0
+    for timestamp, _, record in timed:
+        gap = timestamp - previous
+        offset += min(gap, max_gap) if max_gap is not None else gap
+        previous = timestamp
+        events.append(ReplayEvent(
+            offset=offset,
+            session_id=record.get("session_id") or Config.DEFAULT_SESSION_ID,
+            query=record["query"],
+            recorded=record
+        ))
+    return events
+
+
+def repeat_ratio(events: List[ReplayEvent]) -> float:
+    """同一會話內重複出現的查詢比例（Embedding 快取命中率的上限，不計快取容量限制）"""
+    seen = set()
+    repeats = 0
+    for event in events:
+        key = (event.session_id, event.query)
+        repeats += key in seen
+        seen.add(key)
+    return repeats / len(events) if events else 0.0
+
+
+# ==================== 送出查詢 ====================
+
+class SystemTarget:
+    """行程內的 ResponsesRAGSystem"""
+
+    def __init__(self, system):
+        self.system = system
+
+    async def send(self, event: ReplayEvent) -> Dict:
+        result = await self.system.process_query(event.query, session_id=event.session_id)
+        return {
+            "ttft": result["timing"].get("ttft"),
+            "cache_hit": result["timing"]["rag"].get("embedding_cache_hit"),
+            "dimensions": result["dimensions"]
+        }
+
+
+class HttpTarget:
+    """執行中的 web API（POST /api/query）"""
+
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+
+    async def send(self, event: ReplayEvent) -> Dict:
+        response = await self.client.post("/api/query", json={"query": event.query, "session_id": event.session_id})
+        response.raise_for_status()
+        data = response.json()
+        return {
+            "ttft": data["timing_details"].get("ttft"),
+            "cache_hit": data.get("cache", {}).get("embedding_cache_hit"),
+            "dimensions": data["dimensions"]
+        }
+
+
+async def replay(target, events: List[ReplayEvent], speed: float) -> List[ReplayResult]:
+    """
+    依時間表重播（每個會話一個協程，會話內依序送出）
+
+    Args:
+        target: SystemTarget 或 HttpTarget
+        events: 重播事件
+        speed: 時間縮放倍數（2 表示兩倍速；0 表示不等待，會話內仍依序）
+
+    Returns:
+        重播結果（依完成順序）
+    """
+    sessions: Dict[str, List[ReplayEvent]] = defaultdict(list)
+    for event in events:
+        sessions[event.session_id].append(event)
+
+    results: List[ReplayResult] = []
+    t_start = time.perf_counter()
+
+    async def run_session(session_events: List[ReplayEvent]):
+        for event in session_events:
+            scheduled = t_start + (event.offset / speed if speed > 0 else 0.0)
+            await asyncio.sleep(max(0.0, scheduled - time.perf_counter()))
+            started = time.perf_counter()
+            try:
+                info = await target.send(event)
+                results.append(ReplayResult(
+                    event=event, ok=True, latency=time.perf_counter() - started,
+                    start_lag=max(0.0, started - scheduled), **info
+                ))
+            except Exception as e:
+                results.append(ReplayResult(
+                    event=event, ok=False, latency=time.perf_counter() - started,
+                    start_lag=max(0.0, started - scheduled), error=f"{type(e).__name__}: {e}"
+                ))
+
+    await asyncio.gather(*(run_session(session_events) for session_events in sessions.values()))
+    return results
+
+
+# ==================== 報告 ====================
+
+def summarize(results: List[ReplayResult], events: List[ReplayEvent], wall_time: float) -> Dict:
+    """
+    彙總重播結果
+
+    Args:
+        results: 重播結果
+        events: 重播事件（計算記錄中的重複比例）
+        wall_time: 重播實際耗時（秒）
+
+    Returns:
+        統計字典
+    """
+    ok = [r for r in results if r.ok]
+    hits = [r for r in ok if r.cache_hit]
+    misses = [r for r in ok if r.cache_hit is False]
+    replayed_r = [str(r.dimensions.get("R")) for r in ok if "R" in r.dimensions]
+    compared = [
+        (str(r.dimensions.get("R")), str(r.event.recorded["dimensions"]["R"]))
+        for r in ok
+        if "R" in r.dimensions and "R" in (r.event.recorded.get("dimensions") or {})
+    ]
+    return {
+        "requests": len(results),
+        "sessions": len({e.session_id for e in events}),
+        "errors": len(results) - len(ok),
+        "error_samples": [r.error for r in results if not r.ok][:5],
+        "wall_time": round(wall_time, 3),
+        "recorded_span": round(events[-1].offset, 3) if events else 0.0,
+        "throughput": round(len(ok) / wall_time, 3) if wall_time > 0 else 0.0,
+        "latency": distribution([r.latency for r in ok]),
+        "ttft": distribution([r.ttft for r in ok if r.ttft]),
+        "start_lag": distribution([r.start_lag for r in results]),
+        "cache": {
+            "embedding_hit_rate": round(len(hits) / len(ok), 4) if ok else 0.0,
+            "workload_repeat_ratio": round(repeat_ratio(events), 4),
+            "latency_hit": distribution([r.latency for r in hits]),
+            "latency_miss": distribution([r.latency for r in misses])
+        },
+        "repetition": {
+            "replayed_r1_rate": round(replayed_r.count("1") / len(replayed_r), 4) if replayed_r else None,
+            "recorded_r1_rate": round(sum(1 for _, rec in compared if rec == "1") / len(compared), 4)
+            if compared else None,
+            "agreement": round(sum(1 for new, rec in compared if new == rec) / len(compared), 4)
+            if compared else None,
+            "compared": len(compared)
+        }
+    }
+
+
+def _fmt(dist: Optional[Dict], key: str) -> str:
+    return f"{dist[key]:.3f}s" if dist else "-"
+
+
+def print_report(summary: Dict, speed: float):
+    """打印重播報告"""
+    cache = summary["cache"]
+    repetition = summary["repetition"]
+    print("\n" + "=" * 70)
+    print(f"🔁 歷史流量重播（{'不等待' if speed <= 0 else f'{speed:g} 倍速'}）")
+    print("=" * 70)
+    print(f"  查詢數: {summary['requests']}（{summary['sessions']} 個會話），錯誤 {summary['errors']}")
+    print(f"  記錄時間跨度: {summary['recorded_span']:.1f}s → 重播耗時 {summary['wall_time']:.1f}s"
+          f"（{summary['throughput']:.2f} req/s）")
+    print(f"  延遲: p50 {_fmt(summary['latency'], 'p50')}  p95 {_fmt(summary['latency'], 'p95')}"
+          f"  p99 {_fmt(summary['latency'], 'p99')}")
+    print(f"  TTFT: p50 {_fmt(summary['ttft'], 'p50')}  p95 {_fmt(summary['ttft'], 'p95')}")
+    print(f"  排程延遲: p95 {_fmt(summary['start_lag'], 'p95')}（同會話前一個查詢尚未完成時會延後）")
+    print(f"  Embedding 快取命中率: {cache['embedding_hit_rate'] * 100:.1f}%"
+          f"（記錄中同會話重複查詢 {cache['workload_repeat_ratio'] * 100:.1f}%）")
+    print(f"    ├─ 命中 p50 {_fmt(cache['latency_hit'], 'p50')}，未命中 p50 {_fmt(cache['latency_miss'], 'p50')}")
+    if repetition["replayed_r1_rate"] is not None:
+        print(f"  R=1 比例: 重播 {repetition['replayed_r1_rate'] * 100:.1f}%", end="")
+        if repetition["compared"]:
+            print(f"，記錄 {repetition['recorded_r1_rate'] * 100:.1f}%，"
+                  f"一致率 {repetition['agreement'] * 100:.1f}%（{repetition['compared']} 筆）")
+        else:
+            print()
+    if summary["error_samples"]:
+        print(f"  ⚠️  錯誤範例: {summary['error_samples'][0]}")
+    print("=" * 70)
+
+
+async def run(args: argparse.Namespace) -> Dict:
+    """載入記錄並對目標重播"""
+    events = load_workload(args.log, args.max_gap)
+    if args.limit:
+        events = events[:args.limit]
+    if not events:
+        raise SystemExit(f"❌ {args.log} 中沒有可重播的查詢")
+    print(f"📂 載入 {len(events)} 個查詢（{len({e.session_id for e in events})} 個會話）")
+
+    t0 = time.perf_counter()
+    if args.url:
+        async with httpx.AsyncClient(base_url=args.url.rstrip("/"), timeout=args.timeout) as client:
+            results = await replay(HttpTarget(client), events, args.speed)
+    else:
+        settings = MockSettings(
+            latency=args.latency, embedding_latency=args.embedding_latency,
+            token_rate=args.token_rate, seed=args.seed
+        )
+        async with OfflineSystem(settings, verbose=args.verbose, mock=not args.live) as system:
+            with quiet(not args.verbose):
+                results = await replay(SystemTarget(system), events, args.speed)
+    return summarize(results, events, time.perf_counter() - t0)
+
+
+def main():
+    """主函數"""
+    parser = argparse.ArgumentParser(description="歷史流量重播（保留會話內順序與到達間隔）")
+    parser.add_argument("log", nargs="?", default=Config.HISTORY_STORAGE_PATH,
+                        help="history.json 或 JSON Lines 請求日誌")
+    parser.add_argument("--speed", type=float, default=1.0, help="時間縮放倍數（0 表示不等待，會話內仍依序）")
+    parser.add_argument("--max-gap", type=float, help="相鄰查詢的最大間隔（秒），壓縮長時間閒置")
+    parser.add_argument("--limit", type=int, help="只重播前 N 個查詢")
+    parser.add_argument("--url", help="對執行中的 web API 重播（例如 http://127.0.0.1:8000），默認為行程內系統")
+    parser.add_argument("--live", action="store_true", help="行程內系統使用實際上游（默認為模擬上游）")
+    parser.add_argument("--timeout", type=float, default=60.0, help="web API 請求逾時（秒）")
+    parser.add_argument("--latency", default="uniform:0.05,0.3", help="模擬 chat 延遲分布")
+    parser.add_argument("--embedding-latency", default="uniform:0.02,0.1", help="模擬 embedding 延遲分布")
+    parser.add_argument("--token-rate", type=float, default=100, help="模擬流式 tokens/秒（<=0 不限速）")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", help="將重播結果寫入 JSON 檔")
+    parser.add_argument("--verbose", action="store_true", help="輸出系統日誌")
+    args = parser.parse_args()
+
+    summary = asyncio.run(run(args))
+    print_report(summary, args.speed)
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(summary, f, ensure_ascii=False, indent=2)
+        print(f"💾 重播結果已儲存: {args.output}")
+
+
+if __name__ == "__main__":
+    main()
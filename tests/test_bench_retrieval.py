@@ -0,0 +1,76 @@
+"""
+檢索基準測試
+驗證各檢索方式在小型合成語料上的結果與精確 top-k 一致（量化與 IVF 允許少量誤差）
+"""
+import argparse
+
+import numpy as np
+
+from scripts.bench_retrieval import METHODS, bench_method, exact_top_k, make_corpus, make_queries, recall_at_k
+
+
+def _args(**overrides) -> argparse.Namespace:
+    """基準腳本的預設參數"""
+    params = dict(loop_max_docs=10000, nlist=0, nprobe=0, seed=42, top_k=3,
+                  hnsw_m=16, ef_construction=200, ef_search=64)
+    params.update(overrides)
+    return argparse.Namespace(**params)
+
+
+def _search_all(name, corpus, queries, k=3, **overrides):
+    """以指定方式建立索引並搜尋所有查詢"""
+    method = METHODS[name](_args(**overrides))
+    method.build(corpus)
+    found = [method.search(query, k) for query in queries]
+    method.close()
+    return found
+
+
+def test_corpus_is_normalized_and_reproducible():
+    """合成語料為單位向量，相同種子產生相同語料"""
+    corpus = make_corpus(300, 32, seed=7)
+    assert corpus.dtype == np.float32
+    assert np.allclose(np.linalg.norm(corpus, axis=1), 1.0, atol=1e-5)
+    assert np.array_equal(corpus, make_corpus(300, 32, seed=7))
+
+
+def test_exact_methods_match_ground_truth():
+    """逐文件迴圈與矩陣搜尋的結果與精確 top-k 完全相同"""
+    corpus = make_corpus(400, 32)
+    queries = make_queries(corpus, 10)
+    truth = exact_top_k(corpus, queries, 3)
+
+    for name in ("loop", "matrix"):
+        found = _search_all(name, corpus, queries)
+        assert recall_at_k(found, truth, 3) == 1.0, name
+
+
+def test_approximate_methods_recall():
+    """int8 量化 recall 接近 1；IVF 搜尋全部群時等同精確搜尋"""
+    corpus = make_corpus(400, 32)
+    queries = make_queries(corpus, 20)
+    truth = exact_top_k(corpus, queries, 3)
+
+    assert recall_at_k(_search_all("int8", corpus, queries), truth, 3) >= 0.9
+    assert recall_at_k(_search_all("ivf", corpus, queries, nlist=8, nprobe=8), truth, 3) == 1.0
+
+
+def test_bench_method_record():
+    """量測結果包含延遲分位數、吞吐量、索引大小與 recall"""
+    corpus = make_corpus(200, 16)
+    queries = make_queries(corpus, 5)
+    record = bench_method(METHODS["matrix"](_args()), corpus, queries, exact_top_k(corpus, queries, 3), 3)
+
+    assert record["status"] == "ok"
+    assert record["index_bytes"] == corpus.nbytes
+    assert record["recall_at_3"] == 1.0
+    assert record["latency_ms"]["p50"] <= record["latency_ms"]["p99"] <= record["latency_ms"]["max"]
+    assert record["qps"] > 0
+
+
+if __name__ == "__main__":
+    test_corpus_is_normalized_and_reproducible()
+    test_exact_methods_match_ground_truth()
+    test_approximate_methods_recall()
+    test_bench_method_record()
+    print("✅ 檢索基準測試通過")
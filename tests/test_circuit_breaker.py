@@ -0,0 +1,178 @@
+"""
+斷路器測試
+驗證 closed → open → half_open → closed 狀態轉換
+"""
+import asyncio
+import time
+from types import SimpleNamespace
+
+from core.circuit_breaker import CircuitBreaker
+
+
+def test_opens_after_threshold():
+    """連續失敗達到閾值後開啟，並直接拒絕請求"""
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=60)
+
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+    assert breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    assert not breaker.allow_request(), "開啟狀態應拒絕請求"
+    assert breaker.get_stats()["total_rejected"] == 1
+
+
+def test_success_resets_failures():
+    """成功調用會重置連續失敗次數"""
+    breaker = CircuitBreaker("test", failure_threshold=2, recovery_timeout=60)
+
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_half_open_probe():
+    """恢復時間後只放行一個探測請求，成功則關閉、失敗則重新開啟"""
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.01)
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    time.sleep(0.02)
+
+    assert breaker.allow_request(), "應放行探測請求"
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    assert not breaker.allow_request(), "探測進行中應拒絕其他請求"
+
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.02)
+    assert breaker.allow_request()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.allow_request()
+
+
+def test_lost_probe_reopens():
+    """探測請求逾期未回報時重新開啟，經過恢復時間後可再次探測"""
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.01, probe_timeout=0.05)
+
+    breaker.record_failure()
+    time.sleep(0.02)
+    assert breaker.allow_request(), "應放行探測請求"
+    assert not breaker.allow_request()
+
+    time.sleep(0.06)
+    assert not breaker.allow_request(), "遺失的探測應使斷路器重新開啟"
+    assert breaker.state == CircuitBreaker.OPEN
+
+    time.sleep(0.02)
+    assert breaker.allow_request(), "重新開啟後應能再次探測"
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+class _HangingClient:
+    """上游請求永遠不回應的假 client（用來在等待中取消）"""
+
+    def __init__(self):
+        self.started = asyncio.Event()
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._hang))
+        self.embeddings = SimpleNamespace(create=self._hang)
+
+    async def _hang(self, **kwargs):
+        self.started.set()
+        await asyncio.Event().wait()
+
+
+def _half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=0.01)
+    breaker.record_failure()
+    time.sleep(0.02)
+    return breaker
+
+
+async def _cancel_during_probe(component, call):
+    component.client = _HangingClient()
+    component.breaker = _half_open_breaker()
+    task = asyncio.create_task(call())
+    await component.client.started.wait()
+    assert component.breaker.state == CircuitBreaker.HALF_OPEN
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+    else:
+        raise AssertionError("請求應被取消")
+    return component.breaker
+
+
+def test_cancelled_probe_releases_breaker():
+    """C 值檢測、知識點檢測與 Embedding 在探測中被取消時釋放名額，下一個請求可繼續探測"""
+    from core.tools.correctness_detector import CorrectnessDetector
+    from core.tools.knowledge_detector import KnowledgeDetector
+    from core.vector_store import VectorStore
+
+    correctness = CorrectnessDetector(api_key="test")
+    knowledge = KnowledgeDetector(api_key="test")
+    store = VectorStore(storage_path="unused.pkl", api_key="test", use_local=False)
+    for component, call in (
+        (correctness, lambda: correctness.detect("IPv4 是什麼？")),
+        (knowledge, lambda: knowledge.detect("IPv4 是什麼？")),
+        (store, lambda: store.create_embedding("IPv4")),
+    ):
+        breaker = asyncio.run(_cancel_during_probe(component, call))
+        assert breaker.state == CircuitBreaker.HALF_OPEN
+        assert breaker.get_stats()["total_failures"] == 1, "取消不應計為上游失敗"
+        assert breaker.allow_request(), "取消後應放行下一個探測請求"
+
+
+class _ReplyClient:
+    """依序返回指定內容（或拋出例外）的假 client"""
+
+    def __init__(self, *replies):
+        self.replies = list(replies)
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    async def _create(self, **kwargs):
+        reply = self.replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=reply))], usage=None)
+
+
+def test_correctness_bad_output_is_not_upstream_failure():
+    """C 值回應無法解析或超出範圍時只計一次成功並限制在 0/1；上游失敗計入斷路器並重新拋出"""
+    from core.tools.correctness_detector import CorrectnessDetector
+
+    detector = CorrectnessDetector(api_key="test")
+    detector.breaker = CircuitBreaker("test", failure_threshold=1, recovery_timeout=60)
+    detector.client = _ReplyClient(None, '{"correct": 5}', "[1]", '{"correct": 1}', TimeoutError("upstream"))
+
+    assert [asyncio.run(detector.detect("q")) for _ in range(4)] == [0, 1, 0, 1]
+    assert detector.breaker.state == CircuitBreaker.CLOSED
+    assert detector.breaker.get_stats()["total_failures"] == 0
+
+    try:
+        asyncio.run(detector.detect("q"))
+    except TimeoutError:
+        pass
+    else:
+        raise AssertionError("上游失敗應重新拋出，交由呼叫端記錄降級")
+    assert detector.breaker.state == CircuitBreaker.OPEN
+
+
+if __name__ == "__main__":
+    test_opens_after_threshold()
+    test_success_resets_failures()
+    test_half_open_probe()
+    test_lost_probe_reopens()
+    test_cancelled_probe_releases_breaker()
+    test_correctness_bad_output_is_not_upstream_failure()
+    print("✅ 斷路器測試通過")
@@ -0,0 +1,54 @@
+"""
+並行度分析測試
+驗證由分支時間戳計算的重疊率、關鍵分支、閒置間隙與串行化判定
+"""
+from scripts.analyze_concurrency import analyze_first_round, summarize
+
+
+def _trace(branches):
+    """建立只含並行處理與其分支的追蹤資料（branches: 名稱 → (開始, 結束)）"""
+    spans = [{"name": "並行處理", "span_id": 1, "parent_id": None, "start": 1.0, "duration": 1.0}]
+    for i, (name, (start, end)) in enumerate(branches.items(), start=2):
+        spans.append({"name": name, "span_id": i, "parent_id": 1, "start": 1.0 + start, "duration": end - start})
+    return {"spans": spans}
+
+
+def test_parallel_branches():
+    """完全重疊時重疊率為 1，關鍵分支為最晚結束者"""
+    analysis = analyze_first_round(_trace({
+        "RAG檢索": (0.0, 0.1), "C值檢測": (0.0, 0.3), "知識點檢測": (0.0, 0.2)
+    }))
+    assert analysis["overlap_ratio"] == 1.0
+    assert analysis["critical_branch"] == "C值檢測"
+    assert analysis["serialized"] == []
+    assert analysis["idle_time"] == 0.0
+
+
+def test_serialized_branches_and_gaps():
+    """前後接續的分支重疊率為 0、被標記為串行，啟動延遲與中間空檔計入閒置間隙"""
+    analysis = analyze_first_round(_trace({
+        "C值檢測": (0.01, 0.2), "知識點檢測": (0.25, 0.45)
+    }))
+    assert analysis["overlap_ratio"] == 0.0
+    assert analysis["serialized"][0]["first"] == "C值檢測"
+    assert analysis["serialized"][0]["then"] == "知識點檢測"
+    assert abs(analysis["idle_time"] - 0.06) < 1e-6
+
+
+def test_summary_counts_serialized_queries():
+    """彙總時統計出現串行化分支的查詢數與關鍵分支分布"""
+    parallel = analyze_first_round(_trace({"C值檢測": (0.0, 0.2), "知識點檢測": (0.0, 0.1)}))
+    serial = analyze_first_round(_trace({"C值檢測": (0.0, 0.2), "知識點檢測": (0.2, 0.3)}))
+    summary = summarize([parallel, serial, parallel])
+
+    assert summary["serialized_queries"] == 1
+    assert summary["overlap_ratio"]["median"] == 1.0
+    assert summary["overlap_ratio"]["min"] == 0.0
+    assert summary["critical_branch"] == {"C值檢測": 2, "知識點檢測": 1}
+
+
+if __name__ == "__main__":
+    test_parallel_branches()
+    test_serialized_branches_and_gaps()
+    test_summary_counts_serialized_queries()
+    print("✅ 並行度分析測試通過")
@@ -0,0 +1,59 @@
+"""
+維度檢測器評估測試
+驗證 C 值 / 知識點指標、字面匹配的本地檢測與查詢快取
+"""
+import asyncio
+
+from scripts.eval_detectors import (
+    CachedDetector, LabeledQuery, LocalDetector, correctness_metrics, evaluate,
+    knowledge_metrics, match_knowledge_points, summarize
+)
+
+POINTS = ["NAT", "NAT64 / DNS64", "DNS", "IPv4", "IPv6"]
+
+
+def test_correctness_metrics():
+    """C=1 為正類；沒有預測為 1 時 precision 為 None"""
+    metrics = correctness_metrics([1, 1, 0, 0], [1, 0, 1, 0])
+    assert metrics == {"n": 4, "agreement": 0.5, "precision": 0.5, "recall": 0.5}
+    assert correctness_metrics([1, 0], [0, 0])["precision"] is None
+
+
+def test_knowledge_metrics():
+    """micro precision / recall、集合完全一致率與 K 值一致率"""
+    gold = [["DNS"], ["IPv4", "IPv6"], []]
+    predicted = [["DNS"], ["IPv4", "NAT"], ["NAT"]]
+    metrics = knowledge_metrics(gold, predicted)
+    assert metrics["precision"] == 0.5
+    assert metrics["recall"] == round(2 / 3, 4)
+    assert metrics["exact_match"] == round(1 / 3, 4)
+    assert metrics["k_agreement"] == round(2 / 3, 4)
+
+
+def test_match_knowledge_points_longest_first():
+    """長名稱優先，「NAT64 / DNS64」不會同時命中 NAT 與 DNS；不分大小寫"""
+    assert match_knowledge_points("NAT64 / DNS64 如何運作？", POINTS) == ["NAT64 / DNS64"]
+    assert match_knowledge_points("ipv4 與 IPv6 的差別", POINTS) == ["IPv4", "IPv6"]
+    assert match_knowledge_points("今天天氣如何？", POINTS) == []
+
+
+def test_cached_detector_hits_on_second_pass():
+    """快取實作第二輪全部命中，結果與第一輪相同"""
+    items = [LabeledQuery("什麼是 DNS？", 0, ["DNS"]), LabeledQuery("IPv4 是 128 位元", 1, ["IPv4"])]
+    detector = CachedDetector(LocalDetector(POINTS))
+    predictions = asyncio.run(evaluate(detector, items, passes=2))
+
+    assert [p.cache_hit for p in predictions] == [False, False, True, True]
+    summary = summarize("cached", predictions)
+    assert summary["cache_hit_rate"] == 0.5
+    assert summary["knowledge"]["exact_match"] == 1.0
+    assert summary["correctness"]["agreement"] == 0.5
+    assert [m["query"] for m in summary["mismatches"]] == ["IPv4 是 128 位元"]
+
+
+if __name__ == "__main__":
+    test_correctness_metrics()
+    test_knowledge_metrics()
+    test_match_knowledge_points_longest_first()
+    test_cached_detector_hits_on_second_pass()
+    print("✅ 維度檢測器評估測試通過")
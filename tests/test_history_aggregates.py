@@ -0,0 +1,66 @@
+"""
+歷史統計聚合測試
+驗證新增時的增量計數、時間分桶與保留期限，以及快照往返
+"""
+from datetime import datetime, timedelta
+
+from config import Config
+from core.history_aggregates import HistoryAggregates, rollup_cutoff
+from core.history_manager import HistoryRecord
+
+
+def _record(timestamp: str, kp: str = "DNS", c: str = "0", session_id: str = "s1") -> HistoryRecord:
+    return HistoryRecord("q", [], [kp], {"K": "1", "C": c, "R": "0"}, timestamp, session_id)
+
+
+def test_incremental_counts():
+    """查詢數、K/C/R、知識點、會話與各粒度分桶在新增時累加"""
+    aggregates = HistoryAggregates(rollups=True)
+    aggregates.add(_record(datetime.now().isoformat()))
+    aggregates.add(_record(datetime.now().isoformat(), kp="IPv4", c="1", session_id="s2"))
+
+    assert aggregates.total == 2
+    assert aggregates.get_dimension_stats() == {"K": {"1": 2}, "C": {"0": 1, "1": 1}, "R": {"0": 2}}
+    assert aggregates.counters["knowledge_point"] == {"DNS": 1, "IPv4": 1}
+    assert aggregates.counters["session"] == {"s1": 1, "s2": 1}
+    assert sum(b["queries"] for b in aggregates.get_rollup("day")) == 2
+
+
+def test_rollup_buckets_and_retention():
+    """桶鍵為時間戳前綴；超過保留期限的分鐘桶在出現新桶時清除"""
+    original = Config.HISTORY_ROLLUP_RETENTION
+    Config.HISTORY_ROLLUP_RETENTION = {"minute": 2, "hour": 24, "day": 30}
+    try:
+        aggregates = HistoryAggregates(rollups=True)
+        now = datetime.now()
+        for minutes_ago in (5, 1, 0, 0):
+            aggregates.add(_record((now - timedelta(minutes=minutes_ago)).isoformat()))
+
+        minutes = aggregates.get_rollup("minute")
+        assert [b["bucket"] for b in minutes] == sorted(b["bucket"] for b in minutes)
+        assert (now - timedelta(minutes=5)).isoformat()[:16] not in [b["bucket"] for b in minutes]
+        assert all(b["bucket"] >= rollup_cutoff("minute") for b in minutes)
+        assert minutes[-1]["queries"] == 2
+        assert aggregates.get_rollup("minute", limit=1) == minutes[-1:]
+        assert aggregates.total == 4
+    finally:
+        Config.HISTORY_ROLLUP_RETENTION = original
+
+
+def test_snapshot_round_trip():
+    """to_dict / from_dict 往返後計數與分桶順序不變；不維護分桶時不產生分桶"""
+    aggregates = HistoryAggregates(rollups=True)
+    aggregates.add(_record(datetime.now().isoformat()))
+    restored = HistoryAggregates.from_dict(aggregates.to_dict())
+    assert restored.to_dict() == aggregates.to_dict()
+
+    plain = HistoryAggregates(rollups=False)
+    plain.add(_record(datetime.now().isoformat()))
+    assert "minute" not in plain.counters and plain.total == 1
+
+
+if __name__ == "__main__":
+    test_incremental_counts()
+    test_rollup_buckets_and_retention()
+    test_snapshot_round_trip()
+    print("✅ 歷史統計聚合測試通過")
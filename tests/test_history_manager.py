@@ -0,0 +1,253 @@
+"""
+歷史管理器測試
+驗證追加日誌的重播、壓縮後的快照、中斷時不重複計數、共享的寫入者，
+SQLite 後端的長期保存與索引分頁查詢，以及增量統計在重新載入後保持一致
+"""
+import json
+import os
+import sqlite3
+import tempfile
+
+from config import Config
+from core.history_manager import HistoryManager, SQLiteHistoryManager, get_history_manager
+
+
+def _add(manager: HistoryManager, query: str, kp: str = "DNS", session_id: str = "s1"):
+    manager.add_query(query, ["dns_basics"], {"K": 1, "C": 0, "R": 0},
+                      knowledge_points=[kp], session_id=session_id)
+
+
+def test_log_append_and_reload():
+    """每筆查詢只追加一行日誌；重新載入時快照 + 日誌還原完整狀態"""
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "history.json")
+        manager = HistoryManager(storage_path=path, flush_interval=0)
+        _add(manager, "什麼是 DNS？")
+        _add(manager, "IPv4 是什麼？", kp="IPv4", session_id="s2")
+
+        assert not os.path.exists(path)
+        with open(manager.log_path, "r", encoding="utf-8") as f:
+            assert [json.loads(line)["id"] for line in f] == [1, 2]
+
+        reloaded = HistoryManager(storage_path=path)
+        assert [r.query for r in reloaded.get_recent_history()] == ["什麼是 DNS？", "IPv4 是什麼？"]
+        assert reloaded.get_knowledge_point_stats() == {"DNS": 1, "IPv4": 1}
+        assert [r.query for r in reloaded.get_recent_history(session_id="s2")] == ["IPv4 是什麼？"]
+        assert reloaded.seq == 2
+
+
+def test_background_flush_on_close():
+    """背景寫入模式下 add_query 不寫檔，close 時寫出剩餘記錄"""
+    with tempfile.TemporaryDirectory() as workdir:
+        manager = HistoryManager(storage_path=os.path.join(workdir, "history.json"), flush_interval=60)
+        _add(manager, "q1")
+        assert not os.path.exists(manager.log_path)
+
+        manager.close()
+        with open(manager.log_path, "r", encoding="utf-8") as f:
+            assert len(f.readlines()) == 1
+
+
+def test_compaction_and_interrupted_truncate():
+    """達到門檻時壓縮為快照並清空日誌；快照後未清空的舊日誌行依序號略過"""
+    original = Config.HISTORY_COMPACT_THRESHOLD
+    Config.HISTORY_COMPACT_THRESHOLD = 3
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            path = os.path.join(workdir, "history.json")
+            manager = HistoryManager(storage_path=path, flush_interval=0)
+            for i in range(4):
+                _add(manager, f"q{i}")
+
+            with open(path, "r", encoding="utf-8") as f:
+                snapshot = json.load(f)
+            assert snapshot["last_seq"] == 3
+            with open(manager.log_path, "r", encoding="utf-8") as f:
+                stale_lines = f.read()
+            assert [json.loads(line)["id"] for line in stale_lines.splitlines()] == [4]
+
+            # 模擬壓縮時在清空日誌前中斷：日誌中仍留有快照已包含的記錄，以及寫到一半的最後一行
+            with open(manager.log_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(manager.history[-2].to_dict(), ensure_ascii=False) + "\n")
+                f.write(stale_lines)
+                f.write('{"id": 5, "query": "半')
+
+            reloaded = HistoryManager(storage_path=path)
+            assert [r.query for r in reloaded.get_recent_history()] == ["q0", "q1", "q2", "q3"]
+            assert reloaded.get_knowledge_point_stats() == {"DNS": 4}
+    finally:
+        Config.HISTORY_COMPACT_THRESHOLD = original
+
+
+def test_query_history_pagination():
+    """由新到舊以 before_id 翻頁，每頁內由舊到新；可依知識點過濾"""
+    with tempfile.TemporaryDirectory() as workdir:
+        manager = HistoryManager(max_size=20, storage_path=os.path.join(workdir, "history.json"), flush_interval=0)
+        for i in range(5):
+            _add(manager, f"q{i}", kp="DNS" if i % 2 == 0 else "IPv4")
+
+        first = manager.query_history(limit=2)
+        assert [r.query for r in first["records"]] == ["q3", "q4"]
+        assert first["total"] == 5
+        second = manager.query_history(limit=2, before_id=first["next_before_id"])
+        assert [r.query for r in second["records"]] == ["q1", "q2"]
+        last = manager.query_history(limit=2, before_id=second["next_before_id"])
+        assert [r.query for r in last["records"]] == ["q0"]
+        assert last["next_before_id"] is None
+
+        dns = manager.query_history(limit=10, knowledge_point="DNS")
+        assert [r.query for r in dns["records"]] == ["q0", "q2", "q4"]
+
+
+def test_clear_and_shared_manager():
+    """clear 寫出空快照並清空日誌；同一路徑共用同一個管理器"""
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "history.json")
+        manager = get_history_manager(path)
+        assert get_history_manager(os.path.join(workdir, ".", "history.json")) is manager
+
+        manager.flush_interval = 0
+        _add(manager, "q1")
+        manager.clear()
+        assert os.path.getsize(manager.log_path) == 0
+        assert HistoryManager(storage_path=path).get_recent_history() == []
+
+
+def test_sqlite_keeps_full_history():
+    """SQLite 後端保存超過 max_size 的記錄，統計涵蓋全部記錄，重新開啟後狀態一致"""
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "history.db")
+        manager = SQLiteHistoryManager(max_size=3, db_path=path, flush_interval=0)
+        for i in range(8):
+            _add(manager, f"q{i}", kp="DNS" if i < 5 else "IPv4", session_id="s1" if i % 2 == 0 else "s2")
+
+        assert len(manager.history) == 3
+        assert manager.get_total_queries() == 8
+        assert manager.get_knowledge_point_stats() == {"DNS": 5, "IPv4": 3}
+        assert manager.get_dimension_stats()["K"] == {"1": 8}
+
+        page = manager.query_history(limit=3, session_id="s1")
+        assert [r.query for r in page["records"]] == ["q2", "q4", "q6"]
+        assert page["total"] == 4
+        older = manager.query_history(limit=3, session_id="s1", before_id=page["next_before_id"])
+        assert [r.query for r in older["records"]] == ["q0"]
+        assert older["next_before_id"] is None
+
+        ipv4 = manager.query_history(limit=10, knowledge_point="IPv4", since=page["records"][0].timestamp)
+        assert [r.query for r in ipv4["records"]] == ["q5", "q6", "q7"]
+
+        reopened = SQLiteHistoryManager(max_size=3, db_path=path)
+        assert [r.query for r in reopened.get_recent_history()] == ["q5", "q6", "q7"]
+        assert reopened.knowledge_point_counter == {"DNS": 5, "IPv4": 3}
+        assert list(reopened.consecutive_access) == ["IPv4", "IPv4", "IPv4"]
+
+
+def test_sqlite_background_flush_and_clear():
+    """背景寫入的記錄在查詢前寫入資料庫；clear 清空資料庫"""
+    with tempfile.TemporaryDirectory() as workdir:
+        manager = SQLiteHistoryManager(db_path=os.path.join(workdir, "history.db"), flush_interval=60)
+        _add(manager, "q1")
+        assert manager.get_total_queries() == 1
+        assert manager.get_recent_history()[0].id == 1
+
+        manager.clear()
+        assert manager.get_total_queries() == 0
+        assert manager.get_knowledge_point_stats() == {}
+        manager.close()
+
+
+def test_aggregates_survive_compaction_and_legacy_snapshot():
+    """統計隨快照保存；沒有 aggregates 的舊版快照由保留的記錄重建，知識點沿用累計計數"""
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "history.json")
+        manager = HistoryManager(max_size=2, storage_path=path, flush_interval=0)
+        for i in range(3):
+            _add(manager, f"q{i}", session_id=f"s{i % 2}")
+        manager.save()
+
+        reloaded = HistoryManager(max_size=2, storage_path=path)
+        assert reloaded.get_total_queries() == 3
+        assert reloaded.get_session_stats() == {"s0": 2, "s1": 1}
+        assert reloaded.get_session_stats("s1") == {"s1": 1}
+        assert sum(b["queries"] for b in reloaded.get_rollup("hour")) == 3
+
+        with open(path, "r", encoding="utf-8") as f:
+            legacy = json.load(f)
+        legacy.pop("aggregates")
+        legacy.pop("last_seq")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump(legacy, f)
+        upgraded = HistoryManager(max_size=2, storage_path=path)
+        assert upgraded.get_total_queries() == 2
+        assert upgraded.get_knowledge_point_stats() == {"DNS": 3}
+
+
+def test_sqlite_counters_rebuilt_for_existing_database():
+    """升級前建立的資料庫（沒有計數表）首次開啟時由 history 表重建統計"""
+    with tempfile.TemporaryDirectory() as workdir:
+        path = os.path.join(workdir, "history.db")
+        manager = SQLiteHistoryManager(db_path=path, flush_interval=0)
+        for i in range(4):
+            _add(manager, f"q{i}", kp="DNS" if i else "IPv4", session_id="s1")
+        manager.conn.execute("DROP TABLE history_counters")
+        manager.conn.close()
+
+        reopened = SQLiteHistoryManager(db_path=path)
+        assert reopened.get_total_queries() == 4
+        assert reopened.get_knowledge_point_stats() == {"DNS": 3, "IPv4": 1}
+        assert reopened.query_history(limit=1, session_id="s1")["total"] == 4
+        assert sum(b["queries"] for b in reopened.get_rollup("day")) == 4
+        with sqlite3.connect(path) as conn:
+            assert conn.execute("SELECT COUNT(*) FROM history_counters WHERE name = 'session'").fetchone() == (1,)
+
+
+def test_backends_return_identical_records():
+    """JSON Lines 與 SQLite 後端讀回的記錄相同（K/C/R 皆為整數）；舊資料庫的 TEXT 欄位也轉為整數"""
+    def strip(records):
+        # 兩個後端各自產生時間戳，其餘欄位應完全相同
+        return [{k: v for k, v in r.to_dict().items() if k != "timestamp"} for r in records]
+
+    with tempfile.TemporaryDirectory() as workdir:
+        jsonl = HistoryManager(storage_path=os.path.join(workdir, "history.json"), flush_interval=0)
+        sqlite = SQLiteHistoryManager(db_path=os.path.join(workdir, "history.db"), flush_interval=0)
+        for manager in (jsonl, sqlite):
+            for i in range(3):
+                _add(manager, f"q{i}", kp="DNS" if i else "IPv4", session_id=f"s{i % 2}")
+
+        reloaded = HistoryManager(storage_path=jsonl.storage_path)
+        expected = strip(jsonl.get_recent_history())
+        assert expected[0]["dimensions"] == {"K": 1, "C": 0, "R": 0}
+        assert strip(reloaded.get_recent_history()) == expected
+        assert strip(sqlite.get_recent_history()) == expected
+        assert strip(sqlite.query_history(limit=10)["records"]) == strip(jsonl.query_history(limit=10)["records"])
+
+        sqlite.conn.execute("UPDATE history SET k = '1', c = '0', r = '0'")
+        assert strip(sqlite.get_recent_history()) == expected
+
+def test_summary_totals_match_dimension_stats():
+    """超過 max_size 後摘要的總數仍為全部查詢數，與三維度統計的加總一致"""
+    with tempfile.TemporaryDirectory() as workdir:
+        for manager in (
+            HistoryManager(max_size=2, storage_path=os.path.join(workdir, "history.json"), flush_interval=0),
+            SQLiteHistoryManager(max_size=2, db_path=os.path.join(workdir, "history.db"), flush_interval=0),
+        ):
+            for i in range(5):
+                _add(manager, f"q{i}")
+            summary = manager.get_summary()
+            assert summary["total_queries"] == 5
+            assert all(sum(counts.values()) == 5 for counts in summary["dimension_stats"].values())
+
+
+if __name__ == "__main__":
+    test_log_append_and_reload()
+    test_background_flush_on_close()
+    test_compaction_and_interrupted_truncate()
+    test_query_history_pagination()
+    test_clear_and_shared_manager()
+    test_sqlite_keeps_full_history()
+    test_sqlite_background_flush_and_clear()
+    test_aggregates_survive_compaction_and_legacy_snapshot()
+    test_sqlite_counters_rebuilt_for_existing_database()
+    test_backends_return_identical_records()
+    test_summary_totals_match_dimension_stats()
+    print("✅ 歷史管理器測試通過")
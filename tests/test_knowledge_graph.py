@@ -0,0 +1,96 @@
+"""
+知識圖譜測試
+驗證定義檔載入、k 跳鄰域、上層閉包、共同上層與提示詞上下文
+"""
+import json
+import os
+import tempfile
+
+from core.knowledge_graph import KnowledgeGraph
+
+NODES = [
+    {"id": "ip_address", "name": "IP 位址"},
+    {"id": "ipv4", "name": "IPv4"},
+    {"id": "ipv6", "name": "IPv6"},
+    {"id": "private_ip", "name": "私有位址"},
+    {"id": "nat", "name": "NAT"},
+    {"id": "dns", "name": "DNS"},
+]
+RELATIONS = [
+    {"source": "ipv4", "target": "ip_address", "type": "is_a"},
+    {"source": "ipv6", "target": "ip_address", "type": "is_a"},
+    {"source": "private_ip", "target": "ipv4", "type": "part_of"},
+    {"source": "nat", "target": "private_ip", "type": "related_to"},
+    {"source": "unknown", "target": "dns", "type": "related_to"},
+]
+
+
+def _graph(max_hops: int = 2) -> KnowledgeGraph:
+    fd, path = tempfile.mkstemp(suffix=".json")
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        json.dump({"nodes": NODES, "relations": RELATIONS}, f)
+    try:
+        return KnowledgeGraph(relations_file=path, max_hops=max_hops)
+    finally:
+        os.unlink(path)
+
+
+def test_load_and_lookup_by_id_or_name():
+    """節點可用 id 或名稱查詢；端點未定義的關係被略過"""
+    graph = _graph()
+    assert graph.get_stats() == {"nodes": 6, "relations": 4, "max_hops": 2}
+    assert graph.has_node("ipv4") and graph.has_node("IPv4")
+    assert not graph.has_node("unknown")
+    assert graph.get_related("unknown") == []
+
+
+def test_related_by_hops():
+    """相關知識點依距離由近到遠，不超過預先計算的距離"""
+    graph = _graph()
+    assert graph.get_related("IPv4") == ["IP 位址", "私有位址"]
+    assert graph.get_related("IPv4", hops=2) == ["IP 位址", "私有位址", "IPv6", "NAT"]
+    assert graph.get_related("IPv4", hops=5) == graph.get_related("IPv4", hops=2)
+    assert graph.get_related("DNS", hops=2) == []
+
+
+def test_ancestors_and_shared_ancestors():
+    """上層閉包沿 is_a / part_of 遞移；related_to 不算上下層"""
+    graph = _graph()
+    assert graph.get_ancestors("私有位址") == ["IP 位址", "IPv4"]
+    assert graph.get_ancestors("NAT") == []
+    assert graph.get_shared_ancestors(["私有位址", "IPv6"]) == ["IP 位址"]
+    assert graph.get_shared_ancestors(["私有位址", "IPv4"]) == ["IP 位址"]
+    assert graph.get_shared_ancestors(["IPv4"]) == []
+
+
+def test_context_for_prompt():
+    """提示詞上下文列出知識點之間的關係、共同上層與延伸知識點"""
+    graph = _graph()
+    assert graph.get_relations_between(["IPv4", "私有位址"]) == [
+        {"source": "私有位址", "target": "IPv4", "type": "part_of"}
+    ]
+    context = graph.get_context_for_prompt(["IPv4", "IPv6"])
+    assert context.splitlines() == [
+        "共同上層知識點：IP 位址",
+        "延伸知識點：IP 位址, 私有位址",
+    ]
+    assert graph.get_context_for_prompt(["DNS"]) == "無"
+    assert graph.get_context_for_prompt([]) == "無"
+
+
+def test_repo_relations_file_loads():
+    """專案內的定義檔可載入，且節點名稱與知識點清單一致"""
+    graph = KnowledgeGraph()
+    with open(os.path.join(os.path.dirname(__file__), "..", "data", "knowledge_points.json"), encoding="utf-8") as f:
+        names = json.load(f)["nodes"]
+    assert graph.get_stats()["nodes"] == len(names)
+    assert all(graph.has_node(name) for name in names)
+
+
+if __name__ == "__main__":
+    test_load_and_lookup_by_id_or_name()
+    test_related_by_hops()
+    test_ancestors_and_shared_ancestors()
+    test_context_for_prompt()
+    test_repo_relations_file_loads()
+    print("✅ 知識圖譜測試通過")
@@ -0,0 +1,80 @@
+"""
+壓力測試工具測試
+驗證端點權重解析、Poisson 到達時間、階段統計與拐點判定
+"""
+from scripts.load_test import RequestRecord, arrival_times, find_knee, parse_mix, summarize_step
+
+
+def _step(level, throughput, p95, error_rate=0.0):
+    """建立只含拐點判定所需欄位的階段統計"""
+    return {"level": level, "throughput": throughput, "error_rate": error_rate, "latency": {"p95": p95}}
+
+
+def test_parse_mix():
+    """權重可省略（默認 1），未知端點拋出 ValueError"""
+    assert parse_mix("query:0.3,stream:0.7") == [("query", 0.3), ("stream", 0.7)]
+    assert parse_mix("stream") == [("stream", 1.0)]
+    try:
+        parse_mix("ws:1")
+        assert False, "應拋出 ValueError"
+    except ValueError:
+        pass
+
+
+def test_arrival_times_reproducible():
+    """相同種子的到達時間相同，數量接近速率 × 時間"""
+    times = arrival_times(rate=50, duration=10, seed=1)
+    assert times == arrival_times(rate=50, duration=10, seed=1)
+    assert all(0 < t < 10 for t in times)
+    assert times == sorted(times)
+    assert 400 < len(times) < 600
+
+
+def test_summarize_step():
+    """吞吐量只計成功請求，延遲與 TTFT 只取成功的請求"""
+    records = [
+        RequestRecord("query", True, 0.5),
+        RequestRecord("stream", True, 1.0, ttft=0.2),
+        RequestRecord("stream", False, 3.0, error="timeout"),
+        RequestRecord("query", False, 0.1, error="HTTP 500"),
+    ]
+    step = summarize_step(records, level=4, elapsed=2.0)
+
+    assert step["requests"] == 4
+    assert step["throughput"] == 1.0
+    assert step["error_rate"] == 0.5
+    assert step["errors"] == {"timeout": 1, "HTTP 500": 1}
+    assert step["latency"]["max"] == 1.0
+    assert step["ttft"]["p50"] == 0.2
+    assert step["endpoints"]["stream"]["errors"] == 1
+
+
+def test_find_knee_closed_loop():
+    """閉環：吞吐量不再增加或 p95 惡化的前一階為拐點"""
+    steps = [_step(1, 1.0, 0.5), _step(2, 1.9, 0.55), _step(4, 3.6, 0.6), _step(8, 3.7, 1.2)]
+    knee = find_knee(steps, "closed")
+    assert knee["level"] == 4
+    assert knee["degraded_at"] == 8
+    assert len(knee["reasons"]) == 2
+
+    healthy = find_knee(steps[:3], "closed")
+    assert healthy["level"] == 4 and healthy["degraded_at"] is None
+
+
+def test_find_knee_open_loop_and_errors():
+    """開環：達不到目標速率時惡化；第一階錯誤率過高時沒有健康的負載"""
+    knee = find_knee([_step(2, 2.0, 0.5), _step(8, 7.9, 0.6), _step(32, 10.0, 0.7)], "open")
+    assert knee["level"] == 8
+    assert knee["degraded_at"] == 32
+
+    broken = find_knee([_step(1, 1.0, 0.5, error_rate=0.2)], "closed")
+    assert broken["level"] is None
+
+
+if __name__ == "__main__":
+    test_parse_mix()
+    test_arrival_times_reproducible()
+    test_summarize_step()
+    test_find_knee_closed_loop()
+    test_find_knee_open_loop_and_errors()
+    print("✅ 壓力測試工具測試通過")
@@ -0,0 +1,50 @@
+"""
+事件迴圈監控測試
+驗證阻塞調用會被偵測並取得指向阻塞程式碼的堆疊樣本
+"""
+import asyncio
+import time
+
+from core.loop_monitor import LoopMonitor
+
+
+def _blocking_call(seconds: float):
+    """模擬協程中的同步調用（例如同步 OpenAI client、JSON 寫檔）"""
+    time.sleep(seconds)
+
+
+async def _run(block: float) -> LoopMonitor:
+    monitor = LoopMonitor(interval=0.01, block_threshold=0.05, max_samples=5)
+    monitor.start()
+    await asyncio.sleep(0.05)
+    if block:
+        _blocking_call(block)
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+    return monitor
+
+
+def test_detects_blocking_call_with_stack():
+    """阻塞超過閾值時記錄一次阻塞與阻塞當下的堆疊"""
+    monitor = asyncio.run(_run(block=0.2))
+    stats = monitor.get_stats()
+
+    assert stats["blocked_count"] == 1
+    assert stats["max_lag"] >= 0.15
+    sample = stats["recent_blocks"][0]
+    assert any("_blocking_call" in line for line in sample["stack"])
+    assert "test_loop_monitor.py" in sample["location"]
+
+
+def test_no_block_without_blocking_calls():
+    """沒有阻塞調用時只記錄延遲量測"""
+    stats = asyncio.run(_run(block=0)).get_stats()
+    assert stats["blocked_count"] == 0
+    assert stats["ticks"] > 0
+    assert stats["running"] is False
+
+
+if __name__ == "__main__":
+    test_detects_blocking_call_with_stack()
+    test_no_block_without_blocking_calls()
+    print("✅ 事件迴圈監控測試通過")
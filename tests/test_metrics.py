@@ -0,0 +1,84 @@
+"""
+指標測試
+驗證直方圖分位數誤差、非時間數值的分桶、時間窗輪替、Prometheus 輸出與觀測成本
+"""
+import random
+import time
+
+from core.metrics import LatencyHistogram, MetricsRegistry, RollingHistogram
+
+
+def test_histogram_quantiles_within_error():
+    """分位數相對誤差在約 3% 以內"""
+    rng = random.Random(0)
+    values = [rng.lognormvariate(-2, 1) for _ in range(20000)]
+    histogram = LatencyHistogram()
+    for v in values:
+        histogram.record(v)
+
+    values.sort()
+    for q, estimate in histogram.quantiles([0.5, 0.95, 0.99]).items():
+        exact = values[int(q * len(values)) - 1]
+        assert abs(estimate - exact) / exact < 0.04, (q, estimate, exact)
+
+
+def test_throughput_uses_own_resolution():
+    """吞吐量以 tokens/秒為單位分桶，不經過秒→微秒換算；0.01 解析度下低吞吐量也能分辨"""
+    registry = MetricsRegistry(window=60, quantiles=[0.5, 0.99])
+    for value in (0.25, 0.5, 0.75):
+        registry.observe_value("rag_upstream_tokens_per_second", value, 0.01, call="生成")
+    for value in (400.0, 800.0):
+        registry.observe_value("rag_upstream_tokens_per_second", value, 0.01, call="C值")
+
+    series = registry.histograms["rag_upstream_tokens_per_second"]
+    assert all(histogram.resolution == 0.01 for histogram in series.values())
+    entries = {e["labels"]["call"]: e for e in registry.snapshot()["histograms"]["rag_upstream_tokens_per_second"]}
+    assert abs(entries["生成"]["quantiles"]["0.5"] - 0.5) < 0.01
+    assert abs(entries["C值"]["quantiles"]["0.99"] - 800.0) / 800.0 < 0.04
+    assert entries["C值"]["sum"] == 1200.0
+
+
+def test_rolling_window_forgets_old_values():
+    """超過兩個時間窗後，舊觀測不再影響分位數（累計數不變）"""
+    histogram = RollingHistogram(window=0.01)
+    histogram.record(5.0)
+    time.sleep(0.03)
+    histogram.record(0.1)
+
+    assert histogram.quantiles([0.99])[0.99] < 0.2
+    assert histogram.count == 2
+
+
+def test_prometheus_output():
+    """Prometheus 文字格式包含 summary 分位數、計數器與量測值"""
+    registry = MetricsRegistry(window=60, quantiles=[0.5, 0.99])
+    registry.observe("rag_stage_latency_seconds", 0.2, stage="RAG檢索")
+    registry.inc("rag_tokens_total", 12, stage="C值", type="prompt_tokens")
+    registry.add_gauge("rag_inflight_requests", 1)
+
+    text = registry.render_prometheus()
+    assert "# TYPE rag_stage_latency_seconds summary" in text
+    assert 'rag_stage_latency_seconds{stage="RAG檢索",quantile="0.5"}' in text
+    assert 'rag_stage_latency_seconds_count{stage="RAG檢索"} 1' in text
+    assert 'rag_tokens_total{stage="C值",type="prompt_tokens"} 12' in text
+    assert "rag_inflight_requests 1" in text
+
+
+def test_observation_cost():
+    """單次觀測成本在數微秒以內"""
+    registry = MetricsRegistry(window=60)
+    n = 20000
+    t_start = time.perf_counter()
+    for i in range(n):
+        registry.observe("rag_stage_latency_seconds", i * 1e-5, stage="RAG檢索")
+    per_call = (time.perf_counter() - t_start) / n
+    assert per_call < 20e-6, f"每次觀測 {per_call * 1e6:.2f}µs"
+
+
+if __name__ == "__main__":
+    test_histogram_quantiles_within_error()
+    test_throughput_uses_own_resolution()
+    test_rolling_window_forgets_old_values()
+    test_prometheus_output()
+    test_observation_cost()
+    print("✅ 指標測試通過")
@@ -0,0 +1,47 @@
+"""
+效能回歸檢查測試
+驗證 Mann-Whitney U 檢定與回歸判定（比值門檻與顯著性兩者都成立才算回歸）
+"""
+from scripts.perf_gate import compare, describe, mann_whitney_greater
+
+
+def _baseline(samples, threshold=0.2):
+    return {**describe(samples), "threshold": threshold}
+
+
+def test_mann_whitney_direction():
+    """明顯較大的樣本 p 值很小，反方向 p 值接近 1，相同分布不顯著"""
+    slow = [1.5 + i * 0.01 for i in range(15)]
+    fast = [1.0 + i * 0.01 for i in range(15)]
+    assert mann_whitney_greater(slow, fast) < 0.001
+    assert mann_whitney_greater(fast, slow) > 0.999
+    assert mann_whitney_greater(fast, list(fast)) > 0.3
+    assert mann_whitney_greater([], fast) == 1.0
+
+
+def test_compare_statuses():
+    """變慢超過門檻且顯著為回歸，變快為 improved，沒有基準為 new"""
+    baseline = _baseline([1.0 + i * 0.01 for i in range(15)])
+
+    assert compare("x", [1.5 + i * 0.01 for i in range(15)], baseline, 0.2, 0.01)["status"] == "regression"
+    assert compare("x", [0.5 + i * 0.01 for i in range(15)], baseline, 0.2, 0.01)["status"] == "improved"
+    assert compare("x", [1.05 + i * 0.01 for i in range(15)], baseline, 0.2, 0.01)["status"] == "ok"
+    assert compare("x", [1.0], None, 0.2, 0.01)["status"] == "new"
+
+
+def test_compare_requires_significance():
+    """中位數超過門檻但樣本太少、不顯著時不判定為回歸；基準檔中的門檻優先"""
+    baseline = _baseline([1.0, 1.6, 0.9])
+    assert compare("x", [1.3, 1.4], baseline, 0.2, 0.01)["status"] == "ok"
+
+    loose = _baseline([1.0 + i * 0.01 for i in range(15)], threshold=1.0)
+    result = compare("x", [1.5 + i * 0.01 for i in range(15)], loose, 0.2, 0.01)
+    assert result["status"] == "ok"
+    assert result["threshold"] == 1.0
+
+
+if __name__ == "__main__":
+    test_mann_whitney_direction()
+    test_compare_statuses()
+    test_compare_requires_significance()
+    print("✅ 效能回歸檢查測試通過")
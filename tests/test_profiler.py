@@ -0,0 +1,64 @@
+"""
+請求剖析測試
+驗證取樣與確定性剖析的輸出格式、同時只允許一個確定性剖析，以及剖析模式的選擇
+"""
+import marshal
+import time
+
+from config import Config
+from core.profiler import ProfilerBusy, RequestProfile, choose_profile_mode, get_profile_store
+
+
+def _busy_work(seconds: float):
+    """佔用 CPU 一段時間"""
+    deadline = time.perf_counter() + seconds
+    total = 0
+    while time.perf_counter() < deadline:
+        total += sum(range(100))
+    return total
+
+
+def test_sampling_profile_collapsed_stacks():
+    """取樣剖析輸出 collapsed stacks，且包含執行中的函式"""
+    profile = RequestProfile("sample", "q").start()
+    _busy_work(0.1)
+    result = profile.stop(trace_id="t1")
+
+    collapsed = result.collapsed()
+    assert "_busy_work (test_profiler.py" in collapsed
+    assert all(line.rsplit(" ", 1)[1].isdigit() for line in collapsed.splitlines())
+    assert get_profile_store().get(result.profile_id) is result
+    assert result.to_summary()["formats"] == ["collapsed"]
+
+
+def test_deterministic_profile_is_exclusive():
+    """確定性剖析產生 pstats，進行中時無法再啟動另一個"""
+    profile = RequestProfile("cprofile", "q").start()
+    try:
+        RequestProfile("cprofile", "q2").start()
+        assert False, "應拋出 ProfilerBusy"
+    except ProfilerBusy:
+        pass
+    _busy_work(0.02)
+    result = profile.stop()
+
+    assert "_busy_work" in result.pstats_text(limit=20)
+    stats = marshal.loads(result.pstats_bytes())
+    assert any(func[2] == "_busy_work" for func in stats)
+
+    # 結束後可再次啟動
+    RequestProfile("cprofile", "q3").start().stop()
+
+
+def test_choose_profile_mode():
+    """明確要求時使用指定模式，未知值使用預設模式，未要求且取樣率為 0 時不剖析"""
+    assert choose_profile_mode("cprofile") == "cprofile"
+    assert choose_profile_mode("1") == Config.PROFILE_DEFAULT_MODE
+    assert choose_profile_mode(None) is None
+
+
+if __name__ == "__main__":
+    test_sampling_profile_collapsed_stacks()
+    test_deterministic_profile_is_exclusive()
+    test_choose_profile_mode()
+    print("✅ 請求剖析測試通過")
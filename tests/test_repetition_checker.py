@@ -0,0 +1,76 @@
+"""
+重複性檢測器測試
+驗證默認規則（連續三次）、可配置的視窗與閾值、視窗移出時的計數維護與狀態還原
+"""
+from config import Config
+from core.tools.repetition_checker import RepetitionChecker
+
+
+def test_default_matches_three_consecutive_turns():
+    """默認視窗 2、閾值 3：同一知識點連續第三次出現才判定為重複"""
+    checker = RepetitionChecker()
+    assert (checker.window, checker.threshold) == (Config.REPETITION_WINDOW, Config.REPETITION_THRESHOLD)
+
+    assert checker.check_and_update(["DNS"]) == 0
+    assert checker.check_and_update(["DNS", "HTTP"]) == 0
+    assert checker.check_and_update(["DNS"]) == 1
+    # 中間隔一次就不算連續
+    assert checker.check_and_update(["TCP"]) == 0
+    assert checker.check_and_update(["DNS"]) == 0
+
+
+def test_window_and_threshold_configurable():
+    """視窗 4、閾值 3：五次詢問中出現三次即為重複，不需要連續"""
+    checker = RepetitionChecker(window=4, threshold=3)
+    results = [checker.check_and_update(kps) for kps in (["A"], ["B"], ["A"], ["C"], ["A"])]
+    assert results == [0, 0, 0, 0, 1]
+
+    # 閾值 1：任何知識點都視為重複；沒有知識點則永遠正常
+    always = RepetitionChecker(window=0, threshold=1)
+    assert always.check_and_update(["A"]) == 1
+    assert always.check_and_update([]) == 0
+
+    for window, threshold in ((2, 4), (2, 0), (-1, 1)):
+        try:
+            RepetitionChecker(window=window, threshold=threshold)
+        except ValueError:
+            continue
+        raise AssertionError(f"window={window}, threshold={threshold} 應該無效")
+
+
+def test_counts_follow_window_eviction():
+    """計數只包含視窗內的知識點，移出後歸零並被刪除"""
+    checker = RepetitionChecker(window=2, threshold=3)
+    for kps in (["A", "B"], ["A"], ["C"]):
+        checker.check_and_update(kps)
+    assert [sorted(kps) for kps in checker.history] == [["A"], ["C"]]
+    assert dict(checker.counts) == {"A": 1, "C": 1}
+
+    checker.check_and_update(["C"])
+    assert dict(checker.counts) == {"C": 2}
+
+
+def test_round_trip_and_legacy_format():
+    """to_dict / from_dict 還原後結果一致；兼容只有 history 的舊格式"""
+    checker = RepetitionChecker()
+    checker.check_and_update(["DNS"])
+    checker.check_and_update(["DNS"])
+    data = checker.to_dict()
+    assert data == {"window": 2, "threshold": 3, "history": [["DNS"], ["DNS"]]}
+
+    restored = RepetitionChecker.from_dict(data)
+    assert dict(restored.counts) == {"DNS": 2}
+    assert restored.check_and_update(["DNS"]) == 1
+
+    legacy = RepetitionChecker.from_dict({"history": [["A"], ["B"], ["A", "C"]]})
+    # 超出目前視窗的舊記錄被移出
+    assert dict(legacy.counts) == {"B": 1, "A": 1, "C": 1}
+    assert legacy.check_and_update(["A"]) == 0
+
+
+if __name__ == "__main__":
+    test_default_matches_three_consecutive_turns()
+    test_window_and_threshold_configurable()
+    test_counts_follow_window_eviction()
+    test_round_trip_and_legacy_format()
+    print("✅ 重複性檢測器測試通過")
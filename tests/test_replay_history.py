@@ -0,0 +1,92 @@
+"""
+歷史流量重播測試
+驗證記錄讀取（history.json / JSON Lines、間隔壓縮）、會話內順序與重播統計
+"""
+import asyncio
+import json
+import os
+import tempfile
+
+from scripts.replay_history import ReplayEvent, load_workload, repeat_ratio, replay, summarize
+
+
+def _write(content: str, suffix: str) -> str:
+    fd, path = tempfile.mkstemp(suffix=suffix)
+    with os.fdopen(fd, "w", encoding="utf-8") as f:
+        f.write(content)
+    return path
+
+
+class _RecordingTarget:
+    """記錄送出順序的目標（R 依會話內是否重複決定）"""
+
+    def __init__(self):
+        self.sent = []
+        self.seen = set()
+
+    async def send(self, event: ReplayEvent):
+        await asyncio.sleep(0.01)
+        key = (event.session_id, event.query)
+        self.sent.append(key)
+        repeated = key in self.seen
+        self.seen.add(key)
+        return {"ttft": 0.005, "cache_hit": repeated, "dimensions": {"R": "1" if repeated else "0"}}
+
+
+def test_load_history_json_sorted_with_max_gap():
+    """history.json 依時間戳排序，超過 max_gap 的間隔被壓縮"""
+    path = _write(json.dumps({"history": [
+        {"query": "b", "session_id": "s1", "timestamp": "2026-03-01T10:00:10"},
+        {"query": "a", "session_id": "s2", "timestamp": "2026-03-01T10:00:00"},
+        {"query": "c", "session_id": "s1", "timestamp": "2026-03-01T11:00:00"},
+    ]}), ".json")
+    try:
+        events = load_workload(path, max_gap=30)
+    finally:
+        os.unlink(path)
+
+    assert [e.query for e in events] == ["a", "b", "c"]
+    assert [e.offset for e in events] == [0.0, 10.0, 40.0]
+
+
+def test_load_jsonl_with_epoch_and_missing_timestamps():
+    """JSON Lines 支援 Unix 秒數；沒有時間戳的記錄沿用前一筆時間，沒有 query 的記錄略過"""
+    lines = [
+        {"query": "a", "timestamp": 100.0},
+        {"query": "b"},
+        {"session_id": "x"},
+        {"query": "c", "timestamp": 102.5},
+    ]
+    path = _write("\n".join(json.dumps(line) for line in lines), ".jsonl")
+    try:
+        events = load_workload(path)
+    finally:
+        os.unlink(path)
+
+    assert [(e.query, e.offset) for e in events] == [("a", 0.0), ("b", 0.0), ("c", 2.5)]
+
+
+def test_replay_preserves_session_order():
+    """同會話的查詢依序送出；快取命中與 R 值統計與記錄一致"""
+    events = [
+        ReplayEvent(0.0, "s1", "q1", {"dimensions": {"R": "0"}}),
+        ReplayEvent(0.0, "s2", "q1", {"dimensions": {"R": "0"}}),
+        ReplayEvent(0.001, "s1", "q2", {"dimensions": {"R": "0"}}),
+        ReplayEvent(0.002, "s1", "q1", {"dimensions": {"R": "1"}}),
+    ]
+    target = _RecordingTarget()
+    results = asyncio.run(replay(target, events, speed=0))
+
+    assert [q for s, q in target.sent if s == "s1"] == ["q1", "q2", "q1"]
+    summary = summarize(results, events, wall_time=1.0)
+    assert summary["errors"] == 0
+    assert summary["cache"]["embedding_hit_rate"] == 0.25
+    assert summary["cache"]["workload_repeat_ratio"] == repeat_ratio(events) == 0.25
+    assert summary["repetition"]["agreement"] == 1.0
+
+
+if __name__ == "__main__":
+    test_load_history_json_sorted_with_max_gap()
+    test_load_jsonl_with_epoch_and_missing_timestamps()
+    test_replay_preserves_session_order()
+    print("✅ 歷史流量重播測試通過")
@@ -0,0 +1,136 @@
+"""
+會話儲存測試
+驗證 LRU / 閒置淘汰、SQLite 後端的狀態往返，以及同一會話的並發查詢不互相覆蓋
+"""
+import asyncio
+import os
+import tempfile
+import time
+import weakref
+
+from core.session_store import SessionStore, SQLiteSessionStore
+from main_parallel import ResponsesRAGSystem
+
+
+def test_sessions_are_isolated():
+    """不同會話的重複性視窗互不影響"""
+    store = SessionStore(max_sessions=10, idle_timeout=60)
+
+    a = store.get("a")
+    b = store.get("b")
+    a.repetition_checker.check_and_update(["DNS"])
+    a.repetition_checker.check_and_update(["DNS"])
+
+    assert a.repetition_checker.check_and_update(["DNS"]) == 1
+    assert b.repetition_checker.check_and_update(["DNS"]) == 0
+    assert store.get("a") is a
+
+
+def test_lru_eviction():
+    """超過上限時淘汰最久未使用的會話"""
+    store = SessionStore(max_sessions=2, idle_timeout=60)
+
+    store.get("a")
+    store.get("b")
+    store.get("a")  # a 變為最近使用
+    store.get("c")  # 應淘汰 b
+
+    assert set(store.sessions) == {"a", "c"}
+    assert store.get_stats()["evicted"] == 1
+
+
+def test_idle_eviction():
+    """閒置超過時限的會話會被淘汰"""
+    store = SessionStore(max_sessions=10, idle_timeout=0.01)
+
+    store.get("a")
+    time.sleep(0.02)
+    store.get("b")
+
+    assert "a" not in store.sessions
+    assert "b" in store.sessions
+
+
+def test_sqlite_round_trip():
+    """SQLite 後端：另一個 worker 可讀到已保存的會話狀態"""
+    with tempfile.TemporaryDirectory() as tmp:
+        db_path = os.path.join(tmp, "sessions.db")
+        writer = SQLiteSessionStore(db_path=db_path, max_sessions=10, idle_timeout=60)
+
+        session = writer.get("s1")
+        for _ in range(2):
+            session.repetition_checker.check_and_update(["NAT"])
+            session.record_turn(["NAT"])
+        writer.save(session)
+
+        reader = SQLiteSessionStore(db_path=db_path, max_sessions=10, idle_timeout=60)
+        restored = reader.get("s1")
+        assert restored.query_count == 2
+        assert list(restored.recent_knowledge_points) == ["NAT", "NAT"]
+        assert restored.repetition_checker.check_and_update(["NAT"]) == 1
+
+        reader.reset("s1")
+        assert writer.get("s1").query_count == 0
+
+        writer.conn.close()
+        reader.conn.close()
+
+
+def test_sqlite_async_round_trip():
+    """SQLite 後端的非同步版本（資料庫操作在執行緒中）與同步版本讀寫同一份狀態"""
+    async def run(db_path: str):
+        writer = SQLiteSessionStore(db_path=db_path, max_sessions=10, idle_timeout=60)
+        reader = SQLiteSessionStore(db_path=db_path, max_sessions=10, idle_timeout=60)
+        try:
+            session = await writer.get_async("s1")
+            session.repetition_checker.check_and_update(["NAT"])
+            session.record_turn(["NAT"])
+            await writer.save_async(session)
+
+            restored = await reader.get_async("s1")
+            assert restored.query_count == 1
+            assert reader.get("s1").query_count == 1
+
+            await reader.reset_async("s1")
+            assert (await writer.get_async("s1")).query_count == 0
+        finally:
+            writer.conn.close()
+            reader.conn.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "sessions.db")))
+
+    memory = SessionStore(max_sessions=10, idle_timeout=60)
+    assert asyncio.run(memory.get_async("m")) is memory.get("m")
+
+
+def test_concurrent_turns_in_one_session():
+    """同一會話的並發請求依序記錄（SQLite 後端每次重新讀取，不會後寫覆蓋先寫）"""
+    async def run(db_path):
+        store = SQLiteSessionStore(db_path=db_path, max_sessions=10, idle_timeout=60)
+        # 只需要會話相關的屬性，不初始化上游 client 與向量庫
+        system = ResponsesRAGSystem.__new__(ResponsesRAGSystem)
+        system.session_store = store
+        system._session_locks = weakref.WeakValueDictionary()
+        try:
+            results = await asyncio.gather(*(system._record_turn("shared", ["NAT"]) for _ in range(4)))
+            session = await store.get_async("shared")
+            assert session.query_count == 4
+            assert list(session.recent_knowledge_points) == ["NAT"] * 4
+            # 依序更新：第三次起達到重複閾值
+            assert [r_value for _, r_value in results] == [0, 0, 1, 1]
+            assert not system._session_locks
+        finally:
+            store.conn.close()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        asyncio.run(run(os.path.join(tmp, "sessions.db")))
+
+if __name__ == "__main__":
+    test_sessions_are_isolated()
+    test_lru_eviction()
+    test_idle_eviction()
+    test_sqlite_round_trip()
+    test_sqlite_async_round_trip()
+    test_concurrent_turns_in_one_session()
+    print("✅ 會話儲存測試通過")
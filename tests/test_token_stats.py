@@ -0,0 +1,86 @@
+"""
+Token 串流統計測試
+驗證 TTFT / token 間隔 / 吞吐量計算、usage 與本地估算的切換，以及彙總到指標
+"""
+import time
+from types import SimpleNamespace
+
+from core.metrics import MetricsRegistry, record_trace
+from core.token_stats import TokenStreamStats, estimate_tokens
+from core.tracer import Tracer
+
+
+def _stream(stats: TokenStreamStats, deltas, gap: float):
+    """模擬一次串流：每隔 gap 秒收到一段內容"""
+    for delta in deltas:
+        time.sleep(gap)
+        stats.on_token(delta)
+
+
+def test_estimate_tokens():
+    """中文約一字一 token，英文約四字元一 token"""
+    assert estimate_tokens("機器學習") == 4
+    assert estimate_tokens("abcdefgh") == 2
+    assert estimate_tokens("") == 0
+
+
+def test_stream_stats_with_usage():
+    """上游回報 usage 時使用實際值，吞吐量以首 token 之後的串流時間計算"""
+    stats = TokenStreamStats()
+    _stream(stats, ["a", "b", "c", "d"], gap=0.01)
+    stats.on_usage(SimpleNamespace(prompt_tokens=100, completion_tokens=40))
+
+    attributes = stats.to_attributes()
+    assert attributes["prompt_tokens"] == 100
+    assert attributes["completion_tokens"] == 40
+    assert attributes["usage_estimated"] is False
+    assert attributes["ttft_generation"] >= 0.01
+    assert 0.008 < attributes["gap_mean"] < 0.05
+    assert attributes["gap_max"] >= attributes["gap_p95"] >= attributes["gap_mean"] * 0.5
+    assert attributes["tokens_per_second"] > 100
+
+
+def test_stream_stats_estimates_without_usage():
+    """沒有 usage 時以本地估算代替並標記；沒有任何內容時不輸出統計"""
+    stats = TokenStreamStats()
+    stats.on_prompt("什麼是機器學習？")
+    _stream(stats, ["監督", "學習"], gap=0)
+    attributes = stats.to_attributes()
+    assert attributes["usage_estimated"] is True
+    assert attributes["prompt_tokens"] == 8
+    assert attributes["completion_tokens"] == 4
+
+    assert TokenStreamStats().to_attributes() == {"chunks": 0}
+
+
+def test_record_trace_token_metrics():
+    """span 上的 token 統計彙總到首 token 時間、吞吐量與 token 用量指標"""
+    tracer = Tracer("test")
+    root = tracer.start_span("總流程")
+    span = tracer.start_span("最終回合生成", parent=root, model="mock", upstream=True)
+    span.set_attributes(
+        ttft_generation=0.2, tokens_per_second=50.0, gap_mean=0.02, gap_p95=0.05, gap_max=0.1,
+        prompt_tokens=100, completion_tokens=40, usage_estimated=True
+    )
+    span.end()
+    root.set_attribute("ttft", 0.3)
+    root.end()
+
+    registry = MetricsRegistry(window=60, quantiles=[0.5])
+    record_trace(tracer, registry)
+    text = registry.render_prometheus()
+
+    assert 'rag_upstream_ttft_seconds_count{call="最終回合生成",model="mock"} 1' in text
+    assert 'rag_inter_token_gap_seconds_count{call="最終回合生成",model="mock",stat="p95"} 1' in text
+    assert "rag_ttft_seconds_count 1" in text
+    assert 'rag_tokens_total{source="estimate",stage="最終回合生成",type="completion_tokens"} 40' in text
+    tps = registry.snapshot()["histograms"]["rag_upstream_tokens_per_second"][0]["quantiles"]["0.5"]
+    assert abs(tps - 50.0) / 50.0 < 0.04
+
+
+if __name__ == "__main__":
+    test_estimate_tokens()
+    test_stream_stats_with_usage()
+    test_stream_stats_estimates_without_usage()
+    test_record_trace_token_metrics()
+    print("✅ Token 串流統計測試通過")
@@ -0,0 +1,125 @@
+"""
+追蹤器測試
+驗證巢狀 span、跨 asyncio.gather 的父子關係、並發請求互不干擾、關鍵路徑與重疊分析
+"""
+import asyncio
+
+from core.timer_utils import TimerReport
+from core.tracer import Tracer, get_current_tracer, trace_span, use_span, use_tracer
+
+
+async def _branch(name: str, delay: float):
+    """模擬一個分支：記錄外層 span 與內層 API span"""
+    with trace_span(name):
+        with trace_span(f"{name} API", thread='C', model="mock") as span:
+            await asyncio.sleep(delay)
+            span.set_attribute("tokens", 10)
+
+
+async def _request() -> Tracer:
+    """模擬一次請求：兩個並行分支 + 一個後續階段"""
+    tracer = Tracer("test")
+    root = tracer.start_span("總流程")
+    parallel = tracer.start_span("並行處理", parent=root)
+    with use_tracer(tracer), use_span(parallel):
+        await asyncio.gather(_branch("快", 0.01), _branch("慢", 0.05))
+    parallel.end()
+    with tracer.span("生成", parent=root):
+        await asyncio.sleep(0.02)
+    root.end()
+    return tracer
+
+
+def test_parent_links_across_gather():
+    """gather 的分支掛在建立任務時的 span 之下，內層 span 掛在分支之下"""
+    tracer = asyncio.run(_request())
+
+    parallel = tracer.find_span("並行處理")
+    slow = tracer.find_span("慢")
+    slow_api = tracer.find_span("慢 API")
+
+    assert slow.parent_id == parallel.span_id
+    assert slow_api.parent_id == slow.span_id
+    assert slow_api.attributes == {"thread": 'C', "model": "mock", "tokens": 10}
+    assert tracer.depth(slow_api) == 3
+
+
+def test_critical_path_and_overlap():
+    """關鍵路徑經過較慢的分支，並行分支的重疊可由時間戳計算"""
+    tracer = asyncio.run(_request())
+    analysis = tracer.analyze()
+
+    names = [step["name"] for step in analysis["critical_path"]]
+    assert names == ["慢 API", "生成"]
+
+    group = next(g for g in analysis["overlap"] if g["span"] == "並行處理")
+    assert group["overlap"] > 0.005
+    assert group["concurrency"] > 1.0
+
+
+def test_timer_report_exporter():
+    """TimerReport 匯出器：主流程取淺層 span，線程報告取 thread 屬性"""
+    tracer = asyncio.run(_request())
+    report = TimerReport.from_tracer(tracer).to_dict()
+
+    assert set(report["stages"]) == {"總流程", "並行處理", "生成"}
+    assert set(report["thread_c"]["stages"]) == {"快 API", "慢 API"}
+
+
+def test_chrome_trace_exporter():
+    """Chrome trace-event 匯出：並行分支分列顯示、同列事件完整巢狀、保留瞬時事件"""
+    tracer = asyncio.run(_request())
+    tracer.find_span("生成").add_event("first_token")
+    events = tracer.to_chrome_trace()["traceEvents"]
+
+    spans = {e["name"]: e for e in events if e["ph"] == "X"}
+    assert spans["快"]["tid"] != spans["慢"]["tid"]
+    assert spans["慢 API"]["tid"] == spans["慢"]["tid"]
+    assert any(e["ph"] == "i" and e["name"] == "first_token" for e in events)
+
+    by_tid = {}
+    for e in spans.values():
+        by_tid.setdefault(e["tid"], []).append(e)
+    for lane in by_tid.values():
+        for a in lane:
+            for b in lane:
+                a_end, b_end = a["ts"] + a["dur"], b["ts"] + b["dur"]
+                overlapping = a["ts"] < b_end and b["ts"] < a_end
+                nested = (a["ts"] <= b["ts"] and b_end <= a_end) or (b["ts"] <= a["ts"] and a_end <= b_end)
+                assert not overlapping or nested
+
+
+def test_trace_span_without_tracer_is_noop():
+    """不在追蹤範圍內時 trace_span 不記錄任何資料"""
+    with trace_span("孤立") as span:
+        span.set_attribute("x", 1)
+    assert span.attributes == {}
+
+
+def test_concurrent_requests_are_isolated():
+    """並發請求在範圍內建立的任務各自記錄到自己的追蹤器，離開範圍後不再有目前追蹤器"""
+    async def request(delay: float) -> Tracer:
+        tracer = Tracer("test")
+        with use_tracer(tracer):
+            task = asyncio.ensure_future(_branch("分支", delay))
+        await task
+        return tracer
+
+    async def run():
+        return await asyncio.gather(request(0.05), request(0.01))
+
+    slow, fast = asyncio.run(run())
+    assert slow.find_span("分支").duration >= 0.04
+    assert fast.find_span("分支").duration < 0.04
+    assert len(slow.spans) == len(fast.spans) == 2
+    assert get_current_tracer() is None
+
+
+if __name__ == "__main__":
+    test_parent_links_across_gather()
+    test_concurrent_requests_are_isolated()
+    test_critical_path_and_overlap()
+    test_timer_report_exporter()
+    test_chrome_trace_exporter()
+    test_trace_span_without_tracer_is_noop()
+    print("✅ 追蹤器測試通過")
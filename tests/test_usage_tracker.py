@@ -0,0 +1,73 @@
+"""
+用量統計測試
+驗證成本計算、單次查詢彙總，以及依階段 / 情境 / 會話累計
+"""
+from config import Config
+from core.tracer import Tracer
+from core.usage_tracker import UsageTracker, calculate_cost, summarize_trace
+
+
+def _trace(session_id: str, scenario_number: int, estimated: bool = False) -> Tracer:
+    """模擬一次查詢：embedding + C 值 + 最終生成"""
+    tracer = Tracer("test")
+    root = tracer.start_span("總流程", session_id=session_id, scenario_number=scenario_number)
+    for name, model, prompt, completion in (
+        ("Embedding API 調用", "text-embedding-3-small", 10, 0),
+        ("C值 API 調用（正確性檢測）", "gpt-4o-mini", 80, 1),
+        ("最終回合生成", "gpt-4o-mini", 1000, 100)
+    ):
+        span = tracer.start_span(name, parent=root, model=model, upstream=True)
+        span.set_attributes(prompt_tokens=prompt, completion_tokens=completion)
+        if name == "最終回合生成":
+            span.set_attribute("usage_estimated", estimated)
+        span.end()
+    tracer.start_span("本地計算", parent=root).end()
+    root.end()
+    return tracer
+
+
+def test_calculate_cost():
+    """成本依每百萬 token 單價計算，未設定單價的模型為 0"""
+    pricing = Config.MODEL_PRICING["gpt-4o-mini"]
+    expected = (1000 * pricing["input"] + 100 * pricing["output"]) / 1e6
+    assert abs(calculate_cost("gpt-4o-mini", 1000, 100) - expected) < 1e-12
+    assert calculate_cost("unknown-model", 1000, 100) == 0.0
+
+
+def test_summarize_trace():
+    """只計入帶 token 用量的 span，估算值另計"""
+    summary = summarize_trace(_trace("s1", 5, estimated=True))
+
+    assert summary["session_id"] == "s1"
+    assert summary["scenario_number"] == 5
+    assert set(summary["stages"]) == {"Embedding API 調用", "C值 API 調用（正確性檢測）", "最終回合生成"}
+    assert summary["total"]["calls"] == 3
+    assert summary["total"]["prompt_tokens"] == 1090
+    assert summary["total"]["estimated_tokens"] == 1100
+    assert summary["total"]["cost_usd"] > 0
+
+
+def test_tracker_aggregates_by_stage_scenario_session():
+    """累計統計依階段、情境與會話拆分，會話數超過上限時淘汰最舊的"""
+    tracker = UsageTracker(max_sessions=2)
+    tracker.record_trace(_trace("s1", 5))
+    tracker.record_trace(_trace("s1", 7))
+    tracker.record_trace(_trace("s2", 5))
+    tracker.record_trace(_trace("s3", 5))
+
+    summary = tracker.get_summary()
+    assert summary["queries"] == 4
+    assert summary["by_stage"]["最終回合生成"]["calls"] == 4
+    assert summary["by_scenario"]["5"]["queries"] == 3
+    assert summary["by_model"]["gpt-4o-mini"]["completion_tokens"] == 4 * 101
+    assert summary["sessions"] == 2
+
+    assert tracker.get_summary("s1")["queries"] == 0
+    assert tracker.get_summary("s3")["queries"] == 1
+
+
+if __name__ == "__main__":
+    test_calculate_cost()
+    test_summarize_trace()
+    test_tracker_aggregates_by_stage_scenario_session()
+    print("✅ 用量統計測試通過")
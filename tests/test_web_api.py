@@ -0,0 +1,53 @@
+"""
+Web API 測試
+驗證 WebSocket 會話遇到格式錯誤的訊息時回覆錯誤事件並維持連線，以及清空歷史記錄
+"""
+import os
+import tempfile
+from types import SimpleNamespace
+
+from fastapi.testclient import TestClient
+
+import web_api
+from core.history_manager import HistoryManager
+from core.session_store import SessionStore
+
+
+def test_websocket_survives_malformed_messages():
+    """非 JSON 或非物件的訊息回覆 error，同一連線隨後的 ping 仍正常回應"""
+    original = web_api.system
+    web_api.system = SimpleNamespace(session_store=SessionStore())
+    try:
+        with TestClient(web_api.app).websocket_connect("/ws/session?session_id=ws-test") as ws:
+            assert ws.receive_json()["type"] == "session"
+            for frame in ("not json", "[]", '"hi"', "42"):
+                ws.send_text(frame)
+                assert ws.receive_json()["type"] == "error", frame
+            ws.send_json({"type": "unknown"})
+            assert ws.receive_json()["type"] == "error"
+            ws.send_json({"type": "ping"})
+            assert ws.receive_json() == {"type": "pong"}
+    finally:
+        web_api.system = original
+
+
+def test_clear_history_endpoint():
+    """DELETE /api/history 清空記錄（在執行緒中執行）"""
+    original = web_api.history_manager
+    with tempfile.TemporaryDirectory() as workdir:
+        manager = HistoryManager(storage_path=os.path.join(workdir, "history.json"), flush_interval=0)
+        manager.add_query("什麼是 DNS？", ["dns_basics"], {"K": 1, "C": 0, "R": 0}, knowledge_points=["DNS"])
+        web_api.history_manager = manager
+        try:
+            response = TestClient(web_api.app).delete("/api/history")
+        finally:
+            web_api.history_manager = original
+        assert response.status_code == 200
+        assert manager.get_total_queries() == 0
+        assert manager.get_recent_history() == []
+
+
+if __name__ == "__main__":
+    test_websocket_survives_malformed_messages()
+    test_clear_history_endpoint()
+    print("✅ Web API 測試通過")
@@ -96,14 +96,31 @@ async function sendMessage() {
     try {
         const startTime = Date.now();
 
-        console.log('🔄 調用 API...');
-        // 調用 API
-        const response = await fetch(`${API_BASE}/api/query`, {
-            method: 'POST',
-            headers: {
-                'Content-Type': 'application/json',
-            },
-            body: JSON.stringify({ query: message })
+        console.log('🔄 調用流式 API...');
+        let answer = '';
+        let streamingDiv = null;
+        let result = null;
+
+        // 調用流式 API：收到第一個答案片段即開始顯示
+        await streamQuery(message, (event, data) => {
+            if (event === 'delta') {
+                if (!streamingDiv) {
+                    removeLoading(loadingId);
+                    streamingDiv = addStreamingMessageToDOM();
+                    const ttft = ((Date.now() - startTime) / 1000).toFixed(2);
+                    console.log(`⚡ 首個 token 時間: ${ttft}s`);
+                }
+                answer += data.content;
+                streamingDiv.querySelector('.message-content').innerText = answer;
+                const messagesDiv = document.getElementById('messages');
+                messagesDiv.scrollTop = messagesDiv.scrollHeight;
+            } else if (event === 'scenario') {
+                console.log(`🎯 情境判定: 第 ${data.scenario_number} 種情境`);
+            } else if (event === 'done') {
+                result = data;
+            } else if (event === 'error') {
+                throw new Error(data.detail);
+            }
         });
 
         const endTime = Date.now();
@@ -111,25 +128,22 @@ async function sendMessage() {
 
         console.log(`⏱️ API 響應時間: ${responseTime}s`);
 
-        if (!response.ok) {
-            const errorText = await response.text();
-            console.error('❌ API 錯誤:', errorText);
-            throw new Error(`API 請求失敗: ${response.status}`);
+        if (!result) {
+            throw new Error('流式回應未完成');
         }
+        console.log('✅ 收到回應:', result);
 
-        const data = await response.json();
-        console.log('✅ 收到回應:', data);
-
-        // 移除載入動畫
+        // 移除載入動畫與暫時的流式訊息
         removeLoading(loadingId);
+        if (streamingDiv) streamingDiv.remove();
 
         // 顯示回答
         console.log('顯示助手回答');
-        addMessage('assistant', data.answer, {
-            dimensions: data.dimensions,
-            matched_docs: data.matched_docs,
+        addMessage('assistant', result.answer, {
+            dimensions: result.dimensions,
+            matched_docs: result.matched_docs,
             response_time: responseTime,
-            scenario: data.scenario
+            scenario: result.scenario
         });
 
         // 更新統計
@@ -146,6 +160,58 @@ async function sendMessage() {
     }
 }
 
+// 調用流式 API（解析 Server-Sent Events）
+async function streamQuery(message, onEvent) {
+    const response = await fetch(`${API_BASE}/api/query/stream`, {
+        method: 'POST',
+        headers: {
+            'Content-Type': 'application/json',
+        },
+        body: JSON.stringify({ query: message })
+    });
+
+    if (!response.ok) {
+        const errorText = await response.text();
+        console.error('❌ API 錯誤:', errorText);
+        throw new Error(`API 請求失敗: ${response.status}`);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+
+        // 每個事件以空行分隔
+        let separator;
+        while ((separator = buffer.indexOf('\n\n')) !== -1) {
+            const rawEvent = buffer.slice(0, separator);
+            buffer = buffer.slice(separator + 2);
+
+            let eventName = 'message';
+            let data = '';
+            rawEvent.split('\n').forEach(line => {
+                if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                else if (line.startsWith('data:')) data += line.slice(5).trim();
+            });
+            if (data) onEvent(eventName, JSON.parse(data));
+        }
+    }
+}
+
+// 添加流式輸出中的助手訊息（完成後由 addMessage 取代）
+function addStreamingMessageToDOM() {
+    const messagesDiv = document.getElementById('messages');
+    const messageDiv = document.createElement('div');
+    messageDiv.className = 'message message-assistant';
+    messageDiv.innerHTML = '<div class="message-content"></div>';
+    messagesDiv.appendChild(messageDiv);
+    return messageDiv;
+}
+
 // 添加訊息（保存到歷史）
 function addMessage(type, content, meta = null) {
     console.log(`➕ 添加${type}訊息:`, content.substring(0, 50) + '...');
@@ -4,18 +4,27 @@ Web API 後端
 所有計時在後端進行，不受前端渲染影響
 """
 import asyncio
+import hmac
 import time
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, Response, StreamingResponse
+from starlette.requests import HTTPConnection
 from pydantic import BaseModel
 from typing import Optional, List, Dict
 import os
 import json
+import uuid
 import uvicorn
 
 from main_parallel import ResponsesRAGSystem
 from config import Config, get_config_summary
-from core.history_manager import HistoryManager
+from core.history_manager import HistoryManager, get_history_manager
+from core.circuit_breaker import get_all_breaker_stats
+from core.metrics import get_metrics
+from core.usage_tracker import get_usage_tracker
+from core.loop_monitor import get_loop_monitor
+from core.profiler import get_profile_store
 
 # 創建 FastAPI 應用
 app = FastAPI(
@@ -45,6 +54,7 @@ class QueryRequest(BaseModel):
     query: str
     scenario_ids: Optional[List[str]] = None
     auto_classify: bool = True
+    session_id: Optional[str] = None  # 會話 ID（也可用 X-Session-ID 標頭提供）
 
 
 class QueryResponse(BaseModel):
@@ -66,6 +76,8 @@ class HistoryResponse(BaseModel):
     recent_queries: List[dict]
     knowledge_point_stats: Dict[str, int]
     dimension_stats: Dict[str, dict]
+    matched_queries: int = 0
+    next_before_id: Optional[int] = None
 
 
 class ConfigResponse(BaseModel):
@@ -97,9 +109,9 @@ async def startup_event():
     print("🚀 RAG 教學問答系統 API 啟動中...")
     print("="*60)
     
-    # 1. 初始化歷史管理器
+    # 1. 初始化歷史管理器（與 RAG 系統共用同一個寫入者）
     print("📁 初始化歷史管理器...")
-    history_manager = HistoryManager()
+    history_manager = get_history_manager()
     
     # 2. 初始化主系統
     print("⚙️ 初始化 RAG 系統...")
@@ -113,6 +125,10 @@ async def startup_event():
         print("⚠️  首次啟動：需要向量化文件（約 10-15 秒）")
         await system.initialize_documents()
     
+    # 4. 啟動事件迴圈監控（偵測阻塞事件迴圈的同步調用）
+    if Config.LOOP_MONITOR_ENABLED:
+        get_loop_monitor().start()
+    
     elapsed = time.perf_counter() - start_time
     print(f"\n✅ 系統初始化完成！（耗時: {elapsed:.2f}秒）")
     print(f"📡 API 服務運行於: http://{Config.API_HOST}:{Config.API_PORT}")
@@ -125,11 +141,67 @@ async def startup_event():
 async def shutdown_event():
     """應用關閉時清理資源"""
     print("\n🛑 RAG 流式系統 API 關閉中...")
+    await get_loop_monitor().stop()
     if history_manager:
+        history_manager.close()
         history_manager.save()
     print("✅ 資源已清理\n")
 
 
+# ==================== 響應組裝 ====================
+
+def _build_query_response(result: dict, backend_total_time: float) -> dict:
+    """
+    將 ResponsesRAGSystem 的處理結果轉換為 API 響應格式
+    
+    Args:
+        result: process_query / process_query_stream 的完整結果
+        backend_total_time: 後端總處理時間（秒）
+        
+    Returns:
+        API 響應字典
+    """
+    # 提取需要的資訊
+    scenario_number = result.get("scenario_number", 0)
+    
+    # 獲取詳細計時報告
+    time_report = result.get("time_report", {})
+    
+    return {
+        "answer": result.get("final_answer", "抱歉，無法生成回答"),
+        "dimensions": result.get("dimensions", {}),
+        "matched_docs": result.get("matched_docs", []),
+        "knowledge_points": result.get("knowledge_points", []),
+        "scenario": f"第 {scenario_number} 種情境",
+        "scenario_number": scenario_number,
+        "scenario_label": result.get("scenario_label", ""),
+        "scenario_role": result.get("scenario_role", ""),
+        "fallbacks": result.get("fallbacks", []),
+        "response_time": backend_total_time,
+        "timing_details": {
+            "backend_total": round(backend_total_time, 3),
+            "stages": time_report.get("stages", {}),
+            "thread_a": time_report.get("thread_a", {}),
+            "thread_b": time_report.get("thread_b", {}),
+            "ttft": round(result.get("timing", {}).get("ttft", 0), 3),
+            "tokens": result.get("timing", {}).get("tokens", {}),
+            "timestamp": time_report.get("timestamp", "")
+        },
+        "usage": result.get("usage", {}),
+        "cache": {
+            "embedding_cache_hit": result.get("timing", {}).get("rag", {}).get("embedding_cache_hit", False)
+        },
+        "trace_id": result.get("trace", {}).get("trace_id"),
+        "trace_file": result.get("trace_file"),
+        "profile_id": result.get("profile_id")
+    }
+
+
+def _sse_event(event: str, data: dict) -> str:
+    """格式化一個 Server-Sent Event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
 # ==================== API 端點 ====================
 
 @app.get("/")
@@ -141,14 +213,32 @@ async def root():
         "docs": "/docs",
         "endpoints": {
             "query": "/api/query",
+            "query_stream": "/api/query/stream",
+            "session_ws": "/ws/session",
             "history": "/api/history",
+            "history_stats": "/api/history/stats",
             "config": "/api/config",
             "health": "/api/health",
+            "metrics": "/metrics",
+            "usage": "/api/usage",
             "knowledge_count": "/api/knowledge/count"
         }
     }
 
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def metrics_endpoint():
+    """
+    Prometheus 指標（文字格式）
+    
+    包含各階段 / 上游調用的延遲分位數、快取命中、降級、錯誤、token 用量與處理中的請求數
+    """
+    metrics = get_metrics()
+    for name, stats in get_all_breaker_stats().items():
+        metrics.set_gauge("rag_circuit_breaker_open", 0 if stats["state"] == "closed" else 1, breaker=name)
+    return PlainTextResponse(metrics.render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
 @app.get("/api/health")
 async def health_check():
     """健康檢查 - 詳細狀態"""
@@ -169,12 +259,51 @@ async def health_check():
         "vector_loaded": vector_loaded,
         "vector_count": vector_count,
         "ready": system is not None and vector_loaded,
+        "circuit_breakers": get_all_breaker_stats(),
+        "sessions": await asyncio.to_thread(system.session_store.get_stats) if system is not None else None,
+        "event_loop": get_loop_monitor().get_stats(),
         "version": "2.0.0"
     }
 
 
+def _trace_requested(http_request: Request) -> bool:
+    """請求是否帶有 X-Trace-Export 標頭（要求寫出本次查詢的 Chrome trace-event 檔案）"""
+    return http_request.headers.get("x-trace-export", "").lower() in ("1", "true", "yes")
+
+
+def _admin_authorized(connection: HTTPConnection) -> bool:
+    """請求是否帶有正確的 X-Admin-Token（未設定 Config.ADMIN_TOKEN 時一律拒絕）"""
+    token = connection.headers.get("x-admin-token", "")
+    return bool(Config.ADMIN_TOKEN) and hmac.compare_digest(token, Config.ADMIN_TOKEN)
+
+
+def _profile_requested(connection: HTTPConnection, requested: Optional[str] = None) -> Optional[str]:
+    """
+    本次請求要求的剖析模式（X-Profile 標頭或 WebSocket 訊息的 profile 欄位；需管理權杖）
+    
+    Returns:
+        "cprofile" / "sample"（其他真值使用預設模式），未要求或未授權時為 None
+    """
+    requested = requested or connection.headers.get("x-profile")
+    if not requested or requested.lower() in ("0", "false", "no"):
+        return None
+    if not _admin_authorized(connection):
+        print("⚠️  X-Profile 需要有效的 X-Admin-Token，忽略剖析要求")
+        return None
+    return requested.lower()
+
+
+def _resolve_session_id(request: QueryRequest, http_request: Request) -> str:
+    """決定請求所屬的會話 ID（請求內容優先，其次 X-Session-ID 標頭，最後為預設會話）"""
+    return (
+        request.session_id
+        or http_request.headers.get("x-session-id")
+        or Config.DEFAULT_SESSION_ID
+    )
+
+
 @app.post("/api/query")
-async def process_query(request: QueryRequest):
+async def process_query(request: QueryRequest, http_request: Request):
     """
     處理查詢請求 - K/C/R 三維度分類
     所有計時在後端進行，從接收到轉發完成
@@ -193,22 +322,16 @@ async def process_query(request: QueryRequest):
         print(f"{'='*70}")
         
         # 使用 ResponsesRAGSystem 的雙回合並行處理（內部已有詳細計時）
-        result = await system.process_query(query)
-        
-        # 提取需要的資訊
-        dimensions = result.get("dimensions", {})
-        matched_docs = result.get("matched_docs", [])
-        final_answer = result.get("final_answer", "抱歉，無法生成回答")
-        scenario_number = result.get("scenario_number", 0)
-        scenario_label = result.get("scenario_label", "")
-        scenario_role = result.get("scenario_role", "")
-        knowledge_points = result.get("knowledge_points", [])
-        
-        # 獲取詳細計時報告
-        time_report = result.get("time_report", {})
+        result = await system.process_query(
+            query,
+            session_id=_resolve_session_id(request, http_request),
+            export_trace=_trace_requested(http_request),
+            profile=_profile_requested(http_request)
+        )
         
         # 計算後端總處理時間（從接收到準備轉發）
         backend_total_time = time.perf_counter() - backend_receive_time
+        get_metrics().observe("rag_request_latency_seconds", backend_total_time, endpoint="/api/query")
         
         print(f"\n{'='*70}")
         print(f"📤 後端準備轉發結果")
@@ -216,62 +339,324 @@ async def process_query(request: QueryRequest):
         print(f"{'='*70}\n")
         
         # 返回詳細的響應格式（包含完整計時資訊）
-        return {
-            "answer": final_answer,
-            "dimensions": dimensions,
-            "matched_docs": matched_docs,
-            "knowledge_points": knowledge_points,
-            "scenario": f"第 {scenario_number} 種情境",
-            "scenario_number": scenario_number,
-            "scenario_label": scenario_label,
-            "scenario_role": scenario_role,
-            "response_time": backend_total_time,
-            "timing_details": {
-                "backend_total": round(backend_total_time, 3),
-                "stages": time_report.get("stages", {}),
-                "thread_a": time_report.get("thread_a", {}),
-                "thread_b": time_report.get("thread_b", {}),
-                "timestamp": time_report.get("timestamp", "")
-            }
-        }
+        return _build_query_response(result, backend_total_time)
         
     except Exception as e:
         import traceback
         error_detail = traceback.format_exc()
         print(f"❌ API 錯誤:\n{error_detail}")
+        get_metrics().inc("rag_errors_total", stage="api", type=type(e).__name__)
         raise HTTPException(status_code=500, detail=f"處理查詢時發生錯誤: {str(e)}")
 
 
+@app.post("/api/query/stream")
+async def process_query_stream(request: QueryRequest, http_request: Request):
+    """
+    處理查詢請求（Server-Sent Events 流式版本）
+    
+    事件依序為：retrieval（RAG 完成）、first_round（C 值 / 知識點完成）、
+    scenario（情境編號）、delta（答案片段，多次）、done（完整結果與計時）
+    客戶端斷線時停止並取消上游生成
+    """
+    if system is None:
+        raise HTTPException(status_code=503, detail="系統未初始化")
+    
+    # 記錄後端接收時間（計時起點）
+    backend_receive_time = time.perf_counter()
+    query = request.query
+    session = await system.session_store.get_async(_resolve_session_id(request, http_request))
+    print(f"\n📥 後端接收流式查詢: {query}（會話 {session.session_id}）")
+    
+    async def event_generator():
+        events = system.process_query_stream(
+            query,
+            session=session,
+            export_trace=_trace_requested(http_request),
+            profile=_profile_requested(http_request)
+        )
+        try:
+            async for event in events:
+                if await http_request.is_disconnected():
+                    print("🔌 客戶端已斷線，取消上游生成")
+                    break
+                
+                event_type = event["type"]
+                if event_type == "done":
+                    backend_total_time = time.perf_counter() - backend_receive_time
+                    get_metrics().observe(
+                        "rag_request_latency_seconds", backend_total_time, endpoint="/api/query/stream"
+                    )
+                    print(f"📤 流式查詢完成，總處理時間: {backend_total_time:.3f}s")
+                    yield _sse_event("done", _build_query_response(event["result"], backend_total_time))
+                else:
+                    payload = {k: v for k, v in event.items() if k != "type"}
+                    payload["elapsed"] = round(time.perf_counter() - backend_receive_time, 3)
+                    yield _sse_event(event_type, payload)
+        except Exception as e:
+            import traceback
+            print(f"❌ 流式 API 錯誤:\n{traceback.format_exc()}")
+            get_metrics().inc("rag_errors_total", stage="api_stream", type=type(e).__name__)
+            yield _sse_event("error", {"detail": f"處理查詢時發生錯誤: {str(e)}"})
+        finally:
+            # 關閉事件生成器 → 取消未完成的分支並關閉上游串流
+            await events.aclose()
+    
+    return StreamingResponse(
+        event_generator(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+@app.websocket("/ws/session")
+async def session_websocket(websocket: WebSocket):
+    """
+    多輪教學會話（WebSocket）
+    
+    會話狀態（重複性視窗、最近知識點、查詢向量快取）由會話儲存依 session_id 保存，
+    以相同 session_id 重新連線會延續先前的狀態；
+    同一連線上的每次查詢以事件形式回傳階段計時與答案片段
+    
+    客戶端訊息：
+      - {"type": "query", "query": "...", "trace": false}   trace=true 時寫出 Chrome trace-event 檔案
+      - {"type": "reset"}   重置會話狀態
+      - {"type": "ping"}
+    伺服器事件：session、retrieval、first_round、scenario、delta、done、error、pong
+    """
+    await websocket.accept()
+    
+    if system is None:
+        await websocket.send_json({"type": "error", "detail": "系統未初始化"})
+        await websocket.close(code=1013)
+        return
+    
+    session_id = websocket.query_params.get("session_id") or uuid.uuid4().hex
+    session = await system.session_store.get_async(session_id)
+    await websocket.send_json({"type": "session", **session.to_dict()})
+    print(f"🔗 WebSocket 會話已建立: {session_id}")
+    
+    try:
+        while True:
+            # 格式錯誤的訊息只回覆錯誤事件，不中斷會話
+            raw = await websocket.receive_text()
+            try:
+                message = json.loads(raw)
+            except json.JSONDecodeError:
+                message = None
+            if not isinstance(message, dict):
+                await websocket.send_json({"type": "error", "detail": "訊息必須是 JSON 物件"})
+                continue
+            message_type = message.get("type")
+            
+            if message_type == "ping":
+                await websocket.send_json({"type": "pong"})
+                continue
+            
+            if message_type == "reset":
+                session = await system.session_store.reset_async(session_id)
+                await websocket.send_json({"type": "session", **session.to_dict()})
+                continue
+            
+            if message_type != "query" or not message.get("query"):
+                await websocket.send_json({"type": "error", "detail": f"未知的訊息: {message_type}"})
+                continue
+            
+            # 記錄後端接收時間（計時起點）
+            backend_receive_time = time.perf_counter()
+            # 每次查詢重新讀取會話（SQLite 後端時可能已由其他 worker 更新）
+            session = await system.session_store.get_async(session_id)
+            events = system.process_query_stream(
+                message["query"],
+                session=session,
+                export_trace=bool(message.get("trace")),
+                profile=_profile_requested(websocket, message.get("profile"))
+            )
+            try:
+                async for event in events:
+                    event_type = event["type"]
+                    if event_type == "done":
+                        backend_total_time = time.perf_counter() - backend_receive_time
+                        get_metrics().observe(
+                            "rag_request_latency_seconds", backend_total_time, endpoint="/ws/session"
+                        )
+                        response = _build_query_response(event["result"], backend_total_time)
+                        response["session"] = event["result"]["session"]
+                        await websocket.send_json({"type": "done", **response})
+                    else:
+                        payload = {k: v for k, v in event.items() if k != "type"}
+                        payload["elapsed"] = round(time.perf_counter() - backend_receive_time, 3)
+                        await websocket.send_json({"type": event_type, **payload})
+            except WebSocketDisconnect:
+                raise
+            except Exception as e:
+                import traceback
+                print(f"❌ WebSocket 查詢錯誤:\n{traceback.format_exc()}")
+                get_metrics().inc("rag_errors_total", stage="websocket", type=type(e).__name__)
+                await websocket.send_json({"type": "error", "detail": f"處理查詢時發生錯誤: {str(e)}"})
+            finally:
+                # 關閉事件生成器 → 取消未完成的分支並關閉上游串流
+                await events.aclose()
+    
+    except WebSocketDisconnect:
+        print(f"🔌 WebSocket 會話已斷線: {session_id}（共 {session.query_count} 次查詢）")
+
+
+# ==================== 管理端點 ====================
+
+def _require_admin(http_request: Request):
+    """管理端點的權限檢查"""
+    if not Config.ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="管理端點未啟用（請設定 ADMIN_TOKEN）")
+    if not _admin_authorized(http_request):
+        raise HTTPException(status_code=403, detail="X-Admin-Token 無效")
+
+
+@app.get("/admin/profiles")
+async def list_profiles(http_request: Request):
+    """列出最近的請求剖析結果"""
+    _require_admin(http_request)
+    return {"profiles": get_profile_store().list()}
+
+
+@app.get("/admin/profiles/{profile_id}")
+async def get_profile(
+    profile_id: str,
+    http_request: Request,
+    format: Optional[str] = None,
+    sort: str = "cumulative",
+    limit: int = 50
+):
+    """
+    獲取單一剖析結果
+    
+    Args:
+        profile_id: 剖析 ID（查詢響應中的 profile_id）
+        format: "collapsed"（取樣剖析，預設）、"text"（cProfile 報告，預設）或 "pstats"（cProfile 二進位檔）
+        sort: text 格式的排序欄位（cumulative、tottime、calls…）
+        limit: text 格式輸出的函式數
+    """
+    _require_admin(http_request)
+    result = get_profile_store().get(profile_id)
+    if result is None:
+        raise HTTPException(status_code=404, detail=f"找不到剖析結果: {profile_id}")
+    
+    format = format or ("collapsed" if result.mode == "sample" else "text")
+    if format not in result.to_summary()["formats"]:
+        raise HTTPException(status_code=400, detail=f"{result.mode} 剖析不支援格式: {format}")
+    
+    if format == "collapsed":
+        return PlainTextResponse(result.collapsed())
+    if format == "pstats":
+        return Response(
+            result.pstats_bytes(),
+            media_type="application/octet-stream",
+            headers={"Content-Disposition": f'attachment; filename="{profile_id}.pstats"'}
+        )
+    return PlainTextResponse(result.pstats_text(sort=sort, limit=limit))
+
+
 @app.get("/api/history", response_model=HistoryResponse)
-async def get_history(limit: int = 10):
+async def get_history(
+    limit: int = Query(10, ge=1, le=500),
+    session_id: Optional[str] = None,
+    before_id: Optional[int] = None,
+    knowledge_point: Optional[str] = None,
+    since: Optional[str] = None,
+    until: Optional[str] = None
+):
     """
-    獲取歷史記錄
+    獲取歷史記錄（由新到舊分頁；SQLite 後端以索引查詢全部記錄）
     
     Args:
-        limit: 返回的記錄數量（默認10）
+        limit: 每頁記錄數量（默認10）
+        session_id: 只返回指定會話的記錄（默認全部會話）
+        before_id: 分頁游標，傳入上一頁返回的 next_before_id
+        knowledge_point: 只返回涉及指定知識點的記錄
+        since: 只返回此時間（ISO 8601，含）之後的記錄
+        until: 只返回此時間（ISO 8601，不含）之前的記錄
     """
     if history_manager is None:
         raise HTTPException(status_code=503, detail="歷史管理器未初始化")
     
-    try:
-        recent_queries = history_manager.get_recent_history(limit)
-        
-        response = HistoryResponse(
-            total_queries=len(history_manager.history),
-            recent_queries=[q.to_dict() for q in recent_queries],
+    def build_response() -> HistoryResponse:
+        page = history_manager.query_history(
+            limit, before_id=before_id, session_id=session_id,
+            knowledge_point=knowledge_point, since=since, until=until
+        )
+        return HistoryResponse(
+            total_queries=history_manager.get_total_queries(),
+            matched_queries=page["total"],
+            next_before_id=page["next_before_id"],
+            recent_queries=[q.to_dict() for q in page["records"]],
             knowledge_point_stats=history_manager.get_knowledge_point_stats(),
             dimension_stats={
                 dim: dict(counter)
                 for dim, counter in history_manager.get_dimension_stats().items()
             }
         )
-        
-        return response
-        
+    
+    try:
+        # SQLite 後端的查詢在執行緒中進行，不阻塞事件迴圈
+        return await asyncio.to_thread(build_response)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"獲取歷史記錄時發生錯誤: {str(e)}")
 
 
+@app.get("/api/history/stats")
+async def get_history_stats(
+    granularity: str = Query("hour", pattern="^(minute|hour|day)$"),
+    buckets: int = Query(24, ge=0, le=1440),
+    session_id: Optional[str] = None
+):
+    """
+    獲取增量維護的歷史統計（不掃描歷史記錄，適合儀表板高頻輪詢）
+    
+    Args:
+        granularity: 時間分桶粒度（minute / hour / day）
+        buckets: 返回最近幾個桶
+        session_id: 同時返回指定會話的查詢次數
+    """
+    if history_manager is None:
+        raise HTTPException(status_code=503, detail="歷史管理器未初始化")
+    
+    def build_stats() -> dict:
+        stats = {
+            "total_queries": history_manager.get_total_queries(),
+            "dimension_stats": {
+                dim: dict(counter)
+                for dim, counter in history_manager.get_dimension_stats().items()
+            },
+            "knowledge_point_stats": history_manager.get_knowledge_point_stats(),
+            "rollup": {
+                "granularity": granularity,
+                "buckets": history_manager.get_rollup(granularity, buckets) if Config.HISTORY_ROLLUPS_ENABLED else []
+            }
+        }
+        if session_id is not None:
+            stats["session"] = {
+                "session_id": session_id,
+                "queries": history_manager.get_session_stats(session_id).get(session_id, 0)
+            }
+        return stats
+    
+    return await asyncio.to_thread(build_stats)
+
+
+@app.get("/api/usage")
+async def get_usage(session_id: Optional[str] = None):
+    """
+    獲取 token 用量與成本統計（依階段、模型、情境與會話累計）
+    
+    Args:
+        session_id: 只返回指定會話的用量（默認返回全部統計）
+    """
+    return {
+        "usage": get_usage_tracker().get_summary(session_id),
+        "pricing": Config.MODEL_PRICING,
+        "currency": "USD"
+    }
+
+
 @app.delete("/api/history")
 async def clear_history():
     """清空歷史記錄"""
@@ -279,7 +664,8 @@ async def clear_history():
         raise HTTPException(status_code=503, detail="歷史管理器未初始化")
     
     try:
-        history_manager.clear()
+        # SQLite 刪除 / 快照重寫在執行緒中進行，不阻塞事件迴圈
+        await asyncio.to_thread(history_manager.clear)
         return {"message": "歷史記錄已清空"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"清空歷史記錄時發生錯誤: {str(e)}")
@@ -310,7 +696,8 @@ async def get_dimensions():
     return {
         "dimensions": Config.DIMENSIONS,
         "knowledge_points": Config.KNOWLEDGE_POINTS,
-        "repetition_threshold": Config.REPETITION_THRESHOLD
+        "repetition_threshold": Config.REPETITION_THRESHOLD,
+        "repetition_window": Config.REPETITION_WINDOW
     }
 
 